@@ -1,5 +1,6 @@
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 import uvicorn
 import cv2
 import numpy as np
@@ -11,6 +12,7 @@ import json
 from datetime import datetime
 import logging
 from typing import Optional
+from utils.json_utils import NumpyJSONResponse
 
 # Setup Logging
 logging.basicConfig(level=logging.INFO)
@@ -20,7 +22,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="Document Verification AI/ML Service",
     description="AI/ML microservice for document verification and analysis",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=NumpyJSONResponse
 )
 
 # Enable CORS (For frontend connection)
@@ -38,16 +41,50 @@ app.add_middleware(
 )
 
 # Import route modules
-from routes.analysis import router as analysis_router
+from routes.analysis import router as analysis_router, warm_up_analysis
 from routes.ocr import router as ocr_router
 from routes.signature import router as signature_router
 from routes.validation import router as validation_router
+from routes.jobs import router as jobs_router, create_worker_pool
+from utils.job_queue import job_queue, JOB_CONCURRENCY
+from utils.concurrency import apply_thread_budget, thread_report, thread_settings
+from utils.memory_stats import memory_report
+from utils.admission import admission_controller
+from utils.warmup import WARMUP, warmup_report
+from utils.stage_cache import stage_cache
+from utils.pipeline_profiles import profile_costs
+from utils.stage_scheduler import stage_scheduler
 
 # Register routers with API prefix
 app.include_router(analysis_router, prefix="/api/v1")
 app.include_router(ocr_router, prefix="/api/v1")
 app.include_router(signature_router, prefix="/api/v1")
 app.include_router(validation_router, prefix="/api/v1")
+app.include_router(jobs_router, prefix="/api/v1")
+
+# Background workers for queued analysis jobs (JOB_CONCURRENCY=0 leaves them to worker.py)
+job_worker_pool = create_worker_pool(JOB_CONCURRENCY)
+
+@app.on_event("startup")
+async def configure_thread_budget():
+    # serve.py applies the budget right after fork; plain uvicorn runs get it here
+    if not thread_settings:
+        apply_thread_budget()
+
+@app.on_event("startup")
+async def warm_up():
+    # Startup handlers finish before the worker reports ready (see serve.py)
+    if WARMUP:
+        await run_in_threadpool(warm_up_analysis)
+
+@app.on_event("startup")
+async def start_job_workers():
+    if JOB_CONCURRENCY > 0:
+        job_worker_pool.start()
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    job_worker_pool.stop(timeout=5)
 
 # Health Check Route
 @app.get("/health")
@@ -59,8 +96,15 @@ async def health_check():
         "services": {
             "ocr": "available",
             "signature_detection": "available",
-            "document_analysis": "available"
-        }
+            "document_analysis": "available",
+            "job_queue": job_queue.stats()
+        },
+        "memory": memory_report(),
+        "admission": admission_controller.stats(),
+        "warmup": warmup_report(),
+        "stage_cache": stage_cache.stats(),
+        "pipeline_profiles": profile_costs.stats(),
+        "stage_threads": stage_scheduler.stats()
     }
 
 # Service Info Route
@@ -75,10 +119,12 @@ async def service_info():
             "Signature Detection",
             "Document Format Validation",
             "Image Quality Assessment",
-            "Document Type Classification"
+            "Document Type Classification",
+            "Asynchronous Analysis Jobs"
         ],
         "supported_formats": ["JPEG", "PNG", "PDF"],
-        "max_file_size": "10MB"
+        "max_file_size": "10MB",
+        "threads": thread_report()
     }
 
 # Root Test Route
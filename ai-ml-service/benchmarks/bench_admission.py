@@ -0,0 +1,86 @@
+"""
+Benchmark: admission-control memory estimates against measured stage peaks.
+
+For a 3 MP and a 12 MP page (saved as JPEG), measures the peak of numpy
+allocations (tracemalloc) of the decode and of each stage, each in a fresh
+interpreter so no scratch buffer or cached artifact is reused, and prints
+it in bytes per pixel next to the utils.admission coefficient. The
+measured values should stay at or below the coefficients. Run from the
+ai-ml-service directory:
+
+    python benchmarks/bench_admission.py
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.admission import DECODE_BYTES_PER_PIXEL, STAGE_BYTES_PER_PIXEL
+
+DOCUMENT_TYPE = 'aadhar-card'
+
+def make_page(width, height):
+    rng = np.random.default_rng(6)
+    page = cv2.add(np.full((height, width, 3), 225, np.uint8), rng.integers(0, 25, (height, width, 3), dtype=np.uint8))
+    for i in range(height // 200):
+        cv2.putText(page, 'GOVERNMENT OF INDIA 1234 5678 9012', (width // 3, 200 + i * 150),
+                    cv2.FONT_HERSHEY_SIMPLEX, 2.5, (30, 30, 30), 5)
+    return page
+
+def stage_graph(context, stage):
+    from routes.analysis import legacy_stage_graph, simple_verifier, compression_summary, noise_summary
+    from utils.stage_scheduler import Stage
+    if stage.startswith('legacy.'):
+        return legacy_stage_graph(context, DOCUMENT_TYPE, 'page.jpg', (stage[len('legacy.'):],))
+    if stage == 'compression_analysis':
+        return [Stage(stage, lambda: compression_summary(context.jpeg_forensics))]
+    if stage == 'noise_analysis':
+        return [Stage(stage, lambda: noise_summary(context.noise_analysis))]
+    return simple_verifier.feature_stage_graph(context, {stage})
+
+def measure(path, stage):
+    """Peak bytes per pixel of `stage` ('decode' for the image and its grayscale version)"""
+    import logging
+    logging.disable(logging.CRITICAL)
+    from utils.image_context import ImageContext
+    from utils.stage_scheduler import stage_scheduler
+    context = ImageContext(path, DOCUMENT_TYPE)
+    pixels = context.size[0] * context.size[1]
+    # Built before tracing starts, so the route module imports aren't counted
+    stages = stage_graph(context, stage)
+    tracemalloc.start()
+    context.image, context.gray
+    if stage == 'decode':
+        return tracemalloc.get_traced_memory()[1] / pixels
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    stage_scheduler.run(stages)
+    return (tracemalloc.get_traced_memory()[1] - base) / pixels
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--measure':
+        print(measure(sys.argv[2], sys.argv[3]))
+        return
+    coefficients = {'decode': DECODE_BYTES_PER_PIXEL, **STAGE_BYTES_PER_PIXEL}
+    sizes = ((2000, 1500), (4000, 3000))
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for width, height in sizes:
+            paths.append(os.path.join(directory, f'page_{width}x{height}.jpg'))
+            cv2.imwrite(paths[-1], make_page(width, height), [cv2.IMWRITE_JPEG_QUALITY, 90])
+        print(f"{'stage':>22}{'estimate B/px':>15}" + ''.join(f"{f'{w}x{h} B/px':>16}" for w, h in sizes))
+        for stage, coefficient in coefficients.items():
+            measured = [float(subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', path, stage],
+                                             capture_output=True, text=True, check=True).stdout.split()[-1])
+                        for path in paths]
+            print(f"{stage:>22}{coefficient:>15}" + ''.join(f"{value:>16.1f}" for value in measured))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark: tiled block statistics vs. the per-block Python loops.
+
+Times, per page size, the previous loop implementations of the legacy
+copy-paste block comparison (every 32 px block against every block in later
+rows) and the LBP texture map against their TileStats / vectorized ports in
+routes.analysis, and checks the results agree. The loops are quadratic or
+per-pixel, so only small pages are used. Run from the ai-ml-service
+directory:
+
+    python benchmarks/bench_block_stats.py
+"""
+
+import logging
+import os
+import sys
+import timeit
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.disable(logging.CRITICAL)
+
+from routes.analysis import detect_copy_paste_artifacts, calculate_lbp
+
+def make_page(width, height):
+    rng = np.random.default_rng(3)
+    page = cv2.add(np.full((height, width), 225, np.uint8), rng.integers(0, 25, (height, width), dtype=np.uint8))
+    for i in range(height // 60):
+        cv2.putText(page, 'GOVERNMENT OF INDIA 1234', (width // 4, 40 + i * 50),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, 30, 2)
+    return page
+
+def copy_paste_loop(gray, block_size=32):
+    h, w = gray.shape
+    matches = 0
+    for i in range(0, h - block_size, block_size):
+        for j in range(0, w - block_size, block_size):
+            block = gray[i:i + block_size, j:j + block_size]
+            for ii in range(i + block_size, h - block_size, block_size):
+                for jj in range(0, w - block_size, block_size):
+                    diff = cv2.absdiff(block, gray[ii:ii + block_size, jj:jj + block_size])
+                    if 1.0 - np.mean(diff) / 255.0 > 0.95:
+                        matches += 1
+    return matches
+
+def lbp_loop(gray):
+    rows, cols = gray.shape
+    lbp = np.zeros((rows - 2, cols - 2), dtype=np.uint8)
+    for i in range(1, rows - 1):
+        for j in range(1, cols - 1):
+            center = gray[i, j]
+            neighbors = [gray[i - 1, j - 1], gray[i - 1, j], gray[i - 1, j + 1], gray[i, j + 1],
+                         gray[i + 1, j + 1], gray[i + 1, j], gray[i + 1, j - 1], gray[i, j - 1]]
+            lbp[i - 1, j - 1] = sum(1 << k for k, n in enumerate(neighbors) if n >= center)
+    return lbp
+
+def main():
+    print(f"{'page':>9}{'check':>12}{'loop ms':>10}{'tiled ms':>10}  same")
+    # Sizes that aren't tile multiples, where the loops cover the same tiles
+    for width, height in ((330, 270), (650, 490)):
+        gray = make_page(width, height)
+        for name, loop, port in (
+                ('copy-paste', copy_paste_loop, detect_copy_paste_artifacts),
+                ('lbp', lbp_loop, calculate_lbp)):
+            loop_time = min(timeit.repeat(lambda: loop(gray), number=1, repeat=1))
+            port_time = min(timeit.repeat(lambda: port(gray), number=1, repeat=3))
+            same = np.allclose(loop(gray), port(gray))
+            print(f"{width:>4}x{height:<4}{name:>12}{loop_time * 1e3:>10.1f}{port_time * 1e3:>10.1f}  {same}")
+
+if __name__ == "__main__":
+    main()
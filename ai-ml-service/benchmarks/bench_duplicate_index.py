@@ -0,0 +1,58 @@
+"""
+Benchmark: near-duplicate lookup in the multi-index hashing index.
+
+Fills a temporary index with random document hashes, plants near-duplicates
+of a query, and times DuplicateIndex.find against a vectorized linear scan
+(XOR + popcount over every stored pHash). Run from the ai-ml-service
+directory:
+
+    python benchmarks/bench_duplicate_index.py
+"""
+
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.duplicate_index import DuplicateIndex, DUPLICATE_HAMMING_RADIUS
+
+def fill(index, hashes):
+    with index._connection() as conn:
+        conn.execute("BEGIN")
+        for i, value in enumerate(hashes):
+            index.add(f"doc-{i}", 'id-card', {'phash': int(value), 'dhash': 0, 'ahash': 0}, conn)
+        conn.execute("COMMIT")
+
+def linear_scan(hashes, query, radius):
+    xor = (hashes ^ np.uint64(query)).view(np.uint8).reshape(-1, 8)
+    distances = np.unpackbits(xor, axis=1).sum(axis=1)
+    return np.flatnonzero(distances <= radius)
+
+def main(sizes=(100000, 1000000), number=50):
+    rng = np.random.default_rng(5)
+    query = int(rng.integers(0, 2 ** 63, dtype=np.uint64))
+    print(f"radius {DUPLICATE_HAMMING_RADIUS}")
+    print(f"{'documents':>10}{'index ms':>10}{'linear scan ms':>16}{'found':>7}")
+    for size in sizes:
+        hashes = rng.integers(0, 2 ** 63, size, dtype=np.uint64) * np.uint64(2) + rng.integers(0, 2, size, dtype=np.uint64)
+        # Near-duplicates: the query with 1..radius random bits flipped
+        for i, flips in enumerate(range(1, DUPLICATE_HAMMING_RADIUS + 1)):
+            bits = rng.choice(64, flips, replace=False)
+            hashes[i * 997] = np.uint64(query ^ sum(1 << int(b) for b in bits))
+
+        with tempfile.TemporaryDirectory() as directory:
+            index = DuplicateIndex(os.path.join(directory, 'duplicates.db'))
+            fill(index, hashes)
+            lookup = {'phash': query, 'dhash': 0}
+            found = len(index.find(lookup, limit=100))
+            index_s = min(timeit.repeat(lambda: index.find(lookup), number=number, repeat=3)) / number
+        scan_s = min(timeit.repeat(lambda: linear_scan(hashes, query, DUPLICATE_HAMMING_RADIUS),
+                                   number=5, repeat=3)) / 5
+        print(f"{size:>10}{index_s * 1e3:>10.2f}{scan_s * 1e3:>16.1f}{found:>7}")
+
+if __name__ == "__main__":
+    main()
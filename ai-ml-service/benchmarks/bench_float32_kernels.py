@@ -0,0 +1,81 @@
+"""
+Benchmark: float32 scratch-buffer kernels vs. the float64 expressions.
+
+Runs, on a 24 MP page, the previous float64 forms of the sharpness,
+brightness/contrast, gradient-magnitude and FFT-energy computations against
+the utils.scratch kernels (the FFT energy as in
+AdvancedDocumentVerifier.frequency_energy), and reports the time and the
+peak of numpy allocations (tracemalloc) of each. The kernels are timed on a
+second call, once the thread's scratch buffers exist. Run from the
+ai-ml-service directory:
+
+    python benchmarks/bench_float32_kernels.py
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from scipy import fft
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.scratch import gradient_magnitude, laplacian_variance, mean_std, scratch
+
+def make_page(width, height):
+    rng = np.random.default_rng(5)
+    page = cv2.add(np.full((height, width), 225, np.uint8), rng.integers(0, 25, (height, width), dtype=np.uint8))
+    for i in range(height // 200):
+        cv2.putText(page, 'GOVERNMENT OF INDIA 1234 5678 9012', (width // 3, 200 + i * 150),
+                    cv2.FONT_HERSHEY_SIMPLEX, 2.5, 30, 5)
+    return page
+
+def float64_kernels(gray):
+    sharpness = cv2.Laplacian(gray, cv2.CV_64F).var()
+    contrast = np.std(gray)
+    gx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
+    gy = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
+    gradient = np.sqrt(gx**2 + gy**2)
+    gradient_std = np.std(gradient)
+    del gx, gy, gradient
+    energy = np.sum(np.log(np.abs(np.fft.fftshift(np.fft.fft2(gray))) + 1) ** 2)
+    return sharpness, contrast, gradient_std, energy
+
+def float32_kernels(gray):
+    sharpness = laplacian_variance(gray)
+    contrast = mean_std(gray)[1]
+    gradient_std = mean_std(gradient_magnitude(gray))[1]
+    pixels = scratch('fft_input', gray.shape)
+    pixels[...] = gray
+    spectrum = fft.rfft2(pixels)
+    magnitude = np.abs(spectrum, out=scratch('fft_magnitude', spectrum.shape))
+    del spectrum
+    np.log1p(magnitude, out=magnitude)
+    magnitude *= magnitude
+    columns = magnitude.sum(axis=0, dtype=np.float64)
+    energy = float(columns.sum() + columns[1:(gray.shape[1] + 1) // 2].sum())
+    return sharpness, contrast, gradient_std, energy
+
+def measure(func, gray):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(gray)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def main():
+    gray = make_page(6000, 4000)
+    float32_kernels(gray)  # allocate the scratch buffers
+    print(f"{'kernels':>9}{'ms':>9}{'peak MB':>10}  sharpness / contrast / gradient std / fft energy")
+    for name, func in (('float64', float64_kernels), ('float32', float32_kernels)):
+        result, elapsed, peak = measure(func, gray)
+        values = ' / '.join(f"{value:.6g}" for value in result)
+        print(f"{name:>9}{elapsed * 1e3:>9.0f}{peak / 2**20:>10.1f}  {values}")
+
+if __name__ == "__main__":
+    main()
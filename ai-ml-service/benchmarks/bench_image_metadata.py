@@ -0,0 +1,75 @@
+"""
+Benchmark: header-only metadata parsing vs. exifread and PIL.
+
+Writes a JPEG carrying EXIF (IFD0 camera tags, an Exif sub-IFD), XMP and an
+ICC profile, then times the previous per-verifier extraction - exifread with
+full details and PIL's _getexif, each opening the file plus an os.stat -
+against parse_image_metadata on the upload bytes. Run from the ai-ml-service
+directory (exifread is optional):
+
+    python benchmarks/bench_image_metadata.py
+"""
+
+import io
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+from PIL import Image, ImageCms
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.image_metadata import parse_image_metadata
+
+try:
+    import exifread
+    EXIFREAD_AVAILABLE = True
+except ImportError:
+    EXIFREAD_AVAILABLE = False
+
+def make_jpeg(width, height):
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 255, (height, width, 3), dtype=np.uint8))
+    exif = Image.Exif()
+    exif.update({271: 'Canon', 272: 'Canon EOS 5D Mark IV', 274: 1, 305: 'Adobe Photoshop 24.0',
+                 306: '2024:01:01 10:00:00'})
+    exif.get_ifd(0x8769)[0x9003] = '2024:01:01 09:59:58'
+    icc = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+    xmp = b'<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:Description xmp:CreatorTool="Adobe Photoshop 24.0"/></x:xmpmeta>'
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90, exif=exif, icc_profile=icc, xmp=xmp)
+    return buffer.getvalue()
+
+def with_exifread(path):
+    os.stat(path)
+    with open(path, 'rb') as f:
+        return exifread.process_file(f)
+
+def with_pil(path):
+    os.stat(path)
+    with Image.open(path) as image:
+        return image._getexif()
+
+def main(number=200):
+    print(f"{'image':>11}{'exifread us':>13}{'PIL us':>10}{'header us':>11}")
+    for width, height in ((1600, 1200), (4000, 3000)):
+        data = make_jpeg(width, height)
+        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f:
+            f.write(data)
+        try:
+            timings = []
+            for func in ((lambda: with_exifread(f.name)) if EXIFREAD_AVAILABLE else None,
+                         lambda: with_pil(f.name),
+                         lambda: parse_image_metadata(data)):
+                if func is None:
+                    timings.append(float('nan'))
+                    continue
+                timings.append(min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6)
+            print(f"{width:>5}x{height:<5}{timings[0]:>13.1f}{timings[1]:>10.1f}{timings[2]:>11.1f}")
+        finally:
+            os.unlink(f.name)
+
+if __name__ == "__main__":
+    main()
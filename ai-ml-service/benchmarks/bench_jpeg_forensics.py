@@ -0,0 +1,52 @@
+"""
+Benchmark: JPEG compression analysis vs. the per-block variance loop.
+
+Times, per page size, the previous forensics-stage loop (np.var over every
+8x8 block) against analyze_jpeg, which also estimates the quality, detects
+double quantization and the block grid alignment, and reports how far the
+two block-variance means differ. Run from the ai-ml-service directory:
+
+    python benchmarks/bench_jpeg_forensics.py
+"""
+
+import os
+import sys
+import timeit
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.jpeg_forensics import analyze_jpeg, compression_features
+
+def make_page(width, height):
+    rng = np.random.default_rng(2)
+    page = cv2.add(np.full((height, width, 3), 225, np.uint8), rng.integers(0, 25, (height, width, 3), dtype=np.uint8))
+    for i in range(height // 200):
+        cv2.putText(page, 'GOVERNMENT OF INDIA 1234 5678 9012', (width // 3, 200 + i * 150),
+                    cv2.FONT_HERSHEY_SIMPLEX, 2.5, (30, 30, 30), 5)
+    return page
+
+def block_loop(gray):
+    h, w = gray.shape
+    block_scores = []
+    for i in range(0, h - 8, 8):
+        for j in range(0, w - 8, 8):
+            block_scores.append(np.var(gray[i:i + 8, j:j + 8]))
+    return np.mean(block_scores), np.std(block_scores)
+
+def main(number=1):
+    print(f"{'page':>11}{'loop ms':>10}{'analyze ms':>12}{'mean diff %':>13}")
+    for width, height in ((1600, 1200), (4000, 3000)):
+        data = cv2.imencode('.jpg', make_page(width, height), [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+        gray = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+        loop = min(timeit.repeat(lambda: block_loop(gray), number=number, repeat=3)) / number
+        analyze = min(timeit.repeat(lambda: analyze_jpeg(data, gray), number=number, repeat=3)) / number
+        loop_mean, _ = block_loop(gray)
+        features = compression_features(analyze_jpeg(data, gray))
+        diff = abs(features['block_variance_mean'] - loop_mean) / loop_mean * 100
+        print(f"{width:>5}x{height:<5}{loop * 1e3:>10.1f}{analyze * 1e3:>12.1f}{diff:>13.2f}")
+
+if __name__ == "__main__":
+    main()
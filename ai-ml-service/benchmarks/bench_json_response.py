@@ -0,0 +1,84 @@
+"""
+Benchmark: response serialization for a typical /analyze payload.
+
+Compares the previous path (to_serializable walk + stdlib JSONResponse)
+with NumpyJSONResponse. Run from the ai-ml-service directory:
+
+    python benchmarks/bench_json_response.py
+"""
+
+import os
+import sys
+import timeit
+
+import numpy as np
+from fastapi.responses import JSONResponse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.json_utils import to_serializable, NumpyJSONResponse, ORJSON_AVAILABLE
+
+def build_typical_analyze_response():
+    """Build a payload shaped like the /analyze response, with numpy values left in place"""
+    rng = np.random.default_rng(42)
+    features = {}
+    for i in range(80):
+        features[f'numeric_feature_{i}'] = np.float64(rng.random() * 1000)
+    for i in range(10):
+        features[f'flag_{i}'] = np.bool_(rng.random() > 0.5)
+    for i in range(10):
+        features[f'count_{i}'] = np.int64(rng.integers(0, 100))
+    features['extracted_text'] = 'GOVERNMENT OF INDIA ' * 25
+    features['color_histogram'] = rng.random(96).astype(np.float32)
+    features['logo_candidates'] = [
+        {'area': np.float64(rng.random() * 5000), 'bbox': (int(x), int(x) + 10, 40, 40), 'circular': np.bool_(True)}
+        for x in rng.integers(0, 1000, 20)
+    ]
+
+    classification_result = {
+        'is_authentic': np.bool_(False),
+        'confidence': np.float64(0.42),
+        'classification_method': 'ensemble_ml',
+        'anomaly_score': np.float64(0.13),
+        'detailed_scores': {k: np.float64(rng.random()) for k in
+                            ['svm_confidence', 'xgb_confidence', 'rf_confidence', 'rule_based_score', 'anomaly_score']},
+        'features': features
+    }
+
+    return {
+        'is_valid': np.bool_(False),
+        'confidence_score': np.float64(0.37),
+        'detected_text': features['extracted_text'],
+        'extracted_data': {
+            'metadata': {'file_size': np.int64(523311), 'dimensions': {'width': np.int64(1600), 'height': np.int64(1000)}},
+            'quality_metrics': {k: np.float64(rng.random() * 100) for k in ['sharpness', 'contrast', 'brightness', 'noise_level']}
+        },
+        'anomalies': ['Very low OCR confidence - possible image quality issues'] * 4,
+        'processing_time': 0.004,
+        'ocr_accuracy': np.float64(0.61),
+        'signature_detected': np.bool_(True),
+        'format_validation': {'dimensions_valid': True, 'aspect_ratio_valid': np.bool_(True), 'size_score': np.float64(1.0)},
+        'quality_score': np.float64(0.72),
+        'ml_analysis': classification_result,
+        'feature_count': len(features),
+        'ml_method': 'advanced_ensemble',
+        'timestamp': '2024-01-01T00:00:00'
+    }
+
+def stdlib_path(payload):
+    return JSONResponse(to_serializable(payload)).body
+
+def numpy_path(payload):
+    return NumpyJSONResponse(payload).body
+
+def main(number=2000):
+    payload = build_typical_analyze_response()
+    print(f"orjson available: {ORJSON_AVAILABLE}")
+    print(f"{'path':<38}{'us/response':>14}{'bytes':>10}")
+    for name, fn in [('to_serializable + JSONResponse', stdlib_path),
+                     ('NumpyJSONResponse', numpy_path)]:
+        seconds = min(timeit.repeat(lambda: fn(payload), number=number, repeat=5))
+        print(f"{name:<38}{seconds / number * 1e6:>14.1f}{len(fn(payload)):>10}")
+
+if __name__ == "__main__":
+    main()
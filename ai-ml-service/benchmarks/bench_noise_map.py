@@ -0,0 +1,52 @@
+"""
+Benchmark: sliding-window noise variance from integral images.
+
+Times, per page size, window_variance for several window sizes (quarter-
+window stride) against computing the same windows with np.var on each
+window, and the full analyze_noise pass. The integral-image cost should stay
+flat as the window grows. Run from the ai-ml-service directory:
+
+    python benchmarks/bench_noise_map.py
+"""
+
+import os
+import sys
+import timeit
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.noise_map import analyze_noise, noise_residual, window_variance
+
+def make_page(width, height):
+    rng = np.random.default_rng(4)
+    page = cv2.add(np.full((height, width), 225, np.uint8), rng.integers(0, 25, (height, width), dtype=np.uint8))
+    for i in range(height // 200):
+        cv2.putText(page, 'GOVERNMENT OF INDIA 1234 5678 9012', (width // 3, 200 + i * 150),
+                    cv2.FONT_HERSHEY_SIMPLEX, 2.5, 30, 5)
+    return page
+
+def window_loop(values, window, step):
+    height, width = values.shape
+    return np.array([[np.var(values[y:y + window, x:x + window]) for x in range(0, width - window + 1, step)]
+                     for y in range(0, height - window + 1, step)])
+
+def main():
+    windows = (16, 32, 64, 128)
+    print(f"{'page':>11}" + ''.join(f"{f'loop {w} ms':>13}{f'integral {w} ms':>17}" for w in windows) + f"{'analyze ms':>12}")
+    for width, height in ((1600, 1200), (4000, 3000)):
+        gray = make_page(width, height)
+        residual = noise_residual(gray)
+        row = f"{width:>5}x{height:<5}"
+        for window in windows:
+            step = window // 4
+            loop = min(timeit.repeat(lambda: window_loop(residual, window, step), number=1, repeat=1))
+            integral = min(timeit.repeat(lambda: window_variance(residual, window, step), number=1, repeat=3))
+            row += f"{loop * 1e3:>13.1f}{integral * 1e3:>17.1f}"
+        analyze = min(timeit.repeat(lambda: analyze_noise(gray), number=1, repeat=3))
+        print(row + f"{analyze * 1e3:>12.1f}")
+
+if __name__ == "__main__":
+    main()
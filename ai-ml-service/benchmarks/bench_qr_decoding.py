@@ -0,0 +1,52 @@
+"""
+Benchmark: ROI-first QR decoding vs. decoding the full frame.
+
+Renders a dense QR code (a 1200-digit payload, the size of an Aadhaar secure
+QR) onto pages of increasing resolution and times decode_codes against a
+single full-frame decode with the same decoder (pyzbar when zbar is
+installed, OpenCV otherwise). The same pages without a QR code, the common
+case, are timed too, with and without expect_qr. Run from the ai-ml-service
+directory:
+
+    python benchmarks/bench_qr_decoding.py
+"""
+
+import os
+import sys
+import timeit
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.qr_decoding import decode_codes, _decode, PYZBAR_AVAILABLE
+
+def make_page(width, height, module=6, with_qr=True):
+    rng = np.random.default_rng(2)
+    page = cv2.add(np.full((height, width), 230, np.uint8), rng.integers(0, 20, (height, width), dtype=np.uint8))
+    for i in range(height // 150):
+        cv2.putText(page, 'GOVERNMENT OF INDIA 1234 5678 9012', (100, 150 + i * 90),
+                    cv2.FONT_HERSHEY_SIMPLEX, 2, 20, 4)
+    if not with_qr:
+        return page
+    qr = cv2.QRCodeEncoder.create().encode('1' * 1200)
+    qr = cv2.resize(qr, None, fx=module, fy=module, interpolation=cv2.INTER_NEAREST)
+    y, x = height - qr.shape[0] - 200, width - qr.shape[1] - 200
+    page[y:y + qr.shape[0], x:x + qr.shape[1]] = qr
+    return page
+
+def main(number=3):
+    print(f"decoder: {'pyzbar' if PYZBAR_AVAILABLE else 'opencv'}")
+    print(f"{'page':>11}{'qr':>7}{'expect_qr':>10}{'full frame ms':>15}{'roi-first ms':>14}  method")
+    for width, height in ((2000, 1500), (4000, 3000), (6000, 4000)):
+        for with_qr, expect_qr in ((True, False), (False, False), (False, True)):
+            page = make_page(width, height, with_qr=with_qr)
+            full = min(timeit.repeat(lambda: _decode(page), number=number, repeat=3)) / number
+            roi = min(timeit.repeat(lambda: decode_codes(page, expect_qr=expect_qr), number=number, repeat=3)) / number
+            method = decode_codes(page, expect_qr=expect_qr)['method']
+            print(f"{width:>5}x{height:<5}{'yes' if with_qr else 'no':>7}{str(expect_qr):>10}"
+                  f"{full * 1e3:>15.1f}{roi * 1e3:>14.1f}  {method}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Benchmark: reduced-scale JPEG views vs. the full-resolution decode.
+
+Times, per page size, the full cv2.imread decode against the DCT-domain
+reduced decodes ImageContext.view uses (1/2, 1/4, 1/8), and face detection
+on the face view against detection on the full image. Run from the
+ai-ml-service directory:
+
+    python benchmarks/bench_reduced_views.py
+"""
+
+import os
+import sys
+import tempfile
+import timeit
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.face_descriptors import detect_faces
+from utils.image_context import ImageContext, FACE_VIEW_SIDE
+
+def make_page(width, height):
+    rng = np.random.default_rng(1)
+    page = cv2.add(np.full((height, width, 3), 225, np.uint8), rng.integers(0, 25, (height, width, 3), dtype=np.uint8))
+    for i in range(height // 200):
+        cv2.putText(page, 'GOVERNMENT OF INDIA 1234 5678 9012', (width // 3, 200 + i * 150),
+                    cv2.FONT_HERSHEY_SIMPLEX, 2.5, (30, 30, 30), 5)
+    side = height // 3
+    cv2.ellipse(page, (width // 6, height // 3), (side // 3, side // 2), 0, 0, 360, (140, 170, 200), -1)
+    return page
+
+def main(number=3):
+    print(f"{'page':>11}{'full ms':>9}{'1/2 ms':>8}{'1/4 ms':>8}{'1/8 ms':>8}{'faces full ms':>15}{'faces view ms':>15}")
+    for width, height in ((2000, 1500), (4000, 3000), (6000, 4000)):
+        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f:
+            path = f.name
+        try:
+            cv2.imwrite(path, make_page(width, height), [cv2.IMWRITE_JPEG_QUALITY, 90])
+            decode = [min(timeit.repeat(lambda: cv2.imread(path), number=number, repeat=3)) / number]
+            for flag in (cv2.IMREAD_REDUCED_COLOR_2, cv2.IMREAD_REDUCED_COLOR_4, cv2.IMREAD_REDUCED_COLOR_8):
+                decode.append(min(timeit.repeat(lambda: cv2.imread(path, flag), number=number, repeat=3)) / number)
+
+            image = cv2.imread(path)
+            faces_full = min(timeit.repeat(lambda: detect_faces(image), number=1, repeat=3))
+            # Fresh context per run: reduced decode plus detection
+            faces_view = min(timeit.repeat(lambda: ImageContext(path).faces, number=1, repeat=3))
+            factor = ImageContext(path).reduction(FACE_VIEW_SIDE)
+            print(f"{width:>5}x{height:<5}{decode[0] * 1e3:>9.1f}" + ''.join(f"{t * 1e3:>8.1f}" for t in decode[1:]) +
+                  f"{faces_full * 1e3:>15.1f}{faces_view * 1e3:>15.1f}  (face view 1/{factor})")
+        finally:
+            os.unlink(path)
+
+if __name__ == "__main__":
+    main()
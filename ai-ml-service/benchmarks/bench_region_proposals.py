@@ -0,0 +1,108 @@
+"""
+Benchmark: contour-based detectors vs. shared region proposals.
+
+The "findContours" column re-implements the previous per-detector pattern
+(threshold, findContours, Python loop over contourArea/arcLength/
+boundingRect/convexHull/approxPolyDP) for the detectors that run on one
+document. The "region table" column runs the current detectors against one
+shared RegionProposer. Run from the ai-ml-service directory:
+
+    python benchmarks/bench_region_proposals.py
+"""
+
+import os
+import sys
+import timeit
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.region_proposals import RegionProposer
+from routes.analysis import detect_signature_presence, analyze_document_structure
+from routes.validation import detect_text_regions, detect_photo_regions
+from routes.signature import find_signatures
+
+def make_document(width=1600, height=1142, lines=30):
+    """Synthetic scan: noisy paper, photo box, seal, many lines of text and a signature"""
+    rng = np.random.default_rng(3)
+    image = np.full((height, width, 3), 225, np.uint8)
+    image = cv2.add(image, rng.integers(0, 30, image.shape, dtype=np.uint8))
+    cv2.rectangle(image, (80, 300), (400, 700), (90, 90, 90), -1)
+    cv2.circle(image, (1400, 160), 60, (30, 30, 120), -1)
+    for i in range(lines):
+        cv2.putText(image, f"NAME DOB 12/03/1990 ADDRESS GOVT OF INDIA {i}", (450, 60 + i * 35),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (20, 20, 20), 2)
+    pts = (np.cumsum(rng.integers(-6, 7, (400, 2)), axis=0) + [700, 1080]).astype(np.int32)
+    cv2.polylines(image, [pts], False, (10, 10, 10), 4)
+    return cv2.GaussianBlur(image, (3, 3), 0)
+
+def contours(binary):
+    return cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+
+def previous_detectors(gray):
+    """Per-detector thresholding and contour loops, as before region proposals"""
+    inv127 = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY_INV)[1]
+    bin127 = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)[1]
+    otsu = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+    otsu_inv = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+
+    # Signature presence and signature finding
+    sum(1 for c in contours(inv127) if 100 < cv2.contourArea(c) < 10000)
+    for c in contours(inv127):
+        area = cv2.contourArea(c)
+        if 1000 < area < 50000:
+            x, y, w, h = cv2.boundingRect(c)
+            cv2.contourArea(cv2.convexHull(c))
+
+    # Logo heuristics (advanced and simple verifiers)
+    for _ in range(2):
+        for c in contours(cv2.Canny(gray, 50, 150)):
+            area = cv2.contourArea(c)
+            if 500 < area < 10000:
+                cv2.arcLength(c, True)
+                cv2.boundingRect(c)
+
+    # QR squares
+    for c in contours(bin127):
+        if 1000 < cv2.contourArea(c) < 50000:
+            cv2.boundingRect(c)
+
+    # Text regions and document structure
+    for c in contours(otsu_inv):
+        if 100 < cv2.contourArea(c) < 10000:
+            cv2.boundingRect(c)
+    for c in contours(otsu):
+        cv2.boundingRect(c)
+        cv2.contourArea(c)
+
+    # Photo regions
+    for c in contours(cv2.Canny(gray, 50, 150)):
+        if 5000 < cv2.contourArea(c) < 100000:
+            cv2.approxPolyDP(c, 0.02 * cv2.arcLength(c, True), True)
+
+def current_detectors(image, gray):
+    regions = RegionProposer(gray)
+    detect_signature_presence(image, regions)
+    find_signatures(image, regions)
+    # Logo and QR filters (the verifiers' content stages also run face detection)
+    edges, binary = regions.table('canny'), regions.table('bin127')
+    np.count_nonzero((edges['area'] > 500) & (edges['area'] < 10000) & (edges['circularity'] > 0.3))
+    np.count_nonzero((binary['area'] > 1000) & (binary['area'] < 50000) & (binary['aspect_ratio'] > 0.8))
+    detect_text_regions(gray, regions)
+    analyze_document_structure(image, '', regions)
+    detect_photo_regions(gray, regions)
+
+def main(number=10):
+    for lines in (5, 30):
+        image = make_document(lines=lines)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        n_contours = len(contours(cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]))
+        before = min(timeit.repeat(lambda: previous_detectors(gray), number=number, repeat=3)) / number
+        after = min(timeit.repeat(lambda: current_detectors(image, gray), number=number, repeat=3)) / number
+        print(f"{lines:>3} text lines, {n_contours:>5} contours: "
+              f"findContours {before * 1e3:7.1f} ms   region table {after * 1e3:7.1f} ms")
+
+if __name__ == "__main__":
+    main()
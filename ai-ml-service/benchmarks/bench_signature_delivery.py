@@ -0,0 +1,67 @@
+"""
+Benchmark: /extract-signature crop encoding and delivery.
+
+Compares the previous path (PIL PNG + base64 in JSON) with the crop cache
+encodings, inline and as binary parts, for a set of signature-sized crops.
+Run from the ai-ml-service directory:
+
+    python benchmarks/bench_signature_delivery.py
+"""
+
+import base64
+import io
+import os
+import sys
+import timeit
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.crop_cache import encode_crop
+
+def make_crops(count=4, size=(140, 320)):
+    """Scanned-looking signature crops: textured paper with a thick ink stroke"""
+    rng = np.random.default_rng(7)
+    crops = []
+    for _ in range(count):
+        crop = np.full(size + (3,), 232, np.uint8)
+        crop = cv2.add(crop, rng.integers(0, 18, crop.shape, dtype=np.uint8))
+        pts = (np.cumsum(rng.integers(-5, 6, (200, 2)), axis=0) + [size[1] // 2, size[0] // 2]).astype(np.int32)
+        cv2.polylines(crop, [pts], False, (25, 25, 60), 3)
+        crops.append(crop)
+    return crops
+
+def previous_inline(crops):
+    out = []
+    for crop in crops:
+        buffer = io.BytesIO()
+        Image.fromarray(crop).save(buffer, format='PNG')
+        out.append(base64.b64encode(buffer.getvalue()).decode())
+    return sum(len(s) for s in out)
+
+def inline(crops, encoding, quality=None):
+    return sum(len(base64.b64encode(encode_crop(c, encoding, quality))) for c in crops)
+
+def binary(crops, encoding, quality=None):
+    return sum(len(encode_crop(c, encoding, quality)) for c in crops)
+
+def main(number=50):
+    crops = make_crops()
+    cases = [
+        ('PIL PNG + base64 (previous)', lambda: previous_inline(crops)),
+        ('png inline', lambda: inline(crops, 'png')),
+        ('png binary', lambda: binary(crops, 'png')),
+        ('jpeg q85 binary', lambda: binary(crops, 'jpeg', 85)),
+        ('webp q80 binary', lambda: binary(crops, 'webp', 80)),
+    ]
+    print(f"{len(crops)} crops of {crops[0].shape[1]}x{crops[0].shape[0]}")
+    print(f"{'path':<30}{'ms/response':>12}{'bytes':>10}")
+    for name, fn in cases:
+        seconds = min(timeit.repeat(fn, number=number, repeat=3)) / number
+        print(f"{name:<30}{seconds * 1e3:>12.2f}{fn():>10}")
+
+if __name__ == "__main__":
+    main()
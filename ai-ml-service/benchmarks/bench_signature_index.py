@@ -0,0 +1,54 @@
+"""
+Benchmark: reference signature search in the memory-mapped vector index.
+
+Fills a temporary index with random unit descriptors spread over many
+subjects, then times a per-subject comparison (the /signature/compare path),
+a full scan excluding one subject, and a Python loop over the same vectors
+for reference. Run from the ai-ml-service directory:
+
+    python benchmarks/bench_signature_index.py
+"""
+
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.vector_index import VectorIndex
+from utils.signature_descriptors import DESCRIPTOR_DIM
+
+def fill(index, vectors, per_subject):
+    for i, vector in enumerate(vectors):
+        index.add(vector, f"subject-{i // per_subject}")
+
+def python_loop(vectors, query):
+    best = None
+    for i, vector in enumerate(vectors):
+        distance = 1.0 - float(np.dot(vector, query) / (np.linalg.norm(vector) * np.linalg.norm(query)))
+        if best is None or distance < best[1]:
+            best = (i, distance)
+    return best
+
+def main(sizes=(1000, 10000), per_subject=5, number=20):
+    rng = np.random.default_rng(11)
+    print(f"{'vectors':>8}{'subject ms':>12}{'scan ms':>10}{'python loop ms':>16}")
+    for size in sizes:
+        vectors = rng.standard_normal((size, DESCRIPTOR_DIM)).astype(np.float32)
+        query = vectors[size // 2] + 0.1 * rng.standard_normal(DESCRIPTOR_DIM).astype(np.float32)
+        with tempfile.TemporaryDirectory() as directory:
+            index = VectorIndex('bench', DESCRIPTOR_DIM, directory=directory)
+            fill(index, vectors, per_subject)
+            subject = f"subject-{(size // 2) // per_subject}"
+            per_subject_s = min(timeit.repeat(lambda: index.search(query, 3, subject_id=subject),
+                                              number=number, repeat=3)) / number
+            scan_s = min(timeit.repeat(lambda: index.search(query, 3, exclude_subject_id=subject),
+                                       number=number, repeat=3)) / number
+        loop_s = min(timeit.repeat(lambda: python_loop(vectors, query), number=1, repeat=3))
+        print(f"{size:>8}{per_subject_s * 1e3:>12.2f}{scan_s * 1e3:>10.2f}{loop_s * 1e3:>16.1f}")
+
+if __name__ == "__main__":
+    main()
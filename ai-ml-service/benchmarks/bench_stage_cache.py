@@ -0,0 +1,64 @@
+"""
+Benchmark: one file sent to /analyze, /detect-signature, /validate-format
+and /ocr, with and without the stage cache.
+
+Each route sequence runs on a fresh upload (a new content hash), twice: the
+second pass is a client retrying the same file. Prints the wall time per
+call and the stage cache hit ratios. Run from the ai-ml-service directory:
+
+    python benchmarks/bench_stage_cache.py
+"""
+
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+from app import app
+from utils.stage_cache import stage_cache
+
+DOCUMENT_TYPE = 'aadhar-card'
+CALLS = (('/api/v1/analyze', True), ('/api/v1/detect-signature', False),
+         ('/api/v1/validate-format', True), ('/api/v1/ocr', False))
+
+def make_upload(seed, width=1600, height=1000):
+    rng = np.random.default_rng(seed)
+    page = cv2.add(np.full((height, width, 3), 225, np.uint8), rng.integers(0, 25, (height, width, 3), dtype=np.uint8))
+    for i in range(12):
+        cv2.putText(page, f'GOVERNMENT OF INDIA 1234 5678 {9000 + i}', (450, 80 + i * 70),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.2, (30, 30, 30), 2)
+    pts = (np.cumsum(rng.integers(-6, 7, (300, 2)), axis=0) + [600, 920]).astype(np.int32)
+    cv2.polylines(page, [pts], False, (10, 10, 10), 4)
+    return cv2.imencode('.jpg', page, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+def run_sequence(client, content):
+    timings = {}
+    for path, typed in CALLS:
+        start = time.perf_counter()
+        response = client.post(path, files={'file': ('doc.jpg', content, 'image/jpeg')},
+                               data={'document_type': DOCUMENT_TYPE} if typed else None)
+        response.raise_for_status()
+        timings[path] = time.perf_counter() - start
+    return timings
+
+def main():
+    client = TestClient(app)
+    budget = stage_cache.max_bytes
+    for label, max_bytes, seed in (('no cache', 0, 1), ('stage cache', budget, 2)):
+        stage_cache.max_bytes = max_bytes
+        content = make_upload(seed)
+        passes = [run_sequence(client, content) for _ in range(2)]
+        print(f"{label}:")
+        for path, _ in CALLS:
+            print(f"  {path:<26}" + ''.join(f"{timings[path] * 1000:>10.1f} ms" for timings in passes))
+    for stage, counts in stage_cache.stats()['stages'].items():
+        print(f"{stage:>30}: {counts['hits']} hits, {counts['misses']} misses ({counts['hit_ratio']:.0%})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark: feature-extraction throughput for different splits of the host's
+CPUs into worker processes x threads per worker.
+
+Each configuration forks the given number of processes, applies the thread
+budget in each (as serve.py does) and counts documents processed in a fixed
+time window. The "oversubscribed" row leaves every library at its default of
+one thread per core in every process. Run from the ai-ml-service directory:
+
+    python benchmarks/bench_thread_budget.py --seconds 10
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.concurrency import apply_thread_budget, available_cpus
+
+def make_document(path, width=1600, height=1000):
+    """Write a synthetic ID-card-like image with text, boxes and noise"""
+    rng = np.random.default_rng(0)
+    image = np.full((height, width, 3), 235, dtype=np.uint8)
+    cv2.rectangle(image, (40, 40), (width - 40, height - 40), (60, 60, 160), 6)
+    cv2.circle(image, (200, 200), 90, (30, 120, 30), -1)
+    for i in range(12):
+        cv2.putText(image, f"FIELD {i}: GOVERNMENT OF INDIA 1234 5678", (360, 140 + i * 60),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.1, (20, 20, 20), 2)
+    image = cv2.add(image, rng.integers(0, 20, image.shape, dtype=np.uint8))
+    cv2.imwrite(path, image)
+
+def worker(image_path, budget, seconds, start_at, counter):
+    if budget:
+        apply_thread_budget(budget)
+    try:
+        from utils.ml_pipeline import ml_verifier as verifier
+    except ImportError:
+        from utils.simple_verifier import simple_verifier as verifier
+
+    while time.time() < start_at:
+        time.sleep(0.01)
+    done = 0
+    deadline = start_at + seconds
+    while time.time() < deadline:
+        verifier.extract_comprehensive_features(image_path, 'id-card')
+        done += 1
+    with counter.get_lock():
+        counter.value += done
+
+def run(image_path, workers, budget, seconds):
+    ctx = multiprocessing.get_context('fork')
+    counter = ctx.Value('i', 0)
+    # Leave time for the imports before the measurement window opens
+    start_at = time.time() + 5
+    procs = [ctx.Process(target=worker, args=(image_path, budget, seconds, start_at, counter))
+             for _ in range(workers)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    return counter.value / seconds
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    cpus = available_cpus()
+    splits = [(w, cpus // w) for w in range(1, cpus + 1) if cpus % w == 0]
+    configs = [(f"{w} x {t}", w, t) for w, t in splits]
+    configs.append((f"{cpus} x default (oversubscribed)", cpus, None))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image_path = os.path.join(tmp, 'document.jpg')
+        make_document(image_path)
+
+        print(f"CPUs: {cpus}")
+        print(f"{'workers x threads':<34}{'docs/s':>10}")
+        for name, workers, budget in configs:
+            print(f"{name:<34}{run(image_path, workers, budget, args.seconds):>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, File, UploadFile, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from datetime import datetime
 import os
 import io
@@ -9,7 +9,27 @@ import numpy as np
 import pytesseract
 import logging
 import sys
-from utils.json_utils import to_serializable
+import tempfile
+import time
+from typing import Optional
+from utils.json_utils import NumpyJSONResponse
+from utils.analysis_plan import build_analysis_plan, LEGACY_ANALYSES
+from utils.admission import AdmissionRejected, admission_controller, planned_stages
+from utils.block_stats import TileStats
+from utils.deadlines import (Deadline, current_deadline, deadline_header, ensure_time_left, request_deadline,
+                             tesseract_timeout)
+from utils.aadhaar_qr import verify_aadhaar_qr, qr_ocr_features, cross_check_fields
+from utils.duplicate_index import check_near_duplicates
+from utils.face_descriptors import check_face_reuse
+from utils.image_context import ImageContext, HASH_VIEW_SIDE
+from utils.jpeg_forensics import compression_summary
+from utils.memory_stats import track_memory
+from utils.noise_map import analyze_noise, noise_summary
+from utils.pipeline_profiles import DEFAULT_PROFILE, get_pipeline_profile, pipeline_profiles, profile_costs
+from utils.scratch import gradient_magnitude, laplacian_variance, mean_std
+from utils.region_proposals import get_region_proposer
+from utils.stage_scheduler import Stage, stage_scheduler
+from utils.warmup import run_warmup, write_synthetic_document
 
 # Add the parent directory to sys.path to import utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -33,22 +53,104 @@ except ImportError:
 logger = logging.getLogger(__name__)
 
 # Create APIRouter instance
-router = APIRouter()
+router = APIRouter(default_response_class=NumpyJSONResponse)
 
 # Uploads directory
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Namespace of the legacy sub-analyses when scheduled next to the feature stages
+LEGACY_STAGE_PREFIX = 'legacy.'
+
+# near_duplicates field when the image could not be hashed
+NEAR_DUPLICATES_DEFAULT = {"checked": False, "matches": []}
+
+# face_reuse field when no face was checked
+FACE_REUSE_DEFAULT = {"checked": False, "reused_across_identities": False, "matches": []}
+
+# compression_analysis field when the stage didn't run
+COMPRESSION_ANALYSIS_DEFAULT = {"is_jpeg": False, "quality": None, "double_compressed": False,
+                                "tampered_ratio": 0.0, "tamper_map": None}
+
+# noise_analysis field when the stage didn't run
+NOISE_ANALYSIS_DEFAULT = {"score": 0.0, "inconsistent_ratio": 0.0, "regions": [], "heatmap": None}
+
+# Legacy forensics: quantization tables below this IJG quality count as over-compressed
+JPEG_LOW_QUALITY = int(os.getenv('JPEG_LOW_QUALITY', '50'))
+# Share of informative blocks with a different compression history that flags splicing
+JPEG_TAMPERED_RATIO = float(os.getenv('JPEG_TAMPERED_RATIO', '0.05'))
+
+# Block size of the copy-paste check
+COPY_PASTE_TILE = 32
+# Similar block pairs above which copy-paste is reported
+COPY_PASTE_MAX_MATCHES = 5
+# Most candidate block pairs compared per vectorized batch (bounds the pair arrays)
+COPY_PASTE_BATCH = 8192
+
+# aadhaar_qr field for other document types, or when no QR was decoded
+AADHAAR_QR_DEFAULT = {"present": False, "parsed": False, "signature_verified": None, "validated": False}
+
+# Stages run even when the time left can't cover their usual cost: the text (or
+# the QR standing in for it) and the stages recording into the indexes
+REQUIRED_STAGES = frozenset({'ocr', LEGACY_STAGE_PREFIX + 'ocr', 'aadhaar_qr', 'near_duplicates', 'face_reuse'})
+
+# OCR stages a validated Aadhaar QR replaces: stage name -> substitute result from the QR check
+AADHAAR_QR_OCR_STAGES = {
+    'ocr': lambda qr: qr_ocr_features(qr['text'], include_easyocr=USE_ADVANCED_ML),
+    LEGACY_STAGE_PREFIX + 'ocr': lambda qr: {"text": qr['text'], "accuracy": float(calculate_ocr_accuracy(qr['text']))},
+}
+
+def with_aadhaar_qr_fast_path(stage):
+    """
+    Make an OCR stage wait for the 'aadhaar_qr' stage and return the QR's
+    data instead of running OCR when the QR validated. Other stages are
+    returned unchanged.
+    """
+    substitute = AADHAAR_QR_OCR_STAGES.get(stage.name)
+    if substitute is None:
+        return stage
+
+    def run(qr, *args):
+        return substitute(qr) if qr['validated'] else stage.func(*args)
+
+    condition = None
+    if stage.condition is not None:
+        condition = lambda qr, *args: stage.condition(*args)
+    return Stage(stage.name, run, deps=('aadhaar_qr',) + stage.deps, timeout=stage.timeout,
+                 default=stage.default, condition=condition, optional=stage.optional)
+
 @router.post("/analyze")
 async def analyze_document(
     file: UploadFile = File(...),
-    document_type: str = Form(...)
+    document_type: str = Form(...),
+    fields: Optional[str] = Form(None),
+    profile: Optional[str] = Form(None),
+    subject_id: Optional[str] = Form(None),
+    cross_check_ocr: bool = Form(False),
+    deadline: Optional[Deadline] = Depends(deadline_header)
 ):
+    """
+    Analyze a document. `subject_id` identifies the person or account the
+    document was submitted for; its face is then checked against, and
+    recorded in, the face index under that identity. For Aadhaar cards with
+    a secure QR whose signature verifies, OCR is replaced by the QR data
+    unless `cross_check_ocr` asks for OCR to run; whenever OCR runs, it is
+    compared with the QR fields. With an X-Request-Timeout-Ms
+    header, the analysis answers within that budget: stages it can't fit are
+    left out, and the result is flagged `partial` with its `skipped_stages`.
+    """
+    ensure_time_left(deadline)
     try:
         # Validate file type
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="Only image files are supported")
 
+        # Work out which stages the requested output fields depend on
+        try:
+            plan = build_analysis_plan(fields, profile)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
         # Save uploaded file
         filename = file.filename
         file_location = os.path.join(UPLOAD_FOLDER, filename)
@@ -57,72 +159,237 @@ async def analyze_document(
 
         logger.info(f"Received file: {filename}, document_type: {document_type}")
 
-        # Choose verifier based on available libraries
-        if USE_ADVANCED_ML:
-            # Extract comprehensive features using advanced ML pipeline
-            features = safe_ml_verifier.extract_comprehensive_features(file_location, document_type)
-            
-            if 'error' in features:
-                raise HTTPException(status_code=500, detail=f"Feature extraction failed: {features['error']}")
-            
-            # Classify document using ensemble ML models
-            classification_result = safe_ml_verifier.classify_document(features)
-            
-            logger.info(f"Advanced ML Analysis - Features: {len(features)}, Confidence: {classification_result.get('confidence', 0)}")
-        else:
-            # Use simplified verifier
-            features = simple_verifier.extract_comprehensive_features(file_location, document_type)
-            
-            if 'error' in features:
-                raise HTTPException(status_code=500, detail=f"Feature extraction failed: {features['error']}")
-            
-            # Classify document using rule-based approach
-            classification_result = simple_verifier.classify_document(features)
-            
-            logger.info(f"Simplified Analysis - Features: {len(features)}, Confidence: {classification_result.get('confidence', 0)}")
-        
-        # Perform legacy analysis for compatibility
-        legacy_analysis = perform_legacy_analysis(file_location, document_type)
-        
-        # Combine results with enhanced logic
-        final_result = combine_enhanced_analysis_results(features, classification_result, legacy_analysis)
-        
-        # Clean up uploaded file
         try:
-            os.remove(file_location)
-        except:
-            pass
-
-        logger.info(f"Analysis Result - Valid: {final_result['is_valid']}, Confidence: {final_result['confidence_score']}")
+            # In the threadpool, so a request waiting for admission doesn't block the event loop
+            response_data = await run_in_threadpool(run_document_analysis, file_location, document_type, plan,
+                                                    subject_id, cross_check_ocr, deadline)
+        except AdmissionRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        finally:
+            # Clean up uploaded file
+            try:
+                os.remove(file_location)
+            except:
+                pass
 
-        response_data = {
-            "is_valid": final_result["is_valid"],
-            "confidence_score": final_result["confidence_score"],
-            "detected_text": final_result["detected_text"],
-            "extracted_data": final_result["extracted_data"],
-            "anomalies": final_result["anomalies"],
-            "processing_time": final_result["processing_time"],
-            "ocr_accuracy": final_result["ocr_accuracy"],
-            "signature_detected": final_result["signature_detected"],
-            "format_validation": final_result["format_validation"],
-            "quality_score": final_result["quality_score"],
-            "ml_analysis": classification_result,
-            "feature_count": len(features),
-            "ml_method": "advanced_ensemble" if USE_ADVANCED_ML else "simplified",
-            "risk_factors": classification_result.get('risk_factors', []),
-            "authenticity_indicators": classification_result.get('authenticity_indicators', []),
-            "detailed_analysis": classification_result.get('detailed_analysis', ''),
-            "timestamp": datetime.now().isoformat()
-        }
-        return JSONResponse(to_serializable(response_data))
+        return NumpyJSONResponse(response_data)
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error analyzing document: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Document analysis failed: {str(e)}")
 
-def combine_enhanced_analysis_results(features, classification_result, legacy_analysis):
+def run_document_analysis(file_location, document_type, plan=None, subject_id=None, cross_check_ocr=False,
+                          deadline=None):
+    """
+    Run the analysis pipeline on a saved upload and build the response payload.
+    Only the stages needed for the plan's fields are run (default: all fields),
+    minus those the document type's pipeline profile skips. Shared by the
+    synchronous /analyze route and the background job workers.
+    The run is admitted against the worker's memory budget first, from the
+    upload's header (utils.admission; raises AdmissionRejected), and may be
+    downscaled; the decision is reported in `admission`. The peak resident
+    memory of the run is logged and reported in `memory`. A `deadline`
+    (utils.deadlines) bounds the admission wait and the stages.
+    """
+    plan = plan or build_analysis_plan()
+    context = ImageContext(file_location, document_type)
+    plan = plan.without(context.profile.skip_stages)
+    with request_deadline(deadline), admission_controller.reserve(
+            context.metadata, planned_stages(plan), len(context.data),
+            timeout=deadline.remaining() if deadline is not None else None) as admission:
+        context.downscale = admission.downscale
+        if admission.downscale > 1:
+            logger.info(f"Analyzing {os.path.basename(file_location)} at 1/{admission.downscale} scale "
+                        f"to fit the memory budget")
+        with track_memory() as memory:
+            result = _run_document_analysis(context, file_location, document_type, plan, subject_id, cross_check_ocr)
+    report = memory.report()
+    logger.info(f"Peak memory {report['peak_rss_mb']} MB ({report['peak_delta_mb']:+} MB during the analysis, "
+                f"{admission.estimate / 2**20:.0f} MB estimated)")
+    if 'memory' in plan.fields:
+        result['memory'] = report
+    if 'admission' in plan.fields:
+        result['admission'] = admission.report()
+    return result
+
+def warm_up_analysis():
+    """
+    Run a synthetic document through feature extraction, classification and
+    the legacy analysis (plus the compression, noise and Aadhaar QR stages),
+    logging the time of each stage. Stages that record into the duplicate and
+    face indexes are left out.
+    """
+    verifier = safe_ml_verifier if USE_ADVANCED_ML else simple_verifier
+    # A document type with the Aadhaar QR check, so the QR stages run too
+    document_type = next((name for name, profile in pipeline_profiles.items() if profile.aadhaar_qr), DEFAULT_PROFILE)
+    features = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        context = ImageContext(write_synthetic_document(os.path.join(directory, 'warmup.jpg')), document_type)
+
+        def extract_features():
+            # extract_comprehensive_features, keeping the scheduler run for its stage timings
+            run = stage_scheduler.run(verifier.feature_stage_graph(context))
+            features.update(verifier.collect_features(context, run))
+            return run
+
+        def legacy_analysis():
+            run = stage_scheduler.run(legacy_stage_graph(context, document_type, 'warmup.jpg') + [
+                Stage('compression_analysis', lambda: compression_summary(context.jpeg_forensics)),
+                Stage('noise_analysis', lambda: noise_summary(context.noise_analysis)),
+                Stage('aadhaar_qr', lambda: verify_aadhaar_qr(context.codes)),
+            ])
+            finalize_document_analysis(run.results, set(LEGACY_ANALYSES), datetime.now())
+            return run
+
+        steps = [
+            ('extract_comprehensive_features', extract_features),
+            ('classify_document', lambda: verifier.classify_document(features)),
+            ('legacy_analysis', legacy_analysis),
+        ]
+        if USE_ADVANCED_ML:
+            # Feature extraction only used the Aadhaar language set; run the other EasyOCR readers once too
+            steps.append(('easyocr_readers', lambda: verifier.ocr_manager.warm_up(context.image, context.gray)))
+        return run_warmup(steps)
+
+def _run_document_analysis(context, file_location, document_type, plan, subject_id, cross_check_ocr):
+    verifier = safe_ml_verifier if USE_ADVANCED_ML else simple_verifier
+    start_time = datetime.now()
+
+    features = {}
+    classification_result = {}
+    legacy_analysis = {}
+    near_duplicates = dict(NEAR_DUPLICATES_DEFAULT)
+    face_reuse = dict(FACE_REUSE_DEFAULT)
+    aadhaar_qr = dict(AADHAAR_QR_DEFAULT)
+    compression_analysis = dict(COMPRESSION_ANALYSIS_DEFAULT)
+    noise_analysis = dict(NOISE_ANALYSIS_DEFAULT)
+    skipped_stages = {}
+
+    # The upload is decoded once for every stage
+    if not context.is_readable():
+        if plan.feature_stages:
+            raise RuntimeError("Feature extraction failed: Could not read image")
+        legacy_analysis = {
+            "is_valid": False,
+            "confidence_score": 0.0,
+            "anomalies": ["Could not load image file"]
+        }
+    else:
+        # Feature extraction and legacy sub-analyses share one dependency graph,
+        # so independent stages of both run concurrently
+        stages = []
+        if plan.feature_stages:
+            stages += verifier.feature_stage_graph(context, plan.feature_stages)
+        if plan.legacy_analyses:
+            stages += legacy_stage_graph(context, document_type, os.path.basename(file_location),
+                                         plan.legacy_analyses, prefix=LEGACY_STAGE_PREFIX)
+        # Every readable upload is recorded in the near-duplicate index
+        stages.append(Stage('near_duplicates', lambda: check_near_duplicates(
+            context.content_hash, context.gray_view(HASH_VIEW_SIDE), document_type), default=NEAR_DUPLICATES_DEFAULT))
+        profile = context.profile
+        if profile.runs('face') and ('face_reuse' in plan.fields or subject_id):
+            # After the face stage, whose detections and descriptors it reuses
+            face_stages = [stage.name for stage in stages if stage.name == 'face']
+            stages.append(Stage('face_reuse', lambda *face_features: check_face_reuse(
+                context.faces, context.face_descriptors, subject_id, context.content_hash),
+                deps=face_stages, default=FACE_REUSE_DEFAULT))
+        if plan.runs_field_stage('compression_analysis'):
+            stages.append(Stage('compression_analysis', lambda: compression_summary(context.jpeg_forensics),
+                                default=COMPRESSION_ANALYSIS_DEFAULT))
+        if plan.runs_field_stage('noise_analysis'):
+            stages.append(Stage('noise_analysis', lambda: noise_summary(context.noise_analysis),
+                                default=NOISE_ANALYSIS_DEFAULT))
+        if profile.aadhaar_qr:
+            # Decode and verify the QR first; a valid payload stands in for OCR
+            stages.append(Stage('aadhaar_qr', lambda: verify_aadhaar_qr(context.codes), default=AADHAAR_QR_DEFAULT))
+            if not cross_check_ocr:
+                stages = [with_aadhaar_qr_fast_path(stage) for stage in stages]
+        # The profile's time budget, or the caller's deadline if that comes first
+        deadlines = [time.monotonic() + profile.time_budget] if profile.time_budget else []
+        if current_deadline() is not None:
+            deadlines.append(current_deadline().expires_at)
+        for stage in stages:
+            stage.optional = stage.name not in REQUIRED_STAGES
+        run = stage_scheduler.run(stages, deadline=min(deadlines, default=None),
+                                  expected_cost=lambda name: profile_costs.expected_seconds(profile, name))
+        profile_costs.record(profile, run)
+        logger.info(f"Stages finished in {run.elapsed:.3f}s ({len(stages)} stages, profile {profile.name})")
+        skipped_stages = run.incomplete()
+        if skipped_stages:
+            logger.warning(f"Partial analysis, stages left out by the time budget: {skipped_stages}")
+
+        if plan.feature_stages:
+            features = verifier.collect_features(context, run)
+        if plan.legacy_analyses:
+            legacy_analysis = finalize_document_analysis(run.results, plan.legacy_analyses, start_time,
+                                                         prefix=LEGACY_STAGE_PREFIX)
+        near_duplicates = run.results['near_duplicates']
+        face_reuse = run.results.get('face_reuse', face_reuse)
+        aadhaar_qr = run.results.get('aadhaar_qr', aadhaar_qr)
+        compression_analysis = run.results.get('compression_analysis', compression_analysis)
+        noise_analysis = run.results.get('noise_analysis', noise_analysis)
+        if aadhaar_qr['validated'] and not cross_check_ocr:
+            aadhaar_qr['skipped_stages'] = sorted(set(AADHAAR_QR_OCR_STAGES) & set(run.results))
+        elif aadhaar_qr['parsed']:
+            # OCR ran: compare its text with the QR fields (an unverified QR may be forged)
+            ocr_text = run.results.get(LEGACY_STAGE_PREFIX + 'ocr', {}).get('text') or features.get('extracted_text', '')
+            aadhaar_qr['cross_check'] = cross_check_fields(aadhaar_qr['fields'], ocr_text)
+
+    if plan.classify:
+        # Classify document using ensemble ML models or the rule-based approach
+        classification_result = verifier.classify_document(features)
+        
+        analysis_name = "Advanced ML" if USE_ADVANCED_ML else "Simplified"
+        logger.info(f"{analysis_name} Analysis - Features: {len(features)}, Confidence: {classification_result.get('confidence', 0)}")
+    
+    # Combine results with enhanced logic
+    final_result = combine_enhanced_analysis_results(features, classification_result, legacy_analysis,
+                                                     None if plan.is_full else plan.feature_stages)
+
+    if plan.is_full:
+        logger.info(f"Analysis Result - Valid: {final_result['is_valid']}, Confidence: {final_result['confidence_score']}")
+    else:
+        logger.info(f"Partial analysis for fields {list(plan.fields)} - stages: {sorted(plan.feature_stages)}, "
+                    f"legacy: {sorted(plan.legacy_analyses)}")
+
+    response_data = {
+        "is_valid": final_result["is_valid"],
+        "confidence_score": final_result["confidence_score"],
+        "detected_text": final_result["detected_text"],
+        "extracted_data": final_result["extracted_data"],
+        "anomalies": final_result["anomalies"],
+        "processing_time": final_result["processing_time"],
+        "ocr_accuracy": final_result["ocr_accuracy"],
+        "signature_detected": final_result["signature_detected"],
+        "format_validation": final_result["format_validation"],
+        "quality_score": final_result["quality_score"],
+        "ml_analysis": classification_result,
+        "feature_count": len(features),
+        "ml_method": "advanced_ensemble" if USE_ADVANCED_ML else "simplified",
+        "risk_factors": classification_result.get('risk_factors', []),
+        "authenticity_indicators": classification_result.get('authenticity_indicators', []),
+        "detailed_analysis": classification_result.get('detailed_analysis', ''),
+        "near_duplicates": near_duplicates,
+        "face_reuse": face_reuse,
+        "aadhaar_qr": aadhaar_qr,
+        "compression_analysis": compression_analysis,
+        "noise_analysis": noise_analysis,
+        # Filled in by run_document_analysis once the run is over
+        "memory": None,
+        "admission": None,
+        "partial": bool(skipped_stages),
+        "skipped_stages": skipped_stages,
+        "timestamp": datetime.now().isoformat()
+    }
+    return {field: response_data[field] for field in plan.fields}
+
+def combine_enhanced_analysis_results(features, classification_result, legacy_analysis, feature_stages=None):
     """
-    Enhanced combination of ML analysis results with legacy analysis
+    Enhanced combination of ML analysis results with legacy analysis.
+    `feature_stages` lists the stages that ran when only part of the pipeline was executed.
     """
     try:
         start_time = datetime.now()
@@ -213,7 +480,7 @@ def combine_enhanced_analysis_results(features, classification_result, legacy_an
             anomalies.append(f"Document received {penalty_analysis['penalty_count']} penalty points")
         
         # Calculate enhanced quality score
-        quality_score = calculate_enhanced_quality_score(features, classification_result)
+        quality_score = calculate_enhanced_quality_score(features, classification_result, feature_stages)
         
         # Extract OCR information
         detected_text = features.get('extracted_text', '')
@@ -259,8 +526,11 @@ def combine_enhanced_analysis_results(features, classification_result, legacy_an
             "penalty_count": 1
         }
 
-def calculate_enhanced_quality_score(features, classification_result):
-    """Calculate enhanced quality score based on multiple factors"""
+def calculate_enhanced_quality_score(features, classification_result, feature_stages=None):
+    """
+    Calculate enhanced quality score based on multiple factors.
+    Factors from stages outside `feature_stages` are left out instead of counting as zero.
+    """
     try:
         quality_factors = []
         
@@ -272,8 +542,9 @@ def calculate_enhanced_quality_score(features, classification_result):
         quality_factors.append(min(contrast / 100.0, 1.0))
         
         # OCR quality
-        ocr_conf = features.get('ocr_confidence_mean', 0)
-        quality_factors.append(ocr_conf / 100.0)
+        if feature_stages is None or 'ocr' in feature_stages:
+            ocr_conf = features.get('ocr_confidence_mean', 0)
+            quality_factors.append(ocr_conf / 100.0)
         
         # Face quality (if applicable)
         if features.get('face_detected', False):
@@ -286,8 +557,9 @@ def calculate_enhanced_quality_score(features, classification_result):
             quality_factors.append(qr_quality)
         
         # Template matching quality
-        template_score = features.get('template_match_score', 0)
-        quality_factors.append(template_score)
+        if feature_stages is None or 'logo' in feature_stages:
+            template_score = features.get('template_match_score', 0)
+            quality_factors.append(template_score)
         
         # Overall quality
         base_quality = np.mean(quality_factors) if quality_factors else 0.5
@@ -380,7 +652,7 @@ def combine_analysis_results(features, classification_result, legacy_analysis):
     """Legacy function for backward compatibility"""
     return combine_enhanced_analysis_results(features, classification_result, legacy_analysis)
 
-def perform_legacy_analysis(file_location, document_type):
+def perform_legacy_analysis(file_location, document_type, analyses=None):
     """
     Perform legacy analysis for backward compatibility
     """
@@ -395,7 +667,7 @@ def perform_legacy_analysis(file_location, document_type):
             }
 
         # Perform simplified legacy analysis
-        analysis_result = perform_document_analysis(image, document_type, os.path.basename(file_location))
+        analysis_result = perform_document_analysis(image, document_type, os.path.basename(file_location), analyses)
         
         return analysis_result
     except Exception as e:
@@ -406,12 +678,75 @@ def perform_legacy_analysis(file_location, document_type):
             "anomalies": [f"Legacy analysis failed: {str(e)}"]
         }
 
-def perform_document_analysis(image, document_type, filename):
+def perform_document_analysis(image, document_type, filename, analyses=None):
     """
-    Perform comprehensive document analysis with fake detection
+    Perform comprehensive document analysis with fake detection.
+    `analyses` restricts the run to a subset of LEGACY_ANALYSES; the final
+    confidence and validity verdict are only computed when all of them run.
     """
+    analyses = set(LEGACY_ANALYSES) if analyses is None else set(analyses)
     start_time = datetime.now()
-    
+
+    try:
+        context = ImageContext(None, document_type, image=image)
+        run = stage_scheduler.run(legacy_stage_graph(context, document_type, filename, analyses))
+        results = run.results
+    except Exception as e:
+        logger.error(f"Error in document analysis: {str(e)}")
+        results = {}
+        analyses = set()
+        error = f"Analysis error: {str(e)}"
+    else:
+        error = None
+
+    analysis_result = finalize_document_analysis(results, analyses, start_time)
+    if error:
+        analysis_result["anomalies"].append(error)
+    return analysis_result
+
+# Default results of the legacy sub-analyses, used when one is skipped, fails or times out
+LEGACY_DEFAULTS = {
+    'quality': 0.0,
+    'ocr': {"text": "", "accuracy": 0.0},
+    'signature': False,
+    'format': {},
+    'anomalies': [],
+}
+
+def legacy_stage_graph(context, document_type, filename, analyses=None, prefix=''):
+    """
+    Scheduler stages for the legacy sub-analyses of an ImageContext. Anomaly
+    detection inspects the OCR text, so it depends on the OCR stage when both
+    are selected. `prefix` namespaces the stage names when merged into a
+    larger graph. Quality is scored on a reduced view and format only needs
+    the image size; the other analyses use the full-resolution image.
+    """
+    analyses = set(LEGACY_ANALYSES) if analyses is None else set(analyses)
+
+    graph = {
+        'quality': (lambda: analyze_image_quality(context.view(context.view_side('quality'))), ()),
+        'ocr': (lambda: context.stage('perform_ocr_analysis', lambda: perform_ocr_analysis(context.image)), ()),
+        'signature': (lambda: detect_signature_presence(context.image, context.regions), ()),
+        'format': (lambda: validate_document_format(None, document_type, size=context.source_size), ()),
+    }
+    if 'ocr' in analyses:
+        graph['anomalies'] = (lambda ocr_result: detect_anomalies(context.image, ocr_result["text"], filename,
+                                                                  context.regions, context.jpeg_forensics,
+                                                                  context.tile_stats(COPY_PASTE_TILE),
+                                                                  context.noise_analysis), ('ocr',))
+    else:
+        graph['anomalies'] = (lambda: detect_anomalies(context.image, "", filename, context.regions,
+                                                       context.jpeg_forensics, context.tile_stats(COPY_PASTE_TILE),
+                                                       context.noise_analysis), ())
+
+    return [Stage(prefix + name, func, deps=[prefix + dep for dep in deps], default=LEGACY_DEFAULTS[name])
+            for name, (func, deps) in graph.items() if name in analyses]
+
+def finalize_document_analysis(results, analyses, start_time, prefix=''):
+    """
+    Build the legacy analysis result from stage results (keyed by prefixed
+    stage name) and, when every sub-analysis ran, the final verdict.
+    """
     analysis_result = {
         "is_valid": False,
         "confidence_score": 0.0,
@@ -424,78 +759,88 @@ def perform_document_analysis(image, document_type, filename):
         "format_validation": {},
         "quality_score": 0.0
     }
-    
+
+    def result(name):
+        return results.get(prefix + name, LEGACY_DEFAULTS[name])
+
     try:
+        quality_score = result('quality')
+        ocr_result = result('ocr')
+        signature_detected = result('signature')
+        format_validation = result('format')
+        anomalies = list(result('anomalies'))
+
         # 1. Image Quality Analysis
-        quality_score = analyze_image_quality(image)
-        analysis_result["quality_score"] = quality_score
+        if 'quality' in analyses:
+            analysis_result["quality_score"] = quality_score
         
         # 2. OCR Analysis
-        ocr_result = perform_ocr_analysis(image)
-        analysis_result["detected_text"] = ocr_result["text"]
-        analysis_result["ocr_accuracy"] = ocr_result["accuracy"]
+        if 'ocr' in analyses:
+            analysis_result["detected_text"] = ocr_result["text"]
+            analysis_result["ocr_accuracy"] = ocr_result["accuracy"]
         
         # 3. Signature Detection
-        signature_detected = detect_signature_presence(image)
-        analysis_result["signature_detected"] = signature_detected
+        if 'signature' in analyses:
+            analysis_result["signature_detected"] = signature_detected
         
         # 4. Format Validation
-        format_validation = validate_document_format(image, document_type)
-        analysis_result["format_validation"] = format_validation
+        if 'format' in analyses:
+            analysis_result["format_validation"] = format_validation
         
         # 5. Anomaly Detection
-        anomalies = detect_anomalies(image, ocr_result["text"], filename)
-        analysis_result["anomalies"] = anomalies
-        
-        # 6. Calculate final confidence score
-        confidence_score = calculate_confidence_score(
-            quality_score, 
-            ocr_result["accuracy"], 
-            signature_detected, 
-            format_validation,
-            len(anomalies)
-        )
-        
-        analysis_result["confidence_score"] = confidence_score
-        
-        # STRICT VALIDATION: Document is only valid if:
-        # 1. High confidence score (>= 0.7)
-        # 2. No critical anomalies
-        # 3. Good quality score (>= 0.4)
-        critical_anomalies = [
-            "Suspicious filename detected",
-            "Suspicious text content detected", 
-            "Suspicious compression artifacts detected",
-            "Irregular gradient patterns detected (possible manipulation)",
-            "Repeated patterns detected (possible copy-paste manipulation)",
-            "Inconsistent noise patterns detected",
-            "Unnatural texture uniformity detected",
-            "Abrupt texture transitions detected"
-        ]
-        
-        has_critical_anomalies = any(anomaly in critical_anomalies for anomaly in anomalies)
-        
-        # Final validation decision
-        analysis_result["is_valid"] = (
-            confidence_score >= 0.7 and 
-            not has_critical_anomalies and 
-            quality_score >= 0.4 and
-            len(anomalies) <= 2
-        )
-        
-        # Add detailed reasoning
-        if not analysis_result["is_valid"]:
-            reasons = []
-            if confidence_score < 0.7:
-                reasons.append(f"Low confidence score: {confidence_score:.2f}")
-            if has_critical_anomalies:
-                reasons.append("Critical anomalies detected")
-            if quality_score < 0.4:
-                reasons.append(f"Poor image quality: {quality_score:.2f}")
-            if len(anomalies) > 2:
-                reasons.append(f"Too many anomalies: {len(anomalies)}")
+        if 'anomalies' in analyses:
+            analysis_result["anomalies"] = anomalies
+        
+        if analyses.issuperset(LEGACY_ANALYSES):
+            # 6. Calculate final confidence score
+            confidence_score = calculate_confidence_score(
+                quality_score, 
+                ocr_result["accuracy"], 
+                signature_detected, 
+                format_validation,
+                len(anomalies)
+            )
+        
+            analysis_result["confidence_score"] = confidence_score
+        
+            # STRICT VALIDATION: Document is only valid if:
+            # 1. High confidence score (>= 0.7)
+            # 2. No critical anomalies
+            # 3. Good quality score (>= 0.4)
+            critical_anomalies = [
+                "Suspicious filename detected",
+                "Suspicious text content detected", 
+                "Suspicious compression artifacts detected",
+                "Irregular gradient patterns detected (possible manipulation)",
+                "Repeated patterns detected (possible copy-paste manipulation)",
+                "Inconsistent noise patterns detected",
+                "Unnatural texture uniformity detected",
+                "Abrupt texture transitions detected"
+            ]
+        
+            has_critical_anomalies = any(anomaly in critical_anomalies for anomaly in anomalies)
+        
+            # Final validation decision
+            analysis_result["is_valid"] = (
+                confidence_score >= 0.7 and 
+                not has_critical_anomalies and 
+                quality_score >= 0.4 and
+                len(anomalies) <= 2
+            )
+        
+            # Add detailed reasoning
+            if not analysis_result["is_valid"]:
+                reasons = []
+                if confidence_score < 0.7:
+                    reasons.append(f"Low confidence score: {confidence_score:.2f}")
+                if has_critical_anomalies:
+                    reasons.append("Critical anomalies detected")
+                if quality_score < 0.4:
+                    reasons.append(f"Poor image quality: {quality_score:.2f}")
+                if len(anomalies) > 2:
+                    reasons.append(f"Too many anomalies: {len(anomalies)}")
             
-            analysis_result["rejection_reasons"] = reasons
+                analysis_result["rejection_reasons"] = reasons
         
         # Calculate processing time
         processing_time = (datetime.now() - start_time).total_seconds()
@@ -515,15 +860,15 @@ def analyze_image_quality(image):
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         
         # Calculate sharpness using Laplacian variance
-        laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+        laplacian_var = laplacian_variance(gray)
         sharpness_score = min(float(laplacian_var) / 1000, 1.0)
         
-        # Calculate brightness
-        brightness = float(np.mean(gray)) / 255.0
+        # Calculate brightness and contrast
+        mean, std = mean_std(gray)
+        brightness = mean / 255.0
         brightness_score = 1.0 - abs(brightness - 0.5) * 2
         
-        # Calculate contrast
-        contrast = float(np.std(gray)) / 255.0
+        contrast = std / 255.0
         contrast_score = min(contrast * 4, 1.0)
         
         # Overall quality score
@@ -550,9 +895,9 @@ def perform_ocr_analysis(image):
         # Apply adaptive threshold
         thresh = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
         
-        # Perform OCR
+        # Perform OCR, bounded by the request's deadline if it has one
         try:
-            text = pytesseract.image_to_string(thresh)
+            text = pytesseract.image_to_string(thresh, timeout=tesseract_timeout())
         except Exception as ocr_error:
             logger.error(f"Tesseract OCR error: {str(ocr_error)}")
             # Fallback: Return empty text with low accuracy
@@ -597,38 +942,30 @@ def calculate_ocr_accuracy(text):
     accuracy = float(meaningful_chars) / float(total_chars)
     return min(float(accuracy), 1.0)
 
-def detect_signature_presence(image):
+def detect_signature_presence(image, regions=None):
     """
-    Basic signature detection using contour analysis
+    Basic signature detection using region analysis of the thresholded image
     """
     try:
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Apply threshold
-        _, thresh = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY_INV)
+        gray = regions.gray if regions is not None else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         
-        # Find contours
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Look for signature-like regions (curved, continuous lines) of dark ink
+        table = get_region_proposer(gray, regions).table('inv127')
+        signature_regions = np.count_nonzero((table['area'] > 100) & (table['area'] < 10000))  # Signature-like area
         
-        # Look for signature-like contours (curved, continuous lines)
-        signature_contours = 0
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if 100 < area < 10000:  # Signature-like area
-                signature_contours += 1
-        
-        return bool(signature_contours > 0)
+        return bool(signature_regions > 0)
         
     except Exception as e:
         logger.error(f"Signature detection error: {str(e)}")
         return False
 
-def validate_document_format(image, document_type):
+def validate_document_format(image, document_type, size=None):
     """
-    Validate document format based on type
+    Validate document format based on type (the aspect ratio range of its
+    pipeline profile). `size` (width, height) may be given instead of the image.
     """
     try:
-        height, width = image.shape[:2]
+        width, height = size if size is not None else image.shape[1::-1]
         aspect_ratio = float(width) / float(height)
         
         format_validation = {
@@ -643,18 +980,13 @@ def validate_document_format(image, document_type):
             format_validation["size_score"] = min(float(width * height) / (1200 * 800), 1.0)
         
         # Aspect ratio validation based on document type
-        expected_ratios = {
-            "passport": (1.3, 1.5),
-            "id-card": (1.5, 1.7),
-            "driver-license": (1.5, 1.8),
-            "certificate": (1.2, 1.4)
-        }
+        expected_ratio = get_pipeline_profile(document_type).format.get('aspect_ratio_range')
         
-        if document_type in expected_ratios:
-            min_ratio, max_ratio = expected_ratios[document_type]
+        if expected_ratio:
+            min_ratio, max_ratio = expected_ratio
             format_validation["aspect_ratio_valid"] = bool(min_ratio <= aspect_ratio <= max_ratio)
         else:
-            format_validation["aspect_ratio_valid"] = True  # Unknown type, assume valid
+            format_validation["aspect_ratio_valid"] = True  # No expected ratio, assume valid
         
         return format_validation
         
@@ -662,7 +994,7 @@ def validate_document_format(image, document_type):
         logger.error(f"Format validation error: {str(e)}")
         return {"dimensions_valid": False, "aspect_ratio_valid": False, "size_score": 0.0}
 
-def detect_anomalies(image, ocr_text, filename):
+def detect_anomalies(image, ocr_text, filename, regions=None, jpeg=None, tiles=None, noise=None):
     """
     Advanced anomaly detection for fake document identification
     """
@@ -691,7 +1023,7 @@ def detect_anomalies(image, ocr_text, filename):
             anomalies.append("Document dimensions too small")
         
         # 5. Advanced Digital Forensics
-        forensic_anomalies = perform_digital_forensics(image)
+        forensic_anomalies = perform_digital_forensics(image, jpeg, tiles, noise)
         anomalies.extend(forensic_anomalies)
         
         # 6. Font and Text Analysis
@@ -707,7 +1039,7 @@ def detect_anomalies(image, ocr_text, filename):
         anomalies.extend(texture_anomalies)
         
         # 9. Document Structure Analysis
-        structure_anomalies = analyze_document_structure(image, ocr_text)
+        structure_anomalies = analyze_document_structure(image, ocr_text, regions)
         anomalies.extend(structure_anomalies)
         
     except Exception as e:
@@ -716,9 +1048,12 @@ def detect_anomalies(image, ocr_text, filename):
     
     return anomalies
 
-def perform_digital_forensics(image):
+def perform_digital_forensics(image, jpeg=None, tiles=None, noise=None):
     """
-    Perform advanced digital forensics to detect manipulation
+    Perform advanced digital forensics to detect manipulation. `jpeg` is the
+    upload's compression analysis (utils.jpeg_forensics.analyze_jpeg), `tiles`
+    the COPY_PASTE_TILE tile statistics of its grayscale image and `noise` its
+    noise consistency map (utils.noise_map.analyze_noise).
     """
     anomalies = []
     
@@ -726,38 +1061,37 @@ def perform_digital_forensics(image):
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         
         # 1. Detect compression artifacts
-        # Look for JPEG compression inconsistencies
-        laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-        laplacian_var = np.var(laplacian)
-        
-        if laplacian_var < 50:  # Very low variance indicates over-compression
-            anomalies.append("Suspicious compression artifacts detected")
+        if jpeg is not None and jpeg['is_jpeg']:
+            # Read from the quantization tables and block DCT statistics
+            if jpeg['quality'] < JPEG_LOW_QUALITY:
+                anomalies.append("Suspicious compression artifacts detected")
+            if jpeg['double_compressed'] and jpeg['tampered_ratio'] > JPEG_TAMPERED_RATIO:
+                anomalies.append("Regions with a different JPEG compression history detected (possible splicing)")
+            if jpeg['misaligned_grid'] and jpeg['misaligned_grid']['present']:
+                anomalies.append("Misaligned JPEG block grid detected (cropped or pasted after compression)")
+        else:
+            # Not a JPEG: very low Laplacian variance indicates over-compression
+            laplacian_var = laplacian_variance(gray)
+            if laplacian_var < 50:
+                anomalies.append("Suspicious compression artifacts detected")
         
         # 2. Detect resampling artifacts using Error Level Analysis (ELA)
-        # Convert to float for mathematical operations
-        gray_float = gray.astype(np.float64)
-        
-        # Calculate second derivative
-        sobel_x = cv2.Sobel(gray_float, cv2.CV_64F, 1, 0, ksize=3)
-        sobel_y = cv2.Sobel(gray_float, cv2.CV_64F, 0, 1, ksize=3)
-        
-        # Calculate gradient magnitude
-        gradient_magnitude = np.sqrt(sobel_x**2 + sobel_y**2)
+        # Sobel gradient magnitude, in float32 scratch buffers
+        _, gradient_std = mean_std(gradient_magnitude(gray))
         
         # Check for unusual gradient patterns
-        gradient_std = np.std(gradient_magnitude)
         if gradient_std > 80:  # High variation might indicate manipulation
             anomalies.append("Irregular gradient patterns detected (possible manipulation)")
         
         # 3. Detect copy-paste operations
         # Look for repeated patterns in the image
-        template_matches = detect_copy_paste_artifacts(gray)
-        if template_matches > 5:  # Too many similar regions
+        template_matches = detect_copy_paste_artifacts(gray, tiles, max_matches=COPY_PASTE_MAX_MATCHES)
+        if template_matches > COPY_PASTE_MAX_MATCHES:  # Too many similar regions
             anomalies.append("Repeated patterns detected (possible copy-paste manipulation)")
         
         # 4. Check for noise inconsistencies
         # Real photos have consistent noise patterns
-        noise_score = analyze_noise_patterns(gray)
+        noise_score = analyze_noise_patterns(gray, noise)
         if noise_score > 0.7:  # Inconsistent noise
             anomalies.append("Inconsistent noise patterns detected")
         
@@ -767,31 +1101,55 @@ def perform_digital_forensics(image):
     
     return anomalies
 
-def detect_copy_paste_artifacts(gray):
+def detect_copy_paste_artifacts(gray, tiles=None, max_matches=None):
     """
-    Detect copy-paste operations by finding repeated patterns
+    Detect copy-paste operations by finding repeated patterns: counts pairs of
+    COPY_PASTE_TILE blocks (the second in a later block row) whose mean
+    absolute difference is under 5% of the range. Counting stops after the
+    first block whose pairs take the count past `max_matches`.
     """
     try:
-        # Divide image into blocks and compare
-        h, w = gray.shape
-        block_size = 32
+        if tiles is None:
+            tiles = TileStats(gray, COPY_PASTE_TILE)
+        if len(tiles) == 0:
+            return 0
+        blocks = tiles.flat()
+        means = tiles.mean.ravel()
+        block_rows = np.repeat(np.arange(tiles.shape[0]), tiles.shape[1])
+        max_diff = 0.05 * 255
+        # Exact: a mean over tile * tile integer differences is under max_diff iff their sum is
+        max_sum = max_diff * blocks.shape[1]
+
+        # The mean absolute difference is at least the difference of the means:
+        # candidates of each block are a window of the blocks sorted by mean
+        order = np.argsort(means, kind='stable')
+        sorted_means = means[order]
+        lo = np.searchsorted(sorted_means, means - max_diff, side='left')
+        hi = np.searchsorted(sorted_means, means + max_diff, side='right')
+        counts = hi - lo
+
         matches = 0
-        
-        for i in range(0, h - block_size, block_size):
-            for j in range(0, w - block_size, block_size):
-                block = gray[i:i+block_size, j:j+block_size]
-                
-                # Search for similar blocks in the rest of the image
-                for ii in range(i + block_size, h - block_size, block_size):
-                    for jj in range(0, w - block_size, block_size):
-                        compare_block = gray[ii:ii+block_size, jj:jj+block_size]
-                        
-                        # Calculate similarity
-                        diff = cv2.absdiff(block, compare_block)
-                        similarity = 1.0 - (np.mean(diff) / 255.0)
-                        
-                        if similarity > 0.95:  # Very similar blocks
-                            matches += 1
+        # Batches of whole blocks, growing up to COPY_PASTE_BATCH candidate pairs
+        # so that pages over max_matches stop after little work
+        cumulative = np.cumsum(counts)
+        first, batch = 0, 256
+        while first < len(blocks):
+            done = cumulative[first - 1] if first else 0
+            start, first = first, min(int(np.searchsorted(cumulative, done + batch)) + 1, len(blocks))
+            batch = min(batch * 2, COPY_PASTE_BATCH)
+            batch_counts = counts[start:first]
+            firsts = np.repeat(np.arange(start, first), batch_counts)
+            offsets = np.arange(batch_counts.sum()) - np.repeat(np.cumsum(batch_counts) - batch_counts, batch_counts)
+            seconds = order[np.repeat(lo[start:first], batch_counts) + offsets]
+            keep = (block_rows[seconds] > block_rows[firsts]) & (np.abs(means[seconds] - means[firsts]) < max_diff)
+            firsts, seconds = firsts[keep], seconds[keep]
+            if len(firsts):
+                diff = cv2.reduce(cv2.absdiff(blocks[seconds], blocks[firsts]), 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S)
+                firsts = firsts[diff.ravel() < max_sum]
+            running = matches + np.cumsum(np.bincount(firsts - start, minlength=first - start))
+            if max_matches is not None and running[-1] > max_matches:
+                return int(running[np.argmax(running > max_matches)])
+            matches = int(running[-1])
         
         return matches
         
@@ -799,35 +1157,15 @@ def detect_copy_paste_artifacts(gray):
         logger.error(f"Copy-paste detection error: {str(e)}")
         return 0
 
-def analyze_noise_patterns(gray):
+def analyze_noise_patterns(gray, noise=None):
     """
-    Analyze noise patterns for inconsistencies
+    Analyze noise patterns for inconsistencies: the coefficient of variation
+    of the local noise variance, summarised from the sliding-window noise map
     """
     try:
-        # Apply Gaussian blur to get noise
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        noise = cv2.absdiff(gray, blurred)
-        
-        # Divide image into regions and analyze noise
-        h, w = noise.shape
-        region_size = 64
-        noise_variances = []
-        
-        for i in range(0, h - region_size, region_size):
-            for j in range(0, w - region_size, region_size):
-                region = noise[i:i+region_size, j:j+region_size]
-                variance = np.var(region)
-                noise_variances.append(variance)
-        
-        # Calculate coefficient of variation
-        if len(noise_variances) > 0:
-            mean_var = np.mean(noise_variances)
-            std_var = np.std(noise_variances)
-            if mean_var > 0:
-                cv_noise = std_var / mean_var
-                return cv_noise
-        
-        return 0.0
+        if noise is None:
+            noise = analyze_noise(gray)
+        return float(noise['score'])
         
     except Exception as e:
         logger.error(f"Noise analysis error: {str(e)}")
@@ -946,12 +1284,8 @@ def analyze_texture_patterns(image):
             anomalies.append("Unnatural texture uniformity detected")
         
         # Check for texture discontinuities
-        # Calculate texture gradients
-        sobelx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-        sobely = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-        
-        # Find areas with abrupt texture changes
-        gradient_mag = np.sqrt(sobelx**2 + sobely**2)
+        # Calculate texture gradients: find areas with abrupt texture changes
+        gradient_mag = gradient_magnitude(gray)
         threshold = np.percentile(gradient_mag, 95)
         
         high_gradient_pixels = np.sum(gradient_mag > threshold)
@@ -972,26 +1306,14 @@ def calculate_lbp(gray):
     """
     try:
         rows, cols = gray.shape
+        center = gray[1:-1, 1:-1]
         lbp = np.zeros((rows-2, cols-2), dtype=np.uint8)
         
-        for i in range(1, rows-1):
-            for j in range(1, cols-1):
-                center = gray[i, j]
-                
-                # Compare with 8 neighbors
-                neighbors = [
-                    gray[i-1, j-1], gray[i-1, j], gray[i-1, j+1],
-                    gray[i, j+1], gray[i+1, j+1], gray[i+1, j],
-                    gray[i+1, j-1], gray[i, j-1]
-                ]
-                
-                # Calculate LBP value
-                lbp_val = 0
-                for k, neighbor in enumerate(neighbors):
-                    if neighbor >= center:
-                        lbp_val += (1 << k)
-                
-                lbp[i-1, j-1] = lbp_val
+        # Compare with the 8 neighbors, clockwise from the top-left one
+        neighbors = [(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)]
+        for k, (dy, dx) in enumerate(neighbors):
+            neighbor = gray[1+dy:rows-1+dy, 1+dx:cols-1+dx]
+            lbp |= (neighbor >= center).astype(np.uint8) << k
         
         return lbp
         
@@ -999,7 +1321,7 @@ def calculate_lbp(gray):
         logger.error(f"LBP calculation error: {str(e)}")
         return gray[1:-1, 1:-1]  # Return cropped original
 
-def analyze_document_structure(image, ocr_text):
+def analyze_document_structure(image, ocr_text, regions=None):
     """
     Analyze document structure for authenticity
     """
@@ -1007,40 +1329,25 @@ def analyze_document_structure(image, ocr_text):
     
     try:
         # Check for proper document layout
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Find text regions using morphological operations
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-        
-        # Apply threshold
-        _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        gray = regions.gray if regions is not None else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         
-        # Find contours
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        # Analyze contour properties
-        text_regions = []
-        for contour in contours:
-            x, y, w, h = cv2.boundingRect(contour)
-            area = cv2.contourArea(contour)
-            
-            # Filter for text-like regions
-            if area > 100 and w > 20 and h > 10:
-                aspect_ratio = w / h
-                if 0.5 < aspect_ratio < 10:  # Reasonable aspect ratio for text
-                    text_regions.append((x, y, w, h))
+        # Filter Otsu-thresholded regions for text-like ones
+        table = get_region_proposer(gray, regions).table('otsu')
+        text_regions = table.subset(
+            (table['area'] > 100) & (table['w'] > 20) & (table['h'] > 10) &
+            (table['aspect_ratio'] > 0.5) & (table['aspect_ratio'] < 10)  # Reasonable aspect ratio for text
+        )
         
         # Check for proper text alignment
         if len(text_regions) > 3:
             # Check if text regions are roughly aligned
-            y_positions = [y for x, y, w, h in text_regions]
-            y_variance = np.var(y_positions)
+            y_variance = np.var(text_regions['y'])
             
             if y_variance > 10000:  # Poor alignment
                 anomalies.append("Poor text alignment detected")
         
         # Check for reasonable text density
-        total_text_area = sum(w * h for x, y, w, h in text_regions)
+        total_text_area = int(np.sum(text_regions['w'] * text_regions['h']))
         image_area = gray.shape[0] * gray.shape[1]
         text_density = total_text_area / image_area
         
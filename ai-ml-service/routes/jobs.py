@@ -0,0 +1,101 @@
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException
+from typing import Optional
+import os
+import uuid
+import logging
+
+from utils.job_queue import (job_queue, public_job_view, check_callback_url, JobWorkerPool, JOB_UPLOAD_FOLDER,
+                             JOB_CONCURRENCY)
+from utils.json_utils import NumpyJSONResponse
+from utils.analysis_plan import build_analysis_plan
+from routes.analysis import run_document_analysis
+
+logger = logging.getLogger(__name__)
+router = APIRouter(default_response_class=NumpyJSONResponse)
+
+os.makedirs(JOB_UPLOAD_FOLDER, exist_ok=True)
+
+def process_analysis_job(payload):
+    """
+    Job handler: run the same analysis pipeline as /analyze on a stored upload
+    """
+    plan = build_analysis_plan(payload.get('fields'), payload.get('profile'))
+    return run_document_analysis(payload['file_path'], payload['document_type'], plan, payload.get('subject_id'),
+                                 payload.get('cross_check_ocr', False))
+
+def create_worker_pool(concurrency=JOB_CONCURRENCY):
+    """Create a worker pool bound to the shared job queue"""
+    return JobWorkerPool(job_queue, process_analysis_job, concurrency=concurrency)
+
+@router.post("/jobs", status_code=202)
+async def submit_analysis_job(
+    file: UploadFile = File(...),
+    document_type: str = Form(...),
+    callback_url: Optional[str] = Form(None),
+    fields: Optional[str] = Form(None),
+    profile: Optional[str] = Form(None),
+    subject_id: Optional[str] = Form(None),
+    cross_check_ocr: bool = Form(False)
+):
+    """
+    Queue a document analysis and return a job id to poll for the result
+    """
+    try:
+        # Validate file type
+        if not file.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail="Only image files are supported")
+
+        if callback_url:
+            try:
+                check_callback_url(callback_url)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+
+        # Reject unknown field selections up front rather than in the worker
+        try:
+            build_analysis_plan(fields, profile)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        # Persist the upload next to the queue so any worker process can read it
+        job_id = uuid.uuid4().hex
+        extension = os.path.splitext(file.filename or '')[1].lower()
+        file_location = os.path.join(JOB_UPLOAD_FOLDER, f"{job_id}{extension}")
+        with open(file_location, "wb") as buffer:
+            buffer.write(await file.read())
+
+        job = job_queue.enqueue({
+            "file_path": file_location,
+            "filename": file.filename,
+            "document_type": document_type,
+            "fields": fields,
+            "profile": profile,
+            "subject_id": subject_id,
+            "cross_check_ocr": cross_check_ocr
+        }, callback_url=callback_url, job_id=job_id)
+
+        logger.info(f"Queued analysis job {job_id} for {file.filename}, document_type: {document_type}")
+
+        return NumpyJSONResponse(status_code=202, content={
+            "success": True,
+            "job_id": job_id,
+            "status": job["status"],
+            "status_url": f"/api/v1/jobs/{job_id}",
+            "expires_at": job["expires_at"]
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Job submission error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Job submission failed: {str(e)}")
+
+@router.get("/jobs/{job_id}")
+async def get_analysis_job(job_id: str):
+    """
+    Return the status of a queued analysis, including the result once completed
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return NumpyJSONResponse(public_job_view(job))
@@ -1,19 +1,28 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException
+from fastapi import APIRouter, Depends, File, UploadFile, HTTPException
 import cv2
 import numpy as np
 from PIL import Image
 import io
 import pytesseract
 import logging
+from typing import Optional
+from utils.deadlines import (Deadline, deadline_header, ensure_time_left, request_deadline, tesseract_timeout,
+                             TESSERACT_TIMEOUT_MESSAGE)
+from utils.json_utils import NumpyJSONResponse
+from utils.stage_cache import stage_cache, upload_key
 
 logger = logging.getLogger(__name__)
-router = APIRouter()
+router = APIRouter(default_response_class=NumpyJSONResponse)
 
 @router.post("/ocr")
-async def perform_ocr_analysis(file: UploadFile = File(...)):
+async def perform_ocr_analysis(file: UploadFile = File(...),
+                               deadline: Optional[Deadline] = Depends(deadline_header)):
     """
-    Perform OCR (Optical Character Recognition) on uploaded document
+    Perform OCR (Optical Character Recognition) on uploaded document. With an
+    X-Request-Timeout-Ms header, tesseract is stopped at the deadline and
+    the (empty) result is flagged `partial`.
     """
+    ensure_time_left(deadline)
     try:
         # Validate file type
         if not file.content_type.startswith('image/'):
@@ -22,20 +31,24 @@ async def perform_ocr_analysis(file: UploadFile = File(...)):
         # Read file content
         content = await file.read()
         
-        # Load image
+        # Load image (decoded on first use, i.e. not when the OCR result is cached)
         image = Image.open(io.BytesIO(content))
         
-        # Perform OCR
-        ocr_result = extract_text_with_confidence(image)
+        # Perform OCR, or reuse the result of an earlier call with the same file
+        key, pixels = upload_key(content)
+        with request_deadline(deadline):
+            ocr_result = stage_cache.get_or_compute(key, 'extract_text_with_confidence',
+                                                    lambda: extract_text_with_confidence(image), pixels=pixels)
         
-        return {
+        return NumpyJSONResponse({
             "success": True,
             "text": ocr_result["text"],
             "confidence": ocr_result["confidence"],
             "word_count": len(ocr_result["text"].split()),
             "detected_languages": ocr_result.get("languages", []),
-            "text_regions": ocr_result.get("regions", [])
-        }
+            "text_regions": ocr_result.get("regions", []),
+            "partial": ocr_result.get("timed_out", False)
+        })
         
     except Exception as e:
         logger.error(f"OCR analysis error: {str(e)}")
@@ -43,7 +56,8 @@ async def perform_ocr_analysis(file: UploadFile = File(...)):
 
 def extract_text_with_confidence(image):
     """
-    Extract text from image with confidence scores
+    Extract text from image with confidence scores; `timed_out` tells whether
+    tesseract was stopped by the request's deadline
     """
     try:
         # Convert PIL to numpy array
@@ -52,11 +66,12 @@ def extract_text_with_confidence(image):
         # Preprocess image for better OCR results
         preprocessed = preprocess_image_for_ocr(img_array)
         
-        # Perform OCR with detailed output
+        # Perform OCR with detailed output, bounded by the request's deadline if it has one
         data = pytesseract.image_to_data(
             preprocessed, 
             output_type=pytesseract.Output.DICT,
-            config='--psm 6'  # Assume uniform block of text
+            config='--psm 6',  # Assume uniform block of text
+            timeout=tesseract_timeout()
         )
         
         # Extract text and confidence
@@ -94,16 +109,22 @@ def extract_text_with_confidence(image):
             "text": full_text,
             "confidence": avg_confidence,
             "languages": languages,
-            "regions": regions
+            "regions": regions,
+            "timed_out": False
         }
         
     except Exception as e:
-        logger.error(f"Text extraction error: {str(e)}")
+        timed_out = isinstance(e, RuntimeError) and str(e) == TESSERACT_TIMEOUT_MESSAGE
+        if timed_out:
+            logger.warning("Text extraction stopped at the request deadline")
+        else:
+            logger.error(f"Text extraction error: {str(e)}")
         return {
             "text": "",
             "confidence": 0.0,
             "languages": [],
-            "regions": []
+            "regions": [],
+            "timed_out": timed_out
         }
 
 def preprocess_image_for_ocr(image):
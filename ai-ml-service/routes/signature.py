@@ -1,18 +1,34 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException
+from fastapi import APIRouter, Depends, File, UploadFile, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
 import cv2
 import numpy as np
 from PIL import Image
 import io
+import uuid
+import base64
 import logging
+import time
+from typing import Optional
+from utils.deadlines import Deadline, deadline_header, ensure_time_left
+from utils.json_utils import NumpyJSONResponse, dumps
+from utils.region_proposals import get_region_proposer
+from utils.crop_cache import (signature_crop_cache, SignatureCacheEntry, content_hash as hash_content,
+                              CROP_ENCODINGS, CROP_CACHE_TTL_SECONDS)
+from utils.stage_cache import upload_key
+from utils.signature_descriptors import signature_descriptor, get_signature_index, SIGNATURE_MATCH_THRESHOLD
 
 logger = logging.getLogger(__name__)
-router = APIRouter()
+router = APIRouter(default_response_class=NumpyJSONResponse)
 
 @router.post("/detect-signature")
-async def detect_signature_in_document(file: UploadFile = File(...)):
+async def detect_signature_in_document(file: UploadFile = File(...),
+                                       deadline: Optional[Deadline] = Depends(deadline_header)):
     """
-    Detect signatures in uploaded document
+    Detect signatures in uploaded document. Answers 504 without analyzing
+    when the X-Request-Timeout-Ms budget is already spent.
     """
+    ensure_time_left(deadline)
     try:
         # Validate file type
         if not file.content_type.startswith('image/'):
@@ -21,87 +37,107 @@ async def detect_signature_in_document(file: UploadFile = File(...)):
         # Read file content
         content = await file.read()
         
-        # Load image
-        image = Image.open(io.BytesIO(content))
-        img_array = np.array(image)
+        # Detect signatures (cached by content hash for a following /extract-signature)
+        key, entry = await run_in_threadpool(detect_signatures_cached, content)
+        signature_result = entry.result
         
-        # Detect signatures
-        signature_result = find_signatures(img_array)
-        
-        return {
+        return NumpyJSONResponse({
             "success": True,
             "signature_detected": signature_result["found"],
             "signature_count": signature_result["count"],
             "signature_regions": signature_result["regions"],
-            "confidence": signature_result["confidence"]
-        }
+            "confidence": signature_result["confidence"],
+            "content_hash": key
+        })
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Signature detection error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Signature detection failed: {str(e)}")
 
-def find_signatures(image):
+def detect_signatures_cached(content):
+    """
+    Run find_signatures on an upload, or reuse the result and crops of an
+    earlier call with the same file. Returns (content_hash, SignatureCacheEntry).
+    """
+    key = hash_content(content)
+    entry = signature_crop_cache.get(key)
+    if entry is not None:
+        return key, entry
+
+    # Load image
+    image = Image.open(io.BytesIO(content))
+    img_array = np.array(image)
+    
+    # Region tables through the stage cache, shared with other routes analyzing the same file
+    _, pixels = upload_key(content)
+    signature_result = find_signatures(img_array, content_hash=key, pixels=pixels)
+    
+    # Keep only the crops, not the whole image
+    crops = [
+        img_array[r["bbox"]["y"]:r["bbox"]["y"] + r["bbox"]["height"],
+                  r["bbox"]["x"]:r["bbox"]["x"] + r["bbox"]["width"]].copy()
+        for r in signature_result["regions"]
+    ]
+    entry = SignatureCacheEntry(signature_result, crops)
+    signature_crop_cache.put(key, entry)
+    return key, entry
+
+def find_signatures(image, regions=None, content_hash=None, **stage_params):
     """
-    Find signature regions in the document
+    Find signature regions in the document. Without `regions`, region tables
+    are computed here, through the stage cache when `content_hash` is given.
     """
     try:
         # Convert to grayscale
         gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
         
-        # Apply threshold to get binary image
-        _, binary = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY_INV)
+        # Regions of the inverted binary image (dark ink on light paper)
+        table = get_region_proposer(gray, regions, content_hash, **stage_params).table('inv127')
+        
+        # Filter regions based on area (signatures typically have certain size range)
+        candidates = table.subset((table['area'] > 1000) & (table['area'] < 50000))
         
-        # Find contours
-        contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Hull-based solidity only for the size-filtered candidates
+        solidities = candidates.solidity()
         
         signature_regions = []
         signature_count = 0
         total_confidence = 0
         
-        for contour in contours:
-            area = cv2.contourArea(contour)
+        for i, (x, y, w, h) in enumerate(candidates.boxes()):
+            area = float(candidates['area'][i])
+            aspect_ratio = float(candidates['aspect_ratio'][i])
+            solidity = float(solidities[i])
+            extent = float(candidates['extent'][i])
             
-            # Filter contours based on area (signatures typically have certain size range)
-            if 1000 < area < 50000:
-                # Get bounding rectangle
-                x, y, w, h = cv2.boundingRect(contour)
-                aspect_ratio = w / h
-                
-                # Calculate contour properties
-                hull = cv2.convexHull(contour)
-                hull_area = cv2.contourArea(hull)
-                solidity = area / hull_area if hull_area > 0 else 0
-                
-                # Calculate extent
-                rect_area = w * h
-                extent = area / rect_area if rect_area > 0 else 0
-                
-                # Signature characteristics:
-                # - Aspect ratio between 0.5 and 4.0
-                # - Solidity between 0.3 and 0.8 (irregular shape)
-                # - Extent between 0.3 and 0.8
-                signature_confidence = calculate_signature_confidence(
-                    aspect_ratio, solidity, extent, area
-                )
-                
-                if signature_confidence > 0.5:
-                    signature_regions.append({
-                        "bbox": {
-                            "x": int(x),
-                            "y": int(y),
-                            "width": int(w),
-                            "height": int(h)
-                        },
-                        "area": int(area),
-                        "confidence": signature_confidence,
-                        "properties": {
-                            "aspect_ratio": aspect_ratio,
-                            "solidity": solidity,
-                            "extent": extent
-                        }
-                    })
-                    signature_count += 1
-                    total_confidence += signature_confidence
+            # Signature characteristics:
+            # - Aspect ratio between 0.5 and 4.0
+            # - Solidity between 0.3 and 0.8 (irregular shape)
+            # - Extent between 0.3 and 0.8
+            signature_confidence = calculate_signature_confidence(
+                aspect_ratio, solidity, extent, area
+            )
+            
+            if signature_confidence > 0.5:
+                signature_regions.append({
+                    "bbox": {
+                        "x": int(x),
+                        "y": int(y),
+                        "width": int(w),
+                        "height": int(h)
+                    },
+                    "area": int(area),
+                    "confidence": signature_confidence,
+                    "properties": {
+                        "aspect_ratio": aspect_ratio,
+                        "solidity": solidity,
+                        "extent": extent
+                    }
+                })
+                signature_count += 1
+                total_confidence += signature_confidence
         
         avg_confidence = total_confidence / signature_count if signature_count > 0 else 0
         
@@ -154,60 +190,253 @@ def calculate_signature_confidence(aspect_ratio, solidity, extent, area):
         logger.error(f"Confidence calculation error: {str(e)}")
         return 0.0
 
+SIGNATURE_DELIVERIES = ('inline', 'multipart', 'url')
+
 @router.post("/extract-signature")
-async def extract_signature_from_document(file: UploadFile = File(...)):
+async def extract_signature_from_document(
+    file: Optional[UploadFile] = File(None),
+    content_hash: Optional[str] = Form(None),
+    encoding: str = Form('png'),
+    quality: Optional[int] = Form(None),
+    delivery: str = Form('inline'),
+    deadline: Optional[Deadline] = Depends(deadline_header)
+):
     """
-    Extract signature regions as separate images
+    Extract signature regions as separate images.
+
+    delivery=inline returns base64 crops in JSON (default), multipart returns a
+    multipart/mixed body with the JSON metadata followed by one binary part per
+    crop, and url returns links to GET /signature-crops/{content_hash}/{id}.
+    Instead of re-uploading, pass the content_hash from /detect-signature.
+    Answers 504 without detecting when the X-Request-Timeout-Ms budget is
+    already spent.
     """
+    ensure_time_left(deadline)
     try:
-        # Validate file type
-        if not file.content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="Only image files are supported")
-        
-        # Read file content
-        content = await file.read()
-        
-        # Load image
-        image = Image.open(io.BytesIO(content))
-        img_array = np.array(image)
-        
-        # Find signatures
-        signature_result = find_signatures(img_array)
+        if encoding not in CROP_ENCODINGS:
+            raise HTTPException(status_code=400, detail=f"encoding must be one of: {', '.join(CROP_ENCODINGS)}")
+        if delivery not in SIGNATURE_DELIVERIES:
+            raise HTTPException(status_code=400, detail=f"delivery must be one of: {', '.join(SIGNATURE_DELIVERIES)}")
+        if quality is not None and not 1 <= quality <= 100:
+            raise HTTPException(status_code=400, detail="quality must be between 1 and 100")
+
+        if file is not None:
+            # Validate file type
+            if not file.content_type.startswith('image/'):
+                raise HTTPException(status_code=400, detail="Only image files are supported")
+            
+            # Find signatures, reusing a previous detection of the same file
+            key, entry = await run_in_threadpool(detect_signatures_cached, await file.read())
+        elif content_hash:
+            key, entry = content_hash, signature_crop_cache.get(content_hash)
+            if entry is None:
+                raise HTTPException(status_code=404, detail="Unknown or expired content_hash; upload the file instead")
+        else:
+            raise HTTPException(status_code=400, detail="Provide a file or a content_hash")
         
         # Extract signature regions
         extracted_signatures = []
         
-        for i, region in enumerate(signature_result["regions"]):
-            bbox = region["bbox"]
-            
-            # Extract region from original image
-            signature_crop = img_array[
-                bbox["y"]:bbox["y"] + bbox["height"],
-                bbox["x"]:bbox["x"] + bbox["width"]
-            ]
-            
-            # Convert to PIL Image
-            signature_img = Image.fromarray(signature_crop)
-            
-            # Convert to base64 for response
-            buffer = io.BytesIO()
-            signature_img.save(buffer, format='PNG')
-            import base64
-            signature_base64 = base64.b64encode(buffer.getvalue()).decode()
-            
-            extracted_signatures.append({
+        for i, region in enumerate(entry.result["regions"]):
+            signature = {
                 "signature_id": i + 1,
-                "bbox": bbox,
-                "confidence": region["confidence"],
-                "image_data": signature_base64
-            })
+                "bbox": region["bbox"],
+                "confidence": region["confidence"]
+            }
+            if delivery == 'inline':
+                crop = await run_in_threadpool(entry.encoded_crop, i + 1, encoding, quality)
+                signature["image_data"] = base64.b64encode(crop).decode()
+            elif delivery == 'url':
+                signature["image_url"] = signature_crop_url(key, i + 1, encoding, quality)
+            extracted_signatures.append(signature)
         
-        return {
+        metadata = {
             "success": True,
             "signature_count": len(extracted_signatures),
-            "signatures": extracted_signatures
+            "signatures": extracted_signatures,
+            "content_hash": key,
+            "encoding": encoding,
+            "media_type": CROP_ENCODINGS[encoding][0]
         }
         
+        if delivery == 'multipart':
+            return await run_in_threadpool(multipart_signature_response, metadata, entry, encoding, quality)
+        
+        return NumpyJSONResponse(metadata)
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Signature extraction error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Signature extraction failed: {str(e)}")
+
+def signature_crop_url(key, signature_id, encoding, quality):
+    url = f"/api/v1/signature-crops/{key}/{signature_id}?encoding={encoding}"
+    return url + (f"&quality={quality}" if quality is not None else "")
+
+def multipart_signature_response(metadata, entry, encoding, quality):
+    """
+    multipart/mixed body: the JSON metadata, then each crop as a binary part
+    whose Content-ID is the signature_id
+    """
+    boundary = uuid.uuid4().hex
+    media_type, extension = CROP_ENCODINGS[encoding]
+    parts = [
+        f"--{boundary}\r\nContent-Type: application/json\r\n\r\n".encode() + dumps(metadata) + b"\r\n"
+    ]
+    for signature in metadata["signatures"]:
+        signature_id = signature["signature_id"]
+        headers = (f"--{boundary}\r\n"
+                   f"Content-Type: {media_type}\r\n"
+                   f"Content-ID: <{signature_id}>\r\n"
+                   f"Content-Disposition: attachment; filename=\"signature_{signature_id}{extension}\"\r\n\r\n")
+        parts.append(headers.encode() + entry.encoded_crop(signature_id, encoding, quality) + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return Response(content=b"".join(parts), media_type=f"multipart/mixed; boundary={boundary}")
+
+@router.get("/signature-crops/{content_hash}/{signature_id}")
+async def get_signature_crop(content_hash: str, signature_id: int, encoding: str = 'png',
+                             quality: Optional[int] = None):
+    """
+    Fetch one signature crop of a recently analyzed upload as a binary image
+    """
+    if encoding not in CROP_ENCODINGS:
+        raise HTTPException(status_code=400, detail=f"encoding must be one of: {', '.join(CROP_ENCODINGS)}")
+    if quality is not None and not 1 <= quality <= 100:
+        raise HTTPException(status_code=400, detail="quality must be between 1 and 100")
+
+    entry = signature_crop_cache.get(content_hash)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired content_hash")
+    try:
+        data = await run_in_threadpool(entry.encoded_crop, signature_id, encoding, quality)
+    except IndexError:
+        raise HTTPException(status_code=404, detail="Signature not found")
+
+    return Response(content=data, media_type=CROP_ENCODINGS[encoding][0],
+                    headers={"Cache-Control": f"private, max-age={int(CROP_CACHE_TTL_SECONDS)}"})
+
+async def resolve_signature_crop(file, content_hash, signature_id, whole_image):
+    """
+    The crop to describe: a detected signature of an upload (or of a cached
+    content_hash), or the whole upload when it is already a signature specimen.
+    Returns (content_hash, crop).
+    """
+    if file is not None:
+        if not file.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail="Only image files are supported")
+        content = await file.read()
+        if whole_image:
+            return hash_content(content), await run_in_threadpool(lambda: np.array(Image.open(io.BytesIO(content))))
+        key, entry = await run_in_threadpool(detect_signatures_cached, content)
+    elif content_hash:
+        if whole_image:
+            raise HTTPException(status_code=400, detail="whole_image requires a file upload")
+        key, entry = content_hash, signature_crop_cache.get(content_hash)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired content_hash; upload the file instead")
+    else:
+        raise HTTPException(status_code=400, detail="Provide a file or a content_hash")
+
+    if not entry.crops:
+        raise HTTPException(status_code=422, detail="No signature detected in the document")
+    if signature_id is None:
+        # Default to the most confident detection
+        confidences = [r["confidence"] for r in entry.result["regions"]]
+        signature_id = int(np.argmax(confidences)) + 1
+    if not 1 <= signature_id <= len(entry.crops):
+        raise HTTPException(status_code=404, detail="Signature not found")
+    return key, entry.crops[signature_id - 1]
+
+def describe_signature_crop(crop):
+    descriptor = signature_descriptor(crop)
+    if descriptor is None:
+        raise HTTPException(status_code=422, detail="Signature crop contains no ink")
+    return descriptor
+
+@router.post("/signature/references")
+async def add_reference_signature(
+    subject_id: str = Form(...),
+    file: Optional[UploadFile] = File(None),
+    content_hash: Optional[str] = Form(None),
+    signature_id: Optional[int] = Form(None),
+    whole_image: bool = Form(False),
+    label: Optional[str] = Form(None),
+    deadline: Optional[Deadline] = Depends(deadline_header)
+):
+    """
+    Enroll a reference signature for a subject (e.g. an account). The upload
+    is either a document, whose detected signature is used, or a signature
+    specimen with whole_image=true. Answers 504, without enrolling, when the
+    X-Request-Timeout-Ms budget runs out before the signature is described,
+    so that a caller retrying after its timeout doesn't enroll it twice.
+    """
+    ensure_time_left(deadline)
+    try:
+        key, crop = await resolve_signature_crop(file, content_hash, signature_id, whole_image)
+        descriptor = await run_in_threadpool(describe_signature_crop, crop)
+        ensure_time_left(deadline)
+        index = get_signature_index()
+        row = index.add(descriptor, subject_id, label or key)
+        return NumpyJSONResponse({
+            "success": True,
+            "subject_id": subject_id,
+            "reference_id": row,
+            "reference_count": index.count(subject_id),
+            "content_hash": key
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Reference signature enrollment error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Reference signature enrollment failed: {str(e)}")
+
+@router.post("/signature/compare")
+async def compare_signature(
+    subject_id: str = Form(...),
+    file: Optional[UploadFile] = File(None),
+    content_hash: Optional[str] = Form(None),
+    signature_id: Optional[int] = Form(None),
+    whole_image: bool = Form(False),
+    k: int = Form(3),
+    deadline: Optional[Deadline] = Depends(deadline_header)
+):
+    """
+    Compare a document's signature against the subject's reference signatures.
+    Returns the k closest references by cosine distance and whether the best
+    one is within SIGNATURE_MATCH_THRESHOLD. Answers 504 when the
+    X-Request-Timeout-Ms budget runs out before the search.
+    """
+    ensure_time_left(deadline)
+    try:
+        if not 1 <= k <= 100:
+            raise HTTPException(status_code=400, detail="k must be between 1 and 100")
+        key, crop = await resolve_signature_crop(file, content_hash, signature_id, whole_image)
+        descriptor = await run_in_threadpool(describe_signature_crop, crop)
+        ensure_time_left(deadline)
+
+        start = time.perf_counter()
+        matches = get_signature_index().search(descriptor, k=k, subject_id=subject_id)
+        search_ms = (time.perf_counter() - start) * 1000
+
+        best_distance = matches[0]["distance"] if matches else None
+        return NumpyJSONResponse({
+            "success": True,
+            "subject_id": subject_id,
+            "has_references": bool(matches),
+            "match": best_distance is not None and best_distance <= SIGNATURE_MATCH_THRESHOLD,
+            "best_distance": best_distance,
+            "threshold": SIGNATURE_MATCH_THRESHOLD,
+            "closest_references": [
+                {"reference_id": m["row"], "label": m["label"], "distance": m["distance"],
+                 "enrolled_at": m["created_at"]}
+                for m in matches
+            ],
+            "search_ms": round(search_ms, 3),
+            "content_hash": key
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Signature comparison error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Signature comparison failed: {str(e)}")
@@ -1,21 +1,31 @@
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException
+from fastapi import APIRouter, Depends, File, UploadFile, Form, HTTPException
 import cv2
 import numpy as np
 from PIL import Image
 import io
 import logging
+from typing import Optional
+from utils.deadlines import Deadline, deadline_header, ensure_time_left
+from utils.json_utils import NumpyJSONResponse
+from utils.pipeline_profiles import get_pipeline_profile
+from utils.stage_cache import upload_key
+from utils.region_proposals import RegionProposer, get_region_proposer
+from utils.scratch import laplacian_variance, mean_std
 
 logger = logging.getLogger(__name__)
-router = APIRouter()
+router = APIRouter(default_response_class=NumpyJSONResponse)
 
 @router.post("/validate-format")
 async def validate_document_format(
     file: UploadFile = File(...),
-    document_type: str = Form(...)
+    document_type: str = Form(...),
+    deadline: Optional[Deadline] = Depends(deadline_header)
 ):
     """
-    Validate document format and structure
+    Validate document format and structure. Answers 504 without analyzing
+    when the X-Request-Timeout-Ms budget is already spent.
     """
+    ensure_time_left(deadline)
     try:
         # Validate file type
         if not file.content_type.startswith('image/'):
@@ -28,23 +38,24 @@ async def validate_document_format(
         image = Image.open(io.BytesIO(content))
         img_array = np.array(image)
         
-        # Perform format validation
-        validation_result = perform_format_validation(img_array, document_type)
+        # Perform format validation (region tables shared with other routes through the stage cache)
+        key, pixels = upload_key(content)
+        validation_result = perform_format_validation(img_array, document_type, content_hash=key, pixels=pixels)
         
-        return {
+        return NumpyJSONResponse({
             "success": True,
             "document_type": document_type,
             "is_valid_format": validation_result["is_valid"],
             "format_score": validation_result["score"],
             "validation_details": validation_result["details"],
             "recommendations": validation_result["recommendations"]
-        }
+        })
         
     except Exception as e:
         logger.error(f"Format validation error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Format validation failed: {str(e)}")
 
-def perform_format_validation(image, document_type):
+def perform_format_validation(image, document_type, content_hash=None, **stage_params):
     """
     Perform comprehensive format validation
     """
@@ -72,7 +83,7 @@ def perform_format_validation(image, document_type):
         quality_score = validate_image_quality(image)
         
         # Validate structure elements
-        structure_score = validate_document_structure(image, document_type)
+        structure_score = validate_document_structure(image, document_type, content_hash, **stage_params)
         
         # Calculate overall score
         overall_score = (
@@ -116,46 +127,10 @@ def perform_format_validation(image, document_type):
 
 def get_document_specifications(document_type):
     """
-    Get specifications for different document types
+    Get specifications for different document types, from their pipeline
+    profiles (unset entries fall back to the generic values of the validators)
     """
-    specifications = {
-        "passport": {
-            "aspect_ratio_range": (1.3, 1.5),
-            "min_dimensions": (600, 800),
-            "recommended_dimensions": (1200, 1600),
-            "required_elements": ["photo", "text_regions", "machine_readable_zone"],
-            "color_requirements": "color_preferred"
-        },
-        "id-card": {
-            "aspect_ratio_range": (1.5, 1.7),
-            "min_dimensions": (500, 800),
-            "recommended_dimensions": (1000, 1600),
-            "required_elements": ["photo", "text_regions", "id_number"],
-            "color_requirements": "color_preferred"
-        },
-        "driver-license": {
-            "aspect_ratio_range": (1.5, 1.8),
-            "min_dimensions": (500, 800),
-            "recommended_dimensions": (1000, 1600),
-            "required_elements": ["photo", "license_number", "address"],
-            "color_requirements": "color_required"
-        },
-        "certificate": {
-            "aspect_ratio_range": (1.2, 1.4),
-            "min_dimensions": (800, 1000),
-            "recommended_dimensions": (1600, 2000),
-            "required_elements": ["title", "name", "date", "signature"],
-            "color_requirements": "any"
-        }
-    }
-    
-    return specifications.get(document_type, {
-        "aspect_ratio_range": (1.0, 2.0),
-        "min_dimensions": (400, 600),
-        "recommended_dimensions": (800, 1200),
-        "required_elements": [],
-        "color_requirements": "any"
-    })
+    return get_pipeline_profile(document_type).format_specifications()
 
 def validate_dimensions(width, height, specs):
     """
@@ -207,15 +182,15 @@ def validate_image_quality(image):
         gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
         
         # Calculate sharpness (Laplacian variance)
-        laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+        laplacian_var = laplacian_variance(gray)
         sharpness_score = min(laplacian_var / 1000, 1.0)
         
-        # Calculate brightness
-        brightness = np.mean(gray) / 255.0
+        # Calculate brightness and contrast
+        mean, std = mean_std(gray)
+        brightness = mean / 255.0
         brightness_score = 1.0 - abs(brightness - 0.5) * 2  # Optimal around 0.5
         
-        # Calculate contrast
-        contrast = np.std(gray) / 255.0
+        contrast = std / 255.0
         contrast_score = min(contrast * 4, 1.0)  # Good contrast > 0.25
         
         # Combine quality metrics
@@ -227,40 +202,33 @@ def validate_image_quality(image):
         logger.error(f"Quality validation error: {str(e)}")
         return 0.0
 
-def validate_document_structure(image, document_type):
+def validate_document_structure(image, document_type, content_hash=None, **stage_params):
     """
-    Validate document structure and layout
+    Validate document structure and layout, weighted by the document type's
+    pipeline profile. Region tables go through the stage cache when
+    `content_hash` is given.
     """
     try:
         # Convert to grayscale
         gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
         
+        # One region proposal pass per binarization, shared by both detectors
+        regions = RegionProposer(gray, content_hash, **stage_params)
+        
+        weights = get_pipeline_profile(document_type).structure_weights
+        
         # Detect text regions
-        text_regions = detect_text_regions(gray)
+        text_regions = detect_text_regions(gray, regions)
         
-        # Detect potential photo regions
-        photo_regions = detect_photo_regions(gray)
+        # Detect potential photo regions, for the types expected to carry one
+        photo_regions = detect_photo_regions(gray, regions) if weights['photo'] else 0
         
         # Score based on expected structure
-        structure_score = 0.0
-        
-        if document_type in ["passport", "id-card", "driver-license"]:
-            # These documents should have both text and photo regions
-            if text_regions > 0:
-                structure_score += 0.5
-            if photo_regions > 0:
-                structure_score += 0.5
-        elif document_type == "certificate":
-            # Certificates mainly have text
-            if text_regions > 0:
-                structure_score += 0.8
-            # May have signature regions
-            structure_score += 0.2  # Bonus for any additional elements
-        else:
-            # Generic document
-            if text_regions > 0:
-                structure_score += 0.7
-            structure_score += 0.3  # Bonus for any structure
+        structure_score = weights['other']  # Bonus for any additional elements
+        if text_regions > 0:
+            structure_score += weights['text']
+        if photo_regions > 0:
+            structure_score += weights['photo']
         
         return min(structure_score, 1.0)
         
@@ -268,51 +236,37 @@ def validate_document_structure(image, document_type):
         logger.error(f"Structure validation error: {str(e)}")
         return 0.0
 
-def detect_text_regions(gray_image):
+def detect_text_regions(gray_image, regions=None):
     """
     Detect text regions in the image
     """
     try:
-        # Apply threshold
-        _, binary = cv2.threshold(gray_image, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-        
-        # Find contours
-        contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        table = get_region_proposer(gray_image, regions).table('otsu_inv')
         
-        text_regions = 0
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if 100 < area < 10000:  # Potential text region size
-                x, y, w, h = cv2.boundingRect(contour)
-                aspect_ratio = w / h
-                if 0.2 < aspect_ratio < 10:  # Text-like aspect ratio
-                    text_regions += 1
+        text_regions = np.count_nonzero(
+            (table['area'] > 100) & (table['area'] < 10000) &  # Potential text region size
+            (table['aspect_ratio'] > 0.2) & (table['aspect_ratio'] < 10)  # Text-like aspect ratio
+        )
         
-        return text_regions
+        return int(text_regions)
         
     except Exception as e:
         logger.error(f"Text region detection error: {str(e)}")
         return 0
 
-def detect_photo_regions(gray_image):
+def detect_photo_regions(gray_image, regions=None):
     """
     Detect photo regions in the image
     """
     try:
         # Look for rectangular regions with specific properties
-        edges = cv2.Canny(gray_image, 50, 150)
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        photo_regions = 0
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if 5000 < area < 100000:  # Photo-like area
-                # Check if it's roughly rectangular
-                approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
-                if len(approx) == 4:  # Rectangular
-                    photo_regions += 1
-        
-        return photo_regions
+        table = get_region_proposer(gray_image, regions).table('canny')
+        candidates = table.subset((table['area'] > 5000) & (table['area'] < 100000))  # Photo-like area
+        
+        # Check if it's roughly rectangular
+        photo_regions = np.count_nonzero(candidates.vertex_counts() == 4)
+        
+        return int(photo_regions)
         
     except Exception as e:
         logger.error(f"Photo region detection error: {str(e)}")
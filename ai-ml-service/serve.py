@@ -0,0 +1,336 @@
+"""
+Production launcher for the AI/ML service.
+
+The parent process imports the application once, which loads the ML models,
+EasyOCR reader and document templates. It then forks worker processes that
+share that memory copy-on-write; each worker runs its own uvicorn server on
+a listening socket inherited from the parent.
+
+    python serve.py --workers 4 --port 10000
+
+Signals handled by the parent:
+    SIGHUP           rolling restart of all workers (one at a time)
+    SIGTERM, SIGINT  graceful shutdown
+    SIGTTIN/SIGTTOU  add / remove one worker
+    SIGUSR1          log per-worker memory usage (RSS and PSS)
+
+Code changes still require restarting the parent, since workers are forked
+from the preloaded application.
+"""
+
+import argparse
+import gc
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+from utils.concurrency import apply_thread_budget, set_thread_env, thread_budget
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("serve")
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Document Verification AI/ML Service launcher")
+    parser.add_argument('--host', default=os.getenv('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '10000')))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WORKERS', str(os.cpu_count() or 1))),
+                        help="Number of worker processes (env WORKERS)")
+    parser.add_argument('--cpu-affinity', dest='cpu_affinity', action='store_true',
+                        default=os.getenv('CPU_AFFINITY', '1') == '1',
+                        help="Pin each worker to its own slice of the available CPUs (env CPU_AFFINITY)")
+    parser.add_argument('--no-cpu-affinity', dest='cpu_affinity', action='store_false')
+    parser.add_argument('--graceful-timeout', type=float, default=float(os.getenv('GRACEFUL_TIMEOUT', '30')),
+                        help="Seconds a worker gets to finish in-flight requests on shutdown")
+    parser.add_argument('--startup-timeout', type=float, default=float(os.getenv('WORKER_STARTUP_TIMEOUT', '120')),
+                        help="Seconds to wait for a replacement worker during a rolling restart")
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--log-level', default=os.getenv('LOG_LEVEL', 'info').lower())
+    return parser.parse_args()
+
+def create_socket(host, port, backlog):
+    """Create the listening socket shared by all workers"""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def cpu_slices(worker_count):
+    """Split the CPUs this process may run on into one slice per worker"""
+    if not hasattr(os, 'sched_getaffinity'):
+        return [None] * worker_count
+    cpus = sorted(os.sched_getaffinity(0))
+    if worker_count >= len(cpus):
+        return [{cpus[i % len(cpus)]} for i in range(worker_count)]
+    size = len(cpus) // worker_count
+    slices = [set(cpus[i * size:(i + 1) * size]) for i in range(worker_count)]
+    # Hand out any remainder to the first workers
+    for i, cpu in enumerate(cpus[worker_count * size:]):
+        slices[i].add(cpu)
+    return slices
+
+def set_affinity(pid, cpus):
+    """Pin every thread of process `pid` to `cpus` (sched_setaffinity only pins the given thread)"""
+    try:
+        tids = [int(tid) for tid in os.listdir(f'/proc/{pid}/task')]
+    except OSError:
+        tids = [pid]
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except OSError:
+            pass  # Thread or process already gone
+
+def memory_usage(pid):
+    """Return (rss_mb, pss_mb) for a process, using smaps_rollup where available"""
+    rss = pss = None
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Rss:'):
+                    rss = int(line.split()[1]) / 1024
+                elif line.startswith('Pss:'):
+                    pss = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return rss, pss
+
+class WorkerServer(uvicorn.Server):
+    """uvicorn server that reports to the parent once application startup has finished"""
+
+    def __init__(self, config, ready_fd):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        if self.ready_fd is not None:
+            try:
+                os.write(self.ready_fd, b'1')
+                os.close(self.ready_fd)
+            except OSError:
+                pass
+            self.ready_fd = None
+
+class Arbiter:
+    """Parent process: owns the socket and forks, monitors and restarts workers"""
+
+    def __init__(self, app, sock, args):
+        self.app = app
+        self.sock = sock
+        self.args = args
+        self.worker_count = max(1, args.workers)
+        self.slices = cpu_slices(self.worker_count) if args.cpu_affinity else None
+        self.workers = {}  # pid -> worker index
+        self.signals = []
+        self.stopping = False
+
+    def cpus_for(self, index):
+        if not self.slices:
+            return None
+        return self.slices[index % len(self.slices)]
+
+    def resize(self, worker_count):
+        """
+        Change the number of workers. The CPUs are split again for the new
+        count and the running workers are re-pinned to their new slices, so
+        slices never overlap; their thread budgets keep the size of the old
+        slice until the next rolling restart (SIGHUP).
+        """
+        self.worker_count = worker_count
+        if not self.args.cpu_affinity:
+            return
+        self.slices = cpu_slices(worker_count)
+        for pid, index in self.workers.items():
+            cpus = self.cpus_for(index)
+            if cpus:
+                set_affinity(pid, cpus)
+
+    def spawn(self, index):
+        """Fork a worker and return (pid, ready_fd)"""
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid:
+            os.close(write_fd)
+            self.workers[pid] = index
+            return pid, read_fd
+
+        # Child
+        os.close(read_fd)
+        exit_code = 0
+        try:
+            self.run_worker(index, write_fd)
+        except Exception as e:
+            logger.error(f"Worker {index} crashed: {e}")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def run_worker(self, index, ready_fd):
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGTTIN, signal.SIGTTOU,
+                    signal.SIGUSR1, signal.SIGCHLD):
+            signal.signal(sig, signal.SIG_DFL)
+
+        cpus = self.cpus_for(index)
+        if cpus:
+            os.sched_setaffinity(0, cpus)
+        apply_thread_budget()
+
+        logger.info(f"Worker {index} (pid {os.getpid()}) starting on CPUs {sorted(cpus) if cpus else 'all'}")
+        config = uvicorn.Config(
+            self.app,
+            log_level=self.args.log_level,
+            timeout_graceful_shutdown=int(self.args.graceful_timeout),
+            lifespan="on"
+        )
+        WorkerServer(config, ready_fd).run(sockets=[self.sock])
+
+    def wait_ready(self, ready_fd, timeout):
+        ready, _, _ = select.select([ready_fd], [], [], timeout)
+        ok = bool(ready) and os.read(ready_fd, 1) == b'1'
+        os.close(ready_fd)
+        return ok
+
+    def handle_signal(self, signum, frame):
+        self.signals.append(signum)
+
+    def install_signals(self):
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGTTIN, signal.SIGTTOU, signal.SIGUSR1):
+            signal.signal(sig, self.handle_signal)
+
+    def run(self):
+        self.install_signals()
+        for index in range(self.worker_count):
+            _, ready_fd = self.spawn(index)
+            os.close(ready_fd)
+        logger.info(f"Serving on {self.args.host}:{self.args.port} with {self.worker_count} workers")
+
+        while not self.stopping:
+            self.reap()
+            while self.signals:
+                self.dispatch(self.signals.pop(0))
+            if self.stopping:
+                break
+            self.ensure_workers()
+            time.sleep(0.5)
+
+        self.shutdown()
+
+    def dispatch(self, signum):
+        if signum in (signal.SIGTERM, signal.SIGINT):
+            logger.info("Shutting down")
+            self.stopping = True
+        elif signum == signal.SIGHUP:
+            self.rolling_restart()
+        elif signum == signal.SIGTTIN:
+            logger.info(f"Increasing workers to {self.worker_count + 1}")
+            self.resize(self.worker_count + 1)
+        elif signum == signal.SIGTTOU and self.worker_count > 1:
+            logger.info(f"Decreasing workers to {self.worker_count - 1}")
+            self.stop_worker(max(self.workers, key=lambda pid: self.workers[pid]))
+            self.resize(self.worker_count - 1)
+        elif signum == signal.SIGUSR1:
+            self.log_memory()
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            index = self.workers.pop(pid, None)
+            if index is not None and not self.stopping:
+                logger.warning(f"Worker {index} (pid {pid}) exited with status {status}")
+
+    def ensure_workers(self):
+        running = set(self.workers.values())
+        for index in range(self.worker_count):
+            if index not in running:
+                _, ready_fd = self.spawn(index)
+                os.close(ready_fd)
+
+    def stop_worker(self, pid, sig=signal.SIGTERM):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+        self.workers.pop(pid, None)
+
+    def rolling_restart(self):
+        """Replace workers one at a time so the socket keeps accepting connections"""
+        logger.info("Rolling restart")
+        for old_pid, index in sorted(self.workers.items(), key=lambda item: item[1]):
+            new_pid, ready_fd = self.spawn(index)
+            if not self.wait_ready(ready_fd, self.args.startup_timeout):
+                logger.error(f"Replacement for worker {index} did not become ready; keeping pid {old_pid}")
+                # Killed, not left running next to the old worker; it never reported ready
+                self.stop_worker(new_pid, signal.SIGKILL)
+                continue
+            self.stop_worker(old_pid)
+
+    def log_memory(self):
+        rss, pss = memory_usage(os.getpid())
+        logger.info(f"Parent pid {os.getpid()}: RSS {rss} MB, PSS {pss} MB")
+        for pid, index in sorted(self.workers.items(), key=lambda item: item[1]):
+            rss, pss = memory_usage(pid)
+            logger.info(f"Worker {index} pid {pid}: RSS {rss} MB, PSS {pss} MB")
+
+    def shutdown(self):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.args.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.2)
+        for pid in list(self.workers):
+            logger.warning(f"Killing worker pid {pid} after graceful timeout")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.sock.close()
+
+def main():
+    args = parse_args()
+    os.chdir(SERVICE_DIR)
+    sys.path.insert(0, SERVICE_DIR)
+
+    sock = create_socket(args.host, args.port, args.backlog)
+
+    # Size OpenMP/BLAS pools for one worker before the preload initializes them
+    slices = cpu_slices(max(1, args.workers)) if args.cpu_affinity else [None]
+    set_thread_env(len(slices[-1]) if slices[-1] and not os.getenv('THREAD_BUDGET') else thread_budget())
+
+    # Preload the application: importing it loads models and templates once
+    start = time.monotonic()
+    from app import app
+    logger.info(f"Application preloaded in {time.monotonic() - start:.1f}s")
+
+    # Move everything allocated so far out of the collector's reach so that
+    # GC passes in the workers don't touch (and copy) the shared pages
+    gc.collect()
+    gc.freeze()
+
+    rss, pss = memory_usage(os.getpid())
+    if rss is not None:
+        logger.info(f"Preloaded parent RSS: {rss:.0f} MB")
+
+    Arbiter(app, sock, args).run()
+
+if __name__ == "__main__":
+    main()
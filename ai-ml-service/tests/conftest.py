@@ -0,0 +1,39 @@
+"""
+Shared test setup: the service directory on sys.path, and the on-disk state
+(job queue, indexes, job uploads) redirected to a temporary directory before
+any service module reads its settings.
+"""
+
+import os
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+_STATE_DIR = tempfile.mkdtemp(prefix='ai-ml-service-tests-')
+os.environ.setdefault('JOB_QUEUE_PATH', os.path.join(_STATE_DIR, 'jobs.db'))
+os.environ.setdefault('JOB_UPLOAD_FOLDER', os.path.join(_STATE_DIR, 'uploads'))
+os.environ.setdefault('INDEX_DIR', os.path.join(_STATE_DIR, 'indexes'))
+os.environ.setdefault('WARMUP', 'false')
+
+@pytest.fixture
+def document_jpeg():
+    """A synthetic 1200x800 document page, JPEG-encoded"""
+    rng = np.random.default_rng(7)
+    page = cv2.add(np.full((800, 1200, 3), 225, np.uint8), rng.integers(0, 20, (800, 1200, 3), dtype=np.uint8))
+    for i in range(8):
+        cv2.putText(page, f'REPUBLIC OF TESTING {1000 + i}', (300, 90 + i * 70),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.1, (30, 30, 30), 2)
+    return cv2.imencode('.jpg', page, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+@pytest.fixture
+def client():
+    """Test client of the service app (startup hooks - warmup, job workers - not run)"""
+    from fastapi.testclient import TestClient
+    from app import app
+    return TestClient(app)
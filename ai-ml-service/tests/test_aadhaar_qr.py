@@ -0,0 +1,57 @@
+import gzip
+
+import pytest
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+import utils.aadhaar_qr as aadhaar_qr
+from utils.aadhaar_qr import verify_aadhaar_qr
+
+FIELDS = ['0', '123420190101120000000', 'Forged Name', '01-01-1990', 'M', 'S/O Someone', 'District', '', '12',
+          'Locality', '560001', 'Post Office', 'State', 'Street', 'Sub District', 'Town']
+
+def secure_qr(sign):
+    """Decimal secure QR payload over FIELDS, a fake photo and the signature `sign` gives"""
+    signed_data = b'\xff'.join(field.encode('latin-1') for field in FIELDS) + b'\xff' + b'photo'
+    raw = gzip.compress(signed_data + sign(signed_data))
+    return str(int.from_bytes(raw, 'big')).encode()
+
+@pytest.fixture
+def private_key(monkeypatch):
+    """Key whose public half stands in for the UIDAI certificate"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    monkeypatch.setattr(aadhaar_qr, '_public_key', key.public_key())
+    monkeypatch.setattr(aadhaar_qr, '_public_key_loaded', True)
+    return key
+
+def sign_with(key):
+    return lambda data: key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+
+def junk_signature(data):
+    return b'\x01' * 256
+
+def result(payload):
+    return verify_aadhaar_qr({'codes': [{'data': payload}]})
+
+def test_unverifiable_qr_is_reported_but_not_validated(monkeypatch):
+    monkeypatch.setattr(aadhaar_qr, '_public_key', None)
+    monkeypatch.setattr(aadhaar_qr, '_public_key_loaded', True)
+    qr = result(secure_qr(junk_signature))
+    assert qr['parsed'] and qr['fields']['name'] == 'Forged Name'
+    assert qr['signature_verified'] is None
+    assert not qr['validated']
+
+def test_qr_signed_with_the_certificate_key_is_validated(private_key):
+    qr = result(secure_qr(sign_with(private_key)))
+    assert qr['signature_verified'] is True
+    assert qr['validated']
+
+def test_forged_signature_is_rejected(private_key):
+    qr = result(secure_qr(junk_signature))
+    assert qr['signature_verified'] is False
+    assert not qr['validated']
+
+def test_unsigned_xml_qr_is_never_validated(private_key):
+    qr = result(b'<?xml version="1.0"?><PrintLetterBarcodeData uid="123412341234" name="Someone" yob="1990"/>')
+    assert qr['parsed'] and qr['format'] == 'xml'
+    assert not qr['validated']
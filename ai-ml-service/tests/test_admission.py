@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+from utils.admission import MB, AdmissionController, AdmissionRejected, admission_controller, estimate_request_memory
+
+STAGES = ['forensics']
+
+def jpeg(width, height, file_size=1_000_000):
+    return {'format': 'jpeg', 'width': width, 'height': height, 'channels': 3, 'bit_depth': 8}, file_size
+
+@pytest.fixture
+def controller():
+    return AdmissionController(budget_mb=200, queue_timeout=5)
+
+def test_request_that_fits_is_admitted_and_released(controller):
+    metadata, size = jpeg(1000, 1000)
+    with controller.reserve(metadata, STAGES, size) as admission:
+        assert admission.decision == 'admitted'
+        assert admission.downscale == 1
+        assert controller.reserved == admission.estimate == estimate_request_memory(metadata, STAGES, size)
+        assert controller.in_flight == 1
+    assert controller.reserved == 0 and controller.in_flight == 0
+    assert controller.stats()['admitted'] == 1
+
+def test_request_waits_for_budget_released_by_an_earlier_one(controller):
+    metadata, size = jpeg(1000, 1000)
+    first = controller.admit(metadata, STAGES, size)
+    threading.Timer(0.2, controller.release, args=(first,)).start()
+
+    second = controller.admit(metadata, STAGES, size)
+    assert second.decision == 'queued'
+    assert second.waited >= 0.15
+    controller.release(second)
+    assert controller.stats()['queued'] == 1
+
+def test_queue_wait_is_bounded_by_the_request_timeout(controller):
+    metadata, size = jpeg(1000, 1000)
+    first = controller.admit(metadata, STAGES, size)
+    start = time.monotonic()
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit(metadata, STAGES, size, timeout=0.1)
+    assert time.monotonic() - start < 1
+    assert (rejected.value.status_code, rejected.value.reason) == (503, 'timeout')
+    controller.release(first)
+
+def test_image_too_large_for_the_budget_is_downscaled(controller):
+    metadata, size = jpeg(4000, 3000)
+    assert estimate_request_memory(metadata, STAGES, size) > controller.budget
+    with controller.reserve(metadata, STAGES, size) as admission:
+        assert admission.decision == 'downscaled'
+        assert admission.downscale == 2
+        assert admission.estimate <= controller.budget
+
+@pytest.mark.parametrize('metadata, size, budget_mb, reason', [
+    # More pixels than ADMISSION_MAX_PIXELS
+    (*jpeg(10000, 10000), 2048, 'bomb'),
+    # Doesn't fit, and decodes to thousands of times its file size
+    (*jpeg(4000, 3000, file_size=10_000), 200, 'bomb'),
+    # Doesn't fit even at 1/8 scale
+    (*jpeg(4000, 3000), 70, 'too_large'),
+])
+def test_oversized_images_are_rejected_with_413(metadata, size, budget_mb, reason):
+    controller = AdmissionController(budget_mb=budget_mb)
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit(metadata, STAGES, size)
+    assert (rejected.value.status_code, rejected.value.reason) == (413, reason)
+    assert controller.reserved == 0
+    assert controller.stats()['rejected_' + reason] == 1
+
+def test_estimate_grows_with_the_planned_stages():
+    metadata, size = jpeg(2000, 1500)
+    assert estimate_request_memory(metadata, ['ocr'], size) < estimate_request_memory(metadata, STAGES, size)
+    assert estimate_request_memory(metadata, STAGES, size, downscale=2) < estimate_request_memory(metadata, STAGES, size)
+
+def test_analyze_answers_413_for_an_image_over_the_budget(client, document_jpeg, monkeypatch):
+    monkeypatch.setattr(admission_controller, 'budget', 1 * MB)
+    response = client.post('/api/v1/analyze', files={'file': ('doc.jpg', document_jpeg, 'image/jpeg')},
+                           data={'document_type': 'passport'})
+    assert response.status_code == 413
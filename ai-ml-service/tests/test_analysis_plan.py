@@ -0,0 +1,85 @@
+import pytest
+
+import routes.analysis as analysis
+from utils.admission import planned_stages
+from utils.analysis_plan import (FEATURE_STAGES, LEGACY_ANALYSES, RESPONSE_FIELDS, RESPONSE_PROFILES,
+                                 build_analysis_plan)
+
+def test_default_plan_runs_everything():
+    plan = build_analysis_plan()
+    assert plan.is_full
+    assert plan.classify
+    assert plan.feature_stages == set(FEATURE_STAGES)
+    assert plan.legacy_analyses == set(LEGACY_ANALYSES)
+
+def test_text_fields_only_run_ocr():
+    plan = build_analysis_plan('detected_text, ocr_accuracy')
+    assert plan.fields == ('detected_text', 'ocr_accuracy')
+    assert plan.feature_stages == {'ocr'}
+    assert not plan.classify
+    assert plan.legacy_analyses == set()
+    assert planned_stages(plan) == ['ocr']
+
+def test_profile_and_fields_are_combined_without_duplicates():
+    plan = build_analysis_plan('format_validation,noise_analysis', 'quality')
+    assert plan.fields == RESPONSE_PROFILES['quality'] + ('noise_analysis',)
+    assert plan.legacy_analyses == {'format'}
+    assert not plan.classify
+    assert plan.runs_field_stage('noise_analysis')
+    assert not plan.runs_field_stage('compression_analysis')
+    assert planned_stages(plan) == ['quality', 'legacy.format', 'noise_analysis']
+
+def test_quality_stage_is_part_of_forensics_in_full_plans():
+    assert 'quality' not in planned_stages(build_analysis_plan())
+    assert 'quality' in planned_stages(build_analysis_plan().without(['forensics']))
+
+def test_legacy_anomalies_imply_legacy_ocr():
+    plan = build_analysis_plan(profile='verdict')
+    assert plan.classify
+    assert {'anomalies', 'ocr'} <= plan.legacy_analyses
+
+def test_without_drops_stages_but_keeps_fields():
+    plan = build_analysis_plan().without(['face', 'legacy.signature', 'noise_analysis'])
+    assert plan.fields == RESPONSE_FIELDS
+    assert 'face' not in plan.feature_stages
+    assert 'signature' not in plan.legacy_analyses
+    assert not plan.runs_field_stage('noise_analysis')
+    assert plan.runs_field_stage('compression_analysis')
+
+@pytest.mark.parametrize('fields, profile', [('detected_text,bogus', None), (None, 'everything')])
+def test_unknown_selections_are_rejected(fields, profile):
+    with pytest.raises(ValueError):
+        build_analysis_plan(fields, profile)
+
+def test_analyze_rejects_unknown_fields(client, document_jpeg):
+    response = client.post('/api/v1/analyze', files={'file': ('doc.jpg', document_jpeg, 'image/jpeg')},
+                           data={'document_type': 'passport', 'fields': 'detected_text,bogus'})
+    assert response.status_code == 400
+    assert 'bogus' in response.json()['detail']
+
+@pytest.fixture
+def scheduled(monkeypatch):
+    """Names of the stages /analyze hands to the stage scheduler"""
+    names = []
+    run = analysis.stage_scheduler.run
+
+    def spy(stages, **kwargs):
+        names.extend(stage.name for stage in stages)
+        return run(stages, **kwargs)
+
+    monkeypatch.setattr(analysis.stage_scheduler, 'run', spy)
+    return names
+
+def test_analyze_runs_only_the_stages_behind_the_selected_fields(client, document_jpeg, scheduled):
+    response = client.post('/api/v1/analyze', files={'file': ('doc.jpg', document_jpeg, 'image/jpeg')},
+                           data={'document_type': 'passport', 'fields': 'detected_text,ocr_accuracy'})
+    assert response.status_code == 200
+    assert set(response.json()) == {'detected_text', 'ocr_accuracy'}
+    assert sorted(scheduled) == ['near_duplicates', 'ocr']
+
+def test_quality_profile_runs_image_level_stages_only(client, document_jpeg, scheduled):
+    response = client.post('/api/v1/analyze', files={'file': ('doc.jpg', document_jpeg, 'image/jpeg')},
+                           data={'document_type': 'passport', 'profile': 'quality'})
+    assert response.status_code == 200
+    assert 0 < response.json()['quality_score'] <= 1
+    assert sorted(scheduled) == ['legacy.format', 'near_duplicates', 'quality']
@@ -0,0 +1,119 @@
+import time
+
+import cv2
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+import routes.analysis as analysis
+import routes.ocr as ocr
+from utils.deadlines import (DEADLINE_RESERVE_MS, TESSERACT_TIMEOUT_GRACE, TESSERACT_TIMEOUT_MESSAGE, Deadline,
+                             current_deadline, deadline_expired, deadline_header, ensure_time_left, request_deadline,
+                             tesseract_timeout)
+from utils.pipeline_profiles import ProfileCosts, get_pipeline_profile
+from utils.stage_scheduler import Stage, StageScheduler
+
+def upload(content):
+    return {'file': ('doc.jpg', content, 'image/jpeg')}
+
+@pytest.fixture
+def other_jpeg():
+    """A document no other test uploads, so no cached stage output answers for it"""
+    page = np.full((600, 900, 3), 230, np.uint8)
+    cv2.putText(page, 'DEADLINE TEST', (200, 300), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (20, 20, 20), 3)
+    return cv2.imencode('.jpg', page)[1].tobytes()
+
+def test_deadline_keeps_a_reserve_for_the_response():
+    deadline = Deadline(DEADLINE_RESERVE_MS + 500)
+    assert 0.4 < deadline.remaining() <= 0.5
+    assert not deadline.expired
+    assert Deadline(DEADLINE_RESERVE_MS).expired
+
+def test_header_dependency():
+    assert deadline_header(None) is None
+    assert deadline_header(2000).timeout_ms == 2000
+    with pytest.raises(HTTPException) as error:
+        deadline_header(0)
+    assert error.value.status_code == 400
+
+def test_spent_budget_answers_504():
+    ensure_time_left(None)
+    ensure_time_left(Deadline(60_000))
+    with pytest.raises(HTTPException) as error:
+        ensure_time_left(Deadline(1))
+    assert error.value.status_code == 504
+
+def test_tesseract_timeout_follows_the_current_deadline():
+    assert tesseract_timeout() == 0
+    with request_deadline(Deadline(DEADLINE_RESERVE_MS + 1000)):
+        assert 1.0 < tesseract_timeout() <= 1.0 + TESSERACT_TIMEOUT_GRACE
+    with request_deadline(Deadline(1)):
+        assert deadline_expired()
+        assert tesseract_timeout() == TESSERACT_TIMEOUT_GRACE
+    assert current_deadline() is None
+
+def test_stages_see_the_request_deadline():
+    deadline = Deadline(60_000)
+    with request_deadline(deadline):
+        run = StageScheduler().run([Stage('probe', current_deadline)])
+    assert run.results['probe'] is deadline
+
+class FakeRun:
+    def __init__(self, elapsed, timings, status):
+        self.elapsed, self.timings, self.status = elapsed, timings, status
+
+def test_costs_count_only_stages_that_ran_to_the_end():
+    costs = ProfileCosts()
+    profile = get_pipeline_profile('passport')
+    costs.record(profile, FakeRun(1.0, {'ocr': 0.4, 'face': 0.2}, {'ocr': 'ok', 'face': 'timeout'}))
+    costs.record(profile, FakeRun(2.0, {'ocr': 0.8, 'face': 0.0}, {'ocr': 'error', 'face': 'over_budget'}))
+
+    assert costs.expected_seconds(profile, 'ocr') == pytest.approx(0.6)
+    assert costs.expected_seconds(profile, 'face') is None
+    assert costs.stats()['passport'] == {'runs': 2, 'mean_seconds': 1.5, 'stage_mean_seconds': {'ocr': 0.6}}
+
+def test_analyze_without_a_deadline_is_complete(client, document_jpeg):
+    response = client.post('/api/v1/analyze', files=upload(document_jpeg), data={'document_type': 'passport'})
+    assert response.status_code == 200
+    assert response.json()['partial'] is False
+    assert response.json()['skipped_stages'] == {}
+
+def test_analyze_leaves_out_optional_stages_the_budget_cannot_cover(client, document_jpeg, monkeypatch):
+    monkeypatch.setattr(analysis.profile_costs, 'expected_seconds', lambda profile, stage: 30.0)
+    response = client.post('/api/v1/analyze', files=upload(document_jpeg), data={'document_type': 'passport'},
+                           headers={'X-Request-Timeout-Ms': '5000'})
+    assert response.status_code == 200
+    result = response.json()
+    assert result['partial'] is True
+    skipped = result['skipped_stages']
+    assert skipped and set(skipped.values()) == {'over_budget'}
+    assert not set(skipped) & analysis.REQUIRED_STAGES
+    assert {'forensics', 'noise_analysis', 'legacy.quality'} <= set(skipped)
+
+@pytest.mark.parametrize('timeout_ms, status_code', [('0', 400), ('-5', 400), ('50', 504)])
+def test_analyze_refuses_unusable_budgets(client, document_jpeg, timeout_ms, status_code):
+    response = client.post('/api/v1/analyze', files=upload(document_jpeg), data={'document_type': 'passport'},
+                           headers={'X-Request-Timeout-Ms': timeout_ms})
+    assert response.status_code == status_code
+
+def test_ocr_reports_a_tesseract_timeout_as_partial(client, other_jpeg, monkeypatch):
+    def timed_out(*args, **kwargs):
+        assert kwargs['timeout'] > 0
+        raise RuntimeError(TESSERACT_TIMEOUT_MESSAGE)
+
+    monkeypatch.setattr(ocr.pytesseract, 'image_to_data', timed_out)
+    response = client.post('/api/v1/ocr', files=upload(other_jpeg), headers={'X-Request-Timeout-Ms': '5000'})
+    assert response.status_code == 200
+    assert response.json()['partial'] is True
+
+@pytest.mark.parametrize('path, data', [
+    ('/api/v1/ocr', None),
+    ('/api/v1/detect-signature', None),
+    ('/api/v1/extract-signature', None),
+    ('/api/v1/validate-format', {'document_type': 'passport'}),
+    ('/api/v1/signature/references', {'subject_id': 'subject', 'whole_image': 'true'}),
+    ('/api/v1/signature/compare', {'subject_id': 'subject', 'whole_image': 'true'}),
+])
+def test_every_analysis_route_honours_the_header(client, other_jpeg, path, data):
+    response = client.post(path, files=upload(other_jpeg), data=data, headers={'X-Request-Timeout-Ms': '1'})
+    assert response.status_code == 504
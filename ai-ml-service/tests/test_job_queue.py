@@ -0,0 +1,174 @@
+import threading
+import time
+
+import pytest
+
+import utils.job_queue as job_queue_module
+from utils.job_queue import (JobQueue, JobWorkerPool, check_callback_url, deliver_callback,
+                             STATUS_COMPLETED, STATUS_FAILED, STATUS_QUEUED, STATUS_RUNNING)
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / 'jobs.db'), ttl_seconds=60, lease_seconds=60, max_attempts=2)
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+def test_claim_takes_the_oldest_job_once(queue):
+    queue.enqueue({'n': 1}, job_id='first')
+    queue.enqueue({'n': 2}, job_id='second')
+
+    job = queue.claim('w1')
+    assert job['id'] == 'first'
+    assert job['status'] == STATUS_RUNNING
+    assert job['worker_id'] == 'w1'
+    assert job['attempts'] == 1
+    assert queue.claim('w2')['id'] == 'second'
+    assert queue.claim('w3') is None
+
+def test_expired_lease_is_claimed_again_up_to_max_attempts(queue):
+    queue.lease_seconds = 0.05
+    queue.enqueue({}, job_id='job')
+    assert queue.claim('w1') is not None
+    assert queue.claim('w2') is None
+
+    time.sleep(0.1)
+    job = queue.claim('w2')
+    assert job['worker_id'] == 'w2'
+    assert job['attempts'] == 2
+
+    time.sleep(0.1)
+    assert queue.claim('w3') is None
+    job = queue.get('job')
+    assert job['status'] == STATUS_FAILED
+    assert job['error'] == 'Job exceeded maximum attempts'
+
+def test_worker_that_lost_its_lease_cannot_finish_the_job(queue):
+    queue.lease_seconds = 0.05
+    queue.enqueue({}, job_id='job')
+    queue.claim('stale')
+    time.sleep(0.1)
+    queue.claim('current')
+
+    assert not queue.renew('job', 'stale')
+    assert not queue.complete('job', {'by': 'stale'}, 'stale')
+    assert queue.get('job')['status'] == STATUS_RUNNING
+    assert queue.complete('job', {'by': 'current'}, 'current')
+    assert queue.get('job')['result'] == {'by': 'current'}
+
+def test_heartbeat_keeps_a_long_job_leased(queue):
+    queue.lease_seconds = 0.2
+    queue.enqueue({}, job_id='job')
+    pool = JobWorkerPool(queue, lambda payload: time.sleep(0.6) or {'done': True})
+    worker = threading.Thread(target=pool.process, args=(queue.claim('w1'),))
+    worker.start()
+    time.sleep(0.4)
+    assert queue.claim('w2') is None
+    worker.join()
+
+    job = queue.get('job')
+    assert job['status'] == STATUS_COMPLETED
+    assert job['attempts'] == 1
+    assert job['result'] == {'done': True}
+
+def test_failed_handler_marks_the_job_failed(queue):
+    queue.enqueue({}, job_id='job')
+
+    def handler(payload):
+        raise ValueError('unreadable upload')
+
+    JobWorkerPool(queue, handler).process(queue.claim('w1'))
+    job = queue.get('job')
+    assert job['status'] == STATUS_FAILED
+    assert job['error'] == 'unreadable upload'
+
+def test_purge_removes_expired_jobs_and_their_uploads(queue, tmp_path):
+    upload = tmp_path / 'upload.jpg'
+    upload.write_bytes(b'jpeg')
+    queue.ttl_seconds = 0.05
+    queue.enqueue({'file_path': str(upload)}, job_id='old')
+    queue.ttl_seconds = 60
+    queue.enqueue({}, job_id='fresh')
+    time.sleep(0.1)
+
+    assert queue.get('old') is None
+    assert queue.purge_expired() == 1
+    assert not upload.exists()
+    assert queue.get('fresh')['status'] == STATUS_QUEUED
+    assert queue.stats() == {STATUS_QUEUED: 1}
+
+@pytest.fixture
+def callback_env(monkeypatch):
+    """Callbacks allowed to hooks.example.com, POSTs recorded instead of sent, no retry backoff"""
+    posts = []
+    responses = []
+    monkeypatch.setattr(job_queue_module, 'JOB_CALLBACK_ALLOWED_HOSTS', ['hooks.example.com'])
+    monkeypatch.setattr(job_queue_module, 'JOB_CALLBACK_RETRIES', 2)
+    monkeypatch.setattr(job_queue_module.time, 'sleep', lambda seconds: None)
+
+    def post(url, **kwargs):
+        posts.append((url, kwargs))
+        return FakeResponse(responses.pop(0) if responses else 200)
+
+    monkeypatch.setattr(job_queue_module.requests, 'post', post)
+    return posts, responses
+
+def test_callback_delivered(queue, callback_env):
+    posts, _ = callback_env
+    queue.enqueue({}, callback_url='https://hooks.example.com/done', job_id='job')
+    queue.claim('w1')
+    queue.complete('job', {'is_valid': True}, 'w1')
+
+    deliver_callback(queue, 'job')
+    assert queue.get('job')['callback_status'] == 'delivered'
+    assert len(posts) == 1
+    assert posts[0][1]['allow_redirects'] is False
+
+def test_callback_failed_after_retries(queue, callback_env):
+    posts, responses = callback_env
+    responses.extend([500, 502])
+    queue.enqueue({}, callback_url='https://hooks.example.com/done', job_id='job')
+    queue.claim('w1')
+    queue.fail('job', 'boom', 'w1')
+
+    deliver_callback(queue, 'job')
+    assert queue.get('job')['callback_status'] == 'failed'
+    assert len(posts) == 2
+
+def test_callback_to_a_host_outside_the_allowlist_is_rejected(queue, callback_env):
+    posts, _ = callback_env
+    queue.enqueue({}, callback_url='http://internal.service/hook', job_id='job')
+    queue.claim('w1')
+    queue.complete('job', {}, 'w1')
+
+    deliver_callback(queue, 'job')
+    assert queue.get('job')['callback_status'] == 'rejected'
+    assert posts == []
+
+@pytest.mark.parametrize('url', [
+    'ftp://hooks.example.com/x',
+    'http://127.0.0.1:8000/hook',
+    'http://localhost/hook',
+    'http://10.1.2.3/hook',
+    'http://169.254.169.254/latest/meta-data',
+    'http://[::1]/hook',
+    'http://[::ffff:127.0.0.1]/hook',
+])
+def test_callback_urls_to_non_public_hosts_are_refused(url, monkeypatch):
+    monkeypatch.setattr(job_queue_module, 'JOB_CALLBACK_ALLOWED_HOSTS', [])
+    with pytest.raises(ValueError):
+        check_callback_url(url)
+
+def test_allowlist_matches_subdomains(monkeypatch):
+    monkeypatch.setattr(job_queue_module, 'JOB_CALLBACK_ALLOWED_HOSTS', ['.example.com'])
+    check_callback_url('https://hooks.example.com/done')
+    with pytest.raises(ValueError):
+        check_callback_url('https://example.org/done')
+
+def test_job_submission_refuses_a_loopback_callback(client, document_jpeg, monkeypatch):
+    monkeypatch.setattr(job_queue_module, 'JOB_CALLBACK_ALLOWED_HOSTS', [])
+    response = client.post('/api/v1/jobs', files={'file': ('doc.jpg', document_jpeg, 'image/jpeg')},
+                           data={'document_type': 'passport', 'callback_url': 'http://127.0.0.1/hook'})
+    assert response.status_code == 400
+    assert 'non-public' in response.json()['detail']
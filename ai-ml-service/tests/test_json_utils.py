@@ -0,0 +1,38 @@
+import importlib
+import json
+
+import numpy as np
+import pytest
+
+import utils.json_utils as json_utils
+
+CONTENT = {
+    'score': float('nan'),
+    'bounds': (float('inf'), -float('inf'), 1.5),
+    'numpy': {'scalar': np.float32('nan'), 'array': np.array([0.5, np.nan]), 'count': np.int64(3)},
+}
+EXPECTED = {'score': None, 'bounds': [None, None, 1.5],
+            'numpy': {'scalar': None, 'array': [0.5, None], 'count': 3}}
+
+@pytest.fixture(params=['orjson', 'stdlib'])
+def dumps(request, monkeypatch):
+    if request.param == 'orjson':
+        if not json_utils.ORJSON_AVAILABLE:
+            pytest.skip('orjson not installed')
+        yield json_utils.dumps
+        return
+    import builtins
+    real_import = builtins.__import__
+
+    def no_orjson(name, *args, **kwargs):
+        if name == 'orjson':
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, '__import__', no_orjson)
+    yield importlib.reload(json_utils).dumps
+    monkeypatch.undo()
+    importlib.reload(json_utils)
+
+def test_non_finite_floats_are_written_as_null(dumps):
+    assert json.loads(dumps(CONTENT)) == EXPECTED
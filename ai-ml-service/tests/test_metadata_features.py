@@ -0,0 +1,25 @@
+import logging
+
+import cv2
+import numpy as np
+
+from utils.image_context import ImageContext
+from utils.simple_verifier import SimpleAdvancedVerifier
+
+def extract(context):
+    return SimpleAdvancedVerifier().extract_metadata_features(context.image_path, context.data, context.metadata)
+
+def test_file_size_comes_from_the_upload_bytes(document_jpeg, tmp_path):
+    path = tmp_path / 'specimen.jpg'
+    path.write_bytes(document_jpeg)
+    features = extract(ImageContext(str(path)))
+    assert features['file_size'] == len(document_jpeg)
+    assert features['suspicious_filename']
+
+def test_in_memory_image_has_no_file(document_jpeg, caplog):
+    image = cv2.imdecode(np.frombuffer(document_jpeg, np.uint8), cv2.IMREAD_COLOR)
+    with caplog.at_level(logging.ERROR):
+        features = extract(ImageContext(None, image=image))
+    assert not caplog.records
+    assert features['file_size'] == 0
+    assert not features['suspicious_filename']
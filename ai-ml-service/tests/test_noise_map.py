@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from utils.noise_map import analyze_noise, noise_summary, window_variance
+
+PATCH = (320, 192, 160, 128)  # x, y, width, height
+
+def spliced_page(patch_sigma, page_sigma=4.0, seed=11):
+    """A smooth page with Gaussian noise of page_sigma, and patch_sigma inside PATCH"""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:512, 0:768]
+    page = 120 + 40 * np.sin(xx / 90.0) + 30 * np.cos(yy / 70.0)
+    noise = rng.normal(0, page_sigma, page.shape)
+    x, y, w, h = PATCH
+    noise[y:y + h, x:x + w] = rng.normal(0, patch_sigma, (h, w))
+    return np.clip(page + noise, 0, 255).astype(np.uint8)
+
+def overlap(box, patch):
+    x, y, w, h = box
+    px, py, pw, ph = patch
+    dx = min(x + w, px + pw) - max(x, px)
+    dy = min(y + h, py + ph) - max(y, py)
+    return max(dx, 0) * max(dy, 0) / (pw * ph)
+
+def test_window_variance_matches_direct_computation():
+    values = np.random.default_rng(0).normal(0, 3, (70, 90)).astype(np.float32)
+    variance = window_variance(values, 16, 4)
+    assert variance.shape == (len(range(0, 70 - 16 + 1, 4)), len(range(0, 90 - 16 + 1, 4)))
+    for row, top in enumerate(range(0, 70 - 16 + 1, 4)):
+        for col, left in enumerate(range(0, 90 - 16 + 1, 4)):
+            window = values[top:top + 16, left:left + 16].astype(np.float64)
+            assert variance[row, col] == pytest.approx(window.var(), rel=1e-6, abs=1e-6)
+
+@pytest.mark.parametrize('patch_sigma, direction', [(16.0, 'higher'), (0.5, 'lower')])
+def test_pasted_patch_is_localized(patch_sigma, direction):
+    analysis = analyze_noise(spliced_page(patch_sigma))
+    assert analysis['regions']
+    strongest = analysis['regions'][0]
+    assert strongest['noise'] == direction
+    assert overlap(strongest['box'], PATCH) > 0.8
+    x, y, w, h = strongest['box']
+    # Found around the patch, not across the page
+    assert w * h < 4 * PATCH[2] * PATCH[3]
+    assert 0 < analysis['inconsistent_ratio'] < 0.5
+
+def test_uniform_noise_has_no_inconsistent_region():
+    analysis = analyze_noise(spliced_page(4.0))
+    assert analysis['regions'] == []
+    assert analysis['inconsistent_ratio'] == 0.0
+    assert analysis['score'] < analyze_noise(spliced_page(16.0))['score']
+
+def test_image_smaller_than_a_window_gives_an_empty_map():
+    analysis = analyze_noise(np.zeros((40, 40), np.uint8))
+    assert analysis['regions'] == [] and analysis['score'] == 0.0
+    assert noise_summary(analysis)['heatmap'] is None
+
+def test_summary_heatmap_is_bounded():
+    summary = noise_summary(analyze_noise(spliced_page(16.0)), map_side=16)
+    assert max(len(summary['heatmap']), len(summary['heatmap'][0])) == 16
+    # Three decimals survive serialization (float32 rounding would leave 1.1230000257-style values)
+    assert all(len(repr(value).split('.')[-1]) <= 3 for row in summary['heatmap'] for value in row)
@@ -0,0 +1,41 @@
+import numpy as np
+
+import utils.ocr_regions as ocr_regions
+from utils.ocr_regions import REST_OF_PAGE, ocr_bands, read_text
+
+MRZ = {'name': 'mrz', 'band': (0.75, 1.0), 'tesseract_config': '--psm 6'}
+
+def page():
+    # Row index as the pixel value, to tell the bands apart
+    return np.repeat(np.arange(100, dtype=np.uint8)[:, None], 20, axis=1)
+
+def rows(band):
+    return band[0, 0], band[-1, 0]
+
+def test_without_regions_the_page_is_read_in_one_pass():
+    gray = page()
+    [(name, config, band)] = ocr_bands(gray)
+    assert name == REST_OF_PAGE and config == '' and band is gray
+
+def test_regions_are_read_first_then_the_rest_top_to_bottom():
+    header = {'name': 'header', 'band': (0.0, 0.1), 'tesseract_config': ''}
+    middle = {'name': 'middle', 'band': (0.4, 0.5), 'tesseract_config': ''}
+    bands = ocr_bands(page(), [MRZ, header, middle])
+    assert [(name, rows(band)) for name, _, band in bands] == [
+        ('mrz', (75, 99)), ('header', (0, 9)), ('middle', (40, 49)),
+        (REST_OF_PAGE, (10, 39)), (REST_OF_PAGE, (50, 74))]
+
+def test_read_text_leads_with_the_regions(monkeypatch):
+    calls = []
+    def image_to_string(band, config, timeout):
+        calls.append(config)
+        return 'P<UTOERIKSSON<<ANNA\n' if band[0, 0] == 75 else 'PASSPORT\n'
+    monkeypatch.setattr(ocr_regions.pytesseract, 'image_to_string', image_to_string)
+    monkeypatch.setattr(ocr_regions.pytesseract, 'image_to_data',
+                        lambda band, config, output_type, timeout: {'conf': [-1, 90]})
+
+    text, confidences, region_text = read_text(page(), [MRZ])
+    assert text == 'P<UTOERIKSSON<<ANNA\nPASSPORT\n'
+    assert calls == ['--psm 6', '']
+    assert confidences == [90.0, 90.0]
+    assert region_text == {'mrz': 'P<UTOERIKSSON<<ANNA'}
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from utils.pipeline_profiles import DEFAULT_PROFILE, PROFILE_DEFAULTS, get_pipeline_profile, load_pipeline_profiles
+
+REGISTRY = {
+    'default': {
+        'skip_stages': ['face'],
+        'time_budget_seconds': None,
+        'format': {'min_dimensions': [400, 600], 'color_requirements': 'any'},
+    },
+    'passport': {
+        'skip_stages': [],
+        'view_sides': {'face': 800},
+        'time_budget_seconds': 20,
+        'format': {'aspect_ratio_range': [1.3, 1.5], 'required_elements': ['photo', 'mrz']},
+    },
+}
+
+def write_registry(tmp_path, registry):
+    path = tmp_path / 'profiles.json'
+    path.write_text(json.dumps(registry))
+    return str(path)
+
+def test_profiles_override_the_default_and_merge_nested_settings(tmp_path):
+    profiles = load_pipeline_profiles(write_registry(tmp_path, REGISTRY))
+    default, passport = profiles[DEFAULT_PROFILE], profiles['passport']
+
+    assert not default.runs('face')
+    assert passport.runs('face')
+    assert passport.view_sides == {'face': 800}
+    assert passport.time_budget == 20 and default.time_budget is None
+    # Format keys the passport doesn't set come from the default profile, then the built-in defaults
+    assert passport.format['aspect_ratio_range'] == (1.3, 1.5)
+    assert passport.format['min_dimensions'] == (400, 600)
+    assert passport.format['recommended_dimensions'] == tuple(PROFILE_DEFAULTS['format']['recommended_dimensions'])
+    assert passport.format_specifications()['required_elements'] == ('photo', 'mrz')
+    assert 'aspect_ratio_range' not in default.format_specifications()
+    assert passport.structure_weights == PROFILE_DEFAULTS['structure_weights']
+
+def test_missing_registry_leaves_the_built_in_default(tmp_path):
+    profiles = load_pipeline_profiles(str(tmp_path / 'missing.json'))
+    assert list(profiles) == [DEFAULT_PROFILE]
+    assert profiles[DEFAULT_PROFILE].skip_stages == frozenset()
+
+@pytest.mark.parametrize('registry, message', [
+    ({'passport': {'skip_stage': ['face']}}, 'unknown keys'),
+    ({'passport': {'skip_stages': ['faces']}}, 'unknown stages'),
+    ({'passport': {'view_sides': {'ocr': 640}}}, 'unknown view consumers'),
+    ({'passport': {'ocr_regions': [{'name': 'mrz', 'band': [0.7, 1.0], 'psm': 6}]}}, 'unknown OCR region keys'),
+    ({'passport': {'ocr_regions': [{'name': 'rest', 'band': [0.7, 1.0]}]}}, 'need a name'),
+    ({'passport': {'ocr_regions': [{'name': 'mrz', 'band': [0.9, 0.7]}]}}, 'band must be'),
+])
+def test_invalid_profiles_are_rejected(tmp_path, registry, message):
+    with pytest.raises(ValueError, match=message):
+        load_pipeline_profiles(write_registry(tmp_path, registry))
+
+def test_invalid_json_is_rejected(tmp_path):
+    path = tmp_path / 'profiles.json'
+    path.write_text('{"default": ')
+    with pytest.raises(ValueError, match='Invalid pipeline profile registry'):
+        load_pipeline_profiles(str(path))
+
+@pytest.mark.parametrize('document_type', ['utility-bill', '', None])
+def test_unknown_document_types_fall_back_to_the_default_profile(document_type):
+    assert get_pipeline_profile(document_type).name == DEFAULT_PROFILE
+
+def test_shipped_registry():
+    assert get_pipeline_profile(DEFAULT_PROFILE).time_budget is None
+    passport = get_pipeline_profile('passport')
+    assert passport.runs('face')
+    assert [region['name'] for region in passport.ocr_regions] == ['mrz']
+    assert get_pipeline_profile(DEFAULT_PROFILE).ocr_regions == ()
+    assert not get_pipeline_profile('certificate').runs('face')
+    aadhaar = get_pipeline_profile('aadhar-card')
+    assert aadhaar.aadhaar_qr and 'hi' in aadhaar.ocr_languages
@@ -0,0 +1,48 @@
+import cv2
+import numpy as np
+import pytest
+
+import utils.qr_decoding as qr_decoding
+from utils.qr_decoding import decode_codes
+
+def page(width=2000, height=1500, payload=None):
+    rng = np.random.default_rng(2)
+    gray = cv2.add(np.full((height, width), 230, np.uint8), rng.integers(0, 20, (height, width), dtype=np.uint8))
+    for i in range(height // 150):
+        cv2.putText(gray, 'GOVERNMENT OF INDIA 1234 5678 9012', (100, 150 + i * 90), cv2.FONT_HERSHEY_SIMPLEX, 2, 20, 4)
+    if payload:
+        code = cv2.resize(cv2.QRCodeEncoder.create().encode(payload), None, fx=6, fy=6,
+                          interpolation=cv2.INTER_NEAREST)
+        y, x = height - code.shape[0] - 200, width - code.shape[1] - 200
+        gray[y:y + code.shape[0], x:x + code.shape[1]] = code
+    return gray
+
+@pytest.fixture
+def full_scans(monkeypatch):
+    """Sizes of the images handed to the decoder that are whole pages"""
+    scans = []
+    decode = qr_decoding._decode
+
+    def spy(image):
+        scans.append(image.shape)
+        return decode(image)
+
+    monkeypatch.setattr(qr_decoding, '_decode', spy)
+    return scans
+
+@pytest.mark.parametrize('width, height', [(2000, 1500), (6000, 4000)])
+def test_code_is_decoded_from_its_crop(width, height, full_scans):
+    gray = page(width, height, '1' * 1200)
+    result = decode_codes(gray)
+    assert result['method'] == 'roi'
+    assert [code['data'] for code in result['codes']] == [b'1' * 1200]
+    assert gray.shape not in full_scans
+
+def test_page_without_finder_patterns_is_not_scanned_in_full(full_scans):
+    assert decode_codes(page())['method'] == 'none'
+    assert full_scans == []
+
+def test_expected_code_falls_back_to_a_full_scan(full_scans):
+    gray = page()
+    assert decode_codes(gray, expect_qr=True)['method'] == 'none'
+    assert full_scans == [gray.shape]
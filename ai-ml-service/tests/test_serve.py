@@ -0,0 +1,62 @@
+import argparse
+import signal
+
+import pytest
+
+import serve
+from serve import Arbiter
+
+@pytest.fixture
+def arbiter(monkeypatch):
+    """An Arbiter over 8 CPUs whose forks, signals and affinity calls are recorded"""
+    monkeypatch.setattr(serve.os, 'sched_getaffinity', lambda pid: set(range(8)), raising=False)
+    args = argparse.Namespace(workers=4, cpu_affinity=True, startup_timeout=1)
+    arbiter = Arbiter(app=None, sock=None, args=args)
+    arbiter.pinned = {}
+    arbiter.killed = []
+    pids = iter(range(100, 200))
+
+    def spawn(index):
+        pid = next(pids)
+        arbiter.workers[pid] = index
+        read_fd, write_fd = serve.os.pipe()
+        serve.os.close(write_fd)
+        return pid, read_fd
+
+    monkeypatch.setattr(arbiter, 'spawn', spawn)
+    monkeypatch.setattr(serve, 'set_affinity', lambda pid, cpus: arbiter.pinned.__setitem__(pid, cpus))
+    monkeypatch.setattr(serve.os, 'kill', lambda pid, sig: arbiter.killed.append((pid, sig)))
+    arbiter.ensure_workers()
+    return arbiter
+
+def slices_of(arbiter):
+    return [arbiter.cpus_for(index) for index in sorted(arbiter.workers.values())]
+
+def assert_disjoint(slices):
+    cpus = [cpu for cpus in slices for cpu in cpus]
+    assert len(cpus) == len(set(cpus))
+
+def test_adding_a_worker_repins_the_running_ones(arbiter):
+    running = dict(arbiter.workers)
+    arbiter.dispatch(signal.SIGTTIN)
+    arbiter.ensure_workers()
+
+    assert arbiter.worker_count == 5
+    assert_disjoint(slices_of(arbiter))
+    assert {pid: arbiter.cpus_for(index) for pid, index in running.items()} == arbiter.pinned
+
+def test_removing_a_worker_repins_the_rest(arbiter):
+    arbiter.dispatch(signal.SIGTTOU)
+    assert sorted(arbiter.workers.values()) == [0, 1, 2]
+    assert_disjoint(slices_of(arbiter))
+    assert sum(len(cpus) for cpus in slices_of(arbiter)) == 8
+    assert set(arbiter.pinned) == set(arbiter.workers)
+
+def test_replacement_that_never_becomes_ready_is_killed(arbiter, monkeypatch):
+    monkeypatch.setattr(arbiter, 'wait_ready', lambda ready_fd, timeout: False)
+    old = dict(arbiter.workers)
+    arbiter.rolling_restart()
+
+    assert arbiter.workers == old
+    assert [sig for _, sig in arbiter.killed] == [signal.SIGKILL] * 4
+    assert not set(pid for pid, _ in arbiter.killed) & set(old)
@@ -0,0 +1,43 @@
+import asyncio
+
+import numpy as np
+
+import routes.signature as signature
+from utils.crop_cache import SignatureCacheEntry, SignatureCropCache
+
+def entry(side):
+    return SignatureCacheEntry({'regions': []}, [np.zeros((side, side, 3), np.uint8)])
+
+def test_crop_cache_is_bounded_by_bytes():
+    cache = SignatureCropCache(max_mb=1)
+    cache.put('small', entry(100))
+    cache.put('large', entry(500))
+    assert cache.get('small') is not None
+    # 'large' is now the least recently used and makes room for the next entry
+    cache.put('next', entry(300))
+    assert cache.get('large') is None
+    assert cache.stats()['bytes'] <= cache.max_bytes
+
+def test_encoded_crops_count_against_the_budget():
+    cache = SignatureCropCache(max_mb=1)
+    cache.put('a', entry(400))
+    before = cache.stats()['bytes']
+    cache.get('a').encoded_crop(1, 'png')
+    assert cache.stats()['bytes'] > before
+
+def test_detection_runs_off_the_event_loop(client, document_jpeg, monkeypatch):
+    loops = []
+    find_signatures = signature.find_signatures
+
+    def spy(*args, **kwargs):
+        try:
+            loops.append(asyncio.get_running_loop())
+        except RuntimeError:
+            loops.append(None)
+        return find_signatures(*args, **kwargs)
+
+    monkeypatch.setattr(signature, 'find_signatures', spy)
+    monkeypatch.setattr(signature, 'signature_crop_cache', SignatureCropCache())
+    response = client.post('/api/v1/detect-signature', files={'file': ('doc.jpg', document_jpeg, 'image/jpeg')})
+    assert response.status_code == 200
+    assert loops == [None]
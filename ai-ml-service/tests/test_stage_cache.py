@@ -0,0 +1,129 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from utils.crop_cache import content_hash
+from utils.deadlines import Deadline, request_deadline
+from utils.stage_cache import StageCache, fingerprint, sizeof, upload_key
+
+class Counter:
+    """A stage function that counts its calls"""
+
+    def __init__(self, value=None):
+        self.calls = 0
+        self.value = value
+
+    def __call__(self):
+        self.calls += 1
+        return self.value if self.value is not None else {'call': self.calls}
+
+@pytest.fixture
+def cache():
+    return StageCache(max_mb=1, ttl_seconds=60)
+
+def test_outputs_are_keyed_by_content_stage_and_parameters(cache):
+    compute = Counter()
+    assert cache.get_or_compute('a' * 64, 'ocr', compute, psm=6) == {'call': 1}
+    assert cache.get_or_compute('a' * 64, 'ocr', compute, psm=6) == {'call': 1}
+    assert compute.calls == 1
+
+    cache.get_or_compute('a' * 64, 'ocr', compute, psm=3)
+    cache.get_or_compute('a' * 64, 'regions', compute, psm=6)
+    cache.get_or_compute('b' * 64, 'ocr', compute, psm=6)
+    assert compute.calls == 4
+    assert cache.stats()['stages'] == {
+        'ocr': {'hits': 1, 'misses': 3, 'hit_ratio': 0.25},
+        'regions': {'hits': 0, 'misses': 1, 'hit_ratio': 0.0},
+    }
+
+def test_parameter_order_does_not_change_the_key():
+    assert fingerprint({'a': 1, 'b': 2}) == fingerprint({'b': 2, 'a': 1})
+    assert fingerprint({'a': 1}) != fingerprint({'a': 2})
+
+def test_dict_outputs_are_handed_out_as_copies(cache):
+    first = cache.get_or_compute('a' * 64, 'ocr', lambda: {'words': ['x']})
+    first['words'].append('mutated')
+    assert cache.get_or_compute('a' * 64, 'ocr', Counter()) == {'words': ['x']}
+
+def test_concurrent_misses_compute_once(cache):
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'ok': True}
+
+    threads = [threading.Thread(target=cache.get_or_compute, args=('a' * 64, 'ocr', slow)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+
+def test_failures_are_not_stored(cache):
+    def fail():
+        raise RuntimeError('tesseract crashed')
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute('a' * 64, 'ocr', fail)
+    compute = Counter()
+    cache.get_or_compute('a' * 64, 'ocr', compute)
+    assert compute.calls == 1
+
+def test_outputs_computed_after_the_deadline_are_not_stored(cache):
+    compute = Counter()
+    with request_deadline(Deadline(1)):
+        cache.get_or_compute('a' * 64, 'ocr', compute)
+    assert cache.stats()['entries'] == 0
+
+    with request_deadline(Deadline(60_000)):
+        cache.get_or_compute('a' * 64, 'ocr', compute)
+    cache.get_or_compute('a' * 64, 'ocr', compute)
+    assert compute.calls == 2
+
+def test_least_recently_used_entries_are_evicted_by_size(cache):
+    block = np.zeros(400 * 1024, np.uint8)
+    for name in ('a', 'b'):
+        cache.get_or_compute(name * 64, 'view', lambda: block)
+    # Touch 'a', so 'b' is the least recently used
+    cache.get_or_compute('a' * 64, 'view', Counter())
+    cache.get_or_compute('c' * 64, 'view', lambda: block)
+
+    assert cache.bytes <= cache.max_bytes
+    compute = Counter(block)
+    cache.get_or_compute('a' * 64, 'view', compute)
+    assert compute.calls == 0
+    cache.get_or_compute('b' * 64, 'view', compute)
+    assert compute.calls == 1
+
+def test_entries_expire(cache):
+    cache.ttl_seconds = 0.05
+    compute = Counter()
+    cache.get_or_compute('a' * 64, 'ocr', compute)
+    time.sleep(0.1)
+    cache.get_or_compute('a' * 64, 'ocr', compute)
+    assert compute.calls == 2
+
+def test_zero_budget_disables_the_cache():
+    cache = StageCache(max_mb=0)
+    compute = Counter()
+    cache.get_or_compute('a' * 64, 'ocr', compute)
+    cache.get_or_compute('a' * 64, 'ocr', compute)
+    assert compute.calls == 2 and cache.stats()['entries'] == 0
+
+def test_sizeof_counts_array_buffers():
+    assert sizeof({'map': np.zeros((100, 100), np.float32)}) > 40_000
+
+def test_upload_key_is_the_content_hash(document_jpeg):
+    assert upload_key(document_jpeg) == (content_hash(document_jpeg), 'upright')
+
+def test_ocr_route_reuses_the_stage_output(client, document_jpeg):
+    from utils.stage_cache import stage_cache
+
+    before = stage_cache.stats()['stages'].get('extract_text_with_confidence', {'hits': 0, 'misses': 0})
+    for _ in range(2):
+        assert client.post('/api/v1/ocr', files={'file': ('doc.jpg', document_jpeg, 'image/jpeg')}).status_code == 200
+    after = stage_cache.stats()['stages']['extract_text_with_confidence']
+    assert (after['hits'] - before['hits'], after['misses'] - before['misses']) == (1, 1)
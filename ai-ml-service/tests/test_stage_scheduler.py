@@ -0,0 +1,122 @@
+import threading
+import time
+
+import pytest
+
+from utils.stage_scheduler import Stage, StageScheduler, get_stage_executor, stage_threads
+
+@pytest.fixture
+def scheduler():
+    return StageScheduler(default_timeout=5)
+
+def test_stages_run_after_their_dependencies(scheduler):
+    order = []
+    lock = threading.Lock()
+
+    def step(name, value):
+        def run(*inputs):
+            with lock:
+                order.append(name)
+            return value + sum(inputs)
+        return run
+
+    run = scheduler.run([
+        Stage('total', step('total', 0), deps=['left', 'right']),
+        Stage('left', step('left', 1), deps=['source']),
+        Stage('right', step('right', 2), deps=['source']),
+        Stage('source', step('source', 10)),
+    ])
+    assert run.results == {'source': 10, 'left': 11, 'right': 12, 'total': 23}
+    assert set(run.status.values()) == {'ok'}
+    assert order[0] == 'source' and order[-1] == 'total'
+
+def test_independent_stages_run_concurrently(scheduler):
+    barrier = threading.Barrier(2, timeout=2)
+    run = scheduler.run([Stage('a', barrier.wait), Stage('b', barrier.wait)])
+    assert run.status == {'a': 'ok', 'b': 'ok'}
+
+def test_failed_and_skipped_stages_contribute_their_default(scheduler):
+    def fail():
+        raise ValueError('no text')
+
+    run = scheduler.run([
+        Stage('broken', fail, default={'text': ''}),
+        Stage('after', lambda result: result['text'] + '!', deps=['broken']),
+        Stage('unneeded', lambda: 'ran', condition=lambda: False, default='skipped'),
+    ])
+    assert run.status == {'broken': 'error', 'after': 'ok', 'unneeded': 'skipped'}
+    assert run.results == {'broken': {'text': ''}, 'after': '!', 'unneeded': 'skipped'}
+
+def test_defaults_are_copies(scheduler):
+    default = {'matches': []}
+    run = scheduler.run([Stage('a', lambda: 1 / 0, default=default)])
+    run.results['a']['matches'].append('x')
+    assert default == {'matches': []}
+
+def test_timed_out_stage_gives_its_default_and_is_counted(scheduler):
+    release = threading.Event()
+    start = time.monotonic()
+    run = scheduler.run([
+        Stage('slow', lambda: release.wait(5) and 'late', timeout=0.1, default='default'),
+        Stage('next', lambda value: value.upper(), deps=['slow']),
+    ])
+    assert time.monotonic() - start < 1
+    assert run.status == {'slow': 'timeout', 'next': 'ok'}
+    assert run.results['next'] == 'DEFAULT'
+    assert run.incomplete() == {'slow': 'timeout'}
+    assert scheduler.stats()['busy_after_timeout'] == 1
+
+    release.set()
+    time.sleep(0.1)
+    assert scheduler.stats() == {'threads': stage_threads(), 'busy_after_timeout': 0, 'timeouts': 1}
+
+def test_timeout_counts_from_the_start_of_the_stage(scheduler):
+    # Another request's stages hold every pool thread for longer than the stage's timeout
+    release = threading.Event()
+    blockers = [get_stage_executor().submit(release.wait, 5) for _ in range(stage_threads())]
+    threading.Timer(0.3, release.set).start()
+
+    run = scheduler.run([Stage('queued', lambda: 'ran', timeout=0.2, default='default')])
+    for blocker in blockers:
+        blocker.result()
+    assert run.status == {'queued': 'ok'}
+    assert run.results == {'queued': 'ran'}
+    assert run.timings['queued'] < 0.2
+
+def test_cycles_and_unknown_dependencies_are_rejected(scheduler):
+    with pytest.raises(ValueError, match='cycle'):
+        scheduler.run([Stage('a', lambda b: b, deps=['b']), Stage('b', lambda a: a, deps=['a']),
+                       Stage('c', lambda: 1)])
+    with pytest.raises(ValueError, match='unknown'):
+        scheduler.run([Stage('a', lambda b: b, deps=['missing'])])
+
+def test_stages_not_started_by_the_run_deadline_are_over_budget(scheduler):
+    run = scheduler.run([
+        Stage('slow', lambda: time.sleep(0.3) or 'done', default='default'),
+        Stage('after', lambda value: value, deps=['slow'], default='after-default'),
+    ], deadline=time.monotonic() + 0.1)
+    assert run.status == {'slow': 'timeout', 'after': 'over_budget'}
+    assert run.results == {'slow': 'default', 'after': 'after-default'}
+    assert run.incomplete() == {'after': 'over_budget', 'slow': 'timeout'}
+
+def test_optional_stages_that_cannot_fit_are_skipped(scheduler):
+    costs = {'expensive': 5.0, 'cheap': 0.01, 'required': 5.0}
+    run = scheduler.run([
+        Stage('expensive', lambda: 'ran', optional=True, default='default'),
+        Stage('cheap', lambda: 'ran', optional=True),
+        Stage('unknown_cost', lambda: 'ran', optional=True),
+        Stage('required', lambda: 'ran'),
+    ], deadline=time.monotonic() + 1, expected_cost=costs.get)
+    assert run.status == {'expensive': 'over_budget', 'cheap': 'ok', 'unknown_cost': 'ok', 'required': 'ok'}
+    assert run.results['expensive'] == 'default'
+    assert run.incomplete() == {'expensive': 'over_budget'}
+
+def test_expected_costs_only_apply_under_a_deadline(scheduler):
+    run = scheduler.run([Stage('expensive', lambda: 'ran', optional=True)], expected_cost=lambda name: 60.0)
+    assert run.status == {'expensive': 'ok'}
+
+def test_pool_size_follows_the_thread_budget(monkeypatch):
+    monkeypatch.setenv('THREAD_BUDGET', '3')
+    assert stage_threads() == 6
+    monkeypatch.setattr('utils.stage_scheduler.STAGE_THREADS', 4)
+    assert stage_threads() == 4
@@ -0,0 +1,282 @@
+"""
+Aadhaar QR payload parsing and verification.
+
+Secure QR (UIDAI): the QR holds a decimal big integer; its big-endian bytes
+are a gzip stream whose content is 0xFF-separated ISO-8859-1 text fields,
+followed by the holder photo (JPEG 2000), optional SHA-256 hashes of the
+email and mobile number, and a 256-byte RSA-2048 / SHA-256 signature over
+everything before it. V2 payloads start with a "V2" field and add the last
+four digits of the mobile number.
+
+Older cards carry an unsigned XML QR (PrintLetterBarcodeData attributes),
+which is parsed but can never be signature-verified.
+
+The signature is checked with the UIDAI offline-eKYC certificate when one is
+available at AADHAAR_QR_CERT_PATH and the cryptography package is installed.
+Anyone can print a well-formed QR, so only a payload whose signature was
+verified counts as validated (and stands in for OCR); without a certificate
+the parsed fields are reported and OCR still runs.
+"""
+
+import os
+import gzip
+import zlib
+import logging
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+try:
+    from cryptography import x509
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+    CRYPTOGRAPHY_AVAILABLE = True
+except ImportError:
+    CRYPTOGRAPHY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+AADHAAR_QR_CERT_PATH = os.getenv('AADHAAR_QR_CERT_PATH', os.path.join(SERVICE_DIR, 'certs', 'uidai_offline_sign.cer'))
+
+SIGNATURE_LENGTH = 256
+HASH_LENGTH = 32
+DELIMITER = 0xFF
+
+TEXT_FIELDS = ('email_mobile_indicator', 'reference_id', 'name', 'dob', 'gender', 'care_of', 'district',
+               'landmark', 'house', 'location', 'pincode', 'post_office', 'state', 'street',
+               'sub_district', 'vtc')
+ADDRESS_FIELDS = ('care_of', 'house', 'street', 'landmark', 'location', 'vtc', 'post_office',
+                  'sub_district', 'district', 'state', 'pincode')
+
+_public_key = None
+_public_key_loaded = False
+
+def _load_public_key():
+    """Public key of the bundled UIDAI certificate (PEM or DER), or None"""
+    global _public_key, _public_key_loaded
+    if not _public_key_loaded:
+        _public_key_loaded = True
+        if CRYPTOGRAPHY_AVAILABLE and os.path.exists(AADHAAR_QR_CERT_PATH):
+            try:
+                with open(AADHAAR_QR_CERT_PATH, 'rb') as f:
+                    data = f.read()
+                cert = (x509.load_pem_x509_certificate(data) if data.lstrip().startswith(b'-----')
+                        else x509.load_der_x509_certificate(data))
+                _public_key = cert.public_key()
+            except Exception as e:
+                logger.error(f"Could not load Aadhaar QR certificate {AADHAAR_QR_CERT_PATH}: {e}")
+    return _public_key
+
+def verify_signature(signed_data: bytes, signature: bytes) -> Optional[bool]:
+    """True/False when a certificate is available, None when it can't be checked"""
+    public_key = _load_public_key()
+    if public_key is None:
+        return None
+    try:
+        public_key.verify(signature, signed_data, padding.PKCS1v15(), hashes.SHA256())
+        return True
+    except InvalidSignature:
+        return False
+    except Exception as e:
+        logger.error(f"Aadhaar QR signature check error: {e}")
+        return False
+
+def _decompress(payload: bytes) -> bytes:
+    try:
+        return gzip.decompress(payload)
+    except (OSError, EOFError):
+        return zlib.decompress(payload)
+
+def parse_secure_qr(data: bytes) -> Optional[Dict[str, Any]]:
+    """Parse a secure QR payload (decimal digits); None if it isn't one"""
+    text = data.decode('ascii', errors='ignore').strip()
+    if len(text) < 100 or not text.isdigit():
+        return None
+    try:
+        number = int(text)
+        raw = _decompress(number.to_bytes((number.bit_length() + 7) // 8, 'big'))
+    except Exception:
+        return None
+
+    version = 'V1'
+    fields = TEXT_FIELDS
+    if raw.startswith(b'V'):
+        version = raw[:raw.index(DELIMITER)].decode('latin-1')
+        fields = ('version',) + TEXT_FIELDS + ('mobile_last4',)
+
+    # Text fields are the first len(fields) delimited values; the photo starts right after them
+    parts, position = [], 0
+    for _ in fields:
+        end = raw.find(DELIMITER, position)
+        if end < 0:
+            return None
+        parts.append(raw[position:end].decode('latin-1'))
+        position = end + 1
+    values = dict(zip(fields, parts))
+
+    if len(raw) - position < SIGNATURE_LENGTH:
+        return None
+    signature = raw[-SIGNATURE_LENGTH:]
+    signed_data = raw[:-SIGNATURE_LENGTH]
+
+    indicator = int(values['email_mobile_indicator']) if values['email_mobile_indicator'].isdigit() else 0
+    hash_count = {0: 0, 1: 1, 2: 1, 3: 2}.get(indicator, 0)
+    photo_end = len(signed_data) - hash_count * HASH_LENGTH
+    photo = signed_data[position:photo_end]
+    hashes_data = signed_data[photo_end:]
+    email_hash = hashes_data[-HASH_LENGTH:].hex() if indicator in (1, 3) else None
+    mobile_hash = hashes_data[:HASH_LENGTH].hex() if indicator in (2, 3) else None
+
+    reference_id = values['reference_id']
+    generated_at = None
+    try:
+        generated_at = datetime.strptime(reference_id[4:18], '%Y%m%d%H%M%S').isoformat()
+    except ValueError:
+        pass
+
+    return {
+        'format': 'secure_qr',
+        'version': version,
+        'reference_id': reference_id,
+        'aadhaar_last4': reference_id[:4],
+        'generated_at': generated_at,
+        'name': values['name'],
+        'dob': values['dob'],
+        'gender': values['gender'],
+        'address': {field: values[field] for field in ADDRESS_FIELDS if values[field]},
+        'mobile_last4': values.get('mobile_last4') or None,
+        'email_hash': email_hash,
+        'mobile_hash': mobile_hash,
+        'photo': photo,
+        'signed_data': signed_data,
+        'signature': signature,
+    }
+
+def parse_xml_qr(data: bytes) -> Optional[Dict[str, Any]]:
+    """Parse the older, unsigned PrintLetterBarcodeData XML QR"""
+    text = data.decode('utf-8', errors='ignore')
+    if 'PrintLetterBarcodeData' not in text:
+        return None
+    try:
+        element = ET.fromstring(text[text.index('<'):])
+        if not element.tag.endswith('PrintLetterBarcodeData'):
+            element = element.find('.//PrintLetterBarcodeData')
+        attributes = dict(element.attrib)
+    except Exception:
+        return None
+
+    uid = attributes.get('uid', '')
+    return {
+        'format': 'xml',
+        'version': 'xml',
+        'reference_id': None,
+        'aadhaar_last4': uid[-4:] if uid else None,
+        'generated_at': None,
+        'name': attributes.get('name', ''),
+        'dob': attributes.get('dob') or attributes.get('yob', ''),
+        'gender': attributes.get('gender', ''),
+        'address': {key: value for key, value in attributes.items()
+                    if key in ('co', 'house', 'street', 'lm', 'loc', 'vtc', 'po', 'subdist', 'dist', 'state', 'pc')},
+        'mobile_last4': None,
+        'email_hash': None,
+        'mobile_hash': None,
+        'photo': b'',
+        'signed_data': None,
+        'signature': None,
+    }
+
+def qr_text(parsed: Dict[str, Any]) -> str:
+    """The printed-card text a validated QR stands in for"""
+    lines = [parsed['name'], f"DOB: {parsed['dob']}", parsed['gender'], ', '.join(parsed['address'].values())]
+    if parsed.get('aadhaar_last4'):
+        lines.append(f"XXXX XXXX {parsed['aadhaar_last4']}")
+    return '\n'.join(line for line in lines if line)
+
+def verify_aadhaar_qr(decoded: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Find, parse and verify an Aadhaar QR among decoded codes (see
+    utils.qr_decoding.decode_codes). `validated` is True only for a secure QR
+    whose signature was verified against the UIDAI certificate.
+    """
+    result = {'present': False, 'parsed': False, 'signature_verified': None, 'validated': False}
+    for code in decoded.get('codes', []):
+        parsed = parse_secure_qr(code['data']) or parse_xml_qr(code['data'])
+        if parsed is None:
+            continue
+
+        signature_verified = None
+        if parsed['signature'] is not None:
+            signature_verified = verify_signature(parsed['signed_data'], parsed['signature'])
+        # Unsigned (XML) payloads, and signatures that couldn't be checked, are reported but never stand in for OCR
+        validated = parsed['format'] == 'secure_qr' and signature_verified is True
+
+        photo = {'present': False}
+        if parsed['photo']:
+            image = cv2.imdecode(np.frombuffer(parsed['photo'], np.uint8), cv2.IMREAD_COLOR)
+            photo = {'present': True, 'bytes': len(parsed['photo'])}
+            if image is not None:
+                photo.update({'width': image.shape[1], 'height': image.shape[0]})
+
+        result.update({
+            'present': True,
+            'parsed': True,
+            'format': parsed['format'],
+            'version': parsed['version'],
+            'signature_verified': signature_verified,
+            'validated': validated,
+            'fields': {key: parsed[key] for key in ('reference_id', 'aadhaar_last4', 'generated_at', 'name',
+                                                     'dob', 'gender', 'address', 'mobile_last4')},
+            'photo': photo,
+            'text': qr_text(parsed),
+        })
+        return result
+    return result
+
+def qr_ocr_features(text: str, include_easyocr: bool = False) -> Dict[str, Any]:
+    """
+    OCR-stage features derived from a validated QR's text, in place of
+    running OCR: the signed payload is exact, so confidence is maximal.
+    """
+    total = len(text)
+    features = {
+        'ocr_text_length': total,
+        'ocr_word_count': len(text.split()),
+        'ocr_confidence_mean': 100.0,
+        'ocr_confidence_std': 0.0,
+        'alpha_ratio': sum(c.isalpha() for c in text) / total if total else 0,
+        'digit_ratio': sum(c.isdigit() for c in text) / total if total else 0,
+        'special_ratio': sum(not c.isalnum() and not c.isspace() for c in text) / total if total else 0,
+        'suspicious_text_detected': False,
+        'extracted_text': text[:500],
+    }
+    if include_easyocr:
+        features['easyocr_regions_count'] = len(text.splitlines())
+        features['easyocr_confidence_mean'] = 1.0
+    return features
+
+def cross_check_fields(fields: Dict[str, Any], ocr_text: str) -> Dict[str, Any]:
+    """Whether the QR name, DOB and Aadhaar last four digits appear in the OCR text"""
+    text = ' '.join(ocr_text.lower().split())
+    digits = ''.join(c for c in ocr_text if c.isdigit())
+    checks: Dict[str, Optional[bool]] = {}
+    if not text:
+        # OCR produced nothing (or is unavailable): nothing to compare against
+        return {'checks': {'name': None, 'dob': None, 'aadhaar_last4': None}, 'mismatches': [], 'consistent': None}
+
+    name_tokens = [token for token in fields.get('name', '').lower().split() if len(token) > 1]
+    checks['name'] = all(token in text for token in name_tokens) if name_tokens else None
+
+    dob_digits = ''.join(c for c in fields.get('dob', '') if c.isdigit())
+    checks['dob'] = dob_digits in digits if dob_digits else None
+
+    last4 = fields.get('aadhaar_last4')
+    checks['aadhaar_last4'] = last4 in digits if last4 else None
+
+    mismatches: List[str] = [field for field, ok in checks.items() if ok is False]
+    return {'checks': checks, 'mismatches': mismatches, 'consistent': not mismatches}
@@ -0,0 +1,239 @@
+"""
+Memory-aware admission control for analysis requests.
+
+Before anything is decoded, a request's peak memory is estimated from the
+header-probed image size (utils.image_metadata) and the stages its plan
+runs, and reserved against a per-worker budget. A request that fits in what
+is left of the budget runs; one that would fit in an idle worker waits
+(first come, first served) until enough of the budget is released; one that
+wouldn't fit even alone is decoded at 1/2, 1/4 or 1/8 scale, whichever is
+the largest resolution that fits. Decompression bombs - more pixels than
+ADMISSION_MAX_PIXELS, or a compression ratio above ADMISSION_MAX_RATIO for
+an image that doesn't fit the budget - are rejected without decoding.
+
+The per-stage costs are bytes per (decoded) pixel, measured as the peak of
+numpy allocations of each stage on 3 and 12 MP pages
+(benchmarks/bench_admission.py). Stages of a request can run concurrently,
+so their costs are added.
+
+    ADMISSION_MEMORY_BUDGET_MB   memory reserved by the analyses of one worker (default: 2048, 0 disables)
+    ADMISSION_BASE_MB            fixed cost per request (default: 64)
+    ADMISSION_QUEUE_TIMEOUT      seconds a request waits for budget before it is rejected (default: 30)
+    ADMISSION_MAX_PIXELS         larger images are rejected as decompression bombs (default: 89478485)
+    ADMISSION_MAX_RATIO          decoded / file size above which an image that doesn't fit is a bomb (default: 500)
+    ADMISSION_DOWNSCALE          downscale images that don't fit instead of rejecting them (default: true)
+"""
+
+import os
+import threading
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_MEMORY_BUDGET_MB = int(os.getenv('ADMISSION_MEMORY_BUDGET_MB', '2048'))
+ADMISSION_BASE_MB = int(os.getenv('ADMISSION_BASE_MB', '64'))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '30'))
+# PIL's DecompressionBombWarning threshold
+ADMISSION_MAX_PIXELS = int(os.getenv('ADMISSION_MAX_PIXELS', '89478485'))
+ADMISSION_MAX_RATIO = float(os.getenv('ADMISSION_MAX_RATIO', '500'))
+ADMISSION_DOWNSCALE = os.getenv('ADMISSION_DOWNSCALE', 'true').lower() == 'true'
+
+MB = 2**20
+
+# Decoded BGR image plus its grayscale version
+DECODE_BYTES_PER_PIXEL = 4
+
+# Peak allocations of each stage, in bytes per pixel of the decoded image
+STAGE_BYTES_PER_PIXEL = {
+    'ocr': 1, 'qr': 2, 'forensics': 33, 'face': 2, 'logo': 2, 'metadata': 0, 'texture': 1, 'color': 1, 'quality': 5,
+    'legacy.quality': 5, 'legacy.ocr': 4, 'legacy.signature': 2, 'legacy.format': 0, 'legacy.anomalies': 36,
+    'compression_analysis': 12, 'noise_analysis': 21,
+}
+
+# Assumed size of uploads whose header gives no dimensions
+UNKNOWN_PIXELS = 12_000_000
+
+# Decode reductions tried, smallest first (see ImageContext.downscale)
+DOWNSCALE_FACTORS = (2, 4, 8)
+
+class AdmissionRejected(Exception):
+    """A request the worker won't run; `status_code` is the HTTP status to answer with"""
+
+    def __init__(self, message: str, status_code: int, reason: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.reason = reason
+
+class Admission:
+    """An admitted request and the memory it holds in the budget"""
+
+    def __init__(self, estimate: int, downscale: int = 1, waited: float = 0.0):
+        self.estimate = estimate
+        self.downscale = downscale
+        self.waited = waited
+
+    @property
+    def decision(self) -> str:
+        if self.downscale > 1:
+            return 'downscaled'
+        return 'queued' if self.waited else 'admitted'
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'decision': self.decision,
+            'estimated_mb': round(self.estimate / MB, 1),
+            'downscale': self.downscale,
+            'waited_ms': round(self.waited * 1000, 1),
+        }
+
+def planned_stages(plan) -> List[str]:
+    """Names of the memory-relevant stages an AnalysisPlan runs"""
+    stages = sorted(plan.feature_stages)
+    if 'forensics' in stages and 'quality' in stages:
+        stages.remove('quality')  # Part of the forensics stage
+    stages += ['legacy.' + name for name in sorted(plan.legacy_analyses)]
+    stages += [field for field in ('compression_analysis', 'noise_analysis') if plan.runs_field_stage(field)]
+    return stages
+
+def estimate_request_memory(metadata: Dict[str, Any], stages: Iterable[str], file_size: int = 0,
+                            downscale: int = 1) -> int:
+    """
+    Peak bytes an analysis running `stages` is expected to need for an upload
+    with this header metadata, decoded at 1/downscale scale
+    """
+    width, height = metadata.get('width'), metadata.get('height')
+    pixels = width * height if width and height else UNKNOWN_PIXELS
+    decoded = -(-pixels // (downscale * downscale))
+    per_pixel = DECODE_BYTES_PER_PIXEL + sum(STAGE_BYTES_PER_PIXEL.get(stage, 0) for stage in stages)
+    estimate = ADMISSION_BASE_MB * MB + file_size + decoded * per_pixel
+    if downscale > 1 and metadata.get('format') != 'jpeg':
+        # Only JPEGs decode at reduced scale; other formats are decoded in full, then resized
+        estimate += pixels * 3
+    bytes_per_sample = (metadata.get('bit_depth') or 8) // 8
+    if bytes_per_sample > 1:
+        # 16-bit images go through a full-depth buffer before the conversion to 8 bits
+        estimate += pixels * (metadata.get('channels') or 3) * bytes_per_sample
+    return estimate
+
+def compression_ratio(metadata: Dict[str, Any], file_size: int) -> Optional[float]:
+    """Raw pixel bytes per byte of the upload, from the header"""
+    width, height = metadata.get('width'), metadata.get('height')
+    if not (width and height and file_size):
+        return None
+    raw = width * height * (metadata.get('channels') or 3) * max(1, (metadata.get('bit_depth') or 8) // 8)
+    return raw / file_size
+
+class AdmissionController:
+    """Per-worker memory budget shared by the /analyze requests and the job workers"""
+
+    def __init__(self, budget_mb: int = ADMISSION_MEMORY_BUDGET_MB, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.budget = budget_mb * MB
+        self.queue_timeout = queue_timeout
+        self.reserved = 0
+        self.in_flight = 0
+        self._waiting = deque()
+        self._condition = threading.Condition()
+        self._counts = {'admitted': 0, 'queued': 0, 'downscaled': 0,
+                        'rejected_bomb': 0, 'rejected_too_large': 0, 'rejected_timeout': 0}
+
+    def _reject(self, reason: str, message: str, status_code: int):
+        with self._condition:
+            self._counts['rejected_' + reason] += 1
+        logger.warning(f"Admission rejected ({reason}): {message}")
+        raise AdmissionRejected(message, status_code, reason)
+
+    def _plan(self, metadata: Dict[str, Any], stages: List[str], file_size: int) -> Admission:
+        """Estimate and downscale for a request, or raise AdmissionRejected"""
+        width, height = metadata.get('width'), metadata.get('height')
+        if width and height and width * height > ADMISSION_MAX_PIXELS:
+            self._reject('bomb', f"Image of {width}x{height} pixels exceeds the {ADMISSION_MAX_PIXELS} pixel limit", 413)
+
+        estimate = estimate_request_memory(metadata, stages, file_size)
+        if not self.budget or estimate <= self.budget:
+            return Admission(estimate)
+
+        ratio = compression_ratio(metadata, file_size)
+        if ratio is not None and ratio > ADMISSION_MAX_RATIO:
+            self._reject('bomb', f"Image of {width}x{height} pixels decompresses {ratio:.0f}x its file size", 413)
+        if ADMISSION_DOWNSCALE:
+            for factor in DOWNSCALE_FACTORS:
+                reduced = estimate_request_memory(metadata, stages, file_size, downscale=factor)
+                if reduced <= self.budget:
+                    return Admission(reduced, downscale=factor)
+        self._reject('too_large', f"Image needs about {estimate // MB} MB, more than the "
+                                  f"{self.budget // MB} MB analysis budget", 413)
+
+    def admit(self, metadata: Dict[str, Any], stages: Iterable[str], file_size: int = 0,
+              timeout: Optional[float] = None) -> Admission:
+        """
+        Reserve a request's estimated memory, waiting up to queue_timeout (or
+        `timeout`, the request's time left, if shorter) for earlier requests
+        to release theirs. Raises AdmissionRejected.
+        """
+        admission = self._plan(metadata, list(stages), file_size)
+        start = time.monotonic()
+        deadline = start + (self.queue_timeout if timeout is None else min(self.queue_timeout, timeout))
+        ticket = object()
+        with self._condition:
+            self._waiting.append(ticket)
+            try:
+                # First come, first served: a large request isn't overtaken by smaller ones
+                while self._waiting[0] is not ticket or not self._fits(admission.estimate):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counts['rejected_timeout'] += 1
+                        logger.warning(f"Admission rejected (timeout): {self.reserved // MB} MB reserved, "
+                                       f"{admission.estimate // MB} MB needed")
+                        raise AdmissionRejected(f"No analysis capacity within {deadline - start:g}s", 503, 'timeout')
+                    self._condition.wait(remaining)
+                    admission.waited = time.monotonic() - start
+            finally:
+                self._waiting.remove(ticket)
+                # The next in line may fit now
+                self._condition.notify_all()
+            if self.budget:
+                self.reserved += admission.estimate
+            self.in_flight += 1
+            self._counts['admitted'] += 1
+            if admission.waited:
+                self._counts['queued'] += 1
+            if admission.downscale > 1:
+                self._counts['downscaled'] += 1
+        return admission
+
+    def _fits(self, estimate: int) -> bool:
+        return not self.budget or self.reserved + estimate <= self.budget
+
+    def release(self, admission: Admission):
+        with self._condition:
+            if self.budget:
+                self.reserved -= admission.estimate
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserve(self, metadata: Dict[str, Any], stages: Iterable[str], file_size: int = 0,
+                timeout: Optional[float] = None) -> Iterator[Admission]:
+        """admit() for the duration of the block"""
+        admission = self.admit(metadata, stages, file_size, timeout)
+        try:
+            yield admission
+        finally:
+            self.release(admission)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                'budget_mb': self.budget // MB,
+                'reserved_mb': round(self.reserved / MB, 1),
+                'in_flight': self.in_flight,
+                'waiting': len(self._waiting),
+                **self._counts,
+            }
+
+# Shared by the request handlers and job workers of this process
+admission_controller = AdmissionController()
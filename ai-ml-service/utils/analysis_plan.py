@@ -0,0 +1,130 @@
+"""
+Output-driven planning for /analyze.
+
+Each response field is mapped to the feature stages, ML classification and
+legacy sub-analyses it is computed from. A request that selects a subset of
+fields (or a named profile) only runs the stages behind those fields.
+A document type's pipeline profile can leave stages out on top of that
+(AnalysisPlan.without).
+"""
+
+import copy
+from typing import Iterable, Optional
+
+# Feature extraction stages of the verifiers (see extract_comprehensive_features)
+# 'quality' measures sharpness, contrast and noise only; the forensics stage includes it
+FEATURE_STAGES = ('ocr', 'qr', 'forensics', 'face', 'logo', 'metadata', 'texture', 'color', 'quality')
+
+# Sub-analyses of the legacy perform_document_analysis path
+LEGACY_ANALYSES = ('quality', 'ocr', 'signature', 'format', 'anomalies')
+
+_ALL_FEATURES = frozenset(FEATURE_STAGES)
+_ALL_LEGACY = frozenset(LEGACY_ANALYSES)
+_NONE = frozenset()
+
+# field -> (feature stages, needs ML classification, legacy sub-analyses)
+# Classification consumes the full feature vector, so it implies every feature stage.
+FIELD_DEPENDENCIES = {
+    "is_valid": (_ALL_FEATURES, True, _ALL_LEGACY),
+    "confidence_score": (_ALL_FEATURES, True, _ALL_LEGACY),
+    "anomalies": (_ALL_FEATURES, True, _ALL_LEGACY),
+    "detected_text": (frozenset({'ocr'}), False, _NONE),
+    "ocr_accuracy": (frozenset({'ocr'}), False, _NONE),
+    "extracted_data": (_ALL_FEATURES, True, _NONE),
+    "quality_score": (frozenset({'quality'}), False, _NONE),
+    "format_validation": (_NONE, False, frozenset({'format'})),
+    "signature_detected": (_NONE, False, _NONE),
+    "ml_analysis": (_ALL_FEATURES, True, _NONE),
+    "feature_count": (_ALL_FEATURES, False, _NONE),
+    "risk_factors": (_ALL_FEATURES, True, _NONE),
+    "authenticity_indicators": (_ALL_FEATURES, True, _NONE),
+    "detailed_analysis": (_ALL_FEATURES, True, _NONE),
+    "near_duplicates": (_NONE, False, _NONE),
+    "face_reuse": (_NONE, False, _NONE),
+    "aadhaar_qr": (_NONE, False, _NONE),
+    "compression_analysis": (_NONE, False, _NONE),
+    "noise_analysis": (_NONE, False, _NONE),
+    "memory": (_NONE, False, _NONE),
+    "admission": (_NONE, False, _NONE),
+    "partial": (_NONE, False, _NONE),
+    "skipped_stages": (_NONE, False, _NONE),
+    "processing_time": (_NONE, False, _NONE),
+    "ml_method": (_NONE, False, _NONE),
+    "timestamp": (_NONE, False, _NONE),
+}
+
+RESPONSE_FIELDS = tuple(FIELD_DEPENDENCIES.keys())
+
+# Named field selections for common callers
+RESPONSE_PROFILES = {
+    "full": RESPONSE_FIELDS,
+    "verdict": ("is_valid", "confidence_score", "anomalies"),
+    "quality": ("quality_score", "format_validation"),
+    "text": ("detected_text", "ocr_accuracy"),
+}
+
+class AnalysisPlan:
+    """Stages required to produce a selection of response fields"""
+
+    def __init__(self, fields: Iterable[str]):
+        self.fields = tuple(fields)
+        self.feature_stages = set()
+        self.classify = False
+        self.legacy_analyses = set()
+        self.skipped_stages = frozenset()
+
+        for field in self.fields:
+            feature_stages, classify, legacy_analyses = FIELD_DEPENDENCIES[field]
+            self.feature_stages |= feature_stages
+            self.classify = self.classify or classify
+            self.legacy_analyses |= legacy_analyses
+
+        # Legacy anomaly detection inspects the legacy OCR text
+        if 'anomalies' in self.legacy_analyses:
+            self.legacy_analyses.add('ocr')
+
+    def without(self, stages: Iterable[str]) -> 'AnalysisPlan':
+        """Copy of the plan that doesn't run `stages` (feature stages, 'legacy.<analysis>', field stages)"""
+        plan = copy.copy(self)
+        plan.skipped_stages = self.skipped_stages | frozenset(stages)
+        plan.feature_stages = self.feature_stages - plan.skipped_stages
+        plan.legacy_analyses = {name for name in self.legacy_analyses if 'legacy.' + name not in plan.skipped_stages}
+        return plan
+
+    def runs_field_stage(self, field: str) -> bool:
+        """Whether the stage named after `field` (compression_analysis, noise_analysis) runs"""
+        return field in self.fields and field not in self.skipped_stages
+
+    @property
+    def is_full(self) -> bool:
+        return set(self.fields) == set(RESPONSE_FIELDS)
+
+    def __repr__(self):
+        return (f"AnalysisPlan(fields={list(self.fields)}, feature_stages={sorted(self.feature_stages)}, "
+                f"classify={self.classify}, legacy_analyses={sorted(self.legacy_analyses)}, "
+                f"skipped_stages={sorted(self.skipped_stages)})")
+
+def build_analysis_plan(fields: Optional[str] = None, profile: Optional[str] = None) -> AnalysisPlan:
+    """
+    Build a plan from a comma-separated field list and/or a profile name.
+    Raises ValueError for unknown fields or profiles.
+    """
+    selected = []
+
+    if profile:
+        if profile not in RESPONSE_PROFILES:
+            raise ValueError(f"Unknown profile '{profile}'. Available: {', '.join(RESPONSE_PROFILES)}")
+        selected.extend(RESPONSE_PROFILES[profile])
+
+    if fields:
+        requested = [f.strip() for f in fields.split(',') if f.strip()]
+        unknown = [f for f in requested if f not in FIELD_DEPENDENCIES]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        selected.extend(requested)
+
+    if not selected:
+        selected = list(RESPONSE_FIELDS)
+
+    # Preserve order, drop duplicates
+    return AnalysisPlan(dict.fromkeys(selected))
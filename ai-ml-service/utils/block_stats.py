@@ -0,0 +1,56 @@
+"""
+Tiled block statistics.
+
+Splits a single-channel image into a grid of non-overlapping tile x tile
+blocks (the incomplete right and bottom margins are dropped) and exposes the
+tiles as a strided (rows, cols, tile, tile) view or as contiguous pixel
+rows, with the per-tile mean map - a rows x cols array - read from the
+integral image (cv2.integral) at the tile corners in one pass.
+
+The mean map is computed on first access and kept, so detectors that share
+a TileStats (see ImageContext.tile_stats) compute it once.
+"""
+
+import threading
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+class TileStats:
+    """Tiles and per-tile mean map of a single-channel image"""
+
+    def __init__(self, values: np.ndarray, tile: int):
+        self.tile = tile
+        self.shape: Tuple[int, int] = (values.shape[0] // tile, values.shape[1] // tile)
+        rows, cols = self.shape
+        self.values = values[:rows * tile, :cols * tile]
+        self._mean: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.shape[0] * self.shape[1]
+
+    def blocks(self) -> np.ndarray:
+        """The tiles as a (rows, cols, tile, tile) array"""
+        rows, cols = self.shape
+        return self.values.reshape(rows, self.tile, cols, self.tile).swapaxes(1, 2)
+
+    def flat(self) -> np.ndarray:
+        """The tiles as contiguous rows of tile * tile pixels, in row-major tile order"""
+        return np.ascontiguousarray(self.blocks()).reshape(len(self), -1)
+
+    @property
+    def mean(self) -> np.ndarray:
+        """Mean pixel value per tile"""
+        if len(self) == 0:
+            # Image smaller than one tile
+            return np.zeros(self.shape)
+        if self._mean is None:
+            with self._lock:
+                if self._mean is None:
+                    sums = cv2.integral(self.values, sdepth=cv2.CV_64F)
+                    corners = sums[::self.tile, ::self.tile]
+                    tile_sums = corners[1:, 1:] - corners[:-1, 1:] - corners[1:, :-1] + corners[:-1, :-1]
+                    self._mean = tile_sums / (self.tile * self.tile)
+        return self._mean
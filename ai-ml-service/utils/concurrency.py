@@ -0,0 +1,131 @@
+"""
+Thread budget for the native libraries used by the service.
+
+OpenCV, PyTorch (CNNs and the EasyOCR detector), the BLAS behind numpy/sklearn
+and XGBoost each size their thread pools to every core of the host by default.
+With several worker processes per host that oversubscribes the CPUs, so every
+worker applies one budget, derived from the CPUs it may run on, to all of them.
+
+    THREAD_BUDGET             threads per worker process (default: CPUs in the
+                              process affinity mask, see serve.py --cpu-affinity)
+    THREAD_BUDGET_INTEROP     torch inter-op threads (default: 1)
+"""
+
+import logging
+import os
+from typing import Callable, Dict, Optional
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+try:
+    from threadpoolctl import threadpool_info, threadpool_limits
+    THREADPOOLCTL_AVAILABLE = True
+except ImportError:
+    THREADPOOLCTL_AVAILABLE = False
+
+# Environment variables read by OpenMP/BLAS runtimes when they are first loaded
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                   'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+# Callbacks for components that hold their own thread settings (e.g. model n_jobs)
+_thread_hooks: Dict[str, Callable[[int], None]] = {}
+
+# Effective settings after the last apply_thread_budget() call
+thread_settings: Dict[str, object] = {}
+
+def available_cpus() -> int:
+    """Number of CPUs this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+def thread_budget() -> int:
+    """Threads each library may use in this process"""
+    configured = os.getenv('THREAD_BUDGET')
+    if configured:
+        try:
+            return max(1, int(configured))
+        except ValueError:
+            logger.warning(f"Ignoring invalid THREAD_BUDGET={configured!r}")
+    return available_cpus()
+
+def set_thread_env(budget: int):
+    """
+    Export the budget to OpenMP/BLAS environment variables. Only runtimes
+    loaded after this call read them, so call it before importing numpy/cv2
+    where possible; apply_thread_budget() covers libraries already loaded.
+    """
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(budget)
+
+def register_thread_hook(name: str, callback: Callable[[int], None]):
+    """Register a callback that receives the thread budget whenever it is applied"""
+    _thread_hooks[name] = callback
+    if thread_settings:
+        _run_hook(name, callback, thread_settings['budget'])
+
+def _run_hook(name, callback, budget):
+    try:
+        callback(budget)
+    except Exception as e:
+        logger.warning(f"Thread budget hook '{name}' failed: {e}")
+
+def apply_thread_budget(budget: Optional[int] = None) -> Dict[str, object]:
+    """Apply one thread budget to every library in this process and return the effective settings"""
+    budget = budget or thread_budget()
+    set_thread_env(budget)
+
+    cv2.setNumThreads(budget)
+
+    if THREADPOOLCTL_AVAILABLE:
+        try:
+            threadpool_limits(limits=budget)
+        except Exception as e:
+            logger.warning(f"threadpoolctl limit failed: {e}")
+
+    try:
+        import torch
+        torch.set_num_threads(budget)
+        try:
+            torch.set_num_interop_threads(int(os.getenv('THREAD_BUDGET_INTEROP', '1')))
+        except RuntimeError:
+            # Only allowed before the first parallel operation in the process
+            pass
+    except ImportError:
+        pass
+
+    thread_settings.clear()
+    thread_settings['budget'] = budget
+    for name, callback in _thread_hooks.items():
+        _run_hook(name, callback, budget)
+
+    thread_settings.update(thread_report())
+    logger.info(f"Applied thread budget of {budget} (pid {os.getpid()})")
+    return dict(thread_settings)
+
+def thread_report() -> Dict[str, object]:
+    """Thread counts each library is actually using in this process"""
+    report = {
+        'budget': thread_settings.get('budget'),
+        'available_cpus': available_cpus(),
+        'opencv_threads': cv2.getNumThreads(),
+        'environment': {var: os.environ.get(var) for var in THREAD_ENV_VARS},
+        'hooks': sorted(_thread_hooks)
+    }
+
+    try:
+        import torch
+        report['torch_threads'] = torch.get_num_threads()
+        report['torch_interop_threads'] = torch.get_num_interop_threads()
+    except ImportError:
+        report['torch_threads'] = None
+
+    if THREADPOOLCTL_AVAILABLE:
+        report['native_threadpools'] = [
+            {'library': info.get('internal_api'), 'num_threads': info.get('num_threads')}
+            for info in threadpool_info()
+        ]
+
+    return report
@@ -0,0 +1,137 @@
+"""
+In-process cache of signature detections and their crops.
+
+Entries are keyed by the SHA-256 of the uploaded file, so calling
+/detect-signature and then /extract-signature (or fetching crops by URL)
+with the same file decodes the image and runs find_signatures once. Crops are
+kept as pixel arrays and encoded on demand; encoded bytes are memoized per
+(signature, encoding, quality).
+
+The cache is bounded by the bytes of the crops and their encodings
+(CROP_CACHE_MB), least-recently-used first, since crop sizes vary with the
+document and the signatures found on it.
+
+Each worker process has its own cache; crop URLs are only valid on the
+process that produced them, so deployments with several workers should
+route crop fetches with session affinity or use the multipart delivery.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CROP_CACHE_MB = float(os.getenv('CROP_CACHE_MB', '64'))
+CROP_CACHE_TTL_SECONDS = float(os.getenv('CROP_CACHE_TTL_SECONDS', '900'))
+
+# encoding -> (MIME type, file extension)
+CROP_ENCODINGS = {
+    'png': ('image/png', '.png'),
+    'jpeg': ('image/jpeg', '.jpg'),
+    'webp': ('image/webp', '.webp'),
+}
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+def encode_crop(crop: np.ndarray, encoding: str = 'png', quality: Optional[int] = None) -> bytes:
+    """
+    Encode an RGB crop. `quality` is 1-100 for jpeg/webp; for png it maps to
+    the zlib compression level (higher quality = smaller file, more CPU).
+    """
+    if encoding not in CROP_ENCODINGS:
+        raise ValueError(f"Unsupported encoding '{encoding}'. Available: {', '.join(CROP_ENCODINGS)}")
+
+    if encoding == 'jpeg':
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality or 90]
+    elif encoding == 'webp':
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality or 90]
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, 1 if quality is None else min(9, quality // 11)]
+
+    bgr = cv2.cvtColor(crop, cv2.COLOR_RGB2BGR) if crop.ndim == 3 else crop
+    ok, buffer = cv2.imencode(CROP_ENCODINGS[encoding][1], bgr, params)
+    if not ok:
+        raise RuntimeError(f"Could not encode crop as {encoding}")
+    return buffer.tobytes()
+
+class SignatureCacheEntry:
+    """Detection result for one upload plus the pixel crops of its signature regions"""
+
+    def __init__(self, result: Dict[str, Any], crops: List[np.ndarray]):
+        self.result = result
+        self.crops = crops
+        self.created_at = time.time()
+        self._encoded: Dict[Tuple[int, str, Optional[int]], bytes] = {}
+        self._lock = threading.Lock()
+
+    def encoded_crop(self, signature_id: int, encoding: str = 'png', quality: Optional[int] = None) -> bytes:
+        """Encoded bytes of crop `signature_id` (1-based, as in the API responses)"""
+        if not 1 <= signature_id <= len(self.crops):
+            raise IndexError(f"No signature {signature_id}")
+        key = (signature_id, encoding, quality)
+        with self._lock:
+            if key not in self._encoded:
+                self._encoded[key] = encode_crop(self.crops[signature_id - 1], encoding, quality)
+            return self._encoded[key]
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the crops and their memoized encodings"""
+        with self._lock:
+            return sum(crop.nbytes for crop in self.crops) + sum(len(data) for data in self._encoded.values())
+
+class SignatureCropCache:
+    """Thread-safe size-bounded LRU of SignatureCacheEntry by content hash, with a TTL"""
+
+    def __init__(self, max_mb: float = CROP_CACHE_MB, ttl_seconds: float = CROP_CACHE_TTL_SECONDS):
+        self.max_bytes = int(max_mb * 2**20)
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, SignatureCacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[SignatureCacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry.created_at > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            # Crops encoded since the last call count from now on
+            self._evict()
+            return entry
+
+    def put(self, key: str, entry: SignatureCacheEntry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        total = sum(entry.nbytes for entry in self._entries.values())
+        while self._entries and total > self.max_bytes:
+            _, entry = self._entries.popitem(last=False)
+            total -= entry.nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': sum(entry.nbytes for entry in self._entries.values()),
+                    'hits': self.hits, 'misses': self.misses}
+
+# Shared instance
+signature_crop_cache = SignatureCropCache()
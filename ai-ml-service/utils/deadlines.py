@@ -0,0 +1,91 @@
+"""
+Request deadlines from the caller.
+
+Callers send the time they will still wait for the answer in the
+X-Request-Timeout-Ms header. The deadline (minus DEADLINE_RESERVE_MS for
+building and sending the response) is held in a context variable for the
+request, so the admission queue, the stage scheduler and the tesseract
+calls below them see it without it being passed through every signature;
+the scheduler copies the context into its pool threads.
+
+Once the budget left can't cover an optional stage's usual cost, the stage
+is skipped; stages still running at the deadline time out. Either way the
+analysis answers on time with a partial result, flagged in the response.
+
+    DEADLINE_RESERVE_MS       time kept for the response after the stages (default: 100)
+    TESSERACT_TIMEOUT_GRACE   seconds a tesseract call may outlive the deadline (default: 0.1)
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from fastapi import Header, HTTPException
+
+DEADLINE_HEADER = 'X-Request-Timeout-Ms'
+DEADLINE_RESERVE_MS = int(os.getenv('DEADLINE_RESERVE_MS', '100'))
+TESSERACT_TIMEOUT_GRACE = float(os.getenv('TESSERACT_TIMEOUT_GRACE', '0.1'))
+
+class Deadline:
+    """Point in time (time.monotonic()) by which a request's work has to be done"""
+
+    def __init__(self, timeout_ms: int):
+        self.timeout_ms = timeout_ms
+        self.expires_at = time.monotonic() + max(0, timeout_ms - DEADLINE_RESERVE_MS) / 1000
+
+    def remaining(self) -> float:
+        """Seconds left, negative once expired"""
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar('request_deadline', default=None)
+
+def current_deadline() -> Optional[Deadline]:
+    """Deadline of the request being served by this thread, if it has one"""
+    return _current_deadline.get()
+
+@contextmanager
+def request_deadline(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """Make `deadline` the current deadline for the duration of the block"""
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+def deadline_expired() -> bool:
+    """Whether the current request's deadline has passed (False without one)"""
+    deadline = current_deadline()
+    return deadline is not None and deadline.expired
+
+# RuntimeError message of a pytesseract call stopped by its timeout
+TESSERACT_TIMEOUT_MESSAGE = 'Tesseract process timeout'
+
+def tesseract_timeout() -> float:
+    """
+    `timeout` for a pytesseract call under the current deadline (0: none).
+    A little past the deadline, so the scheduler has already flagged the
+    stage as timed out; the kill just frees the thread and the process.
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        return 0
+    return max(deadline.remaining(), 0) + TESSERACT_TIMEOUT_GRACE
+
+def deadline_header(x_request_timeout_ms: Optional[int] = Header(None)) -> Optional[Deadline]:
+    """FastAPI dependency: the request's deadline from the X-Request-Timeout-Ms header"""
+    if x_request_timeout_ms is None:
+        return None
+    if x_request_timeout_ms <= 0:
+        raise HTTPException(status_code=400, detail=f"{DEADLINE_HEADER} must be a positive number of milliseconds")
+    return Deadline(x_request_timeout_ms)
+
+def ensure_time_left(deadline: Optional[Deadline]):
+    """Answer 504 instead of doing work the caller will no longer wait for"""
+    if deadline is not None and deadline.expired:
+        raise HTTPException(status_code=504, detail=f"The {DEADLINE_HEADER} budget ran out")
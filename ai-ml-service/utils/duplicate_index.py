@@ -0,0 +1,200 @@
+"""
+Persistent near-duplicate index of analyzed documents.
+
+Every analyzed upload is recorded with its perceptual hashes (see
+utils.perceptual_hash). Queries find earlier documents whose pHash is within a
+Hamming radius using multi-index hashing: the 64-bit hash is split into four
+16-bit chunks, each stored in its own indexed column. Two hashes within
+distance r agree to within r // 4 bits on at least one chunk, so candidates
+are the rows matching any chunk variant within that distance - a handful of
+index probes regardless of the number of stored documents. Candidates are
+then verified on the full hash.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from itertools import combinations
+from typing import Any, Dict, List, Optional
+
+from utils.perceptual_hash import image_hashes, hamming_distance, hash_hex
+from utils.vector_index import INDEX_DIR
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_INDEX_PATH = os.getenv('DUPLICATE_INDEX_PATH', os.path.join(INDEX_DIR, 'duplicates.db'))
+DUPLICATE_HAMMING_RADIUS = int(os.getenv('DUPLICATE_HAMMING_RADIUS', '6'))
+DUPLICATE_MAX_MATCHES = int(os.getenv('DUPLICATE_MAX_MATCHES', '10'))
+
+CHUNKS = 4
+CHUNK_BITS = 16
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    content_hash TEXT NOT NULL UNIQUE,
+    document_type TEXT,
+    phash INTEGER NOT NULL,
+    dhash INTEGER NOT NULL,
+    ahash INTEGER NOT NULL,
+    c0 INTEGER NOT NULL,
+    c1 INTEGER NOT NULL,
+    c2 INTEGER NOT NULL,
+    c3 INTEGER NOT NULL,
+    seen_count INTEGER NOT NULL DEFAULT 1,
+    first_seen_at REAL NOT NULL,
+    last_seen_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_documents_c0 ON documents (c0, phash);
+CREATE INDEX IF NOT EXISTS idx_documents_c1 ON documents (c1, phash);
+CREATE INDEX IF NOT EXISTS idx_documents_c2 ON documents (c2, phash);
+CREATE INDEX IF NOT EXISTS idx_documents_c3 ON documents (c3, phash);
+"""
+
+def to_signed(value: int) -> int:
+    """SQLite integers are signed 64-bit"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+def split_chunks(value: int) -> List[int]:
+    mask = (1 << CHUNK_BITS) - 1
+    return [(value >> (CHUNK_BITS * (CHUNKS - 1 - i))) & mask for i in range(CHUNKS)]
+
+def chunk_variants(chunk: int, radius: int) -> List[int]:
+    """All CHUNK_BITS-bit values within `radius` bit flips of `chunk`"""
+    variants = [chunk]
+    for flips in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), flips):
+            variant = chunk
+            for bit in bits:
+                variant ^= 1 << bit
+            variants.append(variant)
+    return variants
+
+class DuplicateIndex:
+    """SQLite-backed multi-index hashing over document pHashes"""
+
+    def __init__(self, db_path: str = DUPLICATE_INDEX_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def find(self, hashes: Dict[str, int], radius: int = DUPLICATE_HAMMING_RADIUS,
+             limit: int = DUPLICATE_MAX_MATCHES, conn: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+        """Stored documents whose pHash is within `radius` bits of hashes['phash'], closest first"""
+        if conn is None:
+            with self._connection() as conn:
+                return self.find(hashes, radius, limit, conn)
+
+        phash = hashes['phash']
+        chunk_radius = radius // CHUNKS
+        queries, params = [], []
+        for i, chunk in enumerate(split_chunks(phash)):
+            variants = chunk_variants(chunk, chunk_radius)
+            queries.append(f"SELECT id, phash FROM documents WHERE c{i} IN ({','.join('?' * len(variants))})")
+            params.extend(variants)
+
+        # Index-only candidate scan, then verify on the full hash
+        distances = {}
+        for row_id, stored in conn.execute(' UNION '.join(queries), params):
+            distance = hamming_distance(phash, to_unsigned(stored))
+            if distance <= radius:
+                distances[row_id] = distance
+        if not distances:
+            return []
+
+        matches = []
+        for row in conn.execute(f"SELECT * FROM documents WHERE id IN ({','.join('?' * len(distances))})",
+                                list(distances)):
+            matches.append({
+                'content_hash': row['content_hash'],
+                'document_type': row['document_type'],
+                'phash_distance': distances[row['id']],
+                'dhash_distance': hamming_distance(hashes['dhash'], to_unsigned(row['dhash'])),
+                'seen_count': row['seen_count'],
+                'first_seen_at': row['first_seen_at'],
+                'last_seen_at': row['last_seen_at'],
+            })
+        matches.sort(key=lambda m: (m['phash_distance'], m['dhash_distance']))
+        return matches[:limit]
+
+    def add(self, content_hash: str, document_type: str, hashes: Dict[str, int],
+            conn: Optional[sqlite3.Connection] = None):
+        """Record a document; resubmissions of the same bytes bump its seen count"""
+        if conn is None:
+            with self._connection() as conn:
+                return self.add(content_hash, document_type, hashes, conn)
+
+        now = time.time()
+        conn.execute(
+            "INSERT INTO documents (content_hash, document_type, phash, dhash, ahash, c0, c1, c2, c3, "
+            "first_seen_at, last_seen_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (content_hash) DO UPDATE SET seen_count = seen_count + 1, last_seen_at = excluded.last_seen_at",
+            (content_hash, document_type, to_signed(hashes['phash']), to_signed(hashes['dhash']),
+             to_signed(hashes['ahash']), *split_chunks(hashes['phash']), now, now)
+        )
+
+    def check_and_add(self, content_hash: str, document_type: str, hashes: Dict[str, int]) -> List[Dict[str, Any]]:
+        """Earlier near-duplicates of a document, then record it"""
+        with self._connection() as conn:
+            matches = self.find(hashes, conn=conn)
+            self.add(content_hash, document_type, hashes, conn)
+        for match in matches:
+            match['exact'] = match['content_hash'] == content_hash
+        return matches
+
+    def stats(self) -> Dict[str, Any]:
+        with self._connection() as conn:
+            return {'documents': conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]}
+
+_duplicate_index = None
+_duplicate_index_lock = threading.Lock()
+
+def get_duplicate_index() -> DuplicateIndex:
+    """Shared near-duplicate index, opened on first use"""
+    global _duplicate_index
+    if _duplicate_index is None:
+        with _duplicate_index_lock:
+            if _duplicate_index is None:
+                _duplicate_index = DuplicateIndex()
+    return _duplicate_index
+
+def check_near_duplicates(key: str, gray, document_type: str) -> Dict[str, Any]:
+    """
+    Hash a document, look up earlier near-duplicates and record it.
+    `key` identifies the document (the SHA-256 of the file).
+    """
+    hashes = image_hashes(gray)
+
+    index = get_duplicate_index()
+    start = time.perf_counter()
+    matches = index.check_and_add(key, document_type, hashes)
+    return {
+        'checked': True,
+        'phash': hash_hex(hashes['phash']),
+        'dhash': hash_hex(hashes['dhash']),
+        'radius': DUPLICATE_HAMMING_RADIUS,
+        'matches': matches,
+        'search_ms': round((time.perf_counter() - start) * 1000, 3)
+    }
@@ -0,0 +1,167 @@
+"""
+EasyOCR readers and the OCR statistics the advanced verifier reads from them.
+
+The verifier only consumes the number of text regions and the mean
+recognition confidence, so instead of readtext() on the full-resolution
+image with an English + Hindi reader for every document:
+
+- readers are cached per language set (LRU, EASYOCR_READERS of them) and
+  chosen by document type (the ocr_languages of its pipeline profile): only
+  documents that carry Devanagari load the Hindi model, the others use the
+  smaller English-only recognizer;
+- CRAFT detection runs on a canvas whose longest side is bounded by
+  EASYOCR_CANVAS_SIZE (EasyOCR's default is 2560);
+- recognition runs on the grayscale crops in batches of EASYOCR_BATCH_SIZE
+  with the greedy decoder;
+- stats() counts every detected region but recognizes only the
+  EASYOCR_STATS_REGIONS largest ones for the confidence, and keeps no text.
+  readtext() recognizes them all and returns the text as well.
+
+    EASYOCR_LANGUAGES        language set of profiles without ocr_languages, '+'-separated (default: en)
+    EASYOCR_READERS          readers (language sets) kept per process (default: 2)
+    EASYOCR_CANVAS_SIZE      longest side of the detection canvas (default: 1280)
+    EASYOCR_BATCH_SIZE       regions per recognition batch (default: 16)
+    EASYOCR_STATS_REGIONS    regions recognized by stats(), 0 for all (default: 32)
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from utils.pipeline_profiles import get_pipeline_profile, pipeline_profiles
+
+logger = logging.getLogger(__name__)
+
+try:
+    import easyocr
+    EASYOCR_AVAILABLE = True
+except ImportError:
+    EASYOCR_AVAILABLE = False
+    logger.warning("EasyOCR not available, EasyOCR features disabled")
+
+EASYOCR_LANGUAGES = tuple(os.getenv('EASYOCR_LANGUAGES', 'en').split('+'))
+EASYOCR_READERS = int(os.getenv('EASYOCR_READERS', '2'))
+EASYOCR_CANVAS_SIZE = int(os.getenv('EASYOCR_CANVAS_SIZE', '1280'))
+EASYOCR_BATCH_SIZE = int(os.getenv('EASYOCR_BATCH_SIZE', '16'))
+EASYOCR_STATS_REGIONS = int(os.getenv('EASYOCR_STATS_REGIONS', '32'))
+
+# Recognition results below this confidence are left out of the mean
+MIN_CONFIDENCE = 0.1
+
+def document_languages(document_type: str) -> Tuple[str, ...]:
+    """Language set EasyOCR reads `document_type` with"""
+    return get_pipeline_profile(document_type).ocr_languages or EASYOCR_LANGUAGES
+
+def _box_area(box: List[int]) -> int:
+    x_min, x_max, y_min, y_max = box
+    return (x_max - x_min) * (y_max - y_min)
+
+class EasyOCRManager:
+    """Per-process cache of EasyOCR readers, one per language set"""
+
+    def __init__(self, max_readers: int = EASYOCR_READERS):
+        self.max_readers = max(1, max_readers)
+        self._readers: 'OrderedDict[Tuple[str, ...], Any]' = OrderedDict()
+        # Inference on one reader is serialized: torch already uses the worker's thread budget
+        self._reader_locks: Dict[Tuple[str, ...], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get_reader(self, languages: Iterable[str]) -> Tuple[Optional[Any], Optional[threading.Lock]]:
+        """The reader for a language set and its lock, loading it (and evicting the oldest) if needed"""
+        if not EASYOCR_AVAILABLE:
+            return None, None
+        key = tuple(sorted(languages))
+        with self._lock:
+            if key in self._readers:
+                self._readers.move_to_end(key)
+                return self._readers[key], self._reader_locks[key]
+        # Load outside the cache lock: it takes seconds, other language sets stay usable
+        try:
+            reader = easyocr.Reader(list(key))
+            logger.info(f"EasyOCR reader initialized for {'+'.join(key)}")
+        except Exception as e:
+            logger.warning(f"EasyOCR initialization failed for {'+'.join(key)}: {e}")
+            return None, None
+        with self._lock:
+            if key not in self._readers:
+                self._readers[key] = reader
+                self._reader_locks[key] = threading.Lock()
+                while len(self._readers) > self.max_readers:
+                    evicted, _ = self._readers.popitem(last=False)
+                    self._reader_locks.pop(evicted, None)
+                    logger.info(f"EasyOCR reader for {'+'.join(evicted)} evicted")
+            self._readers.move_to_end(key)
+            return self._readers[key], self._reader_locks[key]
+
+    def preload(self, language_sets: Optional[Iterable[Iterable[str]]] = None):
+        """
+        Load the readers of the configured language sets (by default
+        EASYOCR_LANGUAGES and those of the pipeline profiles, up to
+        max_readers), so they're created before serve.py forks the workers
+        """
+        if language_sets is None:
+            language_sets = [EASYOCR_LANGUAGES] + [profile.ocr_languages for profile in pipeline_profiles.values()
+                                                   if profile.ocr_languages]
+        loaded = []
+        for languages in language_sets:
+            key = tuple(sorted(languages))
+            if key not in loaded and len(loaded) < self.max_readers:
+                self.get_reader(key)
+                loaded.append(key)
+
+    def _detect(self, reader, image: np.ndarray) -> Tuple[list, list]:
+        horizontal, free = reader.detect(image, canvas_size=EASYOCR_CANVAS_SIZE)
+        # Lists per input image; one image here
+        return horizontal[0], free[0]
+
+    def _recognize(self, reader, gray: np.ndarray, horizontal: list, free: list) -> list:
+        if not horizontal and not free:
+            return []
+        return reader.recognize(gray, horizontal_list=horizontal, free_list=free, decoder='greedy',
+                                batch_size=EASYOCR_BATCH_SIZE)
+
+    def stats(self, image: np.ndarray, gray: np.ndarray, document_type: str) -> Optional[Dict[str, Any]]:
+        """
+        Number of text regions and mean confidence of the (largest
+        EASYOCR_STATS_REGIONS) recognized ones; None without EasyOCR
+        """
+        reader, lock = self.get_reader(document_languages(document_type))
+        if reader is None:
+            return None
+        with lock:
+            horizontal, free = self._detect(reader, image)
+            regions = len(horizontal) + len(free)
+            if EASYOCR_STATS_REGIONS and regions > EASYOCR_STATS_REGIONS:
+                horizontal = sorted(horizontal, key=_box_area, reverse=True)[:EASYOCR_STATS_REGIONS]
+                free = free[:max(0, EASYOCR_STATS_REGIONS - len(horizontal))]
+            results = self._recognize(reader, gray, horizontal, free)
+        confidences = [result[2] for result in results if result[2] > MIN_CONFIDENCE]
+        return {
+            'regions': regions,
+            'recognized': len(results),
+            'confidence_mean': float(np.mean(confidences)) if confidences else 0,
+        }
+
+    def readtext(self, image: np.ndarray, gray: np.ndarray, document_type: str) -> Optional[list]:
+        """(box, text, confidence) of every detected region, like Reader.readtext; None without EasyOCR"""
+        reader, lock = self.get_reader(document_languages(document_type))
+        if reader is None:
+            return None
+        with lock:
+            horizontal, free = self._detect(reader, image)
+            return self._recognize(reader, gray, horizontal, free)
+
+    def warm_up(self, image: np.ndarray, gray: np.ndarray):
+        """Run detection and recognition once on every loaded reader (first torch inference)"""
+        with self._lock:
+            readers = [(reader, self._reader_locks[key]) for key, reader in self._readers.items()]
+        for reader, lock in readers:
+            with lock:
+                self._recognize(reader, gray, *self._detect(reader, image))
+
+# Shared by every verifier of this process
+easyocr_manager = EasyOCRManager()
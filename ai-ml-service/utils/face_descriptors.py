@@ -0,0 +1,162 @@
+"""
+Face detection, face descriptors and the cross-identity face index.
+
+With face_recognition installed, descriptors are its 128-d dlib embeddings.
+Otherwise an OpenCV-only fallback describes the equalized 96x96 face crop
+with uniform LBP histograms over a 4x4 grid (944 floats, Hellinger
+normalized): much weaker than an embedding, but enough to catch the same
+photo reused across submissions. Each backend has its own VectorIndex, since
+their descriptors are not comparable.
+
+The index stores one descriptor per document under the subject (identity)
+it was submitted for, so "has this face appeared under a different identity"
+is a nearest-neighbour search excluding the current subject.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from utils.vector_index import VectorIndex
+
+try:
+    import face_recognition
+    FACE_RECOGNITION_AVAILABLE = True
+except ImportError:
+    FACE_RECOGNITION_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+FACE_DESCRIPTOR_BACKEND = 'face_recognition' if FACE_RECOGNITION_AVAILABLE else 'lbp'
+FACE_DESCRIPTOR_DIMS = {'face_recognition': 128, 'lbp': 4 * 4 * 59}
+
+# Cosine distance under which two descriptors are taken to be the same face
+_DEFAULT_THRESHOLDS = {'face_recognition': 0.1, 'lbp': 0.1}
+FACE_MATCH_THRESHOLD = float(os.getenv('FACE_MATCH_THRESHOLD', _DEFAULT_THRESHOLDS[FACE_DESCRIPTOR_BACKEND]))
+FACE_MATCH_K = int(os.getenv('FACE_MATCH_K', '5'))
+
+LBP_FACE_SIZE = 98  # 96x96 LBP codes after dropping the border, 24x24 cells
+LBP_GRID = 4
+
+_face_cascade = None
+_cascade_lock = threading.Lock()
+
+def _get_face_cascade():
+    global _face_cascade
+    if _face_cascade is None:
+        with _cascade_lock:
+            if _face_cascade is None:
+                _face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    return _face_cascade
+
+def detect_faces(image: np.ndarray) -> List[Tuple[int, int, int, int]]:
+    """Face boxes (x, y, w, h) of a BGR image"""
+    try:
+        if FACE_RECOGNITION_AVAILABLE:
+            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            return [(left, top, right - left, bottom - top)
+                    for top, right, bottom, left in face_recognition.face_locations(rgb_image)]
+
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        faces = _get_face_cascade().detectMultiScale(
+            gray,
+            scaleFactor=1.1,
+            minNeighbors=4,
+            minSize=(30, 30),
+            flags=cv2.CASCADE_SCALE_IMAGE
+        )
+        return [tuple(int(v) for v in face) for face in faces]
+    except Exception as e:
+        logger.error(f"Face detection error: {e}")
+        return []
+
+def _uniform_lbp_table() -> np.ndarray:
+    """Map the 256 LBP codes to 58 uniform patterns plus one bin for the rest"""
+    table = np.full(256, 58, np.uint8)
+    uniform = [code for code in range(256)
+               if bin(code ^ ((code << 1) & 0xFF | code >> 7)).count('1') <= 2]
+    table[uniform] = np.arange(len(uniform))
+    return table
+
+_LBP_TABLE = _uniform_lbp_table()
+
+def lbp_descriptor(gray_face: np.ndarray) -> np.ndarray:
+    face = cv2.equalizeHist(cv2.resize(gray_face, (LBP_FACE_SIZE, LBP_FACE_SIZE), interpolation=cv2.INTER_AREA))
+    face = face.astype(np.int16)
+    center = face[1:-1, 1:-1]
+    codes = np.zeros(center.shape, np.uint8)
+    offsets = [(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)]
+    for bit, (dy, dx) in enumerate(offsets):
+        neighbour = face[1 + dy:LBP_FACE_SIZE - 1 + dy, 1 + dx:LBP_FACE_SIZE - 1 + dx]
+        codes |= (neighbour >= center).astype(np.uint8) << bit
+
+    patterns = _LBP_TABLE[codes]
+    cell = patterns.shape[0] // LBP_GRID
+    rows, cols = np.indices(patterns.shape) // cell
+    cells = rows * LBP_GRID + cols
+    histogram = np.bincount((cells * 59 + patterns).ravel(), minlength=LBP_GRID * LBP_GRID * 59)
+    return np.sqrt(histogram.astype(np.float32))
+
+def describe_faces(image: np.ndarray, boxes: List[Tuple[int, int, int, int]]) -> List[np.ndarray]:
+    """One descriptor per face box, in the same order; empty on failure"""
+    if not boxes:
+        return []
+    try:
+        if FACE_RECOGNITION_AVAILABLE:
+            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            locations = [(y, x + w, y + h, x) for x, y, w, h in boxes]
+            return [np.asarray(e, np.float32) for e in face_recognition.face_encodings(rgb_image, locations)]
+
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return [lbp_descriptor(gray[y:y + h, x:x + w]) for x, y, w, h in boxes]
+    except Exception as e:
+        logger.error(f"Face descriptor error: {e}")
+        return []
+
+_face_index = None
+_face_index_lock = threading.Lock()
+
+def get_face_index() -> VectorIndex:
+    """Shared face index of the active descriptor backend, opened on first use"""
+    global _face_index
+    if _face_index is None:
+        with _face_index_lock:
+            if _face_index is None:
+                _face_index = VectorIndex(f'faces-{FACE_DESCRIPTOR_BACKEND}',
+                                          FACE_DESCRIPTOR_DIMS[FACE_DESCRIPTOR_BACKEND])
+    return _face_index
+
+def check_face_reuse(boxes: List[Tuple[int, int, int, int]], descriptors: List[np.ndarray],
+                     subject_id: Optional[str] = None, label: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Search the face index for the document's main (largest) face under any
+    other subject, then record it under `subject_id` when one is given.
+    """
+    result = {'checked': False, 'backend': FACE_DESCRIPTOR_BACKEND, 'face_count': len(boxes),
+              'reused_across_identities': False, 'matches': []}
+    if not descriptors:
+        return result
+
+    main = int(np.argmax([w * h for _, _, w, h in boxes[:len(descriptors)]]))
+    index = get_face_index()
+    start = time.perf_counter()
+    matches = index.search(descriptors[main], k=FACE_MATCH_K, exclude_subject_id=subject_id)
+    matches = [{'subject_id': m['subject_id'], 'label': m['label'], 'distance': m['distance'],
+                'seen_at': m['created_at']}
+               for m in matches if m['distance'] <= FACE_MATCH_THRESHOLD]
+    result.update({
+        'checked': True,
+        'reused_across_identities': bool(matches) and subject_id is not None,
+        'matches': matches,
+        'threshold': FACE_MATCH_THRESHOLD,
+        'search_ms': round((time.perf_counter() - start) * 1000, 3)
+    })
+
+    if subject_id is not None:
+        index.add(descriptors[main], subject_id, label)
+    return result
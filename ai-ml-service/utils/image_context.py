@@ -0,0 +1,265 @@
+"""
+Per-request image context shared by the analysis stages.
+
+The decoded image, its grayscale version and any other derived arrays are
+computed once, on first use, and reused by every stage that needs them, so
+stages running concurrently on the stage scheduler don't decode or convert
+the same upload several times.
+
+Stages that don't need full pixels ask for a reduced view instead (see
+ImageContext.view): JPEGs are then decoded directly at 1/2, 1/4 or 1/8 scale
+in the DCT domain, and the full-resolution decode only happens if a stage
+actually uses `image` or `gray`.
+
+A context can also be downscaled as a whole (see utils.admission): `image`
+and everything derived from it are then at 1/2, 1/4 or 1/8 scale, and
+`size` is the reduced size; `source_size` keeps the upload's own.
+"""
+
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from utils.block_stats import TileStats
+from utils.crop_cache import content_hash
+from utils.face_descriptors import detect_faces, describe_faces
+from utils.image_metadata import parse_image_metadata
+from utils.jpeg_forensics import analyze_jpeg
+from utils.noise_map import analyze_noise
+from utils.pipeline_profiles import PipelineProfile, get_pipeline_profile
+from utils.qr_decoding import decode_codes
+from utils.region_proposals import RegionProposer
+from utils.stage_cache import decode_variant, stage_cache
+
+# Longest side (pixels) each reduced-resolution consumer needs
+FACE_VIEW_SIDE = int(os.getenv('FACE_VIEW_SIDE', '1280'))
+COLOR_VIEW_SIDE = int(os.getenv('COLOR_VIEW_SIDE', '800'))
+QUALITY_VIEW_SIDE = int(os.getenv('QUALITY_VIEW_SIDE', '1280'))
+HASH_VIEW_SIDE = int(os.getenv('HASH_VIEW_SIDE', '256'))
+
+# Consumers whose view side a pipeline profile can change
+VIEW_SIDES = {'face': FACE_VIEW_SIDE, 'color': COLOR_VIEW_SIDE, 'quality': QUALITY_VIEW_SIDE}
+
+# Scale factors libjpeg can decode at
+REDUCTIONS = (8, 4, 2)
+_REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+def _shrink(image: np.ndarray, factor: int) -> np.ndarray:
+    return cv2.resize(image, (max(1, image.shape[1] // factor), max(1, image.shape[0] // factor)),
+                      interpolation=cv2.INTER_AREA)
+
+class ImageContext:
+    """Lazily decoded image plus a cache of derived artifacts for one analysis"""
+
+    def __init__(self, image_path: Optional[str], document_type: str = "id-card", image: Optional[np.ndarray] = None,
+                 downscale: int = 1):
+        self.image_path = image_path
+        self.document_type = document_type
+        # Decode reduction of the whole analysis (1, 2, 4 or 8); may be changed until the first decode
+        self.downscale = downscale
+        self._artifacts: Dict[str, Any] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        if image is not None:
+            self._artifacts['image'] = image
+
+    def cached(self, key: str, compute: Callable[[], Any]) -> Any:
+        """Return the artifact stored under `key`, computing it once if missing"""
+        if key in self._artifacts:
+            return self._artifacts[key]
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._artifacts:
+                self._artifacts[key] = compute()
+            return self._artifacts[key]
+
+    def _read_image(self) -> np.ndarray:
+        if self.downscale > 1 and self.metadata['format'] == 'jpeg':
+            image = cv2.imdecode(np.frombuffer(self.data, np.uint8), _REDUCED_FLAGS[self.downscale])
+        else:
+            image = cv2.imread(self.image_path)
+            if image is not None and self.downscale > 1:
+                image = _shrink(image, self.downscale)
+        if image is None:
+            raise ValueError("Could not read image")
+        return image
+
+    @property
+    def image(self) -> np.ndarray:
+        """BGR image; raises ValueError if the file cannot be decoded"""
+        return self.cached('image', self._read_image)
+
+    @property
+    def gray(self) -> np.ndarray:
+        return self.cached('gray', lambda: cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY))
+
+    @property
+    def source_size(self) -> Tuple[int, int]:
+        """(width, height) of the upload, from the file header when possible"""
+        def read_size():
+            metadata = self.metadata
+            if metadata['width'] and metadata['height'] and ('image' not in self._artifacts or self.downscale > 1):
+                # cv2 applies the EXIF orientation: 5-8 swap the axes
+                if metadata['orientation'] in (5, 6, 7, 8):
+                    return metadata['height'], metadata['width']
+                return metadata['width'], metadata['height']
+            height, width = self.image.shape[:2]
+            return width * self.downscale, height * self.downscale
+        return self.cached('source_size', read_size)
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """(width, height) of `image`: the upload's, reduced by `downscale`"""
+        def read_size():
+            if self.downscale == 1:
+                return self.source_size
+            if 'image' in self._artifacts or not self.metadata['width']:
+                height, width = self.image.shape[:2]
+                return width, height
+            # libjpeg rounds reduced sizes up, cv2.resize (other formats) down
+            if self.metadata['format'] == 'jpeg':
+                return tuple(-(-side // self.downscale) for side in self.source_size)
+            return tuple(max(1, side // self.downscale) for side in self.source_size)
+        return self.cached('size', read_size)
+
+    def reduction(self, max_side: int) -> int:
+        """Largest decode reduction (1, 2, 4 or 8) keeping the longer side >= max_side"""
+        longest = max(self.size)
+        for factor in REDUCTIONS:
+            if longest // factor >= max_side:
+                return factor
+        return 1
+
+    def _read_view(self, factor: int) -> np.ndarray:
+        if self.metadata['format'] == 'jpeg' and self.downscale == 1:
+            view = cv2.imdecode(np.frombuffer(self.data, np.uint8), _REDUCED_FLAGS[factor])
+            if view is not None:
+                return view
+        # Other formats have no reduced decode, and a downscaled image is already small: shrink `image`
+        return _shrink(self.image, factor)
+
+    def view(self, max_side: int) -> np.ndarray:
+        """BGR image reduced by `reduction(max_side)`; the full image when no reduction applies"""
+        factor = self.reduction(max_side)
+        if factor == 1:
+            return self.image
+        return self.cached(f'view/{factor}', lambda: self._read_view(factor))
+
+    def gray_view(self, max_side: int) -> np.ndarray:
+        factor = self.reduction(max_side)
+        if factor == 1:
+            return self.gray
+        return self.cached(f'gray_view/{factor}', lambda: cv2.cvtColor(self.view(max_side), cv2.COLOR_BGR2GRAY))
+
+    @property
+    def profile(self) -> PipelineProfile:
+        """Pipeline profile of the document type (see utils.pipeline_profiles)"""
+        return get_pipeline_profile(self.document_type)
+
+    def view_side(self, consumer: str) -> int:
+        """Longest side of the view `consumer` ('face', 'color', 'quality') works at, per the profile"""
+        return self.profile.view_sides.get(consumer, VIEW_SIDES[consumer])
+
+    def view_scale(self, max_side: int) -> float:
+        """Full-resolution pixels per pixel of view(max_side)"""
+        return self.size[0] / self.view(max_side).shape[1]
+
+    def stage_params(self) -> Dict[str, Any]:
+        """Stage cache parameters telling apart the pixels of this context from other decodes of the upload"""
+        params = {'pixels': decode_variant(self.metadata, orientation_applied=True)}
+        if self.downscale > 1:
+            params['downscale'] = self.downscale
+        return params
+
+    def stage(self, name: str, compute: Callable[[], Any], **params) -> Any:
+        """
+        Output of stage `name` on this upload from the process-wide stage cache
+        (utils.stage_cache), computed on a miss. Contexts around an in-memory
+        image have no content hash and always compute.
+        """
+        if self.image_path is None:
+            return compute()
+        return stage_cache.get_or_compute(self.content_hash, name, compute, **params, **self.stage_params())
+
+    @property
+    def regions(self) -> RegionProposer:
+        """Region tables of the grayscale image, one per binarization, shared by the detectors and routes"""
+        def proposer():
+            if self.image_path is None:
+                return RegionProposer(self.gray)
+            return RegionProposer(self.gray, self.content_hash, **self.stage_params())
+        return self.cached('regions', proposer)
+
+    @property
+    def _view_faces(self) -> List[Tuple[int, int, int, int]]:
+        return self.cached('view_faces', lambda: detect_faces(self.view(self.view_side('face'))))
+
+    @property
+    def faces(self) -> List[Tuple[int, int, int, int]]:
+        """
+        Face boxes (x, y, w, h) in full-resolution pixels, detected once on
+        the face view for the face stages and the face index
+        """
+        def scale_faces():
+            scale = self.view_scale(self.view_side('face'))
+            return [tuple(int(round(v * scale)) for v in box) for box in self._view_faces]
+        return self.cached('faces', scale_faces)
+
+    @property
+    def face_descriptors(self) -> List[np.ndarray]:
+        """One descriptor per entry of `faces`, computed on the face view"""
+        return self.cached('face_descriptors', lambda: describe_faces(self.view(self.view_side('face')), self._view_faces))
+
+    @property
+    def codes(self) -> Dict[str, Any]:
+        """Decoded QR codes and barcodes (see utils.qr_decoding.decode_codes)"""
+        return self.cached('codes', lambda: decode_codes(self.gray, expect_qr=self.profile.aadhaar_qr))
+
+    def _read_bytes(self) -> bytes:
+        if self.image_path is None:
+            # Context built around an in-memory image
+            return b''
+        with open(self.image_path, 'rb') as f:
+            return f.read()
+
+    @property
+    def data(self) -> bytes:
+        """Raw bytes of the uploaded file, read once"""
+        return self.cached('data', self._read_bytes)
+
+    @property
+    def content_hash(self) -> str:
+        """SHA-256 of the uploaded file"""
+        return self.cached('content_hash', lambda: content_hash(self.data))
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        """Header metadata of the upload (see utils.image_metadata.parse_image_metadata)"""
+        return self.cached('metadata', lambda: parse_image_metadata(self.data))
+
+    @property
+    def jpeg_forensics(self) -> Dict[str, Any]:
+        """Compression analysis of the full-resolution luminance (see utils.jpeg_forensics.analyze_jpeg)"""
+        # A downscaled decode no longer has the file's 8x8 block grid
+        return self.cached('jpeg_forensics', lambda: analyze_jpeg(self.data, self.gray, block_grid=self.downscale == 1))
+
+    @property
+    def noise_analysis(self) -> Dict[str, Any]:
+        """Sliding-window noise consistency of the full-resolution grayscale image (see utils.noise_map)"""
+        return self.cached('noise_analysis', lambda: analyze_noise(self.gray))
+
+    def tile_stats(self, tile: int) -> TileStats:
+        """Tiles and tile mean map of the full-resolution grayscale image (see utils.block_stats)"""
+        return self.cached(f'tiles/{tile}', lambda: TileStats(self.gray, tile))
+
+    def is_readable(self) -> bool:
+        """Whether the upload decodes; JPEGs are checked with the cheapest reduced decode"""
+        try:
+            self.view(1)
+            return True
+        except ValueError:
+            return False
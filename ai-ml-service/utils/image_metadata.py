@@ -0,0 +1,227 @@
+"""
+Header-only image metadata parsing.
+
+Walks the JPEG marker segments or PNG chunks of the upload bytes once and
+stops at the first image data (SOS / IDAT), so the cost doesn't depend on
+the image size. From the header it reads the dimensions, channel count and
+bit depth, the EXIF IFD0 camera tags (plus DateTimeOriginal from the Exif
+sub-IFD), the XMP packet's CreatorTool and the ICC profile description. The thumbnail IFD and the
+MakerNote are never visited.
+
+Both verifiers build their metadata features from the same parse (see
+ImageContext.metadata).
+"""
+
+import re
+import zlib
+import struct
+import logging
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# EXIF tags read from IFD0 / the Exif sub-IFD
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_ORIENTATION = 0x0112
+TAG_SOFTWARE = 0x0131
+TAG_DATETIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+
+IFD0_TAGS = {TAG_MAKE: 'camera_make', TAG_MODEL: 'camera_model', TAG_ORIENTATION: 'orientation',
+             TAG_SOFTWARE: 'software', TAG_DATETIME: 'datetime'}
+EXIF_IFD_TAGS = {TAG_DATETIME_ORIGINAL: 'datetime_original'}
+
+# TIFF field type -> value size in bytes
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+
+XMP_SIGNATURE = b'http://ns.adobe.com/xap/1.0/\x00'
+ICC_SIGNATURE = b'ICC_PROFILE\x00'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# PNG color type -> samples per pixel (palette images decode to RGB)
+PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}
+
+_CREATOR_TOOL = re.compile(rb'CreatorTool(?:="|>)([^"<]*)')
+
+# JPEG start-of-frame markers (not DHT, JPG and DAC, which share the range)
+SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def empty_metadata() -> Dict[str, Any]:
+    return {
+        'format': None, 'width': None, 'height': None, 'channels': None, 'bit_depth': None,
+        'camera_make': None, 'camera_model': None, 'software': None, 'orientation': None,
+        'datetime': None, 'datetime_original': None,
+        'creator_tool': None, 'icc_profile': None,
+        'has_exif': False, 'has_xmp': False, 'has_icc': False,
+    }
+
+def _ascii(value: bytes) -> Optional[str]:
+    text = value.split(b'\x00', 1)[0].decode('latin-1').strip()
+    return text or None
+
+def _read_ifd(tiff: bytes, offset: int, endian: str, tags: Dict[int, str], result: Dict[str, Any]) -> Optional[int]:
+    """Store the wanted tags of one IFD in `result`; returns the Exif sub-IFD offset if present"""
+    count, = struct.unpack_from(endian + 'H', tiff, offset)
+    exif_offset = None
+    for i in range(count):
+        tag, kind, n, value = struct.unpack_from(endian + 'HHI4s', tiff, offset + 2 + i * 12)
+        if tag == TAG_EXIF_IFD and kind in (4, 13):
+            exif_offset, = struct.unpack(endian + 'I', value)
+            continue
+        name = tags.get(tag)
+        if name is None:
+            continue
+        size = TYPE_SIZES.get(kind, 1) * n
+        if size > 4:
+            start, = struct.unpack(endian + 'I', value)
+            value = tiff[start:start + size]
+        if kind == 2:
+            result[name] = _ascii(value)
+        elif kind == 3:
+            result[name], = struct.unpack_from(endian + 'H', value)
+        elif kind == 4:
+            result[name], = struct.unpack_from(endian + 'I', value)
+    return exif_offset
+
+def parse_exif(tiff: bytes, result: Dict[str, Any]):
+    """IFD0 and Exif sub-IFD tags of a TIFF-structured EXIF block"""
+    if tiff[:2] == b'II':
+        endian = '<'
+    elif tiff[:2] == b'MM':
+        endian = '>'
+    else:
+        return
+    result['has_exif'] = True
+    try:
+        ifd0, = struct.unpack_from(endian + 'I', tiff, 4)
+        exif_offset = _read_ifd(tiff, ifd0, endian, IFD0_TAGS, result)
+        if exif_offset:
+            _read_ifd(tiff, exif_offset, endian, EXIF_IFD_TAGS, result)
+    except struct.error:
+        # Truncated or corrupt IFD: keep the tags read so far
+        pass
+
+def parse_xmp(packet: bytes, result: Dict[str, Any]):
+    result['has_xmp'] = True
+    match = _CREATOR_TOOL.search(packet)
+    if match:
+        result['creator_tool'] = _ascii(match.group(1))
+
+def icc_description(profile: bytes) -> Optional[str]:
+    """The 'desc' tag of an ICC profile (v2 textDescription or v4 multiLocalizedUnicode)"""
+    try:
+        count, = struct.unpack_from('>I', profile, 128)
+        for i in range(count):
+            signature, offset, size = struct.unpack_from('>4sII', profile, 132 + i * 12)
+            if signature != b'desc':
+                continue
+            tag = profile[offset:offset + size]
+            if tag[:4] == b'desc':
+                length, = struct.unpack_from('>I', tag, 8)
+                return _ascii(tag[12:12 + length])
+            if tag[:4] == b'mluc':
+                record_count, = struct.unpack_from('>I', tag, 8)
+                if record_count:
+                    length, text_offset = struct.unpack_from('>II', tag, 20)
+                    return tag[text_offset:text_offset + length].decode('utf-16-be', errors='ignore').strip() or None
+    except struct.error:
+        pass
+    return None
+
+def iter_jpeg_segments(data: bytes) -> Iterator[Tuple[int, bytes]]:
+    """(marker, payload) of each JPEG header segment, up to the first scan"""
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            break
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # Fill byte
+            position += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            position += 2
+            continue
+        if marker in (0xDA, 0xD9):
+            # Start of scan / end of image: the header is over
+            break
+        length, = struct.unpack_from('>H', data, position + 2)
+        yield marker, data[position + 4:position + 2 + length]
+        position += 2 + length
+
+def _parse_jpeg(data: bytes, result: Dict[str, Any]):
+    result['format'] = 'jpeg'
+    icc_chunks = {}
+    for marker, segment in iter_jpeg_segments(data):
+        if marker == 0xE1 and segment[:6] == b'Exif\x00\x00':
+            parse_exif(segment[6:], result)
+        elif marker == 0xE1 and segment.startswith(XMP_SIGNATURE):
+            parse_xmp(segment[len(XMP_SIGNATURE):], result)
+        elif marker == 0xE2 and segment.startswith(ICC_SIGNATURE):
+            icc_chunks[segment[12]] = segment[14:]
+        elif marker in SOF_MARKERS and len(segment) >= 6:
+            result['bit_depth'], result['height'], result['width'], result['channels'] = \
+                struct.unpack_from('>BHHB', segment)
+
+    if icc_chunks:
+        result['has_icc'] = True
+        result['icc_profile'] = icc_description(b''.join(icc_chunks[k] for k in sorted(icc_chunks)))
+
+def _parse_png(data: bytes, result: Dict[str, Any]):
+    result['format'] = 'png'
+    position = len(PNG_SIGNATURE)
+    while position + 8 <= len(data):
+        length, kind = struct.unpack_from('>I4s', data, position)
+        if kind in (b'IDAT', b'IEND'):
+            break
+        chunk = data[position + 8:position + 8 + length]
+        if kind == b'IHDR':
+            result['width'], result['height'], result['bit_depth'], color_type = struct.unpack_from('>IIBB', chunk)
+            result['channels'] = PNG_CHANNELS.get(color_type)
+        elif kind == b'eXIf':
+            parse_exif(chunk, result)
+        elif kind == b'iCCP':
+            name, _, compressed = chunk.partition(b'\x00')
+            result['has_icc'] = True
+            try:
+                result['icc_profile'] = icc_description(zlib.decompress(compressed[1:])) or _ascii(name)
+            except zlib.error:
+                result['icc_profile'] = _ascii(name)
+        elif kind in (b'iTXt', b'tEXt'):
+            keyword, _, text = chunk.partition(b'\x00')
+            if kind == b'iTXt':
+                # compression flag, method, language tag, translated keyword
+                compressed = text[:1] == b'\x01'
+                text = text[2:].split(b'\x00', 2)[-1]
+                if compressed:
+                    try:
+                        text = zlib.decompress(text)
+                    except zlib.error:
+                        text = b''
+            if keyword == b'XML:com.adobe.xmp':
+                parse_xmp(text, result)
+            elif keyword == b'Software' and not result['software']:
+                result['software'] = _ascii(text)
+        position += 12 + length
+
+def parse_image_metadata(data: bytes) -> Dict[str, Any]:
+    """
+    Metadata of a JPEG or PNG from its header segments; fields that are
+    absent (or any other format) are None.
+    """
+    result = empty_metadata()
+    try:
+        if data[:2] == b'\xff\xd8':
+            _parse_jpeg(data, result)
+        elif data[:8] == PNG_SIGNATURE:
+            _parse_png(data, result)
+    except Exception as e:
+        logger.warning(f"Image metadata parse error: {e}")
+    return result
+
+def editing_software_detected(metadata: Dict[str, Any], editing_software: Iterable[str]) -> bool:
+    """Whether the EXIF Software tag or the XMP CreatorTool names an image editor"""
+    tools = ' '.join(filter(None, (metadata.get('software'), metadata.get('creator_tool')))).lower()
+    return any(name in tools for name in editing_software)
@@ -3,6 +3,8 @@ import numpy as np
 from PIL import Image, ImageEnhance
 import logging
 
+from utils.region_proposals import region_table, get_region_proposer
+
 logger = logging.getLogger(__name__)
 
 def preprocess_image(image, enhancement_type="default"):
@@ -275,18 +277,14 @@ def extract_text_regions(image):
         # Combine lines to find text regions
         combined = cv2.addWeighted(horizontal_lines, 0.5, vertical_lines, 0.5, 0.0)
         
-        # Find contours
-        contours, _ = cv2.findContours(combined, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Label the combined line responses once and keep regions above the noise floor
+        table = region_table(combined)
+        table = table.subset(table['area'] > 100)  # Filter small noise
         
-        text_regions = []
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if area > 100:  # Filter small noise
-                x, y, w, h = cv2.boundingRect(contour)
-                text_regions.append({
-                    'bbox': {'x': x, 'y': y, 'width': w, 'height': h},
-                    'area': area
-                })
+        text_regions = [
+            {'bbox': {'x': x, 'y': y, 'width': w, 'height': h}, 'area': float(area)}
+            for (x, y, w, h), area in zip(table.boxes(), table['area'].tolist())
+        ]
         
         return text_regions
         
@@ -294,7 +292,7 @@ def extract_text_regions(image):
         logger.error(f"Text region extraction error: {str(e)}")
         return []
 
-def extract_photo_regions(image):
+def extract_photo_regions(image, regions=None):
     """
     Extract photo regions from image
     """
@@ -305,25 +303,18 @@ def extract_photo_regions(image):
         else:
             gray = image
         
-        # Detect edges
-        edges = cv2.Canny(gray, 50, 150)
-        
-        # Find contours
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        photo_regions = []
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if 5000 < area < 100000:  # Photo-like area range
-                # Check if it's roughly rectangular
-                approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
-                if len(approx) >= 4:  # Rectangular-ish
-                    x, y, w, h = cv2.boundingRect(contour)
-                    photo_regions.append({
-                        'bbox': {'x': x, 'y': y, 'width': w, 'height': h},
-                        'area': area,
-                        'vertices': len(approx)
-                    })
+        # Regions of the edge map in the photo-like area range
+        table = get_region_proposer(gray, regions).table('canny')
+        table = table.subset((table['area'] > 5000) & (table['area'] < 100000))
+        
+        # Check if it's roughly rectangular
+        vertices = table.vertex_counts()
+        table, vertices = table.subset(vertices >= 4), vertices[vertices >= 4]
+        
+        photo_regions = [
+            {'bbox': {'x': x, 'y': y, 'width': w, 'height': h}, 'area': float(area), 'vertices': int(count)}
+            for (x, y, w, h), area, count in zip(table.boxes(), table['area'].tolist(), vertices.tolist())
+        ]
         
         return photo_regions
         
@@ -0,0 +1,397 @@
+"""
+Durable job queue for long-running document verifications.
+
+Jobs are stored in a SQLite database inside the service directory so that
+queued and in-flight work survives worker restarts. The HTTP routes enqueue
+jobs and any number of worker threads or processes (see worker.py) claim
+them from the same database.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import ipaddress
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+
+from utils.json_utils import dumps
+
+logger = logging.getLogger(__name__)
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Queue configuration (overridable through the environment)
+JOB_QUEUE_PATH = os.getenv('JOB_QUEUE_PATH', os.path.join(SERVICE_DIR, 'jobs.db'))
+JOB_UPLOAD_FOLDER = os.getenv('JOB_UPLOAD_FOLDER', os.path.join(SERVICE_DIR, 'uploads', 'jobs'))
+JOB_CONCURRENCY = int(os.getenv('JOB_CONCURRENCY', '2'))
+JOB_TTL_SECONDS = int(os.getenv('JOB_TTL_SECONDS', '86400'))
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '600'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '1.0'))
+JOB_CALLBACK_TIMEOUT = float(os.getenv('JOB_CALLBACK_TIMEOUT', '10'))
+JOB_CALLBACK_RETRIES = int(os.getenv('JOB_CALLBACK_RETRIES', '3'))
+# Hosts callbacks may be sent to, comma-separated ('.example.com' matches its
+# subdomains). Empty: any host resolving to public addresses only.
+JOB_CALLBACK_ALLOWED_HOSTS = [host.strip().lower() for host in os.getenv('JOB_CALLBACK_ALLOWED_HOSTS', '').split(',')
+                              if host.strip()]
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_COMPLETED = 'completed'
+STATUS_FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    callback_url TEXT,
+    callback_status TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT,
+    lease_expires_at REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_expires ON jobs (expires_at);
+"""
+
+class JobQueue:
+    """
+    SQLite-backed FIFO queue with leases.
+
+    A claimed job holds a lease, renewed by its worker while it runs; if the
+    worker dies the lease expires and the job becomes claimable again, up to
+    JOB_MAX_ATTEMPTS attempts. Only the worker holding the lease can finish
+    the job.
+    """
+
+    def __init__(self, db_path: str = JOB_QUEUE_PATH, ttl_seconds: int = JOB_TTL_SECONDS,
+                 lease_seconds: int = JOB_LEASE_SECONDS, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per operation keeps the queue safe to use
+        # from several threads and processes at once.
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, payload: Dict[str, Any], callback_url: Optional[str] = None,
+                job_id: Optional[str] = None) -> Dict[str, Any]:
+        """Add a job to the queue and return its record"""
+        now = time.time()
+        job_id = job_id or uuid.uuid4().hex
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, payload, callback_url, created_at, updated_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, STATUS_QUEUED, json.dumps(payload), callback_url, now, now, now + self.ttl_seconds)
+            )
+        logger.info(f"Enqueued job {job_id}")
+        return self.get(job_id)
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """Atomically claim the oldest runnable job, or return None if the queue is idle"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                "SELECT id FROM jobs "
+                "WHERE expires_at > ? AND attempts < ? AND "
+                "(status = ? OR (status = ? AND lease_expires_at < ?)) "
+                "ORDER BY created_at LIMIT 1",
+                (now, self.max_attempts, STATUS_QUEUED, STATUS_RUNNING, now)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = ?, attempts = attempts + 1, "
+                "lease_expires_at = ?, updated_at = ? WHERE id = ?",
+                (STATUS_RUNNING, worker_id, now + self.lease_seconds, now, row['id'])
+            )
+            conn.execute('COMMIT')
+            return self.get(row['id'])
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def renew(self, job_id: str, worker_id: str) -> bool:
+        """Extend the lease of a running job; False if `worker_id` no longer holds it"""
+        now = time.time()
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires_at = ?, updated_at = ? "
+                "WHERE id = ? AND worker_id = ? AND status = ?",
+                (now + self.lease_seconds, now, job_id, worker_id, STATUS_RUNNING)
+            )
+        return cursor.rowcount > 0
+
+    def complete(self, job_id: str, result: Dict[str, Any], worker_id: Optional[str] = None) -> bool:
+        """Store the result of a finished job; False if `worker_id` lost the lease"""
+        return self._finish(job_id, STATUS_COMPLETED, worker_id, result=dumps(result).decode('utf-8'))
+
+    def fail(self, job_id: str, error: str, worker_id: Optional[str] = None) -> bool:
+        """Record a job failure; False if `worker_id` lost the lease"""
+        return self._finish(job_id, STATUS_FAILED, worker_id, error=error)
+
+    def _finish(self, job_id: str, status: str, worker_id: Optional[str],
+                result: Optional[str] = None, error: Optional[str] = None) -> bool:
+        query = ("UPDATE jobs SET status = ?, result = ?, error = ?, lease_expires_at = NULL, updated_at = ? "
+                 "WHERE id = ?")
+        params = [status, result, error, time.time(), job_id]
+        if worker_id is not None:
+            # A worker whose lease expired and was claimed by another one leaves the job to it
+            query += " AND worker_id = ? AND status = ?"
+            params += [worker_id, STATUS_RUNNING]
+        with self._connection() as conn:
+            cursor = conn.execute(query, params)
+        return cursor.rowcount > 0
+
+    def set_callback_status(self, job_id: str, callback_status: str):
+        with self._connection() as conn:
+            conn.execute("UPDATE jobs SET callback_status = ?, updated_at = ? WHERE id = ?",
+                         (callback_status, time.time(), job_id))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job record, or None if it does not exist or has expired"""
+        with self._connection() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ? AND expires_at > ?",
+                               (job_id, time.time())).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        # A running job whose worker has run out of attempts will never be picked up again
+        if job['status'] == STATUS_RUNNING and job['attempts'] >= self.max_attempts \
+                and (job['lease_expires_at'] or 0) < time.time():
+            job['status'] = STATUS_FAILED
+            job['error'] = job['error'] or 'Job exceeded maximum attempts'
+        return job
+
+    def purge_expired(self) -> int:
+        """Delete jobs past their TTL together with their stored uploads"""
+        now = time.time()
+        with self._connection() as conn:
+            rows = conn.execute("SELECT id, payload FROM jobs WHERE expires_at <= ?", (now,)).fetchall()
+            for row in rows:
+                file_path = json.loads(row['payload']).get('file_path')
+                if file_path:
+                    try:
+                        os.remove(file_path)
+                    except OSError:
+                        pass
+            conn.execute("DELETE FROM jobs WHERE expires_at <= ?", (now,))
+        if rows:
+            logger.info(f"Purged {len(rows)} expired jobs")
+        return len(rows)
+
+    def stats(self) -> Dict[str, int]:
+        with self._connection() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs WHERE expires_at > ? GROUP BY status",
+                                (time.time(),)).fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+def public_job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape a job record for API responses and callbacks"""
+    view = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'attempts': job['attempts'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at'],
+        'expires_at': job['expires_at'],
+        'callback_status': job['callback_status']
+    }
+    if job['status'] == STATUS_COMPLETED:
+        view['result'] = job['result']
+    elif job['status'] == STATUS_FAILED:
+        view['error'] = job['error']
+    return view
+
+def _host_allowed(host: str) -> bool:
+    return any(host == allowed or (allowed.startswith('.') and host.endswith(allowed))
+               for allowed in JOB_CALLBACK_ALLOWED_HOSTS)
+
+def check_callback_url(url: str):
+    """
+    Raise ValueError unless job results may be POSTed to `url`: an http(s)
+    URL whose host is in JOB_CALLBACK_ALLOWED_HOSTS or, without an
+    allowlist, only resolves to public addresses (no loopback, private,
+    link-local or reserved ones)
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ValueError("callback_url must be an http(s) URL")
+    host = parsed.hostname.lower()
+    if JOB_CALLBACK_ALLOWED_HOSTS:
+        if not _host_allowed(host):
+            raise ValueError(f"callback_url host {host} is not allowed")
+        return
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parsed.port or 443, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, ValueError):
+        raise ValueError(f"callback_url host {host} does not resolve")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%')[0])
+        if getattr(ip, 'ipv4_mapped', None):
+            ip = ip.ipv4_mapped
+        if not ip.is_global:
+            raise ValueError(f"callback_url host {host} resolves to a non-public address")
+
+def deliver_callback(queue: JobQueue, job_id: str):
+    """POST the final job state to its callback URL, retrying with backoff"""
+    job = queue.get(job_id)
+    if job is None or not job['callback_url']:
+        return
+    # Checked again at delivery: the host may resolve elsewhere than at submission
+    try:
+        check_callback_url(job['callback_url'])
+    except ValueError as e:
+        logger.warning(f"Callback for job {job_id} not sent: {e}")
+        queue.set_callback_status(job_id, 'rejected')
+        return
+    body = public_job_view(job)
+    for attempt in range(1, JOB_CALLBACK_RETRIES + 1):
+        try:
+            # Redirects aren't followed: they could point the POST at an internal host
+            response = requests.post(job['callback_url'], data=dumps(body), timeout=JOB_CALLBACK_TIMEOUT,
+                                     headers={'Content-Type': 'application/json'}, allow_redirects=False)
+            if response.status_code < 300:
+                queue.set_callback_status(job_id, 'delivered')
+                return
+            logger.warning(f"Callback for job {job_id} returned HTTP {response.status_code}")
+        except Exception as e:
+            logger.warning(f"Callback for job {job_id} failed (attempt {attempt}): {e}")
+        time.sleep(min(2 ** attempt, 30))
+    queue.set_callback_status(job_id, 'failed')
+
+class JobWorkerPool:
+    """
+    Pool of worker threads pulling jobs from a JobQueue.
+
+    The handler receives the job payload and returns a JSON-serializable result.
+    """
+
+    def __init__(self, queue: JobQueue, handler: Callable[[Dict[str, Any]], Dict[str, Any]],
+                 concurrency: int = JOB_CONCURRENCY, poll_interval: float = JOB_POLL_INTERVAL):
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+        self._last_purge = 0.0
+
+    def start(self):
+        for i in range(self.concurrency):
+            worker_id = f"{socket.gethostname()}:{os.getpid()}:{i}"
+            thread = threading.Thread(target=self._run, args=(worker_id,), name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.concurrency} job workers on {self.queue.db_path}")
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self, worker_id: str):
+        while not self._stop.is_set():
+            try:
+                self._maybe_purge()
+                job = self.queue.claim(worker_id)
+            except Exception as e:
+                logger.error(f"Job queue error: {e}")
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self.process(job)
+
+    def _heartbeat(self, job_id: str, worker_id: str, done: threading.Event):
+        """Renew the job's lease every third of its length until `done` is set"""
+        while not done.wait(max(self.queue.lease_seconds / 3, 0.1)):
+            try:
+                if not self.queue.renew(job_id, worker_id):
+                    logger.warning(f"Lost the lease of job {job_id}, its result will be discarded")
+                    return
+            except Exception as e:
+                logger.error(f"Lease renewal of job {job_id} failed: {e}")
+
+    def process(self, job: Dict[str, Any]):
+        job_id, worker_id = job['id'], job['worker_id']
+        logger.info(f"Processing job {job_id} (attempt {job['attempts']})")
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, worker_id, done),
+                                     name=f"job-heartbeat-{job_id[:8]}", daemon=True)
+        heartbeat.start()
+        try:
+            result = self.handler(job['payload'])
+            finished = self.queue.complete(job_id, result, worker_id)
+            if finished:
+                logger.info(f"Job {job_id} completed")
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            finished = self.queue.fail(job_id, str(e), worker_id)
+        finally:
+            done.set()
+            heartbeat.join()
+        if not finished:
+            # Another worker claimed the job after our lease expired; the upload and callback are its own
+            logger.warning(f"Job {job_id} is no longer leased by {worker_id}, result discarded")
+            return
+        file_path = job['payload'].get('file_path')
+        if file_path:
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+        deliver_callback(self.queue, job_id)
+
+    def _maybe_purge(self):
+        now = time.time()
+        if now - self._last_purge > 60:
+            self._last_purge = now
+            self.queue.purge_expired()
+
+# Global instance
+job_queue = JobQueue()
@@ -0,0 +1,334 @@
+"""
+JPEG compression forensics from the quantization tables and block DCT.
+
+The quantization tables are read from the upload's DQT segments (see
+utils.image_metadata.iter_jpeg_segments) and give the encoder quality. The
+8x8 block DCT of the luminance is recomputed from the decoded pixels in one
+vectorized pass (reshape to blocks, then two 8x8 matrix products), which is
+cheaper than entropy-decoding the scan in Python and yields the same
+coefficients up to rounding.
+
+Double compression: an image saved as JPEG twice with different qualities has
+periodic gaps or peaks in the histograms of its quantized coefficients (the
+double-quantization effect). For each low-frequency coefficient whose
+histogram shows a period p, a block's value v is scored as in Lin et al.
+(2009): an untouched, doubly compressed block falls on the histogram's peaks
+(probability h(v) / sum of h over v's period) while a region pasted in after
+the first compression is spread uniformly (1 / p). Combining the frequencies
+gives a per-block probability of tampering.
+
+Grid alignment: a quantized block's high-frequency DCT coefficients stay
+near zero only when measured on the grid they were quantized on, so the
+offset with the most near-zero coefficients is the compression grid. A
+dominant grid other than (0, 0) means the image was cropped or shifted
+after an earlier compression; a clear grid in a PNG means it was a JPEG
+before.
+"""
+
+import os
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from utils.image_metadata import iter_jpeg_segments
+
+logger = logging.getLogger(__name__)
+
+# Minimum periodogram score of a coefficient histogram for a double-quantization period (~1 for noise)
+DQ_PERIOD_THRESHOLD = float(os.getenv('DQ_PERIOD_THRESHOLD', '6'))
+# Posterior above which a block counts as tampered
+DQ_TAMPER_THRESHOLD = float(os.getenv('DQ_TAMPER_THRESHOLD', '0.8'))
+# Relative excess of near-zero coefficients on a grid offset for a compression grid to count as present
+GRID_STRENGTH_THRESHOLD = float(os.getenv('GRID_STRENGTH_THRESHOLD', '0.2'))
+
+# Low-frequency AC coefficients (zigzag positions 1-9) analysed for double quantization
+DQ_COEFFICIENTS = 9
+DQ_MAX_PERIOD = 12
+DQ_HIST_RANGE = 60
+DQ_MIN_SAMPLES = 2000
+DQ_MIN_BIN_COUNT = 5
+
+GRID_MAX_SIDE = 1024
+GRID_ZERO_LEVEL = 0.75
+GRID_MIN_TEXTURE = 8
+
+# Zigzag scan position -> natural (row-major) index
+ZIGZAG = np.array([
+    0, 1, 8, 16, 9, 2, 3, 10, 17, 24, 32, 25, 18, 11, 4, 5,
+    12, 19, 26, 33, 40, 48, 41, 34, 27, 20, 13, 6, 7, 14, 21, 28,
+    35, 42, 49, 56, 57, 50, 43, 36, 29, 22, 15, 23, 30, 37, 44, 51,
+    58, 59, 52, 45, 38, 31, 39, 46, 53, 60, 61, 54, 47, 55, 62, 63,
+])
+
+# IJG (libjpeg) standard luminance table, quality 50
+STANDARD_LUMINANCE = np.array([
+    16, 11, 10, 16, 24, 40, 51, 61,
+    12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56,
+    14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77,
+    24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101,
+    72, 92, 95, 98, 112, 100, 103, 99,
+]).reshape(8, 8)
+
+def _ijg_table(quality: int) -> np.ndarray:
+    scale = 5000 // quality if quality < 50 else 200 - 2 * quality
+    return np.clip((STANDARD_LUMINANCE * scale + 50) // 100, 1, 255)
+
+_IJG_TABLES = np.stack([_ijg_table(q) for q in range(1, 101)])
+
+def _dct_matrix() -> np.ndarray:
+    k, n = np.indices((8, 8))
+    matrix = np.sqrt(2 / 8) * np.cos(np.pi * (2 * n + 1) * k / 16)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+DCT_MATRIX = _dct_matrix()
+
+def parse_quantization_tables(data: bytes) -> Dict[int, np.ndarray]:
+    """8x8 quantization tables (natural order) of a JPEG, by table id; empty for other formats"""
+    tables = {}
+    if data[:2] != b'\xff\xd8':
+        return tables
+    for marker, segment in iter_jpeg_segments(data):
+        if marker != 0xDB:
+            continue
+        position = 0
+        while position < len(segment):
+            precision, table_id = segment[position] >> 4, segment[position] & 0x0F
+            size = 128 if precision else 64
+            values = np.frombuffer(segment[position + 1:position + 1 + size], '>u2' if precision else 'u1')
+            if len(values) < 64:
+                break
+            table = np.zeros(64, np.int32)
+            table[ZIGZAG] = values
+            tables[table_id] = table.reshape(8, 8)
+            position += 1 + size
+    return tables
+
+def estimate_quality(table: np.ndarray) -> Tuple[int, bool]:
+    """Closest IJG quality of a luminance table, and whether it matches exactly"""
+    errors = np.abs(_IJG_TABLES - table).sum(axis=(1, 2))
+    best = int(np.argmin(errors))
+    return best + 1, bool(errors[best] == 0)
+
+def block_dct(gray: np.ndarray, offset: Tuple[int, int] = (0, 0)) -> np.ndarray:
+    """DCT coefficients of every whole 8x8 block, shape (rows, cols, 8, 8), level-shifted like JPEG"""
+    dy, dx = offset
+    height = (gray.shape[0] - dy) // 8 * 8
+    width = (gray.shape[1] - dx) // 8 * 8
+    pixels = gray[dy:dy + height, dx:dx + width].astype(np.float32) - 128
+    blocks = pixels.reshape(height // 8, 8, width // 8, 8).swapaxes(1, 2)
+    return DCT_MATRIX @ blocks @ DCT_MATRIX.T
+
+def block_variance(coefficients: np.ndarray) -> np.ndarray:
+    """Per-block pixel variance from the AC energy (Parseval)"""
+    energy = np.square(coefficients).sum(axis=(2, 3)) - np.square(coefficients[..., 0, 0])
+    return energy / 64
+
+# Candidate double-quantization periods: q1 / q2 is generally not an integer
+DQ_PERIODS = np.arange(2, DQ_MAX_PERIOD + 0.001, 0.05)
+
+def _histogram_period(values: np.ndarray) -> Tuple[float, float]:
+    """
+    Period of the double-quantization pattern in a coefficient histogram (0
+    if none), and its periodogram score. The histogram of |v| is compared to
+    its smooth (Laplacian) envelope; the Poisson-normalized residual is white
+    noise for a single compression, so its periodogram is ~1 at every period.
+    """
+    values = values[(values != 0) & (np.abs(values) <= DQ_HIST_RANGE)]
+    if len(values) < DQ_MIN_SAMPLES:
+        return 0.0, 0.0
+    histogram = np.bincount(np.abs(values), minlength=DQ_HIST_RANGE + 1)[1:].astype(np.float64)
+    envelope = cv2.GaussianBlur(histogram.reshape(1, -1), (0, 0), 3).ravel()
+    # Bins with too few samples are noise
+    usable = envelope >= DQ_MIN_BIN_COUNT
+    if usable.sum() < 2 * DQ_MAX_PERIOD:
+        return 0.0, 0.0
+    bins = np.arange(1, len(histogram) + 1)[usable]
+    residual = (histogram[usable] - envelope[usable]) / np.sqrt(envelope[usable])
+    power = np.sum(np.square(residual)) + 1e-9
+
+    scores = np.abs(np.exp(-2j * np.pi * bins[None, :] / DQ_PERIODS[:, None]) @ residual) ** 2 / power
+    best = int(np.argmax(scores))
+    if scores[best] < DQ_PERIOD_THRESHOLD:
+        return 0.0, float(scores[best])
+    return float(DQ_PERIODS[best]), float(scores[best])
+
+def double_quantization_map(quantized: np.ndarray) -> Dict[str, Any]:
+    """
+    Per-block tampering probability from quantized coefficients of shape
+    (rows, cols, DQ_COEFFICIENTS). Blocks without informative coefficients
+    get 0.5.
+    """
+    rows, cols, count = quantized.shape
+    log_tampered = np.zeros((rows, cols))
+    log_untouched = np.zeros((rows, cols))
+    periods: List[float] = []
+    for i in range(count):
+        values = quantized[..., i]
+        period, _ = _histogram_period(values.ravel())
+        periods.append(round(period, 2))
+        if not period:
+            continue
+        # Values u with the same floor(u / period) share a period window
+        low, high = int(values.min()), int(values.max())
+        support = np.arange(low, high + 1)
+        windows = np.floor(support / period).astype(np.int64)
+        windows -= windows[0]
+        histogram = np.bincount((values - low).ravel(), minlength=len(support)).astype(np.float64)
+        window_mass = np.bincount(windows, weights=histogram)[windows]
+        window_width = np.bincount(windows)[windows]
+
+        p_untouched = histogram / np.maximum(window_mass, 1)
+        index = values - low
+        informative = values != 0
+        log_untouched += np.where(informative, np.log(np.maximum(p_untouched[index], 1e-6)), 0)
+        log_tampered += np.where(informative, -np.log(window_width[index]), 0)
+
+    probability = 1 / (1 + np.exp(np.clip(log_untouched - log_tampered, -50, 50)))
+    # Neighbouring blocks share a region's history
+    probability = cv2.blur(probability.astype(np.float32), (3, 3))
+    return {'periods': periods, 'probability': probability}
+
+def _zero_profile(pixels: np.ndarray) -> np.ndarray:
+    """
+    Share of near-zero high-frequency 1-D DCT coefficients of the textured
+    8-pixel row segments starting at each column offset 0-7
+    """
+    height, width = pixels.shape
+    profile = np.zeros(8)
+    for offset in range(8):
+        usable = (width - offset) // 8 * 8
+        if usable == 0:
+            continue
+        segments = pixels[:, offset:offset + usable].reshape(height, -1, 8)
+        # Flat segments have no high frequencies on any grid
+        textured = np.abs(segments - segments.mean(axis=-1, keepdims=True)).sum(axis=-1) > GRID_MIN_TEXTURE
+        if textured.any():
+            high = (segments[textured] @ DCT_MATRIX.T)[:, 3:]
+            profile[offset] = np.mean(np.abs(high) < GRID_ZERO_LEVEL)
+    return profile
+
+def _grid_peak(profiles: Dict[str, np.ndarray], origin: Dict[str, int], exclude_aligned: bool) -> Dict[str, Any]:
+    offsets, strengths = {}, {}
+    candidates = np.arange(1, 8) if exclude_aligned else np.arange(8)
+    for axis, values in profiles.items():
+        peak = int(candidates[np.argmax(values[candidates])])
+        median = float(np.median(values[candidates]))
+        # Offsets relative to the crop, back to image coordinates
+        offsets[axis] = (peak + origin[axis]) % 8
+        strengths[axis] = float((values[peak] - median) / (1 - median)) if median < 1 else 0.0
+    # A compression leaves its grid along both axes
+    strength = min(strengths.values())
+    return {
+        'offset': (offsets['y'], offsets['x']),
+        'strength': round(strength, 4),
+        'present': strength >= GRID_STRENGTH_THRESHOLD,
+    }
+
+def grid_profile(gray: np.ndarray) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Dominant 8x8 quantization grid (row, column offset), and the strongest
+    grid other than the aligned one. Coefficients that were quantized to zero
+    stay near zero only on the grid they were quantized on, so a grid is an
+    offset with an excess of near-zero high-frequency coefficients. A
+    central crop of at most GRID_MAX_SIDE pixels is analysed.
+    """
+    top = max(0, (gray.shape[0] - GRID_MAX_SIDE) // 2)
+    left = max(0, (gray.shape[1] - GRID_MAX_SIDE) // 2)
+    pixels = gray[top:top + GRID_MAX_SIDE, left:left + GRID_MAX_SIDE].astype(np.float32)
+    profiles = {'y': _zero_profile(pixels.T), 'x': _zero_profile(pixels)}
+    origin = {'y': top, 'x': left}
+    return _grid_peak(profiles, origin, False), _grid_peak(profiles, origin, True)
+
+def _downsample(block_map: np.ndarray, max_side: int) -> np.ndarray:
+    factor = max(1, int(np.ceil(max(block_map.shape) / max_side)))
+    if factor == 1:
+        return block_map
+    height, width = block_map.shape[0] // factor * factor, block_map.shape[1] // factor * factor
+    if height == 0 or width == 0:
+        return block_map
+    return block_map[:height, :width].reshape(height // factor, factor, width // factor, factor).mean(axis=(1, 3))
+
+def analyze_jpeg(data: bytes, gray: np.ndarray, block_grid: bool = True) -> Dict[str, Any]:
+    """
+    Compression analysis of an upload: quantization tables and quality,
+    double-quantization periods with the per-block tampering map
+    ('tamper_map', rows x cols of 8x8 blocks), grid alignment and the per-block
+    pixel variance ('block_variance'). With `block_grid` False (`gray` is a
+    reduced decode, whose blocks aren't the file's) only the tables are read.
+    """
+    tables = parse_quantization_tables(data)
+    luminance = tables.get(0)
+    coefficients = block_dct(gray)
+    grid, misaligned = grid_profile(gray) if block_grid else (None, None)
+    result = {
+        'is_jpeg': luminance is not None,
+        'quality': None,
+        'standard_tables': None,
+        'double_compressed': False,
+        'periods': [],
+        'tampered_ratio': 0.0,
+        'grid': grid,
+        'misaligned_grid': None,
+        'block_variance': block_variance(coefficients),
+        'tamper_map': None,
+    }
+    if luminance is None:
+        return result
+
+    result['quality'], result['standard_tables'] = estimate_quality(luminance)
+    if not block_grid:
+        return result
+    # The last compression's grid is aligned; an earlier one on a shifted grid means a crop or paste
+    result['misaligned_grid'] = misaligned
+    positions = ZIGZAG[1:1 + DQ_COEFFICIENTS]
+    rows, cols = coefficients.shape[:2]
+    selected = coefficients.reshape(rows, cols, 64)[..., positions]
+    quantized = np.rint(selected / luminance.ravel()[positions]).astype(np.int32)
+
+    dq = double_quantization_map(quantized)
+    informative = (quantized != 0).any(axis=2)
+    tampered = (dq['probability'] > DQ_TAMPER_THRESHOLD) & informative
+    result.update({
+        'double_compressed': any(dq['periods']),
+        'periods': dq['periods'],
+        'tamper_map': dq['probability'],
+    })
+    if result['double_compressed'] and informative.any():
+        result['tampered_ratio'] = float(tampered.sum() / informative.sum())
+    return result
+
+def compression_summary(analysis: Dict[str, Any], map_side: int = 32) -> Dict[str, Any]:
+    """JSON-friendly summary of analyze_jpeg, with the tamper map downsampled to at most map_side cells"""
+    tamper_map: Optional[list] = None
+    if analysis['tamper_map'] is not None and analysis['double_compressed']:
+        tamper_map = np.round(_downsample(analysis['tamper_map'], map_side), 3).tolist()
+    return {
+        'is_jpeg': analysis['is_jpeg'],
+        'quality': analysis['quality'],
+        'standard_tables': analysis['standard_tables'],
+        'double_compressed': analysis['double_compressed'],
+        'periods': analysis['periods'],
+        'tampered_ratio': round(analysis['tampered_ratio'], 4),
+        'grid': analysis['grid'],
+        'misaligned_grid': analysis['misaligned_grid'],
+        'tamper_map': tamper_map,
+    }
+
+def compression_features(analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """Scalar verifier features of analyze_jpeg"""
+    variance = analysis['block_variance']
+    misaligned = analysis['misaligned_grid']
+    return {
+        'block_variance_mean': float(np.mean(variance)) if variance.size else 0,
+        'block_variance_std': float(np.std(variance)) if variance.size else 0,
+        'jpeg_quality': analysis['quality'] or 0,
+        'jpeg_double_compressed': analysis['double_compressed'],
+        'jpeg_tampered_ratio': analysis['tampered_ratio'],
+        'jpeg_grid_misaligned': bool(misaligned and misaligned['present']),
+    }
@@ -1,10 +1,62 @@
+import json
+import math
 import numpy as np
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
 def to_serializable(val):
     if isinstance(val, np.generic):
         return val.item()
+    if isinstance(val, np.ndarray):
+        return val.tolist()
     if isinstance(val, dict):
         return {k: to_serializable(v) for k, v in val.items()}
-    if isinstance(val, list):
+    if isinstance(val, (list, tuple)):
         return [to_serializable(v) for v in val]
     return val
+
+def _encode_fallback(val):
+    """Called by the encoder only for values it cannot serialize natively"""
+    if isinstance(val, np.generic):
+        return val.item()
+    if isinstance(val, np.ndarray):
+        return val.tolist()
+    if isinstance(val, (set, frozenset)):
+        return list(val)
+    raise TypeError(f"Type is not JSON serializable: {type(val).__name__}")
+
+if ORJSON_AVAILABLE:
+    _ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(content) -> bytes:
+        """Serialize content to JSON bytes, handling numpy scalars and arrays in native code"""
+        return orjson.dumps(content, default=_encode_fallback, option=_ORJSON_OPTIONS)
+else:
+    def _null_non_finite(val):
+        """Replace NaN and infinities with None, as orjson writes them as null"""
+        if isinstance(val, float):
+            return val if math.isfinite(val) else None
+        if isinstance(val, dict):
+            return {k: _null_non_finite(v) for k, v in val.items()}
+        if isinstance(val, (list, tuple)):
+            return [_null_non_finite(v) for v in val]
+        return val
+
+    def dumps(content) -> bytes:
+        """Serialize content to JSON bytes, handling numpy scalars and arrays"""
+        return json.dumps(_null_non_finite(content), default=lambda val: _null_non_finite(_encode_fallback(val)),
+                          ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode('utf-8')
+
+class NumpyJSONResponse(JSONResponse):
+    """
+    JSON response that serializes numpy values directly, so route handlers can
+    return feature dictionaries without a to_serializable pre-walk.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,111 @@
+"""
+Per-request peak memory.
+
+While at least one request is being tracked, a sampler thread reads the
+process resident set size (/proc/self/statm) every MEMORY_SAMPLE_MS; a
+request's peak is the highest sample taken while it ran. Requests running
+concurrently in one process share the process RSS, so their peaks overlap;
+with one analysis per worker the peak is the request's own, up to the
+sampling interval.
+
+    MEMORY_SAMPLE_MS     sampling interval (default: 10, 0 disables sampling)
+"""
+
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from utils.scratch import scratch_bytes
+
+MEMORY_SAMPLE_MS = float(os.getenv('MEMORY_SAMPLE_MS', '10'))
+
+MB = 2**20
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def current_rss() -> Optional[int]:
+    """Resident set size of this process in bytes, or None where /proc isn't available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+def max_rss() -> int:
+    """Highest resident set size of this process so far, in bytes"""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class MemoryTracker:
+    """RSS at the start of a request and the highest RSS sampled while it runs"""
+
+    def __init__(self):
+        self.start_rss = current_rss() or 0
+        self.peak_rss = self.start_rss
+
+    def sample(self, rss: Optional[int] = None):
+        rss = rss if rss is not None else current_rss()
+        if rss is not None and rss > self.peak_rss:
+            self.peak_rss = rss
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'start_rss_mb': round(self.start_rss / MB, 1),
+            'peak_rss_mb': round(self.peak_rss / MB, 1),
+            'peak_delta_mb': round((self.peak_rss - self.start_rss) / MB, 1),
+            'scratch_mb': round(scratch_bytes() / MB, 1),
+        }
+
+_active = set()
+_active_lock = threading.Lock()
+_wake = threading.Event()
+_sampler = None
+_sampler_pid = None
+
+def _sample_loop():
+    while True:
+        _wake.wait()
+        with _active_lock:
+            trackers = list(_active)
+            if not trackers:
+                _wake.clear()
+                continue
+        rss = current_rss()
+        for tracker in trackers:
+            tracker.sample(rss)
+        time.sleep(MEMORY_SAMPLE_MS / 1000)
+
+def _ensure_sampler():
+    global _sampler, _sampler_pid
+    # Threads don't survive fork (see serve.py): start one per process
+    if _sampler is None or _sampler_pid != os.getpid():
+        _sampler = threading.Thread(target=_sample_loop, name='memory-sampler', daemon=True)
+        _sampler_pid = os.getpid()
+        _sampler.start()
+
+@contextmanager
+def track_memory() -> Iterator[MemoryTracker]:
+    """Track the peak RSS of the enclosed work"""
+    tracker = MemoryTracker()
+    if MEMORY_SAMPLE_MS > 0 and current_rss() is not None:
+        with _active_lock:
+            _ensure_sampler()
+            _active.add(tracker)
+            _wake.set()
+    try:
+        yield tracker
+    finally:
+        with _active_lock:
+            _active.discard(tracker)
+        tracker.sample()
+
+def memory_report() -> Dict[str, Any]:
+    """Process-level memory figures for the health endpoint"""
+    rss = current_rss()
+    return {
+        'rss_mb': round(rss / MB, 1) if rss is not None else None,
+        'max_rss_mb': round(max_rss() / MB, 1),
+        'scratch_mb': round(scratch_bytes() / MB, 1),
+    }
@@ -2,7 +2,7 @@
 Comprehensive ML Pipeline for Document Verification
 Implements advanced AI/ML techniques for fake document detection including:
 - OCR with EasyOCR and Tesseract
-- QR code decoding with pyzbar
+- QR code decoding with pyzbar (OpenCV fallback), candidate regions first
 - CNN-based logo/seal tampering detection
 - SVM/XGBoost classification
 - Metadata and EXIF analysis
@@ -23,15 +23,11 @@ import xgboost as xgb
 import joblib
 import os
 import json
-from typing import Dict, List, Tuple, Optional, Any
+from typing import Dict, List, Tuple, Optional, Any, Iterable, Sequence
 import logging
 from datetime import datetime
-import easyocr
-import pytesseract
-from pyzbar import pyzbar
 import qrcode
 from PIL import Image, ExifTags
-import exifread
 from sklearn.cluster import DBSCAN
 from skimage import feature, filters, morphology, measure
 from scipy import ndimage, fft
@@ -41,6 +37,21 @@ import base64
 import warnings
 warnings.filterwarnings('ignore')
 
+from utils.analysis_plan import FEATURE_STAGES
+from utils.block_stats import TileStats
+from utils.concurrency import register_thread_hook, thread_budget
+from utils.easyocr_manager import easyocr_manager
+from utils.face_descriptors import detect_faces, describe_faces
+from utils.image_context import ImageContext, HASH_VIEW_SIDE
+from utils.image_metadata import parse_image_metadata, editing_software_detected
+from utils.jpeg_forensics import analyze_jpeg, compression_features
+from utils.ocr_regions import read_text
+from utils.perceptual_hash import bits_to_int, hash_hex
+from utils.qr_decoding import decode_codes
+from utils.region_proposals import RegionProposer, get_region_proposer
+from utils.scratch import gradient_magnitude, laplacian_variance, mean_std, noise_level, scratch
+from utils.stage_scheduler import Stage, StageRun, stage_scheduler
+
 # Setup logging first
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -168,18 +179,14 @@ class AdvancedDocumentVerifier:
     """
     
     def __init__(self):
-        try:
-            self.ocr_reader = easyocr.Reader(['en', 'hi'])  # English and Hindi
-            logger.info("EasyOCR reader initialized")
-        except Exception as e:
-            logger.warning(f"EasyOCR initialization failed: {e}")
-            self.ocr_reader = None
+        # EasyOCR readers per language set, loaded now so serve.py's workers share them
+        self.ocr_manager = easyocr_manager
+        self.ocr_manager.preload()
             
         self.scaler = StandardScaler()
         self.models = {}
         self.feature_extractors = {}
         self.template_database = {}
-        self.face_database = {}
         
         # Initialize face cascade for OpenCV fallback
         try:
@@ -281,17 +288,20 @@ class AdvancedDocumentVerifier:
                 learning_rate=0.1,
                 subsample=0.8,
                 colsample_bytree=0.8,
-                random_state=42
+                random_state=42,
+                n_jobs=thread_budget()
             )
             self.models['random_forest'] = RandomForestClassifier(
                 n_estimators=200,
                 max_depth=10,
-                random_state=42
+                random_state=42,
+                n_jobs=thread_budget()
             )
             self.models['isolation_forest'] = IsolationForest(
                 contamination=0.1,
                 random_state=42,
-                n_estimators=100
+                n_estimators=100,
+                n_jobs=thread_budget()
             )
             
             # Try to load pre-trained models
@@ -303,65 +313,71 @@ class AdvancedDocumentVerifier:
             
         except Exception as e:
             logger.error(f"Error loading models: {e}")
+
+    def set_thread_budget(self, budget: int):
+        """Limit the models that run their own thread pools (XGBoost, forests) to `budget` threads"""
+        for model_name, model in self.models.items():
+            if 'n_jobs' in model.get_params():
+                model.set_params(n_jobs=budget)
     
-    def extract_comprehensive_features(self, image_path: str, document_type: str = "id-card") -> Dict[str, Any]:
-        """Extract comprehensive features using multiple AI/ML techniques"""
+    def extract_comprehensive_features(self, image_path: str, document_type: str = "id-card",
+                                       stages: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        Extract comprehensive features using multiple AI/ML techniques.
+        `stages` restricts extraction to a subset of FEATURE_STAGES (default: all).
+        Independent stages run concurrently on the stage scheduler.
+        """
         try:
-            # Read image
-            image = cv2.imread(image_path)
-            if image is None:
+            context = ImageContext(image_path, document_type)
+            if not context.is_readable():  # Fail early on unreadable uploads
                 raise ValueError("Could not read image")
-            
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            
-            features = {
-                'image_path': image_path,
-                'document_type': document_type,
-                'timestamp': datetime.now().isoformat(),
-                'image_hash': self.calculate_image_hash(image)
-            }
-            
+
             logger.info(f"Extracting features for {document_type} document")
-            
-            # 1. OCR Features with confidence analysis
-            ocr_features = self.extract_ocr_features(image, gray)
-            features.update(ocr_features)
-            
-            # 2. QR Code Features with validation
-            qr_features = self.extract_qr_features(image, gray)
-            features.update(qr_features)
-            
-            # 3. Digital Forensics Features
-            forensics_features = self.extract_forensics_features(image, gray)
-            features.update(forensics_features)
-            
-            # 4. Face Recognition and Verification Features
-            if document_type in ['id-card', 'passport', 'driver-license', 'aadhar-card']:
-                face_features = self.extract_face_features(image)
-                features.update(face_features)
-            
-            # 5. Logo/Seal Detection Features
-            logo_features = self.extract_logo_features(image, gray, document_type)
-            features.update(logo_features)
-            
-            # 6. Metadata Features
-            metadata_features = self.extract_metadata_features(image_path)
-            features.update(metadata_features)
-            
-            # 7. Texture and Pattern Features
-            texture_features = self.extract_texture_features(gray)
-            features.update(texture_features)
-            
-            # 8. Color Space Analysis
-            color_features = self.extract_color_features(image)
-            features.update(color_features)
-            
-            return features
-            
+            run = stage_scheduler.run(self.feature_stage_graph(context, stages))
+            return self.collect_features(context, run)
+
         except Exception as e:
             logger.error(f"Error extracting features: {e}")
             return {'error': str(e)}
-    
+
+    def feature_stage_graph(self, context: ImageContext, stages: Optional[Iterable[str]] = None) -> List[Stage]:
+        """Scheduler stages for the selected FEATURE_STAGES; each returns a feature dict"""
+        # Stages the document type's pipeline profile skips (e.g. face for types without a photo) don't run
+        stages = (set(FEATURE_STAGES) if stages is None else set(stages)) - context.profile.skip_stages
+        if 'forensics' in stages:
+            stages.discard('quality')  # The forensics features include the quality measurements
+        document_type = context.document_type
+
+        graph = {
+            'ocr': lambda: context.stage('ocr_features', lambda: self.extract_ocr_features(
+                context.image, context.gray, document_type, context.profile.ocr_regions), document_type=document_type),
+            'qr': lambda: self.extract_qr_features(context.image, context.gray, context.codes),
+            'forensics': lambda: self.extract_forensics_features(context.image, context.gray, context.jpeg_forensics),
+            'quality': lambda: self.extract_quality_features(context.image, context.gray),
+            'face': lambda: self.extract_face_features(context.view(context.view_side('face')), context.faces,
+                                                       context.face_descriptors),
+            'logo': lambda: self.extract_logo_features(context.image, context.gray, document_type, context.regions),
+            'metadata': lambda: self.extract_metadata_features(context.image_path, context.data, context.metadata),
+            'texture': lambda: self.extract_texture_features(context.gray),
+            'color': lambda: self.extract_color_features(context.view(context.view_side('color')),
+                                                         context.reduction(context.view_side('color')) ** 2),
+        }
+
+        return [Stage(name, graph[name], default={}) for name in FEATURE_STAGES if name in stages]
+
+    def collect_features(self, context: ImageContext, run: StageRun) -> Dict[str, Any]:
+        """Merge stage results into the feature dict, in FEATURE_STAGES order"""
+        features = {
+            'image_path': context.image_path,
+            'document_type': context.document_type,
+            'timestamp': datetime.now().isoformat(),
+            'image_hash': self.calculate_image_hash(context.view(HASH_VIEW_SIDE))
+        }
+        for name in FEATURE_STAGES:
+            if name in run.results:
+                features.update(run.results[name])
+        return features
+
     def calculate_image_hash(self, image: np.ndarray) -> str:
         """Calculate perceptual hash of image"""
         try:
@@ -369,50 +385,40 @@ class AdvancedDocumentVerifier:
             resized = cv2.resize(image, (8, 8))
             gray = cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY)
             
-            # Calculate average
-            avg = np.mean(gray)
-            
-            # Create hash
-            hash_bits = []
-            for pixel in gray.flatten():
-                hash_bits.append('1' if pixel > avg else '0')
-            
-            # Convert to hex
-            hash_str = ''.join(hash_bits)
-            hash_int = int(hash_str, 2)
-            return format(hash_int, '016x')
+            # Average hash: one bit per pixel above the mean
+            return hash_hex(bits_to_int(gray > np.mean(gray)))
             
         except Exception as e:
             logger.error(f"Image hash calculation error: {e}")
             return "0000000000000000"
     
-    def extract_ocr_features(self, image: np.ndarray, gray: np.ndarray) -> Dict[str, Any]:
-        """Extract OCR-based features"""
+    def extract_ocr_features(self, image: np.ndarray, gray: np.ndarray, document_type: str = "id-card",
+                             regions: Sequence[Dict[str, Any]] = ()) -> Dict[str, Any]:
+        """
+        Extract OCR-based features; EasyOCR reads with the document type's
+        language set, tesseract reads the profile's OCR `regions` first
+        """
         try:
             features = {}
             
-            # EasyOCR extraction
-            if self.ocr_reader is not None:
-                results = self.ocr_reader.readtext(image)
-                features['easyocr_regions_count'] = len(results)
-                easyocr_confidences = [result[2] for result in results if result[2] > 0.1]
-                features['easyocr_confidence_mean'] = np.mean(easyocr_confidences) if easyocr_confidences else 0
+            # EasyOCR region statistics (no text is kept)
+            easyocr_stats = self.ocr_manager.stats(image, gray, document_type)
+            if easyocr_stats is not None:
+                features['easyocr_regions_count'] = easyocr_stats['regions']
+                features['easyocr_confidence_mean'] = easyocr_stats['confidence_mean']
             else:
                 features['easyocr_regions_count'] = 0
                 features['easyocr_confidence_mean'] = 0
             
             # Tesseract OCR
             try:
-                tesseract_text = pytesseract.image_to_string(gray)
-                tesseract_conf = pytesseract.image_to_data(gray, output_type=pytesseract.Output.DICT)
-                
-                confidences = [conf for conf in tesseract_conf['conf'] if conf > 0]
+                tesseract_text, confidences, region_text = read_text(gray, regions)
                 features['ocr_confidence_mean'] = np.mean(confidences) if confidences else 0
                 features['ocr_confidence_std'] = np.std(confidences) if confidences else 0
                 
             except Exception as e:
                 logger.warning(f"Tesseract OCR error: {e}")
-                tesseract_text = ""
+                tesseract_text, region_text = "", {}
                 features['ocr_confidence_mean'] = 0
                 features['ocr_confidence_std'] = 0
             
@@ -439,8 +445,10 @@ class AdvancedDocumentVerifier:
             suspicious_keywords = ['fake', 'fraud', 'sample', 'test', 'dummy', 'specimen', 'copy']
             features['suspicious_text_detected'] = any(keyword in tesseract_text.lower() for keyword in suspicious_keywords)
             
-            # Store extracted text
+            # Store extracted text (the OCR regions' text leads it)
             features['extracted_text'] = tesseract_text[:500]  # Limit to 500 chars
+            if region_text:
+                features['ocr_region_text'] = region_text
             
             return features
             
@@ -458,13 +466,18 @@ class AdvancedDocumentVerifier:
                 'extracted_text': ''
             }
     
-    def extract_qr_features(self, image: np.ndarray, gray: np.ndarray) -> Dict[str, Any]:
-        """Extract QR code and barcode features"""
+    def extract_qr_features(self, image: np.ndarray, gray: np.ndarray, decoded=None) -> Dict[str, Any]:
+        """
+        Extract QR code and barcode features. `decoded` is the image context's
+        decode_codes result, if already available.
+        """
         try:
             features = {}
             
-            # Decode QR codes and barcodes
-            decoded_objects = pyzbar.decode(image)
+            # Decode QR codes and barcodes (candidate crops first, full frame as fallback)
+            if decoded is None:
+                decoded = decode_codes(gray)
+            decoded_objects = decoded['codes']
             
             features['qr_code_count'] = len(decoded_objects)
             features['qr_codes_detected'] = len(decoded_objects) > 0
@@ -474,7 +487,7 @@ class AdvancedDocumentVerifier:
                 qr_data = []
                 for obj in decoded_objects:
                     try:
-                        data = obj.data.decode('utf-8')
+                        data = obj['data'].decode('utf-8')
                         qr_data.append(data)
                     except:
                         continue
@@ -490,17 +503,8 @@ class AdvancedDocumentVerifier:
                 
                 features['aadhaar_qr_pattern'] = aadhaar_pattern
                 
-                # QR code quality assessment
-                qr_quality_scores = []
-                for obj in decoded_objects:
-                    rect = obj.rect
-                    qr_region = gray[rect.top:rect.top+rect.height, rect.left:rect.left+rect.width]
-                    if qr_region.size > 0:
-                        # Calculate quality based on contrast and sharpness
-                        contrast = np.std(qr_region)
-                        laplacian_var = cv2.Laplacian(qr_region, cv2.CV_64F).var()
-                        quality = min(contrast / 50.0, 1.0) * min(laplacian_var / 100.0, 1.0)
-                        qr_quality_scores.append(quality)
+                # QR code quality, measured on the decoded regions
+                qr_quality_scores = [obj['quality'] for obj in decoded_objects]
                 
                 features['qr_quality_mean'] = np.mean(qr_quality_scores) if qr_quality_scores else 0
                 features['qr_quality_std'] = np.std(qr_quality_scores) if qr_quality_scores else 0
@@ -524,47 +528,33 @@ class AdvancedDocumentVerifier:
                 'qr_quality_std': 0
             }
     
-    def extract_forensics_features(self, image: np.ndarray, gray: np.ndarray) -> Dict[str, Any]:
-        """Extract digital forensics features"""
+    def extract_forensics_features(self, image: np.ndarray, gray: np.ndarray,
+                                   jpeg: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Extract digital forensics features. `jpeg` is the compression analysis
+        of the upload (utils.jpeg_forensics.analyze_jpeg), if available.
+        """
         try:
-            features = {}
-            
             # Image quality metrics
-            features['image_width'] = image.shape[1]
-            features['image_height'] = image.shape[0]
-            features['aspect_ratio'] = image.shape[1] / image.shape[0]
-            
-            # Sharpness (Laplacian variance)
-            laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-            features['sharpness'] = laplacian.var()
-            
-            # Brightness and contrast
-            features['brightness'] = np.mean(gray)
-            features['contrast'] = np.std(gray)
-            
-            # Noise analysis
-            noise = gray.astype(np.float32) - cv2.GaussianBlur(gray, (5, 5), 0).astype(np.float32)
-            features['noise_level'] = np.std(noise)
+            features = self.extract_quality_features(image, gray)
             
             # Edge density
             edges = cv2.Canny(gray, 50, 150)
             features['edge_density'] = np.sum(edges > 0) / edges.size
             
             # Gradient analysis for resampling detection
-            gx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-            gy = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-            gradient_magnitude = np.sqrt(gx**2 + gy**2)
-            features['gradient_mean'] = np.mean(gradient_magnitude)
-            features['gradient_std'] = np.std(gradient_magnitude)
+            features['gradient_mean'], features['gradient_std'] = mean_std(gradient_magnitude(gray))
             
             # Copy-paste detection using template matching
             features['copy_paste_score'] = self.detect_copy_paste(gray)
             
             # Frequency domain analysis
-            f_transform = np.fft.fft2(gray)
-            f_shift = np.fft.fftshift(f_transform)
-            magnitude_spectrum = np.log(np.abs(f_shift) + 1)
-            features['freq_domain_energy'] = np.sum(magnitude_spectrum ** 2)
+            features['freq_domain_energy'] = self.frequency_energy(gray)
+            
+            # JPEG compression history from the quantization tables and 8x8 block DCT
+            if jpeg is None:
+                jpeg = analyze_jpeg(b'', gray)
+            features.update(compression_features(jpeg))
             
             return features
             
@@ -575,73 +565,55 @@ class AdvancedDocumentVerifier:
                 'sharpness': 0, 'brightness': 0, 'contrast': 0,
                 'noise_level': 0, 'edge_density': 0,
                 'gradient_mean': 0, 'gradient_std': 0,
-                'copy_paste_score': 0, 'freq_domain_energy': 0
+                'copy_paste_score': 0, 'freq_domain_energy': 0,
+                'block_variance_mean': 0, 'block_variance_std': 0,
+                'jpeg_quality': 0, 'jpeg_double_compressed': False,
+                'jpeg_tampered_ratio': 0, 'jpeg_grid_misaligned': False
             }
     
-    def extract_face_features(self, image: np.ndarray) -> Dict[str, Any]:
-        """Extract face recognition features with OpenCV fallback"""
+    def extract_quality_features(self, image: np.ndarray, gray: np.ndarray) -> Dict[str, Any]:
+        """Image-level quality measurements (the 'quality' stage, also part of the forensics features)"""
+        features = {}
+        features['image_width'] = image.shape[1]
+        features['image_height'] = image.shape[0]
+        features['aspect_ratio'] = image.shape[1] / image.shape[0]
+        
+        # Sharpness (Laplacian variance)
+        features['sharpness'] = laplacian_variance(gray)
+        
+        # Brightness and contrast
+        features['brightness'], features['contrast'] = mean_std(gray)
+        
+        # Noise analysis
+        features['noise_level'] = noise_level(gray)
+        return features
+    
+    def extract_face_features(self, image: np.ndarray, faces=None, descriptors=None) -> Dict[str, Any]:
+        """
+        Extract face features. `faces` and `descriptors` are the shared
+        detections and face descriptors of the image context, if available.
+        """
         try:
             features = {}
             
+            if faces is None:
+                faces = detect_faces(image)
+            features['face_count'] = len(faces)
+            features['face_detected'] = len(faces) > 0
+            
             if FACE_RECOGNITION_AVAILABLE:
-                # Use face_recognition if available
-                rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                face_locations = face_recognition.face_locations(rgb_image)
-                features['face_count'] = len(face_locations)
-                features['face_detected'] = len(face_locations) > 0
-                
-                if face_locations:
-                    face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
-                    if face_encodings:
-                        features['face_encoding_quality'] = np.mean(np.abs(face_encodings[0]))
-                    else:
-                        features['face_encoding_quality'] = 0
-                else:
-                    features['face_encoding_quality'] = 0
-                
+                if descriptors is None:
+                    descriptors = describe_faces(image, faces)
+                features['face_encoding_quality'] = np.mean(np.abs(descriptors[0])) if descriptors else 0
             else:
-                # Use OpenCV cascade as fallback
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-                
-                if self.face_cascade is not None:
-                    faces = self.face_cascade.detectMultiScale(
-                        gray, 
-                        scaleFactor=1.1,
-                        minNeighbors=4,
-                        minSize=(30, 30),
-                        flags=cv2.CASCADE_SCALE_IMAGE
-                    )
-                    
-                    features['face_count'] = len(faces)
-                    features['face_detected'] = len(faces) > 0
-                    features['face_encoding_quality'] = 0.5 if len(faces) > 0 else 0
-                else:
-                    features['face_count'] = 0
-                    features['face_detected'] = False
-                    features['face_encoding_quality'] = 0
+                # OpenCV fallback has no embedding quality
+                features['face_encoding_quality'] = 0.5 if faces else 0
             
             # Face quality assessment
             if features['face_detected']:
-                face_qualities = []
-                if FACE_RECOGNITION_AVAILABLE and 'face_locations' in locals():
-                    for (top, right, bottom, left) in face_locations:
-                        face_width = right - left
-                        face_height = bottom - top
-                        face_area = face_width * face_height
-                        quality = min(face_area / 10000.0, 1.0)
-                        face_qualities.append(quality)
-                else:
-                    # OpenCV fallback quality assessment
-                    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-                    if self.face_cascade is not None:
-                        faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
-                        for (x, y, w, h) in faces:
-                            face_area = w * h
-                            quality = min(face_area / 10000.0, 1.0)
-                            face_qualities.append(quality)
-                
-                features['face_quality_mean'] = np.mean(face_qualities) if face_qualities else 0
-                features['face_quality_std'] = np.std(face_qualities) if face_qualities else 0
+                face_qualities = [min(w * h / 10000.0, 1.0) for (x, y, w, h) in faces]
+                features['face_quality_mean'] = np.mean(face_qualities)
+                features['face_quality_std'] = np.std(face_qualities)
             else:
                 features['face_quality_mean'] = 0
                 features['face_quality_std'] = 0
@@ -662,7 +634,8 @@ class AdvancedDocumentVerifier:
                 'multiple_faces_detected': False
             }
     
-    def extract_logo_features(self, image: np.ndarray, gray: np.ndarray, document_type: str) -> Dict[str, Any]:
+    def extract_logo_features(self, image: np.ndarray, gray: np.ndarray, document_type: str,
+                              regions: Optional[RegionProposer] = None) -> Dict[str, Any]:
         """Extract logo and seal detection features"""
         try:
             features = {}
@@ -671,42 +644,23 @@ class AdvancedDocumentVerifier:
             template_scores = self.match_templates(gray, document_type)
             features.update(template_scores)
             
-            # Contour-based logo detection
-            edges = cv2.Canny(gray, 50, 150)
-            contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            logo_candidates = []
-            for contour in contours:
-                area = cv2.contourArea(contour)
-                if 500 < area < 10000:  # Logo size range
-                    perimeter = cv2.arcLength(contour, True)
-                    if perimeter > 0:
-                        circularity = 4 * np.pi * area / (perimeter ** 2)
-                        x, y, w, h = cv2.boundingRect(contour)
-                        aspect_ratio = w / h
-                        
-                        if 0.7 < aspect_ratio < 1.3 and circularity > 0.3:
-                            logo_candidates.append({
-                                'area': area,
-                                'circularity': circularity,
-                                'aspect_ratio': aspect_ratio,
-                                'x': x, 'y': y, 'w': w, 'h': h
-                            })
+            # Logo-sized, roughly round regions of the edge map
+            table = get_region_proposer(gray, regions).table('canny')
+            logo_candidates = table.subset(
+                (table['area'] > 500) & (table['area'] < 10000) & (table['perimeter'] > 0) &
+                (table['aspect_ratio'] > 0.7) & (table['aspect_ratio'] < 1.3) & (table['circularity'] > 0.3)
+            )
             
             features['logo_candidates_count'] = len(logo_candidates)
             features['logo_detected'] = len(logo_candidates) > 0
             
-            if logo_candidates:
+            if len(logo_candidates):
                 # Expected logo position analysis
                 img_h, img_w = gray.shape
-                expected_logo_position = False
-                for logo in logo_candidates:
-                    x, y = logo['x'], logo['y']
-                    if (x < img_w * 0.3 and y < img_h * 0.3) or (x > img_w * 0.7 and y < img_h * 0.3):
-                        expected_logo_position = True
-                        break
-                
-                features['logo_expected_position'] = expected_logo_position
+                x, y = logo_candidates['x'], logo_candidates['y']
+                features['logo_expected_position'] = bool(np.any(
+                    (y < img_h * 0.3) & ((x < img_w * 0.3) | (x > img_w * 0.7))
+                ))
             else:
                 features['logo_expected_position'] = False
             
@@ -753,49 +707,50 @@ class AdvancedDocumentVerifier:
             logger.error(f"Template matching error: {e}")
             return {'template_match_score': 0, 'expected_template_found': False}
     
-    def extract_metadata_features(self, image_path: str) -> Dict[str, Any]:
-        """Extract metadata features for origin analysis"""
+    def extract_metadata_features(self, image_path: Optional[str], data: Optional[bytes] = None,
+                                  metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Extract metadata features for origin analysis. `data` and `metadata`
+        are the upload bytes and their parsed header, when already available;
+        `image_path` is None for an in-memory image.
+        """
         try:
             features = {}
-            
-            # File metadata
-            file_stats = os.stat(image_path)
-            features['file_size'] = file_stats.st_size
-            features['file_creation_time'] = file_stats.st_ctime
-            features['file_modification_time'] = file_stats.st_mtime
-            
-            # EXIF data analysis
-            try:
-                with open(image_path, 'rb') as f:
-                    tags = exifread.process_file(f)
-                
-                features['camera_make'] = str(tags.get('Image Make', 'Unknown'))
-                features['camera_model'] = str(tags.get('Image Model', 'Unknown'))
-                features['software'] = str(tags.get('Image Software', 'Unknown'))
-                
-                # Suspicious software detection
-                suspicious_software = ['photoshop', 'gimp', 'paint.net', 'canva', 'pixlr']
-                software_lower = features['software'].lower()
-                features['editing_software_detected'] = any(sw in software_lower for sw in suspicious_software)
-                
-            except Exception as e:
-                logger.warning(f"EXIF extraction error: {e}")
-                features.update({
-                    'camera_make': 'Unknown',
-                    'camera_model': 'Unknown',
-                    'software': 'Unknown',
-                    'editing_software_detected': False
-                })
-            
+            if data is None:
+                data = b''
+                if image_path is not None:
+                    with open(image_path, 'rb') as f:
+                        data = f.read()
+            if metadata is None:
+                metadata = parse_image_metadata(data)
+
+            # File metadata (the upload bytes; filesystem times are those of the temporary file)
+            features['file_size'] = len(data)
+
+            # Header (EXIF/XMP) analysis
+            features['camera_make'] = metadata['camera_make'] or 'Unknown'
+            features['camera_model'] = metadata['camera_model'] or 'Unknown'
+            features['software'] = metadata['software'] or 'Unknown'
+            features['image_orientation'] = metadata['orientation'] or 1
+
+            # Suspicious software detection
+            suspicious_software = ['photoshop', 'gimp', 'paint.net', 'canva', 'pixlr']
+            features['editing_software_detected'] = editing_software_detected(metadata, suspicious_software)
+
             # File type verification
             if MAGIC_AVAILABLE:
                 try:
-                    file_type = magic.from_file(image_path, mime=True)
+                    file_type = magic.from_buffer(data[:2048], mime=True)
                     features['file_type'] = file_type
                     features['file_type_mismatch'] = not file_type.startswith('image/')
                 except Exception as e:
                     features['file_type'] = 'Unknown'
                     features['file_type_mismatch'] = False
+            elif image_path is None:
+                # In-memory image: no extension, go by the parsed header
+                header_format = metadata['format']
+                features['file_type'] = f'image/{header_format}' if header_format else 'unknown'
+                features['file_type_mismatch'] = header_format is None
             else:
                 # Simple file type check based on extension
                 file_ext = os.path.splitext(image_path)[1].lower()
@@ -809,11 +764,10 @@ class AdvancedDocumentVerifier:
             logger.error(f"Metadata feature extraction error: {e}")
             return {
                 'file_size': 0,
-                'file_creation_time': 0,
-                'file_modification_time': 0,
                 'camera_make': 'Unknown',
                 'camera_model': 'Unknown',
                 'software': 'Unknown',
+                'image_orientation': 1,
                 'editing_software_detected': False,
                 'file_type': 'Unknown',
                 'file_type_mismatch': False
@@ -863,8 +817,12 @@ class AdvancedDocumentVerifier:
                 'texture_uniformity': 0
             }
     
-    def extract_color_features(self, image: np.ndarray) -> Dict[str, Any]:
-        """Extract color space features"""
+    def extract_color_features(self, image: np.ndarray, pixel_scale: float = 1.0) -> Dict[str, Any]:
+        """
+        Extract color space features. `pixel_scale` is the number of
+        full-resolution pixels per pixel of `image` when it is a reduced view;
+        histogram counts are scaled by it so features match the full image.
+        """
         try:
             features = {}
             
@@ -890,6 +848,8 @@ class AdvancedDocumentVerifier:
             hist_b = cv2.calcHist([image], [0], None, [32], [0, 256])
             hist_g = cv2.calcHist([image], [1], None, [32], [0, 256])
             hist_r = cv2.calcHist([image], [2], None, [32], [0, 256])
+            if pixel_scale != 1.0:
+                hist_b, hist_g, hist_r = hist_b * pixel_scale, hist_g * pixel_scale, hist_r * pixel_scale
             
             features['color_hist_entropy'] = -np.sum(hist_b * np.log2(hist_b + 1e-10))
             features['color_uniformity'] = np.sum(hist_b ** 2) + np.sum(hist_g ** 2) + np.sum(hist_r ** 2)
@@ -908,27 +868,50 @@ class AdvancedDocumentVerifier:
                 'color_hist_entropy': 0, 'color_uniformity': 0
             }
     
+    def frequency_energy(self, gray: np.ndarray) -> float:
+        """
+        Sum of the squared log magnitude spectrum (log(|F| + 1))^2 over the
+        full 2-D spectrum, from the complex64 half spectrum of a real FFT
+        """
+        pixels = scratch('fft_input', gray.shape)
+        pixels[...] = gray
+        spectrum = fft.rfft2(pixels)
+        magnitude = np.abs(spectrum, out=scratch('fft_magnitude', spectrum.shape))
+        del spectrum
+        np.log1p(magnitude, out=magnitude)
+        magnitude *= magnitude
+        columns = magnitude.sum(axis=0, dtype=np.float64)
+        # Columns 1..ceil(w/2)-1 stand for their conjugate-symmetric twins as well
+        twins = columns[1:(gray.shape[1] + 1) // 2].sum()
+        return float(columns.sum() + twins)
+
     def detect_copy_paste(self, gray: np.ndarray, block_size: int = 32) -> float:
-        """Detect copy-paste operations"""
+        """
+        Detect copy-paste operations: mean normalized cross-correlation
+        (TM_CCOEFF_NORMED) of every block with every block in a later block row
+        """
         try:
-            h, w = gray.shape
-            similarity_scores = []
-            
-            for i in range(0, h - block_size, block_size):
-                for j in range(0, w - block_size, block_size):
-                    block = gray[i:i+block_size, j:j+block_size]
-                    
-                    # Compare with other blocks
-                    for ii in range(i + block_size, h - block_size, block_size):
-                        for jj in range(0, w - block_size, block_size):
-                            compare_block = gray[ii:ii+block_size, jj:jj+block_size]
-                            
-                            # Calculate normalized cross-correlation
-                            correlation = cv2.matchTemplate(block, compare_block, cv2.TM_CCOEFF_NORMED)
-                            similarity_scores.append(correlation[0, 0])
+            tiles = TileStats(gray, block_size)
+            if tiles.shape[0] < 2:
+                return 0.0
+            blocks = tiles.flat().astype(np.float64)
+            blocks -= blocks.mean(axis=1, keepdims=True)
+            norms = np.linalg.norm(blocks, axis=1)
+            # matchTemplate scores a flat template 1, a flat block against any other template 0
+            flat = norms < 1e-6
+            blocks[~flat] /= norms[~flat, None]
+            blocks[flat] = 0
+            
+            # Correlations with all blocks in later rows: each block row's sum against the suffix sums
+            rows, cols = tiles.shape
+            row_sums = blocks.reshape(rows, cols, -1).sum(axis=1)
+            later_sums = np.cumsum(row_sums[::-1], axis=0)[::-1]
+            later_flat = np.cumsum(flat.reshape(rows, cols).sum(axis=1)[::-1])[::-1]
+            total = np.sum(row_sums[:-1] * later_sums[1:]) + cols * np.sum(later_flat[1:])
+            pairs = cols * cols * rows * (rows - 1) / 2
             
             # Return mean similarity score
-            return np.mean(similarity_scores) if similarity_scores else 0.0
+            return float(total / pairs)
             
         except Exception as e:
             logger.error(f"Copy-paste detection error: {e}")
@@ -1152,6 +1135,7 @@ class AdvancedDocumentVerifier:
 
 # Global instance
 ml_verifier = AdvancedDocumentVerifier()
+register_thread_hook('ml_models', ml_verifier.set_thread_budget)
 
 # Helper function for backward compatibility
 def verify_document(image_path: str, document_type: str = "id-card") -> Dict[str, Any]:
@@ -0,0 +1,120 @@
+"""
+Noise-inconsistency localization.
+
+The noise residual (grayscale minus its 5x5 Gaussian blur) is summarised by
+its variance over NOISE_WINDOW x NOISE_WINDOW windows sliding with a stride
+of a quarter window, so a spliced region straddling a fixed grid still
+fills whole windows. Window sums come from the integral and squared integral
+images (cv2.integral2): four lookups per window, whatever its size.
+
+Each window's inconsistency is the natural log of its variance over the
+median window variance. Windows beyond NOISE_INCONSISTENCY_THRESHOLD either
+way are grouped into connected regions, reported as pixel boxes strongest
+first. The legacy scalar score (coefficient of variation of the local noise
+variance) is derived from the same map.
+"""
+
+import os
+import logging
+from typing import Any, Dict, List
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+NOISE_WINDOW = int(os.getenv('NOISE_WINDOW', '64'))
+# |log variance ratio| to the median window for a window to count as inconsistent (1.4 ~ 2x the noise std)
+NOISE_INCONSISTENCY_THRESHOLD = float(os.getenv('NOISE_INCONSISTENCY_THRESHOLD', '1.4'))
+NOISE_TOP_REGIONS = int(os.getenv('NOISE_TOP_REGIONS', '5'))
+
+# Added to window variances so flat (noise-free) windows don't dominate the log ratio
+NOISE_VARIANCE_FLOOR = 1.0
+
+def noise_residual(gray: np.ndarray) -> np.ndarray:
+    """Signed high-frequency residual of a grayscale image"""
+    pixels = gray.astype(np.float32)
+    return pixels - cv2.GaussianBlur(pixels, (5, 5), 0)
+
+def window_variance(values: np.ndarray, window: int, step: int) -> np.ndarray:
+    """
+    Variance of `values` over window x window windows whose top-left corners
+    are every `step` pixels (rows x cols of window positions).
+    """
+    height, width = values.shape
+    sums, squares = cv2.integral2(values, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+    top = np.arange(0, height - window + 1, step)
+    left = np.arange(0, width - window + 1, step)
+
+    def window_sums(integral):
+        a = integral[np.ix_(top, left)]
+        b = integral[np.ix_(top, left + window)]
+        c = integral[np.ix_(top + window, left)]
+        d = integral[np.ix_(top + window, left + window)]
+        return d - b - c + a
+
+    count = window * window
+    mean = window_sums(sums) / count
+    return np.maximum(window_sums(squares) / count - mean ** 2, 0)
+
+def _regions(ratio: np.ndarray, step: int, window: int) -> List[Dict[str, Any]]:
+    """Connected inconsistent windows as pixel boxes, strongest first"""
+    inconsistent = (np.abs(ratio) > NOISE_INCONSISTENCY_THRESHOLD).astype(np.uint8)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(inconsistent, connectivity=8)
+    regions = []
+    for label in range(1, count):
+        left, top, cols, rows = stats[label, :4]
+        values = ratio[labels == label]
+        peak = values[np.argmax(np.abs(values))]
+        regions.append({
+            'box': (int(left * step), int(top * step), int((cols - 1) * step + window), int((rows - 1) * step + window)),
+            'score': round(float(abs(peak)), 3),
+            'noise': 'higher' if peak > 0 else 'lower',
+            'windows': int(stats[label, cv2.CC_STAT_AREA]),
+        })
+    regions.sort(key=lambda region: region['score'], reverse=True)
+    return regions
+
+def analyze_noise(gray: np.ndarray, window: int = NOISE_WINDOW) -> Dict[str, Any]:
+    """
+    Sliding-window noise variance of a grayscale image: the log-ratio map
+    ('ratio', one cell per window position, `step` pixels apart), the
+    inconsistent regions, the share of inconsistent windows and the
+    coefficient of variation of the local variance ('score').
+    """
+    step = max(1, window // 4)
+    result = {'window': window, 'step': step, 'score': 0.0, 'inconsistent_ratio': 0.0,
+              'regions': [], 'ratio': np.zeros((0, 0))}
+    if min(gray.shape[:2]) < window:
+        return result
+
+    variance = window_variance(noise_residual(gray), window, step)
+    mean = float(variance.mean())
+    log_variance = np.log(variance + NOISE_VARIANCE_FLOOR)
+    ratio = log_variance - np.median(log_variance)
+    result.update({
+        'score': float(variance.std() / mean) if mean > 0 else 0.0,
+        'inconsistent_ratio': float(np.mean(np.abs(ratio) > NOISE_INCONSISTENCY_THRESHOLD)),
+        'regions': _regions(ratio, step, window)[:NOISE_TOP_REGIONS],
+        'ratio': ratio,
+    })
+    return result
+
+def noise_summary(analysis: Dict[str, Any], map_side: int = 32) -> Dict[str, Any]:
+    """JSON-friendly summary of analyze_noise, with the |log ratio| heatmap resized to at most map_side cells"""
+    heatmap = None
+    ratio = analysis['ratio']
+    if ratio.size:
+        scale = min(1.0, map_side / max(ratio.shape))
+        size = (max(1, round(ratio.shape[1] * scale)), max(1, round(ratio.shape[0] * scale)))
+        heatmap = cv2.resize(np.abs(ratio).astype(np.float32), size, interpolation=cv2.INTER_AREA)
+        # Rounded in float64: float32 values such as 1.123 would serialize as 1.1230000257
+        heatmap = np.round(heatmap.astype(np.float64), 3).tolist()
+    return {
+        'window': analysis['window'],
+        'step': analysis['step'],
+        'score': round(analysis['score'], 4),
+        'inconsistent_ratio': round(analysis['inconsistent_ratio'], 4),
+        'regions': analysis['regions'],
+        'heatmap': heatmap,
+    }
@@ -0,0 +1,56 @@
+"""
+Region-ordered tesseract OCR.
+
+A pipeline profile's ocr_regions name horizontal bands of the page (top and
+bottom as fractions of its height) that are read first, in the listed order
+and each with its own tesseract options - a passport's machine-readable zone
+with the MRZ character set, say. The rest of the page is read afterwards,
+top to bottom, so the regions' text leads the extracted text. Without
+regions the page is read in one pass, as before.
+"""
+
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+import pytesseract
+
+from utils.deadlines import tesseract_timeout
+
+# Name of the parts of the page outside every configured region
+REST_OF_PAGE = 'rest'
+
+def ocr_bands(gray: np.ndarray, regions: Sequence[Dict[str, Any]] = ()) -> List[Tuple[str, str, np.ndarray]]:
+    """(name, tesseract config, band) in reading order: the regions, then the rest of the page"""
+    if not regions:
+        return [(REST_OF_PAGE, '', gray)]
+    height = gray.shape[0]
+    rows = np.zeros(height, bool)
+    bands = []
+    for region in regions:
+        top, bottom = (int(round(fraction * height)) for fraction in region['band'])
+        if bottom > top:
+            bands.append((region['name'], region['tesseract_config'], gray[top:bottom]))
+            rows[top:bottom] = True
+
+    # Uncovered row runs, top to bottom
+    edges = np.flatnonzero(np.diff(np.concatenate(([1], rows.view(np.int8), [1]))))
+    for top, bottom in zip(edges[::2], edges[1::2]):
+        bands.append((REST_OF_PAGE, '', gray[top:bottom]))
+    return bands
+
+def read_text(gray: np.ndarray, regions: Sequence[Dict[str, Any]] = ()) -> Tuple[str, List[float], Dict[str, str]]:
+    """
+    Tesseract text of the page in region order, the positive word
+    confidences, and the text of each configured region. Each call is
+    bounded by the request's deadline, if it has one.
+    """
+    texts, confidences, region_text = [], [], {}
+    for name, config, band in ocr_bands(gray, regions):
+        text = pytesseract.image_to_string(band, config=config, timeout=tesseract_timeout())
+        data = pytesseract.image_to_data(band, config=config, output_type=pytesseract.Output.DICT,
+                                         timeout=tesseract_timeout())
+        texts.append(text)
+        confidences.extend(float(conf) for conf in data['conf'] if float(conf) > 0)
+        if name != REST_OF_PAGE:
+            region_text[name] = text.strip()
+    return ''.join(texts), confidences, region_text
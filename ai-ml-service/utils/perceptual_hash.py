@@ -0,0 +1,52 @@
+"""
+64-bit perceptual hashes of document images.
+
+- average hash: 8x8 thumbnail thresholded at its mean
+- difference hash: sign of horizontal gradients of a 9x8 thumbnail
+- perceptual hash: 8x8 lowest frequencies of the DCT of a 32x32 thumbnail,
+  thresholded at their median; the most robust to re-compression, rescaling
+  and small local edits, so it keys the near-duplicate index
+
+Hashes are unsigned 64-bit integers (first pixel = most significant bit);
+the Hamming distance between two hashes is the number of differing bits.
+"""
+
+from typing import Dict
+
+import cv2
+import numpy as np
+
+def _to_gray(image: np.ndarray) -> np.ndarray:
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+def bits_to_int(bits: np.ndarray) -> int:
+    """Pack 64 booleans, most significant first, into an int"""
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+def average_hash(gray: np.ndarray) -> int:
+    thumb = cv2.resize(gray, (8, 8), interpolation=cv2.INTER_AREA)
+    return bits_to_int(thumb > thumb.mean())
+
+def difference_hash(gray: np.ndarray) -> int:
+    thumb = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return bits_to_int(thumb[:, 1:] > thumb[:, :-1])
+
+def perceptual_hash(gray: np.ndarray) -> int:
+    thumb = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(thumb)[:8, :8]
+    return bits_to_int(low > np.median(low))
+
+def image_hashes(image: np.ndarray) -> Dict[str, int]:
+    """All three hashes of a BGR or grayscale image"""
+    gray = _to_gray(image)
+    return {
+        'ahash': average_hash(gray),
+        'dhash': difference_hash(gray),
+        'phash': perceptual_hash(gray),
+    }
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+def hash_hex(value: int) -> str:
+    return format(value, '016x')
@@ -0,0 +1,206 @@
+"""
+Per-document-type pipeline profiles.
+
+config/pipeline_profiles.json declares what the analyzers do with each
+document type; types without an entry use its "default" profile, and the
+other profiles only list the keys they change (nested dicts are merged):
+
+    skip_stages           stages not run: feature stages (FEATURE_STAGES),
+                          'legacy.<analysis>', 'compression_analysis',
+                          'noise_analysis'. Skipping a legacy analysis drops
+                          the legacy verdict, like a partial field selection.
+                          Face checks (face stage, face index, "no face"
+                          anomaly) apply to the types that run 'face'.
+    view_sides            longest side of the reduced view used by the
+                          'face', 'color' and 'quality' stages (default: the
+                          *_VIEW_SIDE settings of utils.image_context)
+    ocr_languages         EasyOCR language set (default: EASYOCR_LANGUAGES)
+    ocr_regions           bands tesseract reads first, in order, before the
+                          rest of the page: {"name", "band": [top, bottom]
+                          as fractions of the height, "tesseract_config"}
+                          (see utils.ocr_regions)
+    aadhaar_qr            verify the Aadhaar secure QR first, and use its data
+                          instead of OCR when it validates
+    time_budget_seconds   wall-clock budget of the stage run; stages still
+                          running or not started by then contribute their
+                          default result (null: per-stage timeouts only)
+    format                format specification (aspect_ratio_range null: any)
+    structure_weights     structure score of a text region, a photo region
+                          and the rest of the layout (/validate-format)
+
+The run time of each profile and of its stages is recorded for /health,
+and is the expected cost a deadline is checked against (utils.deadlines).
+
+    PIPELINE_PROFILES_PATH   profile registry (default: config/pipeline_profiles.json)
+"""
+
+import copy
+import json
+import os
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from utils.analysis_plan import FEATURE_STAGES, LEGACY_ANALYSES
+from utils.ocr_regions import REST_OF_PAGE
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_PROFILES_PATH = os.getenv('PIPELINE_PROFILES_PATH', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config', 'pipeline_profiles.json'))
+
+DEFAULT_PROFILE = 'default'
+
+# Stage names a profile can skip
+PROFILE_STAGES = frozenset(FEATURE_STAGES) | {'legacy.' + name for name in LEGACY_ANALYSES} | {
+    'compression_analysis', 'noise_analysis'}
+
+# Consumers of reduced views
+VIEW_CONSUMERS = ('face', 'color', 'quality')
+
+# Keys of an ocr_regions entry
+OCR_REGION_KEYS = frozenset({'name', 'band', 'tesseract_config'})
+
+# Keys every profile has, for a registry missing them
+PROFILE_DEFAULTS = {
+    'skip_stages': [],
+    'view_sides': {},
+    'ocr_languages': None,
+    'ocr_regions': [],
+    'aadhaar_qr': False,
+    'time_budget_seconds': None,
+    'format': {
+        'aspect_ratio_range': None,
+        'min_dimensions': [400, 600],
+        'recommended_dimensions': [800, 1200],
+        'required_elements': [],
+        'color_requirements': 'any',
+    },
+    'structure_weights': {'text': 0.7, 'photo': 0.0, 'other': 0.3},
+}
+
+def _merge(base: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
+    merged = copy.deepcopy(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key].update(value)
+        else:
+            merged[key] = value
+    return merged
+
+def _ocr_region(profile: str, region: Dict[str, Any]) -> Dict[str, Any]:
+    unknown = set(region) - OCR_REGION_KEYS
+    if unknown:
+        raise ValueError(f"Profile '{profile}': unknown OCR region keys {', '.join(sorted(unknown))}")
+    if not region.get('name') or region['name'] == REST_OF_PAGE:
+        raise ValueError(f"Profile '{profile}': OCR regions need a name other than '{REST_OF_PAGE}'")
+    band = region.get('band') or ()
+    if len(band) != 2 or not 0 <= band[0] < band[1] <= 1:
+        raise ValueError(f"Profile '{profile}': OCR region '{region['name']}' band must be [top, bottom] within [0, 1]")
+    return {'name': region['name'], 'band': (float(band[0]), float(band[1])),
+            'tesseract_config': region.get('tesseract_config', '')}
+
+class PipelineProfile:
+    """What the analysis runs for one document type"""
+
+    def __init__(self, name: str, settings: Dict[str, Any]):
+        unknown = set(settings) - set(PROFILE_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Profile '{name}': unknown keys {', '.join(sorted(unknown))}")
+        unknown = set(settings['skip_stages']) - PROFILE_STAGES
+        if unknown:
+            raise ValueError(f"Profile '{name}': unknown stages {', '.join(sorted(unknown))}")
+        unknown = set(settings['view_sides']) - set(VIEW_CONSUMERS)
+        if unknown:
+            raise ValueError(f"Profile '{name}': unknown view consumers {', '.join(sorted(unknown))}")
+
+        self.name = name
+        self.skip_stages = frozenset(settings['skip_stages'])
+        self.view_sides = {consumer: int(side) for consumer, side in settings['view_sides'].items() if side}
+        self.ocr_languages = tuple(settings['ocr_languages']) if settings['ocr_languages'] else None
+        self.ocr_regions = tuple(_ocr_region(name, region) for region in settings['ocr_regions'])
+        self.aadhaar_qr = bool(settings['aadhaar_qr'])
+        self.time_budget = settings['time_budget_seconds']
+        self.format = {key: tuple(value) if isinstance(value, list) else value
+                       for key, value in settings['format'].items()}
+        self.structure_weights = dict(settings['structure_weights'])
+
+    def runs(self, stage: str) -> bool:
+        return stage not in self.skip_stages
+
+    def format_specifications(self) -> Dict[str, Any]:
+        """Format specification without the unset entries"""
+        return {key: value for key, value in self.format.items() if value is not None}
+
+    def __repr__(self):
+        return f"PipelineProfile({self.name!r}, skip_stages={sorted(self.skip_stages)})"
+
+def load_pipeline_profiles(path: str = PIPELINE_PROFILES_PATH) -> Dict[str, PipelineProfile]:
+    """
+    Profiles by document type, from the registry at `path`. A missing file
+    leaves only the built-in default; an invalid one raises ValueError.
+    """
+    try:
+        with open(path) as f:
+            registry = json.load(f)
+    except FileNotFoundError:
+        logger.error(f"Pipeline profile registry {path} not found, using the built-in default profile")
+        registry = {}
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid pipeline profile registry {path}: {e}")
+
+    default = _merge(PROFILE_DEFAULTS, registry.get(DEFAULT_PROFILE, {}))
+    profiles = {name: PipelineProfile(name, _merge(default, settings))
+                for name, settings in registry.items() if name != DEFAULT_PROFILE}
+    profiles[DEFAULT_PROFILE] = PipelineProfile(DEFAULT_PROFILE, default)
+    logger.info(f"Loaded pipeline profiles: {', '.join(sorted(profiles))}")
+    return profiles
+
+pipeline_profiles = load_pipeline_profiles()
+
+def get_pipeline_profile(document_type: Optional[str]) -> PipelineProfile:
+    """The document type's profile, or the default one"""
+    return pipeline_profiles.get(document_type) or pipeline_profiles[DEFAULT_PROFILE]
+
+class ProfileCosts:
+    """Stage run times per profile, for the health endpoint and deadline checks"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._runs: Dict[str, int] = {}
+        self._seconds: Dict[str, float] = {}
+        # profile -> stage -> [completed runs, total seconds]
+        self._stage_seconds: Dict[str, Dict[str, list]] = {}
+
+    def record(self, profile: PipelineProfile, run):
+        """Add a StageRun of `profile`; stages cut short by a deadline or not run don't count"""
+        with self._lock:
+            self._runs[profile.name] = self._runs.get(profile.name, 0) + 1
+            self._seconds[profile.name] = self._seconds.get(profile.name, 0.0) + run.elapsed
+            stages = self._stage_seconds.setdefault(profile.name, {})
+            for stage, seconds in run.timings.items():
+                if run.status.get(stage) in ('ok', 'error'):
+                    totals = stages.setdefault(stage, [0, 0.0])
+                    totals[0] += 1
+                    totals[1] += seconds
+
+    def expected_seconds(self, profile: PipelineProfile, stage: str) -> Optional[float]:
+        """Mean run time of `stage` under `profile` in this process, None before it has completed once"""
+        with self._lock:
+            totals = self._stage_seconds.get(profile.name, {}).get(stage)
+            return totals[1] / totals[0] if totals else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                name: {
+                    'runs': runs,
+                    'mean_seconds': round(self._seconds[name] / runs, 3),
+                    'stage_mean_seconds': {stage: round(seconds / count, 3)
+                                           for stage, (count, seconds) in sorted(self._stage_seconds[name].items())},
+                }
+                for name, runs in sorted(self._runs.items())
+            }
+
+# Shared by the request handlers and job workers of this process
+profile_costs = ProfileCosts()
@@ -0,0 +1,157 @@
+"""
+ROI-first QR code and barcode decoding.
+
+zbar scans every row of the frame it is given, which dominates QR decoding
+on multi-megapixel uploads where the code covers a few percent of the page.
+Codes are therefore localized on a downscaled copy first - QR finder patterns
+with OpenCV's QR detector, 1D barcodes by their strong one-directional
+gradients - and only the candidate crops are decoded at full resolution
+(upscaled when small). The downscaled copy is at most QR_LOCATE_MAX_SIDE
+on its longer side, but never reduced more than QR_LOCATE_MAX_REDUCTION
+times, so the modules of dense codes on very large pages stay resolvable.
+Most pages carry no code at all, so a page where no QR finder patterns are
+found is done after that first pass. When finder
+patterns were found but didn't decode, or the document type is expected to
+carry a QR (the pipeline profile's aadhaar_qr), the page is located again at
+twice the resolution and then scanned in full.
+
+pyzbar is used when the zbar library is available; otherwise QR codes are
+decoded with OpenCV's decoder (1D barcodes then need zbar).
+"""
+
+import os
+import logging
+from typing import Any, Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+try:
+    from pyzbar import pyzbar
+    PYZBAR_AVAILABLE = True
+except ImportError:
+    PYZBAR_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+QR_LOCATE_MAX_SIDE = int(os.getenv('QR_LOCATE_MAX_SIDE', '1600'))
+QR_MIN_CROP_SIDE = int(os.getenv('QR_MIN_CROP_SIDE', '400'))
+QR_LOCATE_MAX_REDUCTION = 3
+QR_CROP_MARGIN = 0.15
+
+Box = Tuple[int, int, int, int]  # left, top, width, height
+
+def _downscale(gray: np.ndarray, max_side: int) -> Tuple[np.ndarray, float]:
+    scale = min(1.0, max_side / max(gray.shape[:2]))
+    if scale == 1.0:
+        return gray, 1.0
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale
+
+def _expand(box: Box, shape, margin: float = QR_CROP_MARGIN) -> Box:
+    """Grow a box by `margin` on each side (the quiet zone), clipped to the image"""
+    x, y, w, h = box
+    dx, dy = int(w * margin) + 2, int(h * margin) + 2
+    left, top = max(0, x - dx), max(0, y - dy)
+    right, bottom = min(shape[1], x + w + dx), min(shape[0], y + h + dy)
+    return left, top, right - left, bottom - top
+
+def _qr_locator():
+    # The ArUco-based detector finds finder patterns faster and at lower resolution
+    return cv2.QRCodeDetectorAruco() if hasattr(cv2, 'QRCodeDetectorAruco') else cv2.QRCodeDetector()
+
+def locate_qr_codes(small: np.ndarray) -> List[Box]:
+    """QR candidates from finder-pattern detection on a downscaled image"""
+    try:
+        found, points = _qr_locator().detectMulti(small)
+    except cv2.error:
+        return []
+    if not found or points is None:
+        return []
+    return [cv2.boundingRect(np.asarray(quad, np.float32)) for quad in points]
+
+def locate_barcodes(small: np.ndarray) -> List[Box]:
+    """1D barcode candidates: blobs of strong horizontal-minus-vertical gradient"""
+    gx = cv2.Sobel(small, cv2.CV_16S, 1, 0, ksize=-1)
+    gy = cv2.Sobel(small, cv2.CV_16S, 0, 1, ksize=-1)
+    gradient = cv2.convertScaleAbs(cv2.subtract(cv2.convertScaleAbs(gx), cv2.convertScaleAbs(gy)))
+    blurred = cv2.blur(gradient, (9, 9))
+    _, mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (21, 7)))
+    mask = cv2.dilate(cv2.erode(mask, None, iterations=4), None, iterations=4)
+
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+    min_area = 0.002 * small.shape[0] * small.shape[1]
+    return [tuple(int(v) for v in stats[i, :4]) for i in range(1, count)
+            if stats[i, cv2.CC_STAT_AREA] >= min_area and stats[i, cv2.CC_STAT_WIDTH] > stats[i, cv2.CC_STAT_HEIGHT]]
+
+def _decode(image: np.ndarray) -> List[Tuple[bytes, str, Box]]:
+    """Decode every code in `image`: (data, symbology, box within image)"""
+    if PYZBAR_AVAILABLE:
+        return [(obj.data, obj.type, tuple(obj.rect)) for obj in pyzbar.decode(image)]
+
+    found, texts, points, _ = cv2.QRCodeDetector().detectAndDecodeMulti(image)
+    if not found:
+        return []
+    return [(text.encode('utf-8'), 'QRCODE', cv2.boundingRect(np.asarray(quad, np.float32)))
+            for text, quad in zip(texts, points) if text]
+
+def _decode_crop(gray: np.ndarray, box: Box) -> List[Tuple[bytes, str, Box]]:
+    x, y, w, h = box
+    crop = gray[y:y + h, x:x + w]
+    scale = max(1.0, QR_MIN_CROP_SIDE / max(1, min(w, h)))
+    if scale > 1.0:
+        crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+    results = []
+    for data, kind, (cx, cy, cw, ch) in _decode(crop):
+        # Back to full-resolution coordinates
+        results.append((data, kind, (x + int(cx / scale), y + int(cy / scale),
+                                     max(1, int(cw / scale)), max(1, int(ch / scale)))))
+    return results
+
+def code_quality(gray: np.ndarray, box: Box) -> float:
+    """Contrast times sharpness of a decoded code's region, both capped at 1"""
+    x, y, w, h = box
+    region = gray[y:y + h, x:x + w]
+    if region.size == 0:
+        return 0.0
+    contrast = np.std(region)
+    laplacian_var = cv2.Laplacian(region, cv2.CV_64F).var()
+    return float(min(contrast / 50.0, 1.0) * min(laplacian_var / 100.0, 1.0))
+
+def decode_codes(gray: np.ndarray, max_side: int = QR_LOCATE_MAX_SIDE, expect_qr: bool = False) -> Dict[str, Any]:
+    """
+    Decode QR codes and barcodes of a grayscale page. `expect_qr` keeps
+    looking (twice the resolution, then the full frame) when nothing is
+    found, for document types that should carry a QR code.
+
+    Returns {'codes': [{'data', 'type', 'rect', 'quality'}], 'method': 'roi' |
+    'full_scan' | 'none', 'candidates': n}; `rect` is (left, top, width,
+    height) in full-resolution pixels.
+    """
+    decoded, method = [], 'roi'
+    candidates, qr_found = [], False
+    side = max(max_side, max(gray.shape[:2]) // QR_LOCATE_MAX_REDUCTION)
+    for side in (side, 2 * side):
+        small, scale = _downscale(gray, side)
+        qr_boxes = locate_qr_codes(small)
+        qr_found = qr_found or bool(qr_boxes)
+        candidates = [_expand(tuple(int(round(v / scale)) for v in box), gray.shape)
+                      for box in qr_boxes + (locate_barcodes(small) if PYZBAR_AVAILABLE else [])]
+        for box in candidates:
+            decoded.extend(_decode_crop(gray, box))
+        # Finder patterns that didn't decode, or no code where one is expected: retry once at twice the size
+        if decoded or scale == 1.0 or not (qr_found or expect_qr):
+            break
+
+    if not decoded and (qr_found or expect_qr):
+        decoded, method = _decode(gray), 'full_scan'
+    if not decoded:
+        method = 'none'
+
+    codes, seen = [], set()
+    for data, kind, box in decoded:
+        if (data, kind) in seen:
+            continue
+        seen.add((data, kind))
+        codes.append({'data': data, 'type': kind, 'rect': box, 'quality': code_quality(gray, box)})
+    return {'codes': codes, 'method': method, 'candidates': len(candidates)}
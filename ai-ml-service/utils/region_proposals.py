@@ -0,0 +1,155 @@
+"""
+Region proposals shared by the logo, signature, text, photo and QR detectors.
+
+Each binarization of a grayscale image is traced once with cv2.findContours
+and turned into a columnar table of region stats (bounding box, area,
+perimeter, aspect ratio, extent, circularity). The stats are computed for all
+contours at once from the concatenated contour points (shoelace area, polyline
+length and min/max reductions per contour), giving the same values as
+contourArea, arcLength and boundingRect. Detectors select regions with
+vectorized masks over the columns instead of looping over contours in Python.
+
+Convex-hull solidity and polygon-approximation vertex counts are only
+computed for the regions a detector has already narrowed down to.
+
+A proposer given the content hash of the upload keeps its tables in the
+process-wide stage cache (utils.stage_cache), so other routes analyzing the
+same file reuse them.
+"""
+
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from utils.stage_cache import stage_cache
+
+# Binarizations used by the detectors, by name
+BINARIZATIONS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    'canny': lambda gray: cv2.Canny(gray, 50, 150),
+    'bin127': lambda gray: cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)[1],
+    'inv127': lambda gray: cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY_INV)[1],
+    'otsu': lambda gray: cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1],
+    'otsu_inv': lambda gray: cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1],
+}
+
+class RegionTable:
+    """
+    Columnar region stats. Columns are numpy arrays indexed by region:
+    index, x, y, w, h, area, perimeter, aspect_ratio, extent, circularity
+    """
+
+    COLUMNS = ('index', 'x', 'y', 'w', 'h', 'area', 'perimeter',
+               'aspect_ratio', 'extent', 'circularity')
+
+    def __init__(self, contours, columns: Dict[str, np.ndarray]):
+        self.contours = contours
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns['index'])
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.columns[column]
+
+    def subset(self, mask) -> 'RegionTable':
+        """Regions selected by a boolean mask or index array"""
+        return RegionTable(self.contours, {name: values[mask] for name, values in self.columns.items()})
+
+    def boxes(self) -> List[Tuple[int, int, int, int]]:
+        return list(zip(self['x'].tolist(), self['y'].tolist(), self['w'].tolist(), self['h'].tolist()))
+
+    def contour(self, i: int) -> np.ndarray:
+        """Outer contour of region i"""
+        return self.contours[self['index'][i]]
+
+    def solidity(self) -> np.ndarray:
+        """Region area over convex hull area"""
+        values = np.zeros(len(self))
+        for i in range(len(self)):
+            hull_area = cv2.contourArea(cv2.convexHull(self.contour(i)))
+            values[i] = self['area'][i] / hull_area if hull_area > 0 else 0
+        return values
+
+    def vertex_counts(self, epsilon_ratio: float = 0.02) -> np.ndarray:
+        """Vertices of the approxPolyDP approximation of each region's contour"""
+        counts = np.zeros(len(self), dtype=np.int32)
+        for i in range(len(self)):
+            contour = self.contour(i)
+            counts[i] = len(cv2.approxPolyDP(contour, epsilon_ratio * cv2.arcLength(contour, True), True))
+        return counts
+
+def region_table(binary: np.ndarray) -> RegionTable:
+    """Trace the outer contours of the non-zero regions of a binary image and compute their stats"""
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    count = len(contours)
+    if count == 0:
+        empty = np.zeros(0)
+        return RegionTable(contours, {name: empty for name in RegionTable.COLUMNS})
+
+    lengths = np.fromiter(map(len, contours), dtype=np.intp, count=count)
+    starts = np.zeros(count, dtype=np.intp)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.float64)
+    px, py = points[:, 0], points[:, 1]
+
+    # Successor of each point along its own closed contour
+    successor = np.arange(1, len(points) + 1)
+    successor[starts + lengths - 1] = starts
+    nx, ny = px[successor], py[successor]
+
+    area = np.abs(np.add.reduceat(px * ny - nx * py, starts)) / 2
+    perimeter = np.add.reduceat(np.hypot(nx - px, ny - py), starts)
+
+    x = np.minimum.reduceat(px, starts).astype(np.int32)
+    y = np.minimum.reduceat(py, starts).astype(np.int32)
+    w = np.maximum.reduceat(px, starts).astype(np.int32) - x + 1
+    h = np.maximum.reduceat(py, starts).astype(np.int32) - y + 1
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        circularity = np.where(perimeter > 0, 4 * np.pi * area / perimeter ** 2, 0)
+
+    columns = {
+        'index': np.arange(count),
+        'x': x, 'y': y, 'w': w, 'h': h,
+        'area': area,
+        'perimeter': perimeter,
+        'aspect_ratio': w / h,
+        'extent': area / (w * h),
+        'circularity': circularity,
+    }
+    return RegionTable(contours, columns)
+
+class RegionProposer:
+    """
+    Region tables for one grayscale image, computed once per binarization.
+    With `content_hash`, tables are cached under it and `params` (which
+    must tell apart different grayscale images of the same upload).
+    """
+
+    def __init__(self, gray: np.ndarray, content_hash: Optional[str] = None, **params):
+        self.gray = gray
+        self.content_hash = content_hash
+        self.params = params
+        self._tables: Dict[str, RegionTable] = {}
+        self._locks = {name: threading.Lock() for name in BINARIZATIONS}
+
+    def _compute(self, binarization: str) -> RegionTable:
+        compute = lambda: region_table(BINARIZATIONS[binarization](self.gray))
+        if self.content_hash is None:
+            return compute()
+        return stage_cache.get_or_compute(self.content_hash, 'regions', compute, binarization=binarization,
+                                          **self.params)
+
+    def table(self, binarization: str) -> RegionTable:
+        if binarization not in self._tables:
+            with self._locks[binarization]:
+                if binarization not in self._tables:
+                    self._tables[binarization] = self._compute(binarization)
+        return self._tables[binarization]
+
+def get_region_proposer(gray: np.ndarray, regions: Optional[RegionProposer] = None,
+                        content_hash: Optional[str] = None, **params) -> RegionProposer:
+    """Use the request's shared proposer when given, else one for this image (cached with `content_hash`)"""
+    return regions if regions is not None else RegionProposer(gray, content_hash, **params)
@@ -0,0 +1,81 @@
+"""
+Per-thread scratch buffers and the float32 image kernels that use them.
+
+Stages run on long-lived threads (the stage scheduler pool, the job
+workers), so each thread keeps its own named buffers and reuses them across
+stages and requests instead of allocating full-resolution temporaries every
+time. A buffer grows to the largest image the thread has seen; requests
+that would take a thread past SCRATCH_MAX_MB get a one-off array instead.
+
+The kernels compute in float32 into those buffers (cv2 `dst` arguments,
+cv2.magnitude) and reduce with cv2.meanStdDev, which accumulates in double,
+so results match the previous float64 code to float32 rounding. Arrays they
+return are scratch views: use them before the next kernel call on the same
+thread.
+"""
+
+import os
+import threading
+import weakref
+from typing import Dict, Tuple
+
+import cv2
+import numpy as np
+
+SCRATCH_MAX_MB = int(os.getenv('SCRATCH_MAX_MB', '256'))
+
+class _Pool(dict):
+    """One thread's buffers by name (a dict subclass, so it can be weakly referenced)"""
+
+_local = threading.local()
+# Pools of the live threads, for reporting; a pool goes away with its thread
+_pools: 'weakref.WeakValueDictionary[int, _Pool]' = weakref.WeakValueDictionary()
+_pools_lock = threading.Lock()
+
+def _pool() -> Dict[str, np.ndarray]:
+    pool = getattr(_local, 'buffers', None)
+    if pool is None:
+        pool = _local.buffers = _Pool()
+        with _pools_lock:
+            _pools[threading.get_ident()] = pool
+    return pool
+
+def scratch(name: str, shape: Tuple[int, ...], dtype=np.float32) -> np.ndarray:
+    """This thread's `name` buffer as an uninitialised contiguous array of `shape`"""
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    pool = _pool()
+    buffer = pool.get(name)
+    if buffer is None or buffer.dtype != dtype or buffer.size < size:
+        held = sum(b.nbytes for key, b in pool.items() if key != name)
+        if held + size * dtype.itemsize > SCRATCH_MAX_MB * 2**20:
+            return np.empty(shape, dtype)
+        buffer = pool[name] = np.empty(size, dtype)
+    return buffer[:size].reshape(shape)
+
+def scratch_bytes() -> int:
+    """Bytes held in scratch buffers by all threads of this process"""
+    with _pools_lock:
+        return sum(buffer.nbytes for pool in list(_pools.values()) for buffer in list(pool.values()))
+
+def mean_std(values: np.ndarray) -> Tuple[float, float]:
+    """Mean and standard deviation of a single-channel array, accumulated in double"""
+    mean, std = cv2.meanStdDev(values)
+    return float(mean[0, 0]), float(std[0, 0])
+
+def laplacian_variance(gray: np.ndarray) -> float:
+    """Variance of the Laplacian (sharpness) of a grayscale image"""
+    laplacian = cv2.Laplacian(gray, cv2.CV_32F, dst=scratch('laplacian', gray.shape))
+    return mean_std(laplacian)[1] ** 2
+
+def noise_level(gray: np.ndarray) -> float:
+    """Standard deviation of the residual of a grayscale image minus its 5x5 Gaussian blur"""
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0, dst=scratch('blurred', gray.shape, np.uint8))
+    residual = cv2.subtract(gray, blurred, dst=scratch('residual', gray.shape), dtype=cv2.CV_32F)
+    return mean_std(residual)[1]
+
+def gradient_magnitude(gray: np.ndarray) -> np.ndarray:
+    """Sobel (3x3) gradient magnitude of a grayscale image, as a float32 scratch view"""
+    gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3, dst=scratch('sobel_x', gray.shape))
+    gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3, dst=scratch('sobel_y', gray.shape))
+    return cv2.magnitude(gx, gy, magnitude=scratch('gradient', gray.shape))
@@ -0,0 +1,73 @@
+"""
+Compact descriptors for signature crops and the per-subject reference index.
+
+A crop is binarized, cropped to its ink bounding box, scaled into a fixed
+128x64 canvas (aspect ratio preserved, centered) and described with a HOG
+of 9 orientations over 16x16 cells, 756 floats. Descriptors of the same
+signer's signatures have small cosine distances; the reference index stores
+them per subject (account) in a VectorIndex.
+"""
+
+import os
+import logging
+import threading
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from utils.vector_index import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_INDEX_NAME = os.getenv('SIGNATURE_INDEX_NAME', 'signatures')
+SIGNATURE_MATCH_THRESHOLD = float(os.getenv('SIGNATURE_MATCH_THRESHOLD', '0.25'))
+
+CANVAS_SIZE = (128, 64)  # width, height
+_hog = cv2.HOGDescriptor(CANVAS_SIZE, (32, 32), (16, 16), (16, 16), 9)
+DESCRIPTOR_DIM = _hog.getDescriptorSize()
+
+def normalize_signature(crop: np.ndarray) -> Optional[np.ndarray]:
+    """Ink-only grayscale canvas of CANVAS_SIZE, or None if the crop has no ink"""
+    if crop.ndim == 3:
+        code = cv2.COLOR_RGBA2GRAY if crop.shape[2] == 4 else cv2.COLOR_RGB2GRAY
+        gray = cv2.cvtColor(crop, code)
+    else:
+        gray = crop
+    _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    points = cv2.findNonZero(ink)
+    if points is None:
+        return None
+    x, y, w, h = cv2.boundingRect(points)
+    ink = ink[y:y + h, x:x + w]
+
+    width, height = CANVAS_SIZE
+    scale = min(width / w, height / h)
+    new_w, new_h = max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+    resized = cv2.resize(ink, (new_w, new_h), interpolation=cv2.INTER_AREA)
+
+    canvas = np.zeros((height, width), np.uint8)
+    top, left = (height - new_h) // 2, (width - new_w) // 2
+    canvas[top:top + new_h, left:left + new_w] = resized
+    return canvas
+
+def signature_descriptor(crop: np.ndarray) -> Optional[np.ndarray]:
+    """L2-normalized HOG descriptor of a signature crop, or None if it has no ink"""
+    canvas = normalize_signature(crop)
+    if canvas is None:
+        return None
+    descriptor = _hog.compute(canvas).ravel().astype(np.float32)
+    norm = np.linalg.norm(descriptor)
+    return descriptor / norm if norm > 0 else descriptor
+
+_signature_index = None
+_signature_index_lock = threading.Lock()
+
+def get_signature_index() -> VectorIndex:
+    """Shared reference signature index, opened on first use"""
+    global _signature_index
+    if _signature_index is None:
+        with _signature_index_lock:
+            if _signature_index is None:
+                _signature_index = VectorIndex(SIGNATURE_INDEX_NAME, DESCRIPTOR_DIM)
+    return _signature_index
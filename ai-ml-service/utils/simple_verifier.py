@@ -6,14 +6,23 @@ import cv2
 import numpy as np
 import os
 import json
-from typing import Dict, List, Tuple, Optional, Any
+from typing import Dict, List, Tuple, Optional, Any, Iterable, Sequence
 import logging
 from datetime import datetime
-import pytesseract
-from PIL import Image, ExifTags
 import warnings
 warnings.filterwarnings('ignore')
 
+from utils.analysis_plan import FEATURE_STAGES
+from utils.face_descriptors import detect_faces
+from utils.image_context import ImageContext
+from utils.image_metadata import parse_image_metadata, editing_software_detected
+from utils.jpeg_forensics import analyze_jpeg, compression_features
+from utils.ocr_regions import read_text
+from utils.pipeline_profiles import get_pipeline_profile
+from utils.region_proposals import RegionProposer, get_region_proposer
+from utils.scratch import gradient_magnitude, laplacian_variance, mean_std, noise_level
+from utils.stage_scheduler import Stage, StageRun, stage_scheduler
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -27,44 +36,83 @@ class SimpleAdvancedVerifier:
         self.suspicious_keywords = ['fake', 'fraud', 'sample', 'test', 'dummy', 'specimen', 'copy', 'not valid', 'template']
         self.editing_software = ['photoshop', 'gimp', 'paint.net', 'canva', 'pixlr', 'photoscape', 'snapseed']
     
-    def extract_comprehensive_features(self, image_path: str, document_type: str = "id-card") -> Dict[str, Any]:
+    def extract_comprehensive_features(self, image_path: str, document_type: str = "id-card",
+                                       stages: Optional[Iterable[str]] = None) -> Dict[str, Any]:
         """
-        Extract comprehensive features using basic libraries
+        Extract comprehensive features using basic libraries.
+        `stages` uses the advanced pipeline's stage names (FEATURE_STAGES); the
+        content analysis covers the face, logo and QR stages.
         """
         try:
-            # Read image
-            image = cv2.imread(image_path)
-            if image is None:
+            context = ImageContext(image_path, document_type)
+            if not context.is_readable():  # Fail early on unreadable uploads
                 raise ValueError("Could not read image")
-            
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            
-            features = {
-                'image_path': image_path,
-                'document_type': document_type,
-                'timestamp': datetime.now().isoformat()
-            }
-            
-            # 1. Basic Image Properties
-            features.update(self.extract_basic_features(image, gray))
-            
-            # 2. OCR Features
-            features.update(self.extract_ocr_features(image, gray))
-            
-            # 3. Digital Forensics Features
-            features.update(self.extract_forensics_features(image, gray))
-            
-            # 4. Metadata Features
-            features.update(self.extract_metadata_features(image_path))
-            
-            # 5. Content Analysis
-            features.update(self.extract_content_features(image, gray, document_type))
-            
-            return features
-            
+
+            run = stage_scheduler.run(self.feature_stage_graph(context, stages))
+            return self.collect_features(context, run)
+
         except Exception as e:
             logger.error(f"Error extracting features: {e}")
             return {'error': str(e)}
+
+    # Scheduler stages in merge order, with the FEATURE_STAGES each one covers
+    STAGE_COVERAGE = (
+        ('quality', {'forensics', 'quality'}),
+        ('basic', {'forensics'}),
+        ('ocr', {'ocr'}),
+        ('forensics', {'forensics'}),
+        ('metadata', {'metadata'}),
+        ('content', {'face', 'logo', 'qr'}),
+    )
+
+    def feature_stage_graph(self, context: ImageContext, stages: Optional[Iterable[str]] = None) -> List[Stage]:
+        """
+        Scheduler stages covering the selected FEATURE_STAGES, minus those the
+        document type's pipeline profile skips; each returns a feature dict
+        """
+        stages = (set(FEATURE_STAGES) if stages is None else set(stages)) - context.profile.skip_stages
+        # The content stage also covers logos and QR codes: without the face stage, it reports no faces
+        faces = (lambda: context.faces) if 'face' in stages else list
+
+        graph = {
+            'quality': lambda: self.extract_quality_features(context.gray),
+            'basic': lambda: self.extract_basic_features(context.image, context.gray),
+            # Keyed by profile: its OCR regions change the reading order
+            'ocr': lambda: context.stage('ocr_features', lambda: self.extract_ocr_features(
+                context.image, context.gray, context.profile.ocr_regions), profile=context.profile.name),
+            'forensics': lambda: self.extract_forensics_features(context.image, context.gray, context.jpeg_forensics),
+            'metadata': lambda: self.extract_metadata_features(context.image_path, context.data, context.metadata),
+            'content': lambda: self.extract_content_features(context.image, context.gray, context.document_type,
+                                                             context.regions, faces()),
+        }
+
+        return [Stage(name, graph[name], default={})
+                for name, covers in self.STAGE_COVERAGE if covers & stages]
+
+    def collect_features(self, context: ImageContext, run: StageRun) -> Dict[str, Any]:
+        """Merge stage results into the feature dict, in STAGE_COVERAGE order"""
+        features = {
+            'image_path': context.image_path,
+            'document_type': context.document_type,
+            'timestamp': datetime.now().isoformat()
+        }
+        for name, _ in self.STAGE_COVERAGE:
+            if name in run.results:
+                features.update(run.results[name])
+        return features
+
+    def extract_quality_features(self, gray: np.ndarray) -> Dict[str, Any]:
+        """Extract image quality metrics (sharpness, brightness, contrast, noise)"""
+        try:
+            features = {}
+            features['sharpness'] = laplacian_variance(gray)
+            features['brightness'], features['contrast'] = mean_std(gray)
+            features['noise_level'] = noise_level(gray)
+            return features
+            
+        except Exception as e:
+            logger.error(f"Quality feature extraction error: {e}")
+            return {'sharpness': 0, 'brightness': 0, 'contrast': 0, 'noise_level': 0}
     
     def extract_basic_features(self, image: np.ndarray, gray: np.ndarray) -> Dict[str, Any]:
         """Extract basic image features"""
@@ -76,11 +124,6 @@ class SimpleAdvancedVerifier:
             features['image_height'] = image.shape[0]
             features['aspect_ratio'] = image.shape[1] / image.shape[0]
             
-            # Image quality metrics
-            features['sharpness'] = cv2.Laplacian(gray, cv2.CV_64F).var()
-            features['brightness'] = np.mean(gray)
-            features['contrast'] = np.std(gray)
-            
             # Edge analysis
             edges = cv2.Canny(gray, 50, 150)
             features['edge_density'] = np.sum(edges > 0) / edges.size
@@ -97,30 +140,27 @@ class SimpleAdvancedVerifier:
             logger.error(f"Basic feature extraction error: {e}")
             return {
                 'image_width': 0, 'image_height': 0, 'aspect_ratio': 0,
-                'sharpness': 0, 'brightness': 0, 'contrast': 0,
                 'edge_density': 0, 'hist_entropy': 0, 'hist_peak': 0, 'hist_uniformity': 0
             }
     
-    def extract_ocr_features(self, image: np.ndarray, gray: np.ndarray) -> Dict[str, Any]:
-        """Extract OCR-based features"""
+    def extract_ocr_features(self, image: np.ndarray, gray: np.ndarray,
+                             regions: Sequence[Dict[str, Any]] = ()) -> Dict[str, Any]:
+        """Extract OCR-based features; the profile's OCR `regions` are read first"""
         try:
             features = {}
             
             # Perform OCR
             try:
-                text = pytesseract.image_to_string(gray)
-                data = pytesseract.image_to_data(gray, output_type=pytesseract.Output.DICT)
+                text, confidences, region_text = read_text(gray, regions)
             except Exception as ocr_error:
                 logger.warning(f"OCR error: {ocr_error}")
-                text = ""
-                data = {'conf': [0]}
+                text, confidences, region_text = "", [], {}
             
             # Text statistics
             features['ocr_text_length'] = len(text)
             features['ocr_word_count'] = len(text.split())
             
             # OCR confidence
-            confidences = [conf for conf in data['conf'] if conf > 0]
             features['ocr_confidence_mean'] = np.mean(confidences) if confidences else 0
             features['ocr_confidence_std'] = np.std(confidences) if confidences else 0
             
@@ -143,8 +183,10 @@ class SimpleAdvancedVerifier:
             text_lower = text.lower()
             features['suspicious_text_detected'] = any(keyword in text_lower for keyword in self.suspicious_keywords)
             
-            # Store extracted text
+            # Store extracted text (the OCR regions' text leads it)
             features['extracted_text'] = text[:500]
+            if region_text:
+                features['ocr_region_text'] = region_text
             
             return features
             
@@ -157,22 +199,17 @@ class SimpleAdvancedVerifier:
                 'suspicious_text_detected': False, 'extracted_text': ''
             }
     
-    def extract_forensics_features(self, image: np.ndarray, gray: np.ndarray) -> Dict[str, Any]:
-        """Extract digital forensics features"""
+    def extract_forensics_features(self, image: np.ndarray, gray: np.ndarray,
+                                   jpeg: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Extract digital forensics features. `jpeg` is the compression analysis
+        of the upload (utils.jpeg_forensics.analyze_jpeg), if available.
+        """
         try:
             features = {}
             
-            # Noise analysis
-            blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-            noise = gray.astype(np.float32) - blurred.astype(np.float32)
-            features['noise_level'] = np.std(noise)
-            
             # Gradient analysis
-            gx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-            gy = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-            gradient_magnitude = np.sqrt(gx**2 + gy**2)
-            features['gradient_mean'] = np.mean(gradient_magnitude)
-            features['gradient_std'] = np.std(gradient_magnitude)
+            features['gradient_mean'], features['gradient_std'] = mean_std(gradient_magnitude(gray))
             
             # Copy-paste detection (simplified)
             features['copy_paste_score'] = self.detect_copy_paste(gray)
@@ -194,72 +231,51 @@ class SimpleAdvancedVerifier:
                 features['saturation_mean'] = 0
                 features['saturation_std'] = 0
             
-            # Compression artifacts
-            # Look for blocking artifacts
-            h, w = gray.shape
-            block_scores = []
-            for i in range(0, h-8, 8):
-                for j in range(0, w-8, 8):
-                    block = gray[i:i+8, j:j+8]
-                    block_var = np.var(block)
-                    block_scores.append(block_var)
-            
-            features['block_variance_mean'] = np.mean(block_scores) if block_scores else 0
-            features['block_variance_std'] = np.std(block_scores) if block_scores else 0
+            # Compression artifacts from the quantization tables and 8x8 block DCT
+            if jpeg is None:
+                jpeg = analyze_jpeg(b'', gray)
+            features.update(compression_features(jpeg))
             
             return features
             
         except Exception as e:
             logger.error(f"Forensics feature extraction error: {e}")
             return {
-                'noise_level': 0, 'gradient_mean': 0, 'gradient_std': 0,
+                'gradient_mean': 0, 'gradient_std': 0,
                 'copy_paste_score': 0, 'color_channel_diff': 0,
                 'saturation_mean': 0, 'saturation_std': 0,
-                'block_variance_mean': 0, 'block_variance_std': 0
+                'block_variance_mean': 0, 'block_variance_std': 0,
+                'jpeg_quality': 0, 'jpeg_double_compressed': False,
+                'jpeg_tampered_ratio': 0, 'jpeg_grid_misaligned': False
             }
     
-    def extract_metadata_features(self, image_path: str) -> Dict[str, Any]:
-        """Extract metadata features"""
+    def extract_metadata_features(self, image_path: Optional[str], data: Optional[bytes] = None,
+                                  metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Extract metadata features from the upload bytes and their parsed header"""
         try:
             features = {}
-            
+            if data is None:
+                data = b''
+                if image_path is not None:
+                    with open(image_path, 'rb') as f:
+                        data = f.read()
+            if metadata is None:
+                metadata = parse_image_metadata(data)
+
             # File metadata
-            file_stats = os.stat(image_path)
-            features['file_size'] = file_stats.st_size
+            features['file_size'] = len(data)
+
+            # Camera and software info
+            features['camera_make'] = metadata['camera_make'] or 'Unknown'
+            features['camera_model'] = metadata['camera_model'] or 'Unknown'
+            features['software'] = metadata['software'] or 'Unknown'
+            features['image_orientation'] = metadata['orientation'] or 1
+
+            # Check for editing software
+            features['editing_software_detected'] = editing_software_detected(metadata, self.editing_software)
             
-            # Try to extract EXIF data
-            try:
-                with Image.open(image_path) as img:
-                    exif_data = img._getexif()
-                    
-                    if exif_data:
-                        # Camera and software info
-                        camera_make = exif_data.get(271, 'Unknown')  # Make
-                        camera_model = exif_data.get(272, 'Unknown')  # Model
-                        software = exif_data.get(305, 'Unknown')  # Software
-                        
-                        features['camera_make'] = str(camera_make)
-                        features['camera_model'] = str(camera_model)
-                        features['software'] = str(software)
-                        
-                        # Check for editing software
-                        software_lower = str(software).lower()
-                        features['editing_software_detected'] = any(sw in software_lower for sw in self.editing_software)
-                    else:
-                        features['camera_make'] = 'Unknown'
-                        features['camera_model'] = 'Unknown'
-                        features['software'] = 'Unknown'
-                        features['editing_software_detected'] = False
-                        
-            except Exception as exif_error:
-                logger.warning(f"EXIF extraction error: {exif_error}")
-                features['camera_make'] = 'Unknown'
-                features['camera_model'] = 'Unknown'
-                features['software'] = 'Unknown'
-                features['editing_software_detected'] = False
-            
-            # Filename analysis
-            filename = os.path.basename(image_path).lower()
+            # Filename analysis (an in-memory image has no name)
+            filename = os.path.basename(image_path).lower() if image_path is not None else ''
             features['suspicious_filename'] = any(keyword in filename for keyword in self.suspicious_keywords)
             
             return features
@@ -268,18 +284,22 @@ class SimpleAdvancedVerifier:
             logger.error(f"Metadata feature extraction error: {e}")
             return {
                 'file_size': 0, 'camera_make': 'Unknown',
-                'camera_model': 'Unknown', 'software': 'Unknown',
+                'camera_model': 'Unknown', 'software': 'Unknown', 'image_orientation': 1,
                 'editing_software_detected': False, 'suspicious_filename': False
             }
     
-    def extract_content_features(self, image: np.ndarray, gray: np.ndarray, document_type: str) -> Dict[str, Any]:
-        """Extract content-specific features"""
+    def extract_content_features(self, image: np.ndarray, gray: np.ndarray, document_type: str,
+                                 regions: Optional[RegionProposer] = None, faces=None) -> Dict[str, Any]:
+        """
+        Extract content-specific features. `faces` are the image context's
+        face boxes (full-resolution pixels), if available.
+        """
         try:
             features = {}
             
-            # Face detection (simplified using contours)
-            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-            faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+            # Face detection
+            if faces is None:
+                faces = detect_faces(image)
             
             features['face_count'] = len(faces)
             features['face_detected'] = len(faces) > 0
@@ -291,7 +311,7 @@ class SimpleAdvancedVerifier:
                 for (x, y, w, h) in faces:
                     face_region = gray[y:y+h, x:x+w]
                     if face_region.size > 0:
-                        face_sharpness = cv2.Laplacian(face_region, cv2.CV_64F).var()
+                        face_sharpness = laplacian_variance(face_region)
                         face_qualities.append(face_sharpness)
                 
                 features['face_quality_mean'] = np.mean(face_qualities) if face_qualities else 0
@@ -300,36 +320,22 @@ class SimpleAdvancedVerifier:
             
             # Logo/seal detection (simplified)
             # Look for circular/rectangular shapes that might be logos
-            contours, _ = cv2.findContours(cv2.Canny(gray, 50, 150), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            logo_candidates = 0
-            for contour in contours:
-                area = cv2.contourArea(contour)
-                if 500 < area < 10000:  # Logo-like size
-                    perimeter = cv2.arcLength(contour, True)
-                    if perimeter > 0:
-                        circularity = 4 * np.pi * area / (perimeter ** 2)
-                        if circularity > 0.3:  # Somewhat circular
-                            logo_candidates += 1
+            regions = get_region_proposer(gray, regions)
+            edges = regions.table('canny')
+            logo_candidates = int(np.count_nonzero(
+                (edges['area'] > 500) & (edges['area'] < 10000) & (edges['circularity'] > 0.3)  # Logo-like size, somewhat circular
+            ))
             
             features['logo_candidates_count'] = logo_candidates
             features['logo_detected'] = logo_candidates > 0
             
             # QR code detection (simplified - look for square patterns)
             # This is a very basic approach
-            qr_patterns = 0
-            kernel = np.ones((5, 5), np.uint8)
-            binary = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)[1]
-            
-            # Look for square patterns
-            squares = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
-            for square in squares:
-                area = cv2.contourArea(square)
-                if 1000 < area < 50000:  # QR code size range
-                    x, y, w, h = cv2.boundingRect(square)
-                    aspect_ratio = w / h
-                    if 0.8 < aspect_ratio < 1.2:  # Square-like
-                        qr_patterns += 1
+            binary = regions.table('bin127')
+            qr_patterns = int(np.count_nonzero(
+                (binary['area'] > 1000) & (binary['area'] < 50000) &  # QR code size range
+                (binary['aspect_ratio'] > 0.8) & (binary['aspect_ratio'] < 1.2)  # Square-like
+            ))
             
             features['qr_code_count'] = qr_patterns
             features['qr_codes_detected'] = qr_patterns > 0
@@ -419,9 +425,9 @@ class SimpleAdvancedVerifier:
                 score -= 0.1
                 anomalies.append("Very little text detected")
             
-            # Face detection for ID documents
+            # Face detection for ID documents (the types whose pipeline profile runs the face stage)
             doc_type = features.get('document_type', '')
-            if doc_type in ['id-card', 'passport', 'driver-license', 'aadhar-card']:
+            if get_pipeline_profile(doc_type).runs('face'):
                 if features.get('face_detected', False):
                     score += 0.1
                     if features.get('face_quality_mean', 0) > 100:
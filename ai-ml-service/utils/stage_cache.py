@@ -0,0 +1,177 @@
+"""
+Process-wide memoization of stage outputs across routes.
+
+Callers often send the same file to several endpoints (/analyze, then /ocr
+and /detect-signature). Stage outputs are kept under (SHA-256 of the
+upload, stage name, fingerprint of the stage parameters), so any route
+running the same stage on the same file reuses the stored output: region
+tables (binarization + contours), tesseract OCR and the verifier OCR
+features. Concurrent misses on one key compute it once.
+
+Eviction is least-recently-used by estimated size (numpy buffers, strings
+and the containers and objects holding them) against STAGE_CACHE_MB, and
+entries expire after STAGE_CACHE_TTL_SECONDS. Outputs are shared: dicts
+and lists are handed out as deep copies, other objects (arrays, region
+tables) must be treated as read-only. Outputs computed while the request's
+deadline ran out aren't stored: they may be a timed-out call's fallback.
+
+Each worker process has its own cache, like the signature crop cache.
+
+    STAGE_CACHE_MB            size budget (default: 256, 0 disables the cache)
+    STAGE_CACHE_TTL_SECONDS   entry lifetime (default: 900)
+"""
+
+import copy
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from utils.crop_cache import content_hash
+from utils.deadlines import deadline_expired
+from utils.image_metadata import parse_image_metadata
+
+STAGE_CACHE_MB = float(os.getenv('STAGE_CACHE_MB', '256'))
+STAGE_CACHE_TTL_SECONDS = float(os.getenv('STAGE_CACHE_TTL_SECONDS', '900'))
+
+def fingerprint(params: Dict[str, Any]) -> str:
+    """Short stable digest of a stage's parameters"""
+    return hashlib.sha1(repr(sorted(params.items())).encode()).hexdigest()[:16]
+
+def decode_variant(metadata: Dict[str, Any], orientation_applied: bool) -> str:
+    """
+    Fingerprint parameter for pixels decoded from an upload. cv2 applies the
+    EXIF orientation and PIL doesn't; otherwise both decode to the same
+    pixels, so their outputs are shared unless the orientation tag rotates
+    the image.
+    """
+    if metadata.get('orientation') in (None, 1):
+        return 'upright'
+    return 'oriented' if orientation_applied else 'stored'
+
+def upload_key(content: bytes, orientation_applied: bool = False) -> Tuple[str, str]:
+    """(content hash, decode_variant) of an upload decoded by the route itself (PIL by default)"""
+    return content_hash(content), decode_variant(parse_image_metadata(content), orientation_applied)
+
+def sizeof(value: Any, _depth: int = 0) -> int:
+    """Approximate bytes held by a stage output"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes + 112
+    if isinstance(value, (bytes, bytearray, str)):
+        return sys.getsizeof(value)
+    if _depth > 6:
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(k, _depth + 1) + sizeof(v, _depth + 1) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(sizeof(item, _depth + 1) for item in value)
+    if hasattr(value, '__dict__'):
+        return sys.getsizeof(value) + sizeof(vars(value), _depth + 1)
+    return sys.getsizeof(value)
+
+class _Entry:
+    __slots__ = ('value', 'size', 'created_at')
+
+    def __init__(self, value: Any, size: int):
+        self.value = value
+        self.size = size
+        self.created_at = time.time()
+
+class StageCache:
+    """Thread-safe size-bounded LRU of stage outputs, with per-stage hit counts"""
+
+    def __init__(self, max_mb: float = STAGE_CACHE_MB, ttl_seconds: float = STAGE_CACHE_TTL_SECONDS):
+        self.max_bytes = int(max_mb * 2**20)
+        self.ttl_seconds = ttl_seconds
+        self.bytes = 0
+        self._entries: 'OrderedDict[Tuple[str, str, str], _Entry]' = OrderedDict()
+        self._pending: Dict[Tuple[str, str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._hits: Dict[str, int] = {}
+        self._misses: Dict[str, int] = {}
+
+    def _lookup(self, key: Tuple[str, str, str]) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry.created_at > self.ttl_seconds:
+            self._remove(key)
+            entry = None
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def _remove(self, key: Tuple[str, str, str]):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+
+    def _count(self, counts: Dict[str, int], stage: str):
+        counts[stage] = counts.get(stage, 0) + 1
+
+    def get_or_compute(self, content_hash: str, stage: str, compute: Callable[[], Any], **params) -> Any:
+        """
+        Output of `stage` with `params` for the upload with `content_hash`,
+        from the cache or computed (once, however many threads ask) and stored
+        """
+        if self.max_bytes <= 0 or not content_hash:
+            return compute()
+        key = (content_hash, stage, fingerprint(params))
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                pending = self._pending.setdefault(key, threading.Lock())
+        if entry is None:
+            with pending:
+                with self._lock:
+                    entry = self._lookup(key)
+                if entry is None:
+                    try:
+                        value = compute()
+                    except Exception:
+                        with self._lock:
+                            self._pending.pop(key, None)
+                        raise
+                    entry = _Entry(value, sizeof(value))
+                    with self._lock:
+                        self._count(self._misses, stage)
+                        if not deadline_expired():
+                            self._store(key, entry)
+                        self._pending.pop(key, None)
+                    return self._hand_out(value)
+        with self._lock:
+            self._count(self._hits, stage)
+        return self._hand_out(entry.value)
+
+    def _store(self, key: Tuple[str, str, str], entry: _Entry):
+        if entry.size > self.max_bytes:
+            # Larger than the whole budget: not kept
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self.bytes += entry.size
+        while self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    @staticmethod
+    def _hand_out(value: Any) -> Any:
+        return copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {}
+            for stage in sorted(set(self._hits) | set(self._misses)):
+                hits, misses = self._hits.get(stage, 0), self._misses.get(stage, 0)
+                stages[stage] = {'hits': hits, 'misses': misses, 'hit_ratio': round(hits / (hits + misses), 3)}
+            return {
+                'entries': len(self._entries),
+                'size_mb': round(self.bytes / 2**20, 2),
+                'max_mb': round(self.max_bytes / 2**20, 1),
+                'stages': stages,
+            }
+
+# Shared by every route of this process
+stage_cache = StageCache()
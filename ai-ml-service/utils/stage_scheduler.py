@@ -0,0 +1,270 @@
+"""
+Dependency-graph scheduler for the analysis stages of one request.
+
+Stages declare the stages they depend on; every stage whose dependencies have
+finished is submitted to a shared thread pool, so independent extractors
+(mostly GIL-releasing OpenCV/NumPy code and tesseract subprocesses) run
+concurrently and request latency tracks the slowest chain instead of the sum.
+
+A stage that raises or exceeds its timeout contributes its default result and
+the run carries on. The timeout counts from the moment the stage starts on a
+pool thread, not from its submission, so time spent queued behind other
+requests' stages doesn't use it up. Python threads can't be interrupted, so
+a timed-out stage keeps its pool thread until it returns; its result is
+discarded, and the threads held that way are counted for /health. A run can
+also have an overall deadline (a pipeline profile's time budget, or the
+caller's, see utils.deadlines): stages still running then time out, stages
+not started yet are not run, and optional stages whose expected cost
+exceeds the time left are skipped. Stages run in a copy of the submitting
+thread's context, so they see its request deadline.
+
+    STAGE_THREADS            pool size per process (default: twice the
+                             worker's thread budget, see utils.concurrency)
+    STAGE_TIMEOUT_SECONDS    default per-stage timeout (default: 60)
+"""
+
+import contextvars
+import copy
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from utils.concurrency import thread_budget
+
+logger = logging.getLogger(__name__)
+
+STAGE_THREADS = int(os.getenv('STAGE_THREADS', '0'))  # 0: from the thread budget
+STAGE_TIMEOUT_SECONDS = float(os.getenv('STAGE_TIMEOUT_SECONDS', '60'))
+
+# Stage threads per thread of the budget: some stages wait on tesseract subprocesses or the GIL
+STAGE_THREADS_PER_BUDGET = 2
+
+# Created lazily per process: executors don't survive fork, and a worker's
+# thread budget is only known once serve.py has pinned it to its CPUs
+_executor = None
+_executor_pid = None
+_executor_threads = 0
+_executor_lock = threading.Lock()
+
+def stage_threads() -> int:
+    """Size of this process's stage pool"""
+    return STAGE_THREADS or STAGE_THREADS_PER_BUDGET * thread_budget()
+
+def get_stage_executor() -> ThreadPoolExecutor:
+    global _executor, _executor_pid, _executor_threads
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor_threads = stage_threads()
+            _executor = ThreadPoolExecutor(max_workers=_executor_threads, thread_name_prefix='stage')
+            _executor_pid = os.getpid()
+        return _executor
+
+class Stage:
+    """
+    One unit of analysis work. `func` is called with the results of `deps`
+    as positional arguments, in order. `condition`, if given, is called with
+    the same arguments and the stage is skipped when it returns False.
+    An `optional` stage is left out when a run's deadline can't cover it.
+    """
+
+    def __init__(self, name: str, func: Callable[..., Any], deps: Iterable[str] = (),
+                 timeout: Optional[float] = None, default: Any = None,
+                 condition: Optional[Callable[..., bool]] = None, optional: bool = False):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.default = default
+        self.condition = condition
+        self.optional = optional
+
+    def default_result(self) -> Any:
+        # Hand out copies so callers can't mutate the shared default
+        return copy.deepcopy(self.default)
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, deps={list(self.deps)})"
+
+class StageRun:
+    """Results of a scheduler run: per-stage result, status and wall time"""
+
+    def __init__(self):
+        self.results: Dict[str, Any] = {}
+        self.status: Dict[str, str] = {}  # ok | error | timeout | skipped | over_budget
+        self.timings: Dict[str, float] = {}
+        self.elapsed = 0.0
+
+    def get(self, name: str, default: Any = None) -> Any:
+        return self.results.get(name, default)
+
+    def incomplete(self) -> Dict[str, str]:
+        """Stages that contributed their default because of a deadline: name -> timeout | over_budget"""
+        return {name: status for name, status in sorted(self.status.items()) if status in ('timeout', 'over_budget')}
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'elapsed': round(self.elapsed, 4),
+            'stages': {name: {'status': self.status[name], 'time': round(self.timings.get(name, 0.0), 4)}
+                       for name in self.status}
+        }
+
+class _Attempt:
+    """When a submitted stage started running on its pool thread (None while queued)"""
+    __slots__ = ('submitted', 'started')
+
+    def __init__(self):
+        self.submitted = time.monotonic()
+        self.started: Optional[float] = None
+
+    def call(self, func: Callable[..., Any], *args) -> Any:
+        self.started = time.monotonic()
+        return func(*args)
+
+class StageScheduler:
+    """Runs a set of stages in dependency order on the shared stage pool"""
+
+    def __init__(self, default_timeout: float = STAGE_TIMEOUT_SECONDS):
+        self.default_timeout = default_timeout
+        self._lock = threading.Lock()
+        # Timed-out stages still holding a pool thread
+        self._abandoned: Set[Future] = set()
+        self._timeouts = 0
+
+    def run(self, stages: List[Stage], deadline: Optional[float] = None,
+            expected_cost: Optional[Callable[[str], Optional[float]]] = None) -> StageRun:
+        """
+        Run `stages`; `deadline` (time.monotonic()) bounds the whole run.
+        `expected_cost` gives a stage's usual run time in seconds (None: unknown).
+        """
+        start = time.monotonic()
+        run = StageRun()
+        pending = {stage.name: stage for stage in stages}
+        self._validate(pending)
+
+        executor = get_stage_executor()
+        running = {}  # future -> (stage, attempt, timeout)
+
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if not all(dep in run.status for dep in stage.deps):
+                    continue
+                del pending[name]
+                args = [run.results[dep] for dep in stage.deps]
+
+                if stage.condition is not None and not self._check_condition(stage, args):
+                    self._finish(run, stage, stage.default_result(), 'skipped', 0.0)
+                    continue
+
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    logger.warning(f"Stage '{stage.name}' not started: the run's time budget is spent")
+                    self._finish(run, stage, stage.default_result(), 'over_budget', 0.0)
+                    continue
+                if deadline is not None and stage.optional and expected_cost is not None:
+                    cost = expected_cost(stage.name)
+                    if cost is not None and now + cost > deadline:
+                        logger.info(f"Optional stage '{stage.name}' skipped: expected {cost:.3f}s, "
+                                    f"{deadline - now:.3f}s left")
+                        self._finish(run, stage, stage.default_result(), 'over_budget', 0.0)
+                        continue
+                timeout = stage.timeout if stage.timeout is not None else self.default_timeout
+                attempt = _Attempt()
+                future = executor.submit(contextvars.copy_context().run, attempt.call, stage.func, *args)
+                running[future] = (stage, attempt, timeout)
+
+            if not running:
+                if pending:
+                    # Only reachable through a dependency cycle, which _validate rejects
+                    raise RuntimeError(f"Stages cannot be scheduled: {sorted(pending)}")
+                break
+
+            # Wake up at the first stage deadline; a queued stage's can't come
+            # before now + its timeout, and is known once it starts
+            now = time.monotonic()
+            wake = [deadline] if deadline is not None else []
+            for _, attempt, timeout in running.values():
+                if timeout:
+                    wake.append((attempt.started or now) + timeout)
+            wait_for = max(0.0, min(wake) - now) if wake else None
+            done, _ = wait(list(running), timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            now = time.monotonic()
+            for future in done:
+                stage, attempt, _ = running.pop(future)
+                elapsed = now - (attempt.started or attempt.submitted)
+                try:
+                    self._finish(run, stage, future.result(), 'ok', elapsed)
+                except Exception as e:
+                    logger.error(f"Stage '{stage.name}' failed: {e}")
+                    self._finish(run, stage, stage.default_result(), 'error', elapsed)
+
+            for future, (stage, attempt, timeout) in list(running.items()):
+                started = attempt.started
+                timed_out = started is not None and timeout and now >= started + timeout
+                if not timed_out and (deadline is None or now < deadline):
+                    continue
+                running.pop(future)
+                if future.cancel():
+                    logger.warning(f"Stage '{stage.name}' not started: the run's time budget is spent")
+                    self._finish(run, stage, stage.default_result(), 'over_budget', 0.0)
+                    continue
+                logger.warning(f"Stage '{stage.name}' timed out after {now - (started or now):.1f}s")
+                self._finish(run, stage, stage.default_result(), 'timeout', now - (started or now))
+                self._abandon(future)
+
+        run.elapsed = time.monotonic() - start
+        logger.debug(f"Stage run finished in {run.elapsed:.3f}s: {run.summary()['stages']}")
+        return run
+
+    def _abandon(self, future: Future):
+        """Count a timed-out stage's pool thread until its function returns"""
+        with self._lock:
+            self._timeouts += 1
+            self._abandoned.add(future)
+            busy = len(self._abandoned)
+        future.add_done_callback(self._release)
+        logger.warning(f"{busy} of {_executor_threads} stage threads busy with timed-out stages")
+
+    def _release(self, future: Future):
+        with self._lock:
+            self._abandoned.discard(future)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'threads': _executor_threads, 'busy_after_timeout': len(self._abandoned), 'timeouts': self._timeouts}
+
+    def _validate(self, stages: Dict[str, Stage]):
+        for stage in stages.values():
+            missing = [dep for dep in stage.deps if dep not in stages]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {', '.join(missing)}")
+
+        # Kahn's algorithm: every stage must be reachable from the dependency-free ones
+        remaining = {name: set(stage.deps) for name, stage in stages.items()}
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError(f"Dependency cycle between stages: {', '.join(sorted(remaining))}")
+            for name in ready:
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+
+    def _check_condition(self, stage, args) -> bool:
+        try:
+            return bool(stage.condition(*args))
+        except Exception as e:
+            logger.error(f"Condition of stage '{stage.name}' failed: {e}")
+            return False
+
+    def _finish(self, run, stage, result, status, elapsed):
+        run.results[stage.name] = result
+        run.status[stage.name] = status
+        run.timings[stage.name] = elapsed
+
+# Shared scheduler instance
+stage_scheduler = StageScheduler()
@@ -0,0 +1,240 @@
+"""
+Persistent nearest-neighbour index for fixed-size descriptors.
+
+Vectors are L2-normalized float32 rows in a memory-mapped file, so every
+worker process searches the same pages from the OS page cache without loading
+the index into its own heap. Row metadata (subject id, label, timestamps)
+lives in a small SQLite database next to it. Distances are cosine distances
+(1 - dot product), computed with vectorized matrix products: over a subject's
+rows for per-subject comparisons, or over the whole matrix in chunks for
+"seen before under another subject" queries.
+
+Appends are serialized across processes with a file lock; a row becomes
+visible to searches once its metadata row is committed, after the vector has
+been written.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+INDEX_DIR = os.getenv('INDEX_DIR', os.path.join(SERVICE_DIR, 'indexes'))
+INDEX_SEARCH_CHUNK_ROWS = int(os.getenv('INDEX_SEARCH_CHUNK_ROWS', '65536'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subjects (
+    code INTEGER PRIMARY KEY AUTOINCREMENT,
+    subject_id TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS items (
+    row INTEGER PRIMARY KEY,
+    subject_code INTEGER NOT NULL,
+    label TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_items_subject ON items (subject_code);
+"""
+
+def normalize(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+class VectorIndex:
+    """Append-only memory-mapped vector index with per-row subject metadata"""
+
+    def __init__(self, name: str, dim: int, directory: str = INDEX_DIR):
+        self.name = name
+        self.dim = dim
+        self.path = os.path.join(directory, name)
+        os.makedirs(self.path, exist_ok=True)
+        self.vectors_path = os.path.join(self.path, 'vectors.f32')
+        self.subjects_path = os.path.join(self.path, 'subjects.i32')
+        self.db_path = os.path.join(self.path, 'meta.db')
+        self.lock_path = os.path.join(self.path, 'write.lock')
+
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._subjects = None
+        self._mapped_rows = 0
+
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+            conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+            row = conn.execute("SELECT value FROM settings WHERE key = 'dim'").fetchone()
+            if row is None:
+                conn.execute("INSERT INTO settings (key, value) VALUES ('dim', ?)", (str(dim),))
+            elif int(row[0]) != dim:
+                raise ValueError(f"Index '{name}' stores {row[0]}-d vectors, not {dim}-d")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _write_lock(self):
+        """Serialize appends between threads and between worker processes"""
+        with self._lock:
+            if not FCNTL_AVAILABLE:
+                yield
+                return
+            with open(self.lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def count(self, subject_id: Optional[str] = None) -> int:
+        with self._connection() as conn:
+            if subject_id is None:
+                return conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+            return conn.execute(
+                "SELECT COUNT(*) FROM items JOIN subjects ON subjects.code = items.subject_code "
+                "WHERE subjects.subject_id = ?", (subject_id,)
+            ).fetchone()[0]
+
+    def add(self, vector: np.ndarray, subject_id: str, label: Optional[str] = None) -> int:
+        """Append a vector for a subject and return its row number"""
+        vector = normalize(vector)
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"Expected a {self.dim}-d vector, got {vector.shape[0]}-d")
+
+        with self._write_lock():
+            with self._connection() as conn:
+                conn.execute("INSERT OR IGNORE INTO subjects (subject_id) VALUES (?)", (subject_id,))
+                code = conn.execute("SELECT code FROM subjects WHERE subject_id = ?", (subject_id,)).fetchone()[0]
+                row = conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM items").fetchone()[0]
+
+                # Vector first, metadata last: searches only read rows with committed metadata
+                self._pwrite(self.vectors_path, row * self.dim * 4, vector.tobytes())
+                self._pwrite(self.subjects_path, row * 4, np.int32(code).tobytes())
+                conn.execute("INSERT INTO items (row, subject_code, label, created_at) VALUES (?, ?, ?, ?)",
+                             (row, code, label, time.time()))
+        return row
+
+    def _pwrite(self, path: str, offset: int, data: bytes):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(fd, data, offset)
+        finally:
+            os.close(fd)
+
+    def _map(self, rows: int):
+        """Map at least `rows` rows of the vector and subject files"""
+        if rows <= self._mapped_rows:
+            return
+        with self._lock:
+            if rows > self._mapped_rows:
+                available = os.path.getsize(self.vectors_path) // (self.dim * 4)
+                self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(available, self.dim))
+                self._subjects = np.memmap(self.subjects_path, dtype=np.int32, mode='r', shape=(available,))
+                self._mapped_rows = available
+
+    def _visible_rows(self, conn) -> int:
+        return conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM items").fetchone()[0]
+
+    def search(self, query: np.ndarray, k: int = 5, subject_id: Optional[str] = None,
+               exclude_subject_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Closest rows to `query` by cosine distance. `subject_id` restricts the
+        search to one subject's rows; `exclude_subject_id` searches everything
+        except that subject's rows.
+        """
+        query = normalize(query)
+        with self._connection() as conn:
+            total = self._visible_rows(conn)
+            if total == 0:
+                return []
+            self._map(total)
+
+            if subject_id is not None:
+                rows = np.array([r[0] for r in conn.execute(
+                    "SELECT row FROM items JOIN subjects ON subjects.code = items.subject_code "
+                    "WHERE subjects.subject_id = ? ORDER BY row", (subject_id,)
+                )], dtype=np.int64)
+                if rows.size == 0:
+                    return []
+                distances = 1.0 - self._vectors[rows] @ query
+                best = np.argsort(distances)[:k]
+                candidates = list(zip(rows[best].tolist(), distances[best].tolist()))
+            else:
+                exclude_code = None
+                if exclude_subject_id is not None:
+                    found = conn.execute("SELECT code FROM subjects WHERE subject_id = ?",
+                                         (exclude_subject_id,)).fetchone()
+                    exclude_code = found[0] if found else None
+                candidates = self._scan(query, k, total, exclude_code)
+
+            return self._describe(conn, candidates)
+
+    def _scan(self, query, k, total, exclude_code):
+        """Top-k over all rows, chunk by chunk, keeping memory bounded"""
+        best_rows = np.empty(0, dtype=np.int64)
+        best_distances = np.empty(0, dtype=np.float32)
+        for start in range(0, total, INDEX_SEARCH_CHUNK_ROWS):
+            stop = min(start + INDEX_SEARCH_CHUNK_ROWS, total)
+            distances = 1.0 - self._vectors[start:stop] @ query
+            if exclude_code is not None:
+                distances[self._subjects[start:stop] == exclude_code] = np.inf
+            if distances.size > k:
+                top = np.argpartition(distances, k)[:k]
+            else:
+                top = np.arange(distances.size)
+            best_rows = np.concatenate([best_rows, top + start])
+            best_distances = np.concatenate([best_distances, distances[top]])
+
+        order = np.argsort(best_distances)[:k]
+        return [(int(r), float(d)) for r, d in zip(best_rows[order], best_distances[order]) if np.isfinite(d)]
+
+    def _describe(self, conn, candidates) -> List[Dict[str, Any]]:
+        if not candidates:
+            return []
+        placeholders = ','.join('?' * len(candidates))
+        meta = {r['row']: r for r in conn.execute(
+            f"SELECT items.row, items.label, items.created_at, subjects.subject_id FROM items "
+            f"JOIN subjects ON subjects.code = items.subject_code WHERE items.row IN ({placeholders})",
+            [row for row, _ in candidates]
+        )}
+        return [{
+            'row': row,
+            'subject_id': meta[row]['subject_id'],
+            'label': meta[row]['label'],
+            'created_at': meta[row]['created_at'],
+            'distance': round(max(distance, 0.0), 6)
+        } for row, distance in candidates if row in meta]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._connection() as conn:
+            return {
+                'vectors': self._visible_rows(conn),
+                'subjects': conn.execute("SELECT COUNT(*) FROM subjects").fetchone()[0],
+                'dim': self.dim
+            }
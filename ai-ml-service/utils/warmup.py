@@ -0,0 +1,114 @@
+"""
+Startup warmup on a synthetic document.
+
+The first analysis in a fresh process pays for lazy initialization: the
+EasyOCR model's first inference (torch kernel selection), the first
+tesseract spawn, the OpenCV cascades, the XGBoost booster, the stage
+scheduler's threads and the scratch buffers. Workers run a generated
+document through the pipeline once (see routes.analysis.warm_up_analysis)
+before they report ready, so no real request sees those costs.
+
+    WARMUP   run the warmup at worker startup (default: true)
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+WARMUP = os.getenv('WARMUP', 'true').lower() == 'true'
+
+# Text lines of the synthetic card, printed like an ID card's fields
+DOCUMENT_LINES = ('GOVERNMENT OF INDIA', 'Name: Warmup Sample', 'DOB: 01/01/1990  Gender: MALE',
+                  '1234 5678 9012')
+
+def synthetic_document(width: int = 1012, height: int = 638) -> np.ndarray:
+    """
+    A BGR ID-card-like image: header band, printed fields, a photo box with
+    a face-like figure, a QR code and a signature stroke, so every stage has
+    something to work on
+    """
+    card = np.full((height, width, 3), 240, np.uint8)
+    rng = np.random.default_rng(0)
+    card = cv2.add(card, rng.integers(0, 12, card.shape, dtype=np.uint8))
+    cv2.rectangle(card, (0, 0), (width, height // 8), (40, 90, 200), -1)
+    cv2.putText(card, DOCUMENT_LINES[0], (width // 4, height // 12), cv2.FONT_HERSHEY_SIMPLEX, 1.1, (255, 255, 255), 2)
+    for i, line in enumerate(DOCUMENT_LINES[1:]):
+        cv2.putText(card, line, (width // 3, height // 4 + i * 60), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (20, 20, 20), 2)
+
+    # Photo: face-like ellipse with eyes and mouth
+    x, y, w, h = width // 24, height // 5, width // 4, height // 2
+    cv2.rectangle(card, (x, y), (x + w, y + h), (200, 200, 200), -1)
+    center = (x + w // 2, y + h // 2)
+    cv2.ellipse(card, center, (w // 3, h // 3), 0, 0, 360, (150, 180, 210), -1)
+    for dx in (-w // 8, w // 8):
+        cv2.circle(card, (center[0] + dx, center[1] - h // 12), w // 24, (40, 40, 40), -1)
+    cv2.ellipse(card, (center[0], center[1] + h // 8), (w // 8, h // 30), 0, 0, 180, (60, 60, 140), 2)
+
+    # QR code in the bottom-right corner
+    try:
+        code = cv2.QRCodeEncoder.create().encode('WARMUP 1234 5678 9012')
+        side = height // 3
+        code = cv2.resize(code, (side, side), interpolation=cv2.INTER_NEAREST)
+        card[height - side - 20:height - 20, width - side - 20:width - 20] = code[..., None]
+    except (AttributeError, cv2.error):
+        pass
+
+    # Signature stroke under the fields
+    t = np.linspace(0, 3 * np.pi, 60)
+    stroke = np.stack([width // 3 + t * 25, height * 0.8 + np.sin(t * 2) * 15], axis=1).astype(np.int32)
+    cv2.polylines(card, [stroke], False, (80, 30, 10), 2)
+    return card
+
+def write_synthetic_document(path: str, width: int = 1012, height: int = 638) -> str:
+    """Save synthetic_document() to `path` (the format follows the extension)"""
+    if not cv2.imwrite(path, synthetic_document(width, height)):
+        raise ValueError(f"Could not write {path}")
+    return path
+
+# Timings of this process's last warmup, for the health endpoint
+_last_warmup: Optional[Dict[str, Any]] = None
+_last_warmup_lock = threading.Lock()
+
+def run_warmup(steps: Iterable[Tuple[str, Callable[[], Any]]]) -> Dict[str, Any]:
+    """
+    Run the warmup steps in order, logging each one's duration. A step that
+    returns a StageRun (anything with `timings`) also has its stages logged.
+    A failing step is logged and skipped: the warmup never stops a worker
+    from starting.
+    """
+    start = time.perf_counter()
+    timings: Dict[str, float] = {}
+    errors: Dict[str, str] = {}
+    for name, step in steps:
+        step_start = time.perf_counter()
+        try:
+            result = step()
+        except Exception as e:
+            logger.warning(f"Warmup step {name} failed: {e}")
+            errors[name] = str(e)
+            continue
+        finally:
+            timings[name] = round(time.perf_counter() - step_start, 3)
+        logger.info(f"Warmup {name}: {timings[name]:.3f}s")
+        for stage, seconds in sorted(getattr(result, 'timings', {}).items()):
+            timings[f"{name}.{stage}"] = round(seconds, 3)
+            logger.info(f"Warmup {name}.{stage}: {seconds:.3f}s")
+
+    report = {'seconds': round(time.perf_counter() - start, 3), 'timings': timings, 'errors': errors}
+    logger.info(f"Warmup finished in {report['seconds']:.3f}s ({len(errors)} failed steps)")
+    global _last_warmup
+    with _last_warmup_lock:
+        _last_warmup = report
+    return report
+
+def warmup_report() -> Optional[Dict[str, Any]]:
+    """The last warmup of this process, or None if it hasn't run"""
+    with _last_warmup_lock:
+        return _last_warmup
@@ -0,0 +1,50 @@
+"""
+Standalone job worker.
+
+Pulls analysis jobs from the shared SQLite queue used by the /api/v1/jobs
+routes. Run as many of these processes as the host allows:
+
+    python worker.py --concurrency 2
+"""
+
+import argparse
+import logging
+import signal
+import threading
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description="Document analysis job worker")
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help="Number of worker threads (default: JOB_CONCURRENCY)")
+    args = parser.parse_args()
+
+    from utils.concurrency import apply_thread_budget
+    from utils.job_queue import JOB_CONCURRENCY
+    from routes.jobs import create_worker_pool
+    from routes.analysis import warm_up_analysis
+    from utils.warmup import WARMUP
+
+    apply_thread_budget()
+    if WARMUP:
+        warm_up_analysis()
+
+    pool = create_worker_pool(args.concurrency or max(JOB_CONCURRENCY, 1))
+    stopped = threading.Event()
+
+    def handle_signal(signum, frame):
+        logger.info(f"Received signal {signum}, finishing current jobs")
+        stopped.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    pool.start()
+    stopped.wait()
+    pool.stop()
+    logger.info("Worker stopped")
+
+if __name__ == "__main__":
+    main()